@@ -7,8 +7,7 @@ import copy
 import threading
 
 from DIRAC import S_OK, S_ERROR, gLogger, gConfig
-from DIRAC.Core.DISET.RPCClient                     import RPCClient
-from DIRAC.Core.Utilities                           import DEncode
+from DIRAC.Core.DISET.RPCClient                     import RPCClient, encodeRPCStub
 from DIRAC.RequestManagementSystem.Client.Request   import Request
 from DIRAC.RequestManagementSystem.Client.Operation import Operation
 from DIRAC.RequestManagementSystem.Client.ReqClient import ReqClient
@@ -23,7 +22,10 @@ class DataStoreClient(object):
     Class providing front end access to DIRAC Accounting DataStore Service
      - It allows to reduce the interactions with the server by building and list of
     pending Registers to be sent that are sent in a bundle using the commit method.
-     - In case the DataStore is down Registers are sent as DISET requests.
+     - In case the DataStore is down Registers are sent as DISET requests, compressed
+    if /LocalSite/CompressFailoverStubs is set.
+     - The Registers of the coalescing types having the same key values and overlapping
+    times are merged into one before being sent.
   """
   def __init__( self, setup = False, retryGraceTime = 0 ):
     self.__setup = setup
@@ -34,6 +36,9 @@ class DataStoreClient(object):
     self.__failoverEnabled = not gConfig.getValue( '/LocalSite/DisableFailover', False )
     self.__registersListLock = threading.RLock()
     self.__commitTimer = threading.Timer(5, self.commit)
+    self.__coalescingTypes = None
+    # { ( typeName, key values ) : last pending register of the coalescing types }
+    self.__coalescedRegisters = {}
 
   def setRetryGraceTime( self, retryGraceTime ):
     """
@@ -41,6 +46,19 @@ class DataStoreClient(object):
     """
     self.__maxTimeRetrying = retryGraceTime
 
+  def setCoalescingTypes( self, typeNames ):
+    """
+    Set the types whose Registers are merged when they have the same key values and overlapping
+    times, /LocalSite/AccountingCoalescingTypes by default. The values of the merged Registers are
+    summed, so this is only for types whose reports do not depend on the number of records
+    """
+    self.__coalescingTypes = set( typeNames )
+
+  def __getCoalescingTypes( self ):
+    if self.__coalescingTypes is None:
+      return gConfig.getValue( '/LocalSite/AccountingCoalescingTypes', [] )
+    return self.__coalescingTypes
+
   def __checkBaseType( self, obj ):
     """
     Check to find that the class inherits from the Base Type
@@ -64,10 +82,33 @@ class DataStoreClient(object):
     if gConfig.getValue( '/LocalSite/DisableAccounting', False ):
       return S_OK()
 
-    self.__registersList.append( copy.deepcopy( register.getValues() ) )
+    registerValues = copy.deepcopy( register.getValues() )
+    with self.__registersListLock:
+      if registerValues[0] in self.__getCoalescingTypes():
+        self.__coalesceRegister( registerValues, len( register.keyFieldsList ) )
+      else:
+        self.__registersList.append( registerValues )
 
     return S_OK()
 
+  def __coalesceRegister( self, registerValues, numKeys ):
+    """
+    Merge a register into the last pending one with the same key values if their times overlap,
+    otherwise add it to the list
+    """
+    typeName, startTime, endTime, valuesList = registerValues
+    registerKey = ( typeName, tuple( valuesList[ :numKeys ] ) )
+    pending = self.__coalescedRegisters.get( registerKey )
+    if pending and startTime <= pending[2] and endTime >= pending[1]:
+      pending[1] = min( pending[1], startTime )
+      pending[2] = max( pending[2], endTime )
+      for valPos in range( numKeys, len( valuesList ) ):
+        pending[3][ valPos ] += valuesList[ valPos ]
+    else:
+      pending = [ typeName, startTime, endTime, valuesList ]
+      self.__coalescedRegisters[ registerKey ] = pending
+      self.__registersList.append( pending )
+
   def disableFailover( self ):
     self.__failoverEnabled = False
 
@@ -88,6 +129,7 @@ class DataStoreClient(object):
     self.__registersListLock.acquire()
     registersList = self.__registersList
     self.__registersList = []
+    self.__coalescedRegisters = {}
     self.__registersListLock.release()
 
     try:
@@ -155,7 +197,9 @@ def _sendToFailover( rpcStub ):
     request.RequestName = "Accounting.DataStore.%s.%s" % ( time.time(), random.random() )
     forwardDISETOp = Operation()
     forwardDISETOp.Type = "ForwardDISET"
-    forwardDISETOp.Arguments = DEncode.encode( rpcStub )
+    # The RMS agents older than v6r18 cannot decode the compressed stubs
+    compress = gConfig.getValue( '/LocalSite/CompressFailoverStubs', False )
+    forwardDISETOp.Arguments = encodeRPCStub( rpcStub, compress = compress )
     request.addOperation( forwardDISETOp )
 
     return ReqClient().putRequest( request )
@@ -0,0 +1,97 @@
+""" Unit tests for the DataStoreClient
+"""
+
+__RCSID__ = "$Id$"
+
+import datetime
+import unittest
+
+from mock import MagicMock, patch
+
+from DIRAC import S_OK
+from DIRAC.Core.DISET.RPCClient import encodeRPCStub, decodeRPCStub
+from DIRAC.AccountingSystem.Client.DataStoreClient import DataStoreClient
+import DIRAC.AccountingSystem.Client.DataStoreClient as moduleTested
+from DIRAC.AccountingSystem.Client.Types.DataOperation import DataOperation
+
+class DataStoreClientTestCase( unittest.TestCase ):
+  """ Test the DataStoreClient
+  """
+
+  def setUp( self ):
+    self.now = datetime.datetime( 2017, 1, 1, 12, 0 )
+    self.rpcMock = MagicMock()
+    self.rpcMock.commitRegisters.return_value = S_OK()
+    self.client = DataStoreClient()
+    self.client.setCoalescingTypes( [ 'DataOperation' ] )
+
+  def __getRegister( self, startSeconds, endSeconds, destination = 'CERN-DST', transferSize = 100 ):
+    register = DataOperation()
+    register.setStartTime( self.now + datetime.timedelta( seconds = startSeconds ) )
+    register.setEndTime( self.now + datetime.timedelta( seconds = endSeconds ) )
+    register.setValuesFromDict( { 'OperationType' : 'putAndRegister', 'User' : 'user',
+                                  'ExecutionSite' : 'LCG.CERN.ch', 'Source' : 'CERN-SRC',
+                                  'Destination' : destination, 'Protocol' : 'srm', 'FinalStatus' : 'Successful',
+                                  'TransferSize' : transferSize, 'TransferTime' : 1.0, 'RegistrationTime' : 0.5,
+                                  'TransferOK' : 1, 'TransferTotal' : 1,
+                                  'RegistrationOK' : 1, 'RegistrationTotal' : 1 } )
+    return register
+
+  def __commit( self ):
+    with patch( 'DIRAC.AccountingSystem.Client.DataStoreClient.RPCClient', return_value = self.rpcMock ):
+      return self.client.commit()
+
+  def test_coalescing( self ):
+    for register in ( self.__getRegister( 0, 60 ), self.__getRegister( 30, 90, transferSize = 50 ),
+                      self.__getRegister( 0, 60, destination = 'PIC-DST' ), self.__getRegister( 3600, 3660 ) ):
+      self.assertTrue( self.client.addRegister( register )['OK'] )
+    result = self.__commit()
+    self.assertTrue( result['OK'] )
+    self.assertEqual( result['Value'], 3 )
+    registers = self.rpcMock.commitRegisters.call_args[0][0]
+    typeName, startTime, endTime, valuesList = registers[0]
+    self.assertEqual( typeName, 'DataOperation' )
+    self.assertEqual( startTime, self.now )
+    self.assertEqual( endTime, self.now + datetime.timedelta( seconds = 90 ) )
+    self.assertEqual( valuesList[4], 'CERN-DST' )
+    self.assertEqual( valuesList[7:], [ 150, 2.0, 1.0, 2, 2, 2, 2 ] )
+    self.assertEqual( registers[1][3][7], 100 )
+    self.assertEqual( registers[2][1], self.now + datetime.timedelta( seconds = 3600 ) )
+
+    # Nothing is merged into the registers already sent
+    self.client.addRegister( self.__getRegister( 0, 60 ) )
+    self.assertEqual( self.__commit()['Value'], 1 )
+    self.assertEqual( self.rpcMock.commitRegisters.call_args[0][0][0][3][7], 100 )
+
+  def test_noCoalescing( self ):
+    self.client.setCoalescingTypes( [] )
+    self.client.addRegister( self.__getRegister( 0, 60 ) )
+    self.client.addRegister( self.__getRegister( 30, 90 ) )
+    self.assertEqual( self.__commit()['Value'], 2 )
+
+  def test_failoverStub( self ):
+    rpcStub = ( ( 'Accounting/DataStore', { 'timeout' : 3600 } ), 'commitRegisters',
+                [ [ ( 'DataOperation', self.now, self.now, [ 'CERN-DST' ] * 100 ) ] ] )
+    compressed = encodeRPCStub( rpcStub, compress = True )
+    self.assertTrue( compressed.startswith( 'Z:' ) )
+    self.assertTrue( len( compressed ) < len( encodeRPCStub( rpcStub ) ) )
+    self.assertEqual( decodeRPCStub( compressed ), decodeRPCStub( encodeRPCStub( rpcStub ) ) )
+    self.assertRaises( ValueError, decodeRPCStub, 'Z:notcompressed' )
+
+  def test_sendToFailover( self ):
+    rpcStub = ( ( 'Accounting/DataStore', { 'timeout' : 3600 } ), 'commitRegisters', [ [] ] )
+    for compress in ( False, True ):
+      with patch( 'DIRAC.AccountingSystem.Client.DataStoreClient.ReqClient' ) as reqClient, \
+           patch( 'DIRAC.AccountingSystem.Client.DataStoreClient.gConfig' ) as config:
+        reqClient.return_value.putRequest.return_value = S_OK()
+        config.getValue.side_effect = lambda option, default: compress if 'CompressFailoverStubs' in option else default
+        self.assertTrue( moduleTested._sendToFailover( rpcStub )['OK'] )
+        request = reqClient.return_value.putRequest.call_args[0][0]
+      arguments = request[0].Arguments
+      # Compressed only when asked to, for the RMS agents not decoding the compressed stubs
+      self.assertEqual( arguments.startswith( 'Z:' ), compress )
+      self.assertEqual( decodeRPCStub( arguments ), decodeRPCStub( encodeRPCStub( rpcStub ) ) )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( DataStoreClientTestCase )
+  testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
@@ -6,13 +6,18 @@ __RCSID__ = "$Id$"
 import datetime
 import time
 import threading
+import Queue
 import random
+import hashlib
+from decimal import Decimal
 
 from DIRAC.Core.Base.DB import DB
 from DIRAC import S_OK, S_ERROR, gConfig
 from DIRAC.FrameworkSystem.Client.MonitoringClient import gMonitor
 from DIRAC.Core.Utilities import List, ThreadSafe, Time, DEncode
 from DIRAC.AccountingSystem.private.TypeLoader import TypeLoader
+from DIRAC.AccountingSystem.private.KeyIdCache import KeyIdCache
+from DIRAC.AccountingSystem.private.SliceCache import SliceCache
 from DIRAC.Core.Utilities.ThreadPool import ThreadPool
 
 gSynchro = ThreadSafe.Synchronizer()
@@ -33,6 +38,16 @@ class AccountingDB( DB ):
     self.dbCatalog = {}
     self.dbBucketsLength = {}
     self.__keysCache = {}
+    self.__keysCacheLock = threading.Lock()
+    self.__keysCacheSize = self.getCSOption( "KeysCacheSize", 10000 )
+    self.__keysMissingLifeTime = self.getCSOption( "KeysMissingLifeTime", 60 )
+    self.__rollupsCheckTime = {}
+    self.__maxRowsPerUpsert = self.getCSOption( "MaxRowsPerUpsert", 1000 )
+    self.__compactionThreads = self.getCSOption( "CompactionThreads", 4 )
+    self.__compactionRangeLength = self.getCSOption( "CompactionRangeLength", 86400 )
+    self.__queryCache = SliceCache( self.getCSOption( "QueryCacheMemory", 128 ) * 1024 * 1024,
+                                    self.getCSOption( "QueryCacheLifeTime", 600 ) )
+    self.__queryCacheSliceBuckets = self.getCSOption( "QueryCacheSliceBuckets", 24 )
     maxParallelInsertions = self.getCSOption( "ParallelRecordInsertions", 10 )
     self.__threadPool = ThreadPool( 1, maxParallelInsertions )
     self.__threadPool.daemonize()
@@ -48,6 +63,33 @@ class AccountingDB( DB ):
             'PrimaryKey' : 'name'
             }
         })
+    self.rollupsCatalogTableName = _getTableName( "catalog", "Rollups" )
+    self._createTables( {
+        self.rollupsCatalogTableName : {
+            'Fields' : {
+                'name' : "VARCHAR(64) NOT NULL",
+                'typeName' : "VARCHAR(64) NOT NULL",
+                'granularity' : "INT UNSIGNED NOT NULL",
+                'keyFields' : "VARCHAR(255) NOT NULL",
+                'ready' : "TINYINT(1) DEFAULT 0 NOT NULL",
+                },
+            'PrimaryKey' : 'name'
+            }
+        })
+    #Time ranges already processed by the compaction and regeneration of the buckets
+    self.checkpointsTableName = _getTableName( "catalog", "Checkpoints" )
+    self._createTables( {
+        self.checkpointsTableName : {
+            'Fields' : {
+                'typeName' : "VARCHAR(64) NOT NULL",
+                'operation' : "VARCHAR(16) NOT NULL",
+                'bucketLength' : "INT UNSIGNED NOT NULL",
+                'rangeStart' : "INT UNSIGNED NOT NULL",
+                'rangeEnd' : "INT UNSIGNED NOT NULL",
+                },
+            'PrimaryKey' : [ 'typeName', 'operation', 'bucketLength', 'rangeStart' ]
+            }
+        })
     self.__loadCatalogFromDB()
     gMonitor.registerActivity( "registeradded",
                                "Register added",
@@ -75,6 +117,8 @@ class AccountingDB( DB ):
     self.__lastCompactionEpoch = Time.toEpoch( lcd )
 
     self.__registerTypes()
+    if not self.__readOnly and self.getCSOption( "PreloadKeys", True ):
+      self.__preloadKeysCache()
 
   def __loadTablesCreated( self ):
     result = self._query( "show tables" )
@@ -89,6 +133,9 @@ class AccountingDB( DB ):
     th.start()
 
   def __periodicAutoCompactDB( self ):
+    retVal = self.__resumeCompaction()
+    if not retVal[ 'OK' ]:
+      self.log.error( "[COMPACT] Can't resume the compaction", retVal[ 'Message' ] )
     while self.autoCompact:
       nct = Time.dateTime()
       if nct.hour >= self.__compactTime.hour:
@@ -249,7 +296,8 @@ class AccountingDB( DB ):
     """
     self.log.verbose( "Adding to catalog type %s" % typeName, "with length %s" % str( bucketsLength ) )
     self.dbCatalog[ typeName ] = { 'keys' : keyFields , 'values' : valueFields,
-                                   'typeFields' : [], 'bucketFields' : [], 'dataTimespan' : 0 }
+                                   'typeFields' : [], 'bucketFields' : [], 'dataTimespan' : 0,
+                                   'rollups' : [] }
     self.dbCatalog[ typeName ][ 'typeFields' ].extend( keyFields )
     self.dbCatalog[ typeName ][ 'typeFields' ].extend( valueFields )
     self.dbCatalog[ typeName ][ 'bucketFields' ] = list( self.dbCatalog[ typeName ][ 'typeFields' ] )
@@ -370,6 +418,17 @@ class AccountingDB( DB ):
       tables[ inTableName ] = { 'Fields' : inbufferDict,
                                 'PrimaryKey' : 'id'
                               }
+    #Rollups have the same fields as the buckets, with a subset of the keys
+    rollups = self.__getRollupsDefinition( name, keyFieldsList )
+    rollupTables = {}
+    for rollup in rollups:
+      if rollup[ 'table' ] not in tablesInThere:
+        rollupFieldsDict = dict( ( field, bucketFieldsDict[ field ] ) for field in bucketFieldsDict
+                                 if field not in keyFieldsList or field in rollup[ 'keys' ] )
+        rollupTables[ rollup[ 'table' ] ] = { 'Fields' : rollupFieldsDict,
+                                              'Indexes' : { 'startTimeIndex' : [ 'startTime' ] },
+                                              'UniqueIndexes' : { 'UniqueConstraint' : [ 'startTime' ] + rollup[ 'keys' ] + [ 'bucketLength' ] }
+                                            }
     if self.__readOnly:
       if tables:
         self.log.notice( "ReadOnly mode: Skipping create of tables for %s. Removing from memory catalog" % name )
@@ -380,8 +439,13 @@ class AccountingDB( DB ):
           pass
       else:
         self.log.notice( "ReadOnly mode: %s is OK" % name )
+      if name in self.dbCatalog:
+        retVal = self.__registerRollups( name, [ rollup for rollup in rollups if rollup[ 'table' ] in tablesInThere ] )
+        if not retVal[ 'OK' ]:
+          self.log.error( "Can't register rollups", "for %s: %s" % ( name, retVal[ 'Message' ] ) )
       return S_OK( not updateDBCatalog )
 
+    tables.update( rollupTables )
     if tables:
       retVal = self._createTables( tables )
       if not retVal[ 'OK' ]:
@@ -394,9 +458,77 @@ class AccountingDB( DB ):
                          [ 'name', 'keyFields', 'valueFields', 'bucketsLength' ],
                          [ name, ",".join( keyFieldsList ), ",".join( valueFieldsList ), bucketsEncoding ] )
       self.__addToCatalog( name, keyFieldsList, valueFieldsList, bucketsLength )
+    retVal = self.__registerRollups( name, rollups )
+    if not retVal[ 'OK' ]:
+      self.log.error( "Can't register rollups", "for %s: %s" % ( name, retVal[ 'Message' ] ) )
     self.log.info( "Registered type %s" % name )
     return S_OK( True )
 
+  def __getRollupsDefinition( self, typeName, keyFields ):
+    """
+    Get the rollups of a type, defined in the Rollups/<type> option as a list of
+    <granularity>[:<key>:<key>...] entries. A rollup without keys keeps all the keys of the type
+    """
+    rollups = []
+    for rollupDef in self.getCSOption( "Rollups/%s" % typeName.split( "_" )[-1], [] ):
+      fields = List.fromChar( rollupDef, ":" )
+      try:
+        granularity = int( fields[0] )
+      except ( IndexError, ValueError ):
+        self.log.error( "Invalid rollup definition", "%s for %s" % ( rollupDef, typeName ) )
+        continue
+      unknownKeys = [ key for key in fields[1:] if key not in keyFields ]
+      if granularity <= 0 or unknownKeys:
+        self.log.error( "Invalid rollup definition", "%s for %s" % ( rollupDef, typeName ) )
+        continue
+      rollupKeys = [ key for key in keyFields if key in fields[1:] ] or list( keyFields )
+      rollups.append( { 'table' : _getRollupTableName( typeName, granularity, rollupKeys, keyFields ),
+                        'granularity' : granularity,
+                        'keys' : rollupKeys,
+                        'ready' : False } )
+    return rollups
+
+  def __registerRollups( self, typeName, rollups ):
+    """
+    Add the rollups to the catalog of the type. A new rollup is maintained from now on,
+    but only used by the queries once it has been built by the compaction
+    """
+    self.dbCatalog[ typeName ][ 'rollups' ] = rollups
+    if not self.__readOnly:
+      #Rollups not defined any more are not maintained, they will have to be rebuilt
+      sqlCmd = "UPDATE `%s` SET `ready`=0 WHERE `typeName`='%s'" % ( self.rollupsCatalogTableName, typeName )
+      if rollups:
+        sqlCmd += " AND `name` NOT IN ( %s )" % ", ".join( "'%s'" % rollup[ 'table' ] for rollup in rollups )
+      retVal = self._update( sqlCmd )
+      if not retVal[ 'OK' ]:
+        return retVal
+      for rollup in rollups:
+        retVal = self.insertFields( self.rollupsCatalogTableName,
+                                    [ 'name', 'typeName', 'granularity', 'keyFields', 'ready' ],
+                                    [ rollup[ 'table' ], typeName, rollup[ 'granularity' ], ",".join( rollup[ 'keys' ] ), 0 ] )
+        if not retVal[ 'OK' ] and retVal[ 'Message' ].find( "Duplicate" ) == -1:
+          return retVal
+    self.__rollupsCheckTime[ typeName ] = 0
+    return S_OK( self.__getReadyRollups( typeName ) )
+
+  def __getReadyRollups( self, typeName ):
+    """
+    Get the rollups of a type that can be used by the queries. The ready flags are reloaded
+    from the catalog every few minutes, as rollups are built by the process doing the compaction
+    """
+    rollups = self.dbCatalog[ typeName ].get( 'rollups', [] )
+    if rollups and time.time() - self.__rollupsCheckTime.get( typeName, 0 ) > 300:
+      self.__rollupsCheckTime[ typeName ] = time.time()
+      retVal = self._query( "SELECT `name` FROM `%s` WHERE `typeName`='%s' AND `ready`=1" % ( self.rollupsCatalogTableName,
+                                                                                            typeName ) )
+      if not retVal[ 'OK' ]:
+        self.log.error( "Can't load the rollups catalog", retVal[ 'Message' ] )
+      else:
+        readyTables = [ row[0] for row in retVal[ 'Value' ] ]
+        for rollup in rollups:
+          rollup[ 'ready' ] = rollup[ 'table' ] in readyTables
+    return [ rollup for rollup in rollups if rollup[ 'ready' ] ]
+
   def getRegisteredTypes( self ):
     """
     Get list of registered types
@@ -467,10 +599,15 @@ class AccountingDB( DB ):
     tablesToDelete.insert( 0, "`%s`" % _getTableName( "type", typeName ) )
     tablesToDelete.insert( 0, "`%s`" % _getTableName( "bucket", typeName ) )
     tablesToDelete.insert( 0, "`%s`" % _getTableName( "in", typeName ) )
+    tablesToDelete.extend( "`%s`" % rollup[ 'table' ] for rollup in self.dbCatalog[ typeName ][ 'rollups' ] )
     retVal = self._query( "DROP TABLE %s" % ", ".join( tablesToDelete ) )
     if not retVal[ 'OK' ]:
       return retVal
     retVal = self._update( "DELETE FROM `%s` WHERE name='%s'" % ( _getTableName( "catalog", "Types" ), typeName ) )
+    retVal = self._update( "DELETE FROM `%s` WHERE typeName='%s'" % ( self.rollupsCatalogTableName, typeName ) )
+    retVal = self._update( "DELETE FROM `%s` WHERE typeName='%s'" % ( self.checkpointsTableName, typeName ) )
+    for keyField in self.dbCatalog[ typeName ][ 'keys' ]:
+      self.__getKeyCache( typeName, keyField ).clear()
     del self.dbCatalog[ typeName ]
     return S_OK()
 
@@ -490,46 +627,91 @@ class AccountingDB( DB ):
       return S_OK( retVal[ 'Value' ][0][0] )
     return S_ERROR( "Key id %s for value %s does not exist although it shoud" % ( keyName, keyValue ) )
 
-  def __addKeyValue( self, typeName, keyName, keyValue ):
-    """
-      Adds a key value to a key table if not existant
-    """
-    #Cast to string just in case
-    if not isinstance( keyValue, basestring ):
-      keyValue = str( keyValue )
-    #No more than 64 chars for keys
-    if len( keyValue ) > 64:
-      keyValue = keyValue[:64]
-
-    #Look into the cache
-    if typeName not in self.__keysCache:
-      self.__keysCache[ typeName ] = {}
-    typeCache = self.__keysCache[ typeName ]
-    if keyName not in typeCache:
-      typeCache[ keyName ] = {}
-    keyCache = typeCache[ keyName ]
-    if keyValue in keyCache:
-      return S_OK( keyCache[ keyValue ] )
-    #Retrieve key
-    keyTable = _getTableName( "key", typeName, keyName )
-    retVal = self.__getIdForKeyValue( typeName, keyName, keyValue )
-    if retVal[ 'OK' ]:
-      keyCache[ keyValue ] = retVal[ 'Value' ]
-      return retVal
-    #Key is not in there
-    retVal = self._getConnection()
+  def __getKeyCache( self, typeName, keyName ):
+    """
+      Get the cache of the ids of a key table
+    """
+    with self.__keysCacheLock:
+      if ( typeName, keyName ) not in self.__keysCache:
+        self.__keysCache[ ( typeName, keyName ) ] = KeyIdCache( self.__keysCacheSize, self.__keysMissingLifeTime )
+      return self.__keysCache[ ( typeName, keyName ) ]
+
+  def __preloadKeysCache( self ):
+    """
+      Fill the caches of the key tables with their most recent values
+    """
+    for typeName in self.dbCatalog:
+      for keyName in self.dbCatalog[ typeName ][ 'keys' ]:
+        retVal = self._query( "SELECT `value`, `id` FROM `%s` ORDER BY `id` DESC LIMIT %d" % ( _getTableName( "key", typeName, keyName ),
+                                                                                             self.__keysCacheSize ) )
+        if not retVal[ 'OK' ]:
+          self.log.error( "Can't preload key values", "%s for %s: %s" % ( keyName, typeName, retVal[ 'Message' ] ) )
+          continue
+        self.__getKeyCache( typeName, keyName ).addMany( dict( ( _keyValueToString( value ), keyId )
+                                                               for value, keyId in retVal[ 'Value' ] ) )
+      self.log.verbose( "Preloaded key values for %s" % typeName )
+
+  def __selectKeyIds( self, typeName, keyName, keyValues, conn = False ):
+    """
+      Finds the id numbers of values in a key table, the values having to match exactly
+    """
+    keyIds = {}
+    for valuesChunk in List.breakListIntoChunks( keyValues, 1000 ):
+      retVal = self._escapeValues( valuesChunk )
+      if not retVal[ 'OK' ]:
+        return retVal
+      retVal = self._query( "SELECT `value`, `id` FROM `%s` WHERE `value` IN ( %s )" % ( _getTableName( "key", typeName, keyName ),
+                                                                                         ", ".join( retVal[ 'Value' ] ) ), conn = conn )
+      if not retVal[ 'OK' ]:
+        return retVal
+      for value, keyId in retVal[ 'Value' ]:
+        keyIds[ _keyValueToString( value ) ] = keyId
+    return S_OK( keyIds )
+
+  def __getKeyIds( self, typeName, keyName, keyValues, insert = True ):
+    """
+      Get the ids of values of a key, inserting the values not in the key table if requested.
+      The values have to be normalized by _normalizeKeyValue
+
+      :return: S_OK( { value : id } ), without the values not in the table (or that could not be inserted)
+    """
+    keyCache = self.__getKeyCache( typeName, keyName )
+    keyIds = keyCache.getMany( keyValues )
+    pendingValues = [ value for value in set( keyValues ) if value not in keyIds and ( insert or not keyCache.isMissing( value ) ) ]
+    if not pendingValues:
+      return S_OK( keyIds )
+    retVal = self.__selectKeyIds( typeName, keyName, pendingValues )
     if not retVal[ 'OK' ]:
       return retVal
-    connection = retVal[ 'Value' ]
-    self.log.info( "Value %s for key %s didn't exist, inserting" % ( keyValue, keyName ) )
-    retVal = self.insertFields( keyTable, [ 'id', 'value' ], [ 0, keyValue ], connection )
-    if not retVal[ 'OK' ] and retVal[ 'Message' ].find( "Duplicate key" ) == -1:
-      return retVal
-    result = self.__getIdForKeyValue( typeName, keyName, keyValue, connection )
-    if not result[ 'OK' ]:
-      return result
-    keyCache[ keyValue ] = result[ 'Value' ]
-    return result
+    foundIds = retVal[ 'Value' ]
+    pendingValues = [ value for value in pendingValues if value not in foundIds ]
+    if pendingValues and insert:
+      self.log.info( "Values %s for key %s didn't exist, inserting" % ( ", ".join( pendingValues ), keyName ) )
+      #Values inserted in the meantime by another thread or DataStore are ignored
+      retVal = self._escapeValues( pendingValues )
+      if not retVal[ 'OK' ]:
+        return retVal
+      retVal = self._update( "INSERT IGNORE INTO `%s` ( `value` ) VALUES %s" % ( _getTableName( "key", typeName, keyName ),
+                                                                              ", ".join( "( %s )" % value for value in retVal[ 'Value' ] ) ) )
+      if not retVal[ 'OK' ]:
+        return retVal
+      retVal = self.__selectKeyIds( typeName, keyName, pendingValues )
+      if not retVal[ 'OK' ]:
+        return retVal
+      foundIds.update( retVal[ 'Value' ] )
+      pendingValues = [ value for value in pendingValues if value not in foundIds ]
+    #The table can hold a value that only matches the one looked for according to its collation
+    for keyValue in list( pendingValues ):
+      retVal = self.__getIdForKeyValue( typeName, keyName, keyValue )
+      if retVal[ 'OK' ]:
+        foundIds[ keyValue ] = retVal[ 'Value' ]
+        pendingValues.remove( keyValue )
+      elif insert:
+        self.log.error( "Can't insert key value", retVal[ 'Message' ] )
+    keyCache.addMany( foundIds )
+    keyCache.setMissing( pendingValues )
+    keyIds.update( foundIds )
+    return S_OK( keyIds )
 
   def calculateBucketLengthForTime( self, typeName, now, when ):
     """
@@ -621,67 +803,161 @@ class AccountingDB( DB ):
     Do the real insert and delete from the in buffer table
     """
     self.log.verbose( "Received bundle to process", "of %s elements" % len( recordTuples ) )
+    recordsPerType = {}
     for record in recordTuples:
-      iD, typeName, startTime, endTime, valuesList, insertionEpoch = record
-      result = self.insertRecordDirectly( typeName, startTime, endTime, valuesList )
+      recordsPerType.setdefault( record[1], [] ).append( record )
+    for typeName, records in recordsPerType.items():
+      inTableName = _getTableName( "in", typeName )
+      result = self.__insertRecordsBundle( typeName, [ record[2:5] for record in records ] )
       if not result[ 'OK' ]:
-        self._update( "UPDATE `%s` SET taken=0 WHERE id=%s" % ( _getTableName( "in", typeName ), iD ) )
-        self.log.error( "Can't insert row", result[ 'Message' ] )
+        self.log.error( "Can't insert rows", result[ 'Message' ] )
+        failed = dict( ( pos, result[ 'Message' ] ) for pos in range( len( records ) ) )
+      else:
+        failed = result[ 'Value' ]
+        for pos in failed:
+          self.log.error( "Can't insert row", failed[ pos ] )
+      if failed:
+        self._update( "UPDATE `%s` SET taken=0 WHERE id in (%s)" % ( inTableName,
+                                                                     ", ".join( str( records[ pos ][0] ) for pos in failed ) ) )
+      insertedRecords = [ record for pos, record in enumerate( records ) if pos not in failed ]
+      if not insertedRecords:
         continue
-      result = self._update( "DELETE FROM `%s` WHERE id=%s" % ( _getTableName( "in", typeName ), iD ) )
+      result = self._update( "DELETE FROM `%s` WHERE id in (%s)" % ( inTableName,
+                                                                     ", ".join( str( record[0] ) for record in insertedRecords ) ) )
       if not result[ 'OK' ]:
-        self.log.error( "Can't delete row from the IN table", result[ 'Message' ] )
-      gMonitor.addMark( "insertiontime", Time.toEpoch() - insertionEpoch )
-
+        self.log.error( "Can't delete rows from the IN table", result[ 'Message' ] )
+      now = Time.toEpoch()
+      for record in insertedRecords:
+        gMonitor.addMark( "insertiontime", now - record[5] )
 
   def insertRecordDirectly( self, typeName, startTime, endTime, valuesList ):
     """
     Add an entry to the type contents
     """
+    result = self.__insertRecordsBundle( typeName, [ ( startTime, endTime, valuesList ) ] )
+    if not result[ 'OK' ]:
+      return result
+    if result[ 'Value' ]:
+      return S_ERROR( result[ 'Value' ][0] )
+    return S_OK()
+
+  def __insertRecordsBundle( self, typeName, records ):
+    """
+    Add a bundle of entries to the type contents. The entries are summed per bucket in memory,
+    so that each bucket row is written once whatever the number of entries falling in it
+
+    :param list records: ( startTime, endTime, valuesList ) tuples
+    :return: S_OK( { position in records : error } ) for the entries that could not be added
+    """
     if self.__readOnly:
       return S_ERROR( "ReadOnly mode enabled. No modification allowed" )
-    gMonitor.addMark( "registeradded", 1 )
-    gMonitor.addMark( "registeradded:%s" % typeName, 1 )
-    self.log.info( "Adding record", "for type %s\n [%s -> %s]" % ( typeName, Time.fromEpoch( startTime ), Time.fromEpoch( endTime ) ) )
     if not typeName in self.dbCatalog:
       return S_ERROR( "Type %s has not been defined in the db" % typeName )
-    #Discover key indexes
-    for keyPos in range( len( self.dbCatalog[ typeName ][ 'keys' ] ) ):
-      keyName = self.dbCatalog[ typeName ][ 'keys' ][ keyPos ]
-      keyValue = valuesList[ keyPos ]
-      retVal = self.__addKeyValue( typeName, keyName, keyValue )
+    keyFields = self.dbCatalog[ typeName ][ 'keys' ]
+    numFields = len( keyFields ) + len( self.dbCatalog[ typeName ][ 'values' ] )
+    nowEpoch = int( Time.toEpoch( Time.dateTime() ) )
+    #Discover key indexes, for all the records at once
+    keyIds = []
+    keyErrors = []
+    for keyPos in range( len( keyFields ) ):
+      keyValues = set( _normalizeKeyValue( record[2][ keyPos ] ) for record in records if len( record[2] ) == numFields )
+      retVal = self.__getKeyIds( typeName, keyFields[ keyPos ], list( keyValues ) )
+      errors = {}
       if not retVal[ 'OK' ]:
-        return retVal
-      self.log.verbose( "Value %s for key %s has id %s" % ( keyValue, keyName, retVal[ 'Value' ] ) )
-      valuesList[ keyPos ] = retVal[ 'Value' ]
-    insertList = list( valuesList )
-    insertList.append( startTime )
-    insertList.append( endTime )
+        #Look for the values one by one, so that only the records with the failing ones are not added
+        self.log.warn( "Can't get key ids, retrying value by value", "%s: %s" % ( keyFields[ keyPos ], retVal[ 'Message' ] ) )
+        ids = {}
+        for keyValue in keyValues:
+          retVal = self.__getKeyIds( typeName, keyFields[ keyPos ], [ keyValue ] )
+          if retVal[ 'OK' ]:
+            ids.update( retVal[ 'Value' ] )
+          else:
+            errors[ keyValue ] = retVal[ 'Message' ]
+        retVal = S_OK( ids )
+      keyIds.append( retVal[ 'Value' ] )
+      keyErrors.append( errors )
+    failed = {}
+    typeRows = []
+    bucketRows = {}
+    for pos in range( len( records ) ):
+      startTime, endTime, valuesList = records[ pos ]
+      self.log.info( "Adding record", "for type %s\n [%s -> %s]" % ( typeName, Time.fromEpoch( startTime ), Time.fromEpoch( endTime ) ) )
+      if len( valuesList ) != numFields:
+        failed[ pos ] = "Fields mismatch for record %s. %s fields and %s expected" % ( typeName,
+                                                                                       len( valuesList ),
+                                                                                       numFields )
+        continue
+      keyValues = []
+      for keyPos in range( len( keyFields ) ):
+        keyValue = _normalizeKeyValue( valuesList[ keyPos ] )
+        if keyValue not in keyIds[ keyPos ]:
+          failed[ pos ] = keyErrors[ keyPos ].get( keyValue,
+                                                   "Key id %s for value %s does not exist" % ( keyFields[ keyPos ], keyValue ) )
+          break
+        keyValues.append( keyIds[ keyPos ][ keyValue ] )
+      if pos in failed:
+        continue
+      values = list( valuesList[ len( keyFields ): ] )
+      typeRows.append( keyValues + values + [ startTime, endTime ] )
+      #HACK: One more record to split in the buckets to be able to count total entries
+      values.append( 1 )
+      buckets = self.calculateBuckets( typeName, startTime, endTime, nowEpoch )
+      self.__sumInBucketRows( bucketRows, buckets, keyValues, values )
+    if not typeRows:
+      return S_OK( failed )
+
+    self.log.verbose( "Writing entries", "%s entries in %s buckets" % ( len( typeRows ), len( bucketRows ) ) )
     retVal = self._getConnection()
     if not retVal[ 'OK' ]:
       return retVal
     connObj = retVal[ 'Value' ]
     try:
-      retVal = self.insertFields(
-          _getTableName( "type", typeName ),
-          self.dbCatalog[ typeName ][ 'typeFields' ],
-          insertList,
-          conn = connObj
-          )
+      #A deadlock rolls back the whole transaction, so it is the whole transaction that is retried
+      for _i in range( max( 1, self.__deadLockRetries ) ):
+        retVal = self.__startTransaction( connObj )
+        if not retVal[ 'OK' ]:
+          return retVal
+        retVal = self.__insertTypeRows( typeName, typeRows, connObj = connObj )
+        if retVal[ 'OK' ]:
+          retVal = self.__writeBucketRows( typeName, bucketRows, connObj = connObj )
+        for rollup in self.dbCatalog[ typeName ][ 'rollups' ]:
+          if retVal[ 'OK' ]:
+            retVal = self.__writeBucketRows( typeName, self.__rollUp( typeName, rollup, bucketRows ),
+                                             connObj = connObj, rollup = rollup )
+        if retVal[ 'OK' ]:
+          retVal = self.__commitTransaction( connObj )
+          if retVal[ 'OK' ]:
+            break
+        self.__rollbackTransaction( connObj )
+        if retVal[ 'Message' ].find( "try restarting transaction" ) == -1:
+          return retVal
       if not retVal[ 'OK' ]:
         return retVal
-      #HACK: One more record to split in the buckets to be able to count total entries
-      valuesList.append( 1 )
-      retVal = self.__startTransaction( connObj )
+    finally:
+      connObj.close()
+    gMonitor.addMark( "registeradded", len( typeRows ) )
+    gMonitor.addMark( "registeradded:%s" % typeName, len( typeRows ) )
+    return S_OK( failed )
+
+  def __insertTypeRows( self, typeName, typeRows, connObj = False ):
+    """
+    Insert raw records in the type table, in multi row statements
+    """
+    sqlFields = ", ".join( "`%s`" % field for field in self.dbCatalog[ typeName ][ 'typeFields' ] )
+    valuesGroups = []
+    for row in typeRows:
+      retVal = self._escapeValues( row )
       if not retVal[ 'OK' ]:
         return retVal
-      retVal = self.__splitInBuckets( typeName, startTime, endTime, valuesList, connObj = connObj )
+      valuesGroups.append( "( %s )" % ", ".join( retVal[ 'Value' ] ) )
+    for groups in List.breakListIntoChunks( valuesGroups, self.__maxRowsPerUpsert ):
+      retVal = self._update( "INSERT INTO `%s` ( %s ) VALUES %s" % ( _getTableName( "type", typeName ),
+                                                                   sqlFields,
+                                                                   ", ".join( groups ) ),
+                             conn = connObj )
       if not retVal[ 'OK' ]:
-        self.__rollbackTransaction( connObj )
         return retVal
-      return self.__commitTransaction( connObj )
-    finally:
-      connObj.close()
+    return S_OK()
 
   def deleteRecord( self, typeName, startTime, endTime, valuesList ):
     """
@@ -694,15 +970,17 @@ class AccountingDB( DB ):
       return S_ERROR( "Type %s has not been defined in the db" % typeName )
     sqlValues = []
     sqlValues.extend( valuesList )
-    #Discover key indexes
+    #Discover key indexes, no record can be there if a value is not
     for keyPos in range( len( self.dbCatalog[ typeName ][ 'keys' ] ) ):
       keyName = self.dbCatalog[ typeName ][ 'keys' ][ keyPos ]
-      keyValue = sqlValues[ keyPos ]
-      retVal = self.__addKeyValue( typeName, keyName, keyValue )
+      keyValue = _normalizeKeyValue( sqlValues[ keyPos ] )
+      retVal = self.__getKeyIds( typeName, keyName, [ keyValue ], insert = False )
       if not retVal[ 'OK' ]:
         return retVal
-      self.log.verbose( "Value %s for key %s has id %s" % ( keyValue, keyName, retVal[ 'Value' ] ) )
-      sqlValues[ keyPos ] = retVal[ 'Value' ]
+      if keyValue not in retVal[ 'Value' ]:
+        return S_OK( 0 )
+      self.log.verbose( "Value %s for key %s has id %s" % ( keyValue, keyName, retVal[ 'Value' ][ keyValue ] ) )
+      sqlValues[ keyPos ] = retVal[ 'Value' ][ keyValue ]
     sqlCond = []
     mainTable = _getTableName( "type", typeName )
     sqlValues.extend( [ startTime, endTime ] )
@@ -741,6 +1019,17 @@ class AccountingDB( DB ):
       return S_OK( 0 )
     sqlValues.append( 1 )
     retVal = self.__deleteFromBuckets( typeName, startTime, endTime, sqlValues, numInsertions, connObj = connObj )
+    if retVal[ 'OK' ] and self.dbCatalog[ typeName ][ 'rollups' ]:
+      #Rollups are updated with the opposite values
+      bucketRows = {}
+      buckets = self.calculateBuckets( typeName, startTime, endTime, self.__lastCompactionEpoch )
+      values = [ -value * numInsertions for value in sqlValues[ numKeyFields:numKeyFields + numValueFields ] + [ 1 ] ]
+      self.__sumInBucketRows( bucketRows, buckets, sqlValues[ :numKeyFields ], values )
+      for rollup in self.dbCatalog[ typeName ][ 'rollups' ]:
+        retVal = self.__writeBucketRows( typeName, self.__rollUp( typeName, rollup, bucketRows ),
+                                         connObj = connObj, rollup = rollup )
+        if not retVal[ 'OK' ]:
+          break
     if not retVal[ 'OK' ]:
       self.__rollbackTransaction( connObj )
       return retVal
@@ -750,19 +1039,6 @@ class AccountingDB( DB ):
       return retVal
     return S_OK( numInsertions )
 
-  def __splitInBuckets( self, typeName, startTime, endTime, valuesList, connObj = False ):
-    """
-    Bucketize a record
-    """
-    #Calculate amount of buckets
-    buckets = self.calculateBuckets( typeName, startTime, endTime )
-    #Separate key values from normal values
-    numKeys = len( self.dbCatalog[ typeName ][ 'keys' ] )
-    keyValues = valuesList[ :numKeys ]
-    valuesList = valuesList[ numKeys: ]
-    self.log.verbose( "Splitting entry", " in %s buckets" % len( buckets ) )
-    return self.__writeBuckets( typeName, buckets, keyValues, valuesList, connObj = connObj )
-
   def __deleteFromBuckets( self, typeName, startTime, endTime, valuesList, numInsertions, connObj = False ):
     """
     DeBucketize a record
@@ -860,48 +1136,142 @@ class AccountingDB( DB ):
     return self._update( cmd, conn = connObj )
 
 
-  def __writeBuckets( self, typeName, buckets, keyValues, valuesList, connObj = False ):
-    """ Insert or update a bucket
+  @staticmethod
+  def __sumInBucketRows( bucketRows, buckets, keyValues, valuesList ):
+    """
+    Add the proportional part of the values of a record to the bucket rows
+
+    :param dict bucketRows: { ( startTime, keyValues, bucketLength ) : values + [ entries ] }, updated
+    :param list buckets: ( startTime, proportion, bucketLength ) tuples from calculateBuckets
+    :param list valuesList: values of the record, the number of entries being the last one
+    """
+    keyValues = tuple( keyValues )
+    for bStartTime, bProportion, bLength in buckets:
+      bucketKey = ( bStartTime, keyValues, bLength )
+      bucketValues = bucketRows.get( bucketKey )
+      if bucketValues is None:
+        bucketRows[ bucketKey ] = [ _proportionalPart( value, bProportion ) for value in valuesList ]
+      else:
+        for valPos in range( len( valuesList ) ):
+          bucketValues[ valPos ] += _proportionalPart( valuesList[ valPos ], bProportion )
+
+  def __writeBucketRows( self, typeName, bucketRows, connObj = False, rollup = None ):
+    """ Insert or update bucket rows, with one upsert per row
+
+    The rows are written in the order of the unique index of the table, so that concurrent
+    insertions lock them in the same order and do not deadlock each other
     """
-#     tableName = _getTableName( "bucket", typeName )
+    if rollup:
+      tableName = rollup[ 'table' ]
+      keyFields = rollup[ 'keys' ]
+    else:
+      tableName = _getTableName( "bucket", typeName )
+      keyFields = self.dbCatalog[ typeName ][ 'keys' ]
     #INSERT PART OF THE QUERY
     sqlFields = [ '`startTime`', '`bucketLength`', '`entriesInBucket`' ]
-    for keyPos in range( len( self.dbCatalog[ typeName ][ 'keys' ] ) ):
-      sqlFields.append( "`%s`" % self.dbCatalog[ typeName ][ 'keys' ][ keyPos ] )
+    for keyField in keyFields:
+      sqlFields.append( "`%s`" % keyField )
     sqlUpData = [ "`entriesInBucket`=`entriesInBucket`+VALUES(`entriesInBucket`)" ]
     for valPos in range( len( self.dbCatalog[ typeName ][ 'values' ] ) ):
       valueField = "`%s`" % self.dbCatalog[ typeName ][ 'values' ][ valPos ]
       sqlFields.append( valueField )
       sqlUpData.append( "%s=%s+VALUES(%s)" % ( valueField, valueField, valueField ) )
     valuesGroups = []
-    for bucketInfo in buckets:
-      bStartTime = bucketInfo[0]
-      bProportion = bucketInfo[1]
-      bLength = bucketInfo[2]
-      sqlValues = [ bStartTime, bLength, "(%s*%s)" % ( valuesList[-1], bProportion )]
-      for keyPos in range( len( self.dbCatalog[ typeName ][ 'keys' ] ) ):
-        sqlValues.append( keyValues[ keyPos ] )
-      for valPos in range( len( self.dbCatalog[ typeName ][ 'values' ] ) ):
-#         value = valuesList[ valPos ]
-        sqlValues.append( "(%s*%s)" % ( valuesList[ valPos ], bProportion ) )
-      valuesGroups.append( "( %s )" % ",".join( str( val ) for val in sqlValues ) )
-
-    cmd = "INSERT INTO `%s` ( %s ) " % ( _getTableName( "bucket", typeName ), ", ".join( sqlFields ) )
-    cmd += "VALUES %s " % ", ".join( valuesGroups)
-    cmd += "ON DUPLICATE KEY UPDATE %s" % ", ".join( sqlUpData )
-
-    for _i in range( max( 1, self.__deadLockRetries ) ):
+    for bucketKey in sorted( bucketRows ):
+      bStartTime, keyValues, bLength = bucketKey
+      bucketValues = bucketRows[ bucketKey ]
+      sqlValues = [ bStartTime, bLength, bucketValues[-1] ] + list( keyValues ) + bucketValues[:-1]
+      valuesGroups.append( "( %s )" % ",".join( _sqlNumber( val ) for val in sqlValues ) )
+
+    for groups in List.breakListIntoChunks( valuesGroups, self.__maxRowsPerUpsert ):
+      cmd = "INSERT INTO `%s` ( %s ) " % ( tableName, ", ".join( sqlFields ) )
+      cmd += "VALUES %s " % ", ".join( groups )
+      cmd += "ON DUPLICATE KEY UPDATE %s" % ", ".join( sqlUpData )
       result = self._update( cmd, conn = connObj )
       if not result[ 'OK' ]:
-        #If failed because of dead lock try restarting
-        if result[ 'Message' ].find( "try restarting transaction" ):
-          continue
-        return result
-      #If OK, break loopo
-      if result[ 'OK' ]:
         return result
+    return S_OK()
 
-    return S_ERROR( "Cannot update bucket: %s" % result[ 'Message' ] )
+  def __rollUp( self, typeName, rollup, bucketRows ):
+    """
+    Get the rows of a rollup for bucket rows, as returned by __sumInBucketRows
+    """
+    keyPositions = [ self.dbCatalog[ typeName ][ 'keys' ].index( key ) for key in rollup[ 'keys' ] ]
+    rollupRows = {}
+    for bucketKey in bucketRows:
+      bStartTime, keyValues, bLength = bucketKey
+      self.__sumInBucketRows( rollupRows,
+                              _spanBucket( bStartTime, bLength, rollup[ 'granularity' ] ),
+                              [ keyValues[ keyPos ] for keyPos in keyPositions ],
+                              bucketRows[ bucketKey ] )
+    return rollupRows
+
+  def __buildRollup( self, typeName, rollup ):
+    """
+    Build a rollup from the buckets of the type and mark it as ready to be used
+
+    :return: S_OK( number of buckets rolled up )
+    """
+    self.log.info( "[ROLLUP] Building %s" % rollup[ 'table' ] )
+    retVal = self._update( "UPDATE `%s` SET `ready`=0 WHERE `name`='%s'" % ( self.rollupsCatalogTableName, rollup[ 'table' ] ) )
+    if not retVal[ 'OK' ]:
+      return retVal
+    rollup[ 'ready' ] = False
+    retVal = self.__runInTransaction( self.__fillRollup, typeName, rollup )
+    if not retVal[ 'OK' ]:
+      return retVal
+    filled = retVal[ 'Value' ]
+    retVal = self._update( "UPDATE `%s` SET `ready`=1 WHERE `name`='%s'" % ( self.rollupsCatalogTableName, rollup[ 'table' ] ) )
+    if not retVal[ 'OK' ]:
+      return retVal
+    rollup[ 'ready' ] = True
+    return S_OK( filled )
+
+  def __fillRollup( self, typeName, rollup, connObj = False ):
+    """
+    Replace the contents of a rollup by the sums of the buckets. The buckets falling in a
+    single period of the rollup are summed by the DB, the longer ones split in python
+    """
+    bucketTable = _getTableName( "bucket", typeName )
+    granularity = rollup[ 'granularity' ]
+    retVal = self._update( "DELETE FROM `%s`" % rollup[ 'table' ], conn = connObj )
+    if not retVal[ 'OK' ]:
+      return retVal
+    keyFields = [ "`%s`" % key for key in rollup[ 'keys' ] ]
+    valueFields = [ "`%s`" % value for value in self.dbCatalog[ typeName ][ 'values' ] ]
+    cmd = "INSERT INTO `%s` ( `startTime`, `bucketLength`, `entriesInBucket`, %s, %s ) " % ( rollup[ 'table' ],
+                                                                                            ", ".join( keyFields ),
+                                                                                            ", ".join( valueFields ) )
+    cmd += "SELECT `startTime` - MOD( `startTime`, %d ), %d, SUM( `entriesInBucket` ), %s, %s FROM `%s` " % (
+        granularity,
+        granularity,
+        ", ".join( keyFields ),
+        ", ".join( "SUM( %s )" % valueField for valueField in valueFields ),
+        bucketTable )
+    cmd += "WHERE MOD( %d, `bucketLength` ) = 0 GROUP BY 1, %s" % ( granularity, ", ".join( keyFields ) )
+    retVal = self._update( cmd, conn = connObj )
+    if not retVal[ 'OK' ]:
+      return retVal
+    self.log.info( "[ROLLUP] %s rows summed for %s" % ( retVal[ 'Value' ], rollup[ 'table' ] ) )
+    numSummed = retVal[ 'Value' ]
+    cmd = "SELECT `startTime`, `bucketLength`, %s, %s, `entriesInBucket` FROM `%s` " % ( ", ".join( keyFields ),
+                                                                                       ", ".join( valueFields ),
+                                                                                       bucketTable )
+    cmd += "WHERE MOD( %d, `bucketLength` ) != 0 LOCK IN SHARE MODE" % granularity
+    retVal = self._query( cmd, conn = connObj )
+    if not retVal[ 'OK' ]:
+      return retVal
+    numKeys = len( keyFields )
+    rollupRows = {}
+    for row in retVal[ 'Value' ]:
+      self.__sumInBucketRows( rollupRows, _spanBucket( row[0], row[1], granularity ),
+                              row[ 2:2 + numKeys ], list( row[ 2 + numKeys: ] ) )
+    self.log.info( "[ROLLUP] %s rows split for %s" % ( len( retVal[ 'Value' ] ), rollup[ 'table' ] ) )
+    numSplit = len( retVal[ 'Value' ] )
+    retVal = self.__writeBucketRows( typeName, rollupRows, connObj = connObj, rollup = rollup )
+    if not retVal[ 'OK' ]:
+      return retVal
+    return S_OK( numSummed + numSplit )
 
   def __checkFieldsExistsInType( self, typeName, fields, tableType ):
     """
@@ -976,25 +1346,119 @@ class AccountingDB( DB ):
     nowEpoch = Time.toEpoch( Time.dateTime () )
     bucketTimeLength = self.calculateBucketLengthForTime( typeName, nowEpoch , startTime )
     startTime = startTime - startTime % bucketTimeLength
-    result = self.__queryType(
-        typeName,
-        startTime,
-        endTime,
-        selectFields,
-        condDict,
-        groupFields,
-        orderFields,
-        "bucket",
-        connObj = connObj
-        )
+    rollup = self.__getRollupForQuery( typeName, bucketTimeLength, selectFields, condDict, groupFields, orderFields )
+    if self.__queryCache.maxMemory > 0 and startTime and endTime and \
+       groupFields and 'startTime' in groupFields[1] and ( not orderFields or orderFields[1][:1] == [ 'startTime' ] ):
+      result = self.__queryBucketsBySlices( typeName, startTime, endTime, selectFields, condDict, groupFields, orderFields,
+                                            connObj = connObj, rollup = rollup )
+    else:
+      result = self.__queryType(
+          typeName,
+          startTime,
+          endTime,
+          selectFields,
+          condDict,
+          groupFields,
+          orderFields,
+          "bucket",
+          connObj = connObj,
+          rollup = rollup
+          )
     gMonitor.addMark( "querytime", Time.toEpoch() - startQueryEpoch )
     return result
 
-  def __queryType( self, typeName, startTime, endTime, selectFields, condDict, groupFields, orderFields, tableType, connObj = False ):
+  def __queryBucketsBySlices( self, typeName, startTime, endTime, selectFields, condDict, groupFields, orderFields,
+                              connObj = False, rollup = None ):
+    """
+    Execute a query grouped by bucket start time slice after slice, the slices of the time line
+    being QueryCacheSliceBuckets buckets long. The slices already queried are taken from the cache,
+    the others are queried and cached once all their buckets are over
+    """
+    startTime, endTime = self.__getBucketsTimeLimits( typeName, startTime, endTime, rollup )
+    queryKey = repr( ( typeName,
+                       rollup[ 'table' ] if rollup else None,
+                       selectFields,
+                       sorted( ( keyName, sorted( condDict[ keyName ] ) if isinstance( condDict[ keyName ], ( list, tuple ) )
+                                          else [ condDict[ keyName ] ] ) for keyName in condDict ),
+                       groupFields,
+                       orderFields ) )
+    nowEpoch = int( Time.toEpoch() )
+    rows = []
+    sliceStart = startTime
+    while sliceStart <= endTime:
+      bucketLength = rollup[ 'granularity' ] if rollup else self.calculateBucketLengthForTime( typeName, nowEpoch, sliceStart )
+      sliceLength = bucketLength * self.__queryCacheSliceBuckets
+      sliceEnd = min( sliceStart - sliceStart % sliceLength + sliceLength - 1, endTime )
+      sliceKey = ( queryKey, sliceStart, sliceEnd )
+      sliceRows = self.__queryCache.get( sliceKey )
+      if sliceRows is None:
+        #The arguments are modified by __queryType
+        retVal = self.__queryType( typeName, sliceStart, sliceEnd, selectFields,
+                                   dict( ( keyName, list( condDict[ keyName ] ) if isinstance( condDict[ keyName ], ( list, tuple ) )
+                                                    else condDict[ keyName ] ) for keyName in condDict ),
+                                   ( groupFields[0], list( groupFields[1] ) ),
+                                   ( orderFields[0], list( orderFields[1] ) ) if orderFields else orderFields,
+                                   "bucket", connObj = connObj, rollup = rollup, alignTimes = False )
+        if not retVal[ 'OK' ]:
+          return retVal
+        sliceRows = retVal[ 'Value' ]
+        lastBucketStart = sliceEnd - sliceEnd % bucketLength
+        if lastBucketStart + bucketLength <= nowEpoch:
+          self.__queryCache.add( sliceKey, sliceRows )
+      rows.extend( sliceRows )
+      sliceStart = sliceEnd + 1
+    return S_OK( tuple( rows ) )
+
+  def __getBucketsTimeLimits( self, typeName, startTime, endTime, rollup = None ):
+    """
+    Get the start times of the first and last buckets, or periods of the rollup, covered by a time range
+    """
+    if startTime:
+      if rollup:
+        startTime = startTime - startTime % rollup[ 'granularity' ]
+      else:
+        #HACK because MySQL and UNIX do not start epoch at the same time
+        startTime = startTime + 3600
+        startTime = self.calculateBuckets( typeName, startTime, startTime )[0][0]
+    if endTime:
+      if rollup:
+        endTime = endTime - endTime % rollup[ 'granularity' ]
+      else:
+        endTime = endTime + 3600
+        endTime = self.calculateBuckets( typeName, endTime, endTime )[0][0]
+    return startTime, endTime
+
+  def __getRollupForQuery( self, typeName, granularity, selectFields, condDict, groupFields, orderFields ):
     """
-    Execute a query over a main table
+    Get the coarsest rollup that can replace the buckets in a query: it has to hold all the keys
+    used by the query, and the granularity of the report has to be a multiple of its own
     """
-    tableName = _getTableName( tableType, typeName )
+    queryKeys = set( condDict )
+    for fields in ( selectFields, groupFields, orderFields ):
+      if fields:
+        queryKeys.update( fields[1] )
+    queryKeys.intersection_update( self.dbCatalog[ typeName ][ 'keys' ] )
+    selectedRollup = None
+    for rollup in self.__getReadyRollups( typeName ):
+      if granularity % rollup[ 'granularity' ] or not queryKeys.issubset( rollup[ 'keys' ] ):
+        continue
+      if not selectedRollup or ( rollup[ 'granularity' ], -len( rollup[ 'keys' ] ) ) > \
+                                ( selectedRollup[ 'granularity' ], -len( selectedRollup[ 'keys' ] ) ):
+        selectedRollup = rollup
+    if selectedRollup:
+      self.log.verbose( "Using rollup %s" % selectedRollup[ 'table' ] )
+    return selectedRollup
+
+  def __queryType( self, typeName, startTime, endTime, selectFields, condDict, groupFields, orderFields, tableType,
+                   connObj = False, rollup = None, alignTimes = True ):
+    """
+    Execute a query over a main table, or over a rollup of the buckets. Unless alignTimes is False,
+    the time range of a query over the buckets is extended to whole buckets
+    """
+    if rollup:
+      tableName = rollup[ 'table' ]
+    else:
+      tableName = _getTableName( tableType, typeName )
     cmd = "SELECT"
     sqlLinkList = []
     #Check if groupFields and orderFields are in ( "%s", ( field1, ) ) form
@@ -1032,18 +1496,14 @@ class AccountingDB( DB ):
         sqlFromList.append( "`%s`" % _getTableName( "key", typeName, key ) )
     cmd += " FROM %s" % ", ".join( sqlFromList )
     #Calculate time conditions
+    if tableType == "bucket" and alignTimes:
+      startTime, endTime = self.__getBucketsTimeLimits( typeName, startTime, endTime, rollup )
     sqlTimeCond = []
     if startTime:
-      if tableType == 'bucket':
-        #HACK because MySQL and UNIX do not start epoch at the same time
-        startTime = startTime + 3600
-        startTime = self.calculateBuckets( typeName, startTime, startTime )[0][0]
       sqlTimeCond.append( "`%s`.`startTime` >= %s" % ( tableName, startTime ) )
     if endTime:
       if tableType == "bucket":
         endTimeSQLVar = "startTime"
-        endTime = endTime + 3600
-        endTime = self.calculateBuckets( typeName, endTime, endTime )[0][0]
       else:
         endTimeSQLVar = "endTime"
       sqlTimeCond.append( "`%s`.`%s` <= %s" % ( tableName, endTimeSQLVar, endTime ) )
@@ -1099,235 +1559,378 @@ class AccountingDB( DB ):
   def compactBuckets( self, typeFilter = False ):
     """
     Compact buckets for all defined types
+
+    The buckets are moved to longer ones level after level. At each level the time ranges of all
+    the types are compacted in parallel, each in its own transaction that also checkpoints it,
+    so that an interrupted compaction is resumed where it was left. The ranges that may write to
+    the same buckets are compacted one after the other
+
+    :return: S_OK( { typeName : { phase : { 'Rows' : rows, 'Seconds' : seconds } } } )
     """
     if self.__readOnly:
       return S_ERROR( "ReadOnly mode enabled. No modification allowed" )
-    gSynchro.lock()
-    try:
-      if self.__doingCompaction:
-        return S_OK()
-      self.__doingCompaction = True
-    finally:
-      gSynchro.unlock()
-    slow = True
+    typesToCompact = []
     for typeName in self.dbCatalog:
       if typeFilter and typeName.find( typeFilter ) == -1:
         self.log.info( "[COMPACT] Skipping %s" % typeName )
         continue
-      if self.dbCatalog[ typeName ][ 'dataTimespan' ] > 0:
-        self.log.info( "[COMPACT] Deleting records older that timespan for type %s" % typeName )
-        self.__deleteRecordsOlderThanDataTimespan( typeName )
-      self.log.info( "[COMPACT] Compacting %s" % typeName )
-      if slow:
-        self.__slowCompactBucketsForType( typeName )
-      else:
-        self.__compactBucketsForType( typeName )
-    self.log.info( "[COMPACT] Compaction finished" )
-    self.__lastCompactionEpoch = int( Time.toEpoch() )
+      typesToCompact.append( typeName )
+    return self.__compactTypes( typesToCompact )
+
+  def __resumeCompaction( self ):
+    """
+    Finish the compaction of the types whose compaction was interrupted
+    """
+    retVal = self._query( "SELECT DISTINCT `typeName` FROM `%s` WHERE `operation`='compact'" % self.checkpointsTableName )
+    if not retVal[ 'OK' ]:
+      return retVal
+    typesToCompact = [ row[0] for row in retVal[ 'Value' ] if row[0] in self.dbCatalog ]
+    if not typesToCompact:
+      return S_OK( {} )
+    self.log.info( "[COMPACT] Resuming the compaction of %s" % ", ".join( typesToCompact ) )
+    return self.__compactTypes( typesToCompact )
+
+  def __compactTypes( self, typesToCompact ):
+    """
+    Compact the buckets of a list of types
+    """
     gSynchro.lock()
     try:
       if self.__doingCompaction:
-        self.__doingCompaction = False
+        return S_OK( {} )
+      self.__doingCompaction = True
     finally:
       gSynchro.unlock()
-    return S_OK()
+    try:
+      stats = {}
+      checkpoints = {}
+      for typeName in typesToCompact:
+        if self.dbCatalog[ typeName ][ 'dataTimespan' ] > 0:
+          self.log.info( "[COMPACT] Deleting records older that timespan for type %s" % typeName )
+          startTime = time.time()
+          deleted = self.__deleteRecordsOlderThanDataTimespan( typeName )
+          self.__addPhaseStats( stats, typeName, "old records", deleted, time.time() - startTime )
+        retVal = self.__getCheckpoint( typeName, "compact" )
+        if not retVal[ 'OK' ]:
+          self.log.error( "[COMPACT] Can't get the compaction checkpoint", "%s: %s" % ( typeName, retVal[ 'Message' ] ) )
+          continue
+        nowEpoch, doneRanges = retVal[ 'Value' ]
+        if nowEpoch:
+          self.log.info( "[COMPACT] Resuming the compaction of %s started at %s" % ( typeName, Time.fromEpoch( nowEpoch ) ) )
+        else:
+          nowEpoch = int( Time.toEpoch() )
+          retVal = self.__checkpointRange( typeName, "compact", 0, 0, nowEpoch )
+          if not retVal[ 'OK' ]:
+            self.log.error( "[COMPACT] Can't checkpoint the compaction", "%s: %s" % ( typeName, retVal[ 'Message' ] ) )
+            continue
+        checkpoints[ typeName ] = ( nowEpoch, doneRanges )
+
+      failedTypes = set()
+      numLevels = max( [ len( self.dbBucketsLength[ typeName ] ) for typeName in checkpoints ] + [ 0 ] )
+      for bPos in range( numLevels - 1 ):
+        tasks = []
+        taskPhases = []
+        for typeName, ( nowEpoch, doneRanges ) in checkpoints.items():
+          if typeName in failedTypes or bPos >= len( self.dbBucketsLength[ typeName ] ) - 1:
+            continue
+          secondsLimit = self.dbBucketsLength[ typeName ][ bPos ][0]
+          bucketLength = self.dbBucketsLength[ typeName ][ bPos ][1]
+          timeLimit = ( nowEpoch - nowEpoch % bucketLength ) - secondsLimit
+          retVal = self.__getRangesToCompact( typeName, bucketLength, timeLimit )
+          if not retVal[ 'OK' ]:
+            self.log.error( "[COMPACT] Can't get the buckets to compact", "%s: %s" % ( typeName, retVal[ 'Message' ] ) )
+            failedTypes.add( typeName )
+            continue
+          #The buckets of a range end before the end of the last bucket starting in it
+          ranges = [ ( rangeStart, rangeEnd, rangeEnd - 1 - ( rangeEnd - 1 ) % bucketLength + bucketLength - 1 )
+                     for rangeStart, rangeEnd in retVal[ 'Value' ] if ( bucketLength, rangeStart ) not in doneRanges ]
+          for group in self.__groupRangesByBuckets( typeName, ranges, nowEpoch ):
+            tasks.append( ( self.__runSequentially, ( [ ( self.__runInTransaction, ( self.__compactRange, typeName,
+                                                                                     bucketLength, rangeStart,
+                                                                                     rangeEnd, nowEpoch ) )
+                                                        for rangeStart, rangeEnd in group ], ) ) )
+            taskPhases.append( ( typeName, "compact %ss" % bucketLength ) )
+        self.log.info( "[COMPACT] Compacting %d time ranges at level %d of %d" % ( len( tasks ), bPos + 1, numLevels - 1 ) )
+        for ( typeName, phase ), ( retVal, seconds ) in zip( taskPhases, self.__runInParallel( tasks ) ):
+          if not retVal[ 'OK' ]:
+            self.log.error( "[COMPACT] Can't compact buckets", "%s: %s" % ( typeName, retVal[ 'Message' ] ) )
+            failedTypes.add( typeName )
+          else:
+            self.__addPhaseStats( stats, typeName, phase, retVal[ 'Value' ], seconds )
+
+      for typeName in checkpoints:
+        if typeName in failedTypes:
+          self.log.warn( "[COMPACT] Compaction of %s will be resumed" % typeName )
+          continue
+        #Rollups are maintained at insertion time, only the new ones have to be built
+        for rollup in self.dbCatalog[ typeName ][ 'rollups' ]:
+          if not rollup[ 'ready' ]:
+            startTime = time.time()
+            retVal = self.__buildRollup( typeName, rollup )
+            if not retVal[ 'OK' ]:
+              self.log.error( "[ROLLUP] Can't build rollup", "%s: %s" % ( rollup[ 'table' ], retVal[ 'Message' ] ) )
+            else:
+              self.__addPhaseStats( stats, typeName, "rollups", retVal[ 'Value' ], time.time() - startTime )
+        retVal = self.__clearCheckpoint( typeName, "compact" )
+        if not retVal[ 'OK' ]:
+          self.log.error( "[COMPACT] Can't clear the compaction checkpoint", "%s: %s" % ( typeName, retVal[ 'Message' ] ) )
+      self.__logStats( "[COMPACT]", stats )
+      self.log.info( "[COMPACT] Compaction finished" )
+      self.__lastCompactionEpoch = int( Time.toEpoch() )
+      return S_OK( stats )
+    finally:
+      gSynchro.lock()
+      try:
+        self.__doingCompaction = False
+      finally:
+        gSynchro.unlock()
 
-  def __selectForCompactBuckets( self, typeName, timeLimit, bucketLength, nextBucketLength, connObj = False ):
+  def __getRangesToCompact( self, typeName, bucketLength, timeLimit ):
     """
-    Nasty SQL query to get ideal buckets using grouping by date calculations and adding value contents
+    Get the time ranges holding buckets of a given length starting before a time limit
     """
     tableName = _getTableName( "bucket", typeName )
-    selectSQL = "SELECT "
-    sqlSelectList = []
-    for field in self.dbCatalog[ typeName ][ 'keys' ]:
-      sqlSelectList.append( "`%s`.`%s`" % ( tableName, field ) )
-    for field in self.dbCatalog[ typeName ][ 'values' ]:
-      sqlSelectList.append( "SUM( `%s`.`%s` )" % ( tableName, field ) )
-    sqlSelectList.append( "SUM( `%s`.`entriesInBucket` )" % ( tableName ) )
-    sqlSelectList.append( "MIN( `%s`.`startTime` )" % tableName )
-    sqlSelectList.append( "MAX( `%s`.`startTime` )" % tableName )
-    selectSQL += ", ".join( sqlSelectList )
-    selectSQL += " FROM `%s`" % tableName
-    selectSQL += " WHERE `%s`.`startTime` < '%s' AND" % ( tableName, timeLimit )
-    selectSQL += " `%s`.`bucketLength` = %s" % ( tableName, bucketLength )
-    #MAGIC bucketing
-    sqlGroupList = [ _bucketizeDataField( "`%s`.`startTime`" % tableName, nextBucketLength ) ]
-    for field in self.dbCatalog[ typeName ][ 'keys' ]:
-      sqlGroupList.append( "`%s`.`%s`" % ( tableName, field ) )
-    selectSQL += " GROUP BY %s" % ", ".join( sqlGroupList )
-    return self._query( selectSQL, conn = connObj )
-
-  def __deleteForCompactBuckets( self, typeName, timeLimit, bucketLength, connObj = False ):
-    """
-    Delete compacted buckets
+    rangeField = _bucketizeDataField( "`startTime`", self.__compactionRangeLength )
+    cmd = "SELECT %s, COUNT(*) FROM `%s` WHERE `bucketLength` = %d AND `startTime` < %d GROUP BY 1" % ( rangeField,
+                                                                                                          tableName,
+                                                                                                          bucketLength,
+                                                                                                          timeLimit )
+    retVal = self._query( cmd )
+    if not retVal[ 'OK' ]:
+      return retVal
+    return S_OK( [ ( int( row[0] ), min( int( row[0] ) + self.__compactionRangeLength, timeLimit ) )
+                   for row in sorted( retVal[ 'Value' ] ) ] )
+
+  def __compactRange( self, typeName, bucketLength, rangeStart, rangeEnd, nowEpoch, connObj = False ):
+    """
+    Move the buckets of a given length starting in a time range to the buckets they belong to at nowEpoch.
+    When these are all of the same length, a multiple of the current one, they are summed by the DB,
+    otherwise the buckets are split in python
+
+    :return: S_OK( number of buckets compacted )
     """
     tableName = _getTableName( "bucket", typeName )
-    deleteSQL = "DELETE FROM `%s` WHERE " % tableName
-    deleteSQL += "`%s`.`startTime` < '%s' AND " % ( tableName, timeLimit )
-    deleteSQL += "`%s`.`bucketLength` = %s" % ( tableName, bucketLength )
-    return self._update( deleteSQL, conn = connObj )
-
-  def __compactBucketsForType( self, typeName ):
-    """
-    Compact all buckets for a given type
-    """
-    nowEpoch = Time.toEpoch()
-    #retVal = self.__startTransaction( connObj )
-    #if not retVal[ 'OK' ]:
-    #  return retVal
-    for bPos in range( len( self.dbBucketsLength[ typeName ] ) - 1 ):
-      self.log.info( "[COMPACT] Query %d of %d" % ( bPos + 1, len( self.dbBucketsLength[ typeName ] ) - 1 ) )
-      secondsLimit = self.dbBucketsLength[ typeName ][ bPos ][0]
-      bucketLength = self.dbBucketsLength[ typeName ][ bPos ][1]
-      timeLimit = ( nowEpoch - nowEpoch % bucketLength ) - secondsLimit
-      nextBucketLength = self.dbBucketsLength[ typeName ][ bPos + 1 ][1]
-      self.log.info( "[COMPACT] Compacting data newer that %s with bucket size %s" % ( Time.fromEpoch( timeLimit ), bucketLength ) )
-      #Retrieve the data
-      retVal = self.__selectForCompactBuckets( typeName, timeLimit, bucketLength, nextBucketLength )
+    rangeCond = "`startTime` >= %d AND `startTime` < %d AND `bucketLength` = %d" % ( rangeStart, rangeEnd, bucketLength )
+    keyFields = [ "`%s`" % key for key in self.dbCatalog[ typeName ][ 'keys' ] ]
+    valueFields = [ "`%s`" % value for value in self.dbCatalog[ typeName ][ 'values' ] + [ 'entriesInBucket' ] ]
+    targetLength = self.calculateBucketLengthForTime( typeName, nowEpoch, rangeStart )
+    if targetLength == self.calculateBucketLengthForTime( typeName, nowEpoch, rangeEnd - 1 ) and \
+       targetLength % bucketLength == 0:
+      if targetLength > bucketLength:
+        #The source table is aliased, as the update part refers to the columns of the inserted table
+        cmd = "INSERT INTO `%s` ( `startTime`, `bucketLength`, %s, %s ) " % ( tableName,
+                                                                             ", ".join( keyFields ),
+                                                                             ", ".join( valueFields ) )
+        cmd += "SELECT %s, %d, %s, %s FROM `%s` AS `src` WHERE %s GROUP BY 1, %s " % (
+            _bucketizeDataField( "`startTime`", targetLength ),
+            targetLength,
+            ", ".join( keyFields ),
+            ", ".join( "SUM( %s )" % valueField for valueField in valueFields ),
+            tableName,
+            rangeCond,
+            ", ".join( keyFields ) )
+        cmd += "ON DUPLICATE KEY UPDATE %s" % ", ".join( "`%s`.%s=`%s`.%s+VALUES(%s)" % ( tableName, valueField,
+                                                                                        tableName, valueField,
+                                                                                        valueField )
+                                                         for valueField in valueFields )
+        retVal = self._update( cmd, conn = connObj )
+        if not retVal[ 'OK' ]:
+          return retVal
+        retVal = self._update( "DELETE FROM `%s` WHERE %s" % ( tableName, rangeCond ), conn = connObj )
+        if not retVal[ 'OK' ]:
+          return retVal
+      else:
+        retVal = S_OK( 0 )
+      compacted = retVal[ 'Value' ]
+    else:
+      cmd = "SELECT `startTime`, `bucketLength`, %s, %s FROM `%s` WHERE %s FOR UPDATE" % ( ", ".join( keyFields ),
+                                                                                        ", ".join( valueFields ),
+                                                                                        tableName,
+                                                                                        rangeCond )
+      retVal = self._query( cmd, conn = connObj )
       if not retVal[ 'OK' ]:
-        #self.__rollbackTransaction( connObj )
         return retVal
       bucketsData = retVal[ 'Value' ]
-      self.log.info( "[COMPACT] Got %d records to compact" % len( bucketsData ) )
-      if len( bucketsData ) == 0:
-        continue
-      retVal = self.__deleteForCompactBuckets( typeName, timeLimit, bucketLength )
+      retVal = self._update( "DELETE FROM `%s` WHERE %s" % ( tableName, rangeCond ), conn = connObj )
       if not retVal[ 'OK' ]:
-        #self.__rollbackTransaction( connObj )
         return retVal
-      self.log.info( "[COMPACT] Compacting %s records %s seconds size for %s" % ( len( bucketsData ), bucketLength, typeName ) )
-      #Add data
-      for record in bucketsData:
-        startTime = record[-2]
-        endTime = record[-1]
-        valuesList = record[:-2]
-        retVal = self.__splitInBuckets( typeName, startTime, endTime, valuesList )
-        if not retVal[ 'OK' ]:
-          #self.__rollbackTransaction( connObj )
-          self.log.error( "[COMPACT] Error while compacting data for record", "%s: %s" % ( typeName, retVal[ 'Value' ] ) )
-      self.log.info( "[COMPACT] Finished compaction %d of %d" % ( bPos, len( self.dbBucketsLength[ typeName ] ) - 1 ) )
-    #return self.__commitTransaction( connObj )
-    return S_OK()
+      numKeys = len( keyFields )
+      bucketRows = {}
+      for row in bucketsData:
+        self.__sumInBucketRows( bucketRows, self.calculateBuckets( typeName, row[0], row[0] + row[1], nowEpoch ),
+                                row[ 2:2 + numKeys ], list( row[ 2 + numKeys: ] ) )
+      retVal = self.__writeBucketRows( typeName, bucketRows, connObj = connObj )
+      if not retVal[ 'OK' ]:
+        return retVal
+      compacted = len( bucketsData )
+    retVal = self.__checkpointRange( typeName, "compact", bucketLength, rangeStart, rangeEnd, connObj = connObj )
+    if not retVal[ 'OK' ]:
+      return retVal
+    return S_OK( compacted )
 
-  def __slowCompactBucketsForType( self, typeName ):
+  def __getCheckpoint( self, typeName, operation ):
     """
-    Compact all buckets for a given type
+    Get the checkpoint of an interrupted operation on a type
+
+    :return: S_OK( ( nowEpoch, doneRanges ) ), nowEpoch being the time the operation was started at,
+             False if there is nothing to resume, and doneRanges a set of ( bucketLength, rangeStart )
     """
-    nowEpoch = Time.toEpoch()
-    for bPos in range( len( self.dbBucketsLength[ typeName ] ) - 1 ):
-      self.log.info( "[COMPACT] Query %d of %d" % ( bPos, len( self.dbBucketsLength[ typeName ] ) - 1 ) )
-      secondsLimit = self.dbBucketsLength[ typeName ][ bPos ][0]
-      bucketLength = self.dbBucketsLength[ typeName ][ bPos ][1]
-      timeLimit = ( nowEpoch - nowEpoch % bucketLength ) - secondsLimit
-      self.log.info( "[COMPACT] Compacting data newer that %s with bucket size %s for %s" % (
-          Time.fromEpoch( timeLimit ),
-          bucketLength,
-          typeName))
-      querySize = 10000
-      previousRecordsSelected = querySize
-      totalCompacted = 0
-      while previousRecordsSelected == querySize:
-        #Retrieve the data
-        self.log.info( "[COMPACT] Retrieving buckets to compact newer that %s with size %s" % (
-            Time.fromEpoch( timeLimit ),
-            bucketLength))
-        roundStartTime = time.time()
-        result = self.__selectIndividualForCompactBuckets( typeName, timeLimit, bucketLength,
-                                                           querySize )
-        if not result[ 'OK' ]:
-          #self.__rollbackTransaction( connObj )
-          return result
-        bucketsData = result[ 'Value' ]
-        previousRecordsSelected = len( bucketsData )
-        selectEndTime = time.time()
-        self.log.info( "[COMPACT] Got %d buckets (%d done) (took %.2f secs)" % ( previousRecordsSelected,
-                                                                                 totalCompacted,
-                                                                                 selectEndTime - roundStartTime ) )
-        if len( bucketsData ) == 0:
-          break
+    retVal = self._query( "SELECT `bucketLength`, `rangeStart`, `rangeEnd` FROM `%s` WHERE `typeName`='%s' AND `operation`='%s'" % (
+        self.checkpointsTableName,
+        typeName,
+        operation ) )
+    if not retVal[ 'OK' ]:
+      return retVal
+    nowEpoch = False
+    doneRanges = set()
+    for bucketLength, rangeStart, rangeEnd in retVal[ 'Value' ]:
+      if not bucketLength and not rangeStart:
+        nowEpoch = int( rangeEnd )
+      else:
+        doneRanges.add( ( int( bucketLength ), int( rangeStart ) ) )
+    return S_OK( ( nowEpoch, doneRanges ) )
 
-        result = self.__deleteIndividualForCompactBuckets( typeName, bucketsData )
-        if not result[ 'OK' ]:
-          #self.__rollbackTransaction( connObj )
-          return result
-        bucketsData = result[ 'Value' ]
-        deleteEndTime = time.time()
-        self.log.info( "[COMPACT] Deleted %s out-of-bounds buckets (took %.2f secs)" % ( len( bucketsData ),
-                                                                                         deleteEndTime - selectEndTime ) )
-        #Add data
-        for record in bucketsData:
-          startTime = record[-2]
-          endTime = record[-2] + record[-1]
-          valuesList = record[:-2]
-          retVal = self.__splitInBuckets( typeName, startTime, endTime, valuesList )
-          if not retVal[ 'OK' ]:
-            self.log.error( "[COMPACT] Error while compacting data for buckets", "%s: %s" % ( typeName, retVal[ 'Value' ] ) )
-        totalCompacted += len( bucketsData )
-        insertElapsedTime = time.time() - deleteEndTime
-        self.log.info( "[COMPACT] Records compacted (took %.2f secs, %.2f secs/bucket)" % ( insertElapsedTime,
-                                                                                            insertElapsedTime / len( bucketsData ) ) )
-      self.log.info( "[COMPACT] Finised compaction %d of %d" % ( bPos, len( self.dbBucketsLength[ typeName ] ) - 1 ) )
-    #return self.__commitTransaction( connObj )
-    return S_OK()
+  def __checkpointRange( self, typeName, operation, bucketLength, rangeStart, rangeEnd, connObj = False ):
+    """
+    Record that a time range has been processed by an operation. The range 0 of length 0
+    records the time the operation was started at
+    """
+    cmd = "INSERT INTO `%s` ( `typeName`, `operation`, `bucketLength`, `rangeStart`, `rangeEnd` ) " % self.checkpointsTableName
+    cmd += "VALUES ( '%s', '%s', %d, %d, %d )" % ( typeName, operation, bucketLength, rangeStart, rangeEnd )
+    return self._update( cmd, conn = connObj )
 
-  def __selectIndividualForCompactBuckets( self, typeName, timeLimit, bucketLength, querySize, connObj = False ):
+  def __clearCheckpoint( self, typeName, operation ):
     """
-    Nasty SQL query to get ideal buckets using grouping by date calculations and adding value contents
+    Forget the checkpoint of an operation once it is finished
     """
-    tableName = _getTableName( "bucket", typeName )
-    selectSQL = "SELECT "
-    sqlSelectList = []
-    for field in self.dbCatalog[ typeName ][ 'keys' ]:
-      sqlSelectList.append( "`%s`.`%s`" % ( tableName, field ) )
-    for field in self.dbCatalog[ typeName ][ 'values' ]:
-      sqlSelectList.append( "`%s`.`%s`" % ( tableName, field ) )
-    sqlSelectList.append( "`%s`.`entriesInBucket`" % ( tableName ) )
-    sqlSelectList.append( "`%s`.`startTime`" % tableName )
-    sqlSelectList.append( "`%s`.bucketLength" % ( tableName ) )
-    selectSQL += ", ".join( sqlSelectList )
-    selectSQL += " FROM `%s`" % tableName
-    selectSQL += " WHERE `%s`.`startTime` < '%s' AND" % ( tableName, timeLimit )
-    selectSQL += " `%s`.`bucketLength` = %s" % ( tableName, bucketLength )
-    #MAGIC bucketing
-    selectSQL += " LIMIT %d" % querySize
-    return self._query( selectSQL, conn = connObj )
-
-  def __deleteIndividualForCompactBuckets( self, typeName, bucketsData, connObj = False ):
-    """
-    Delete compacted buckets
+    return self._update( "DELETE FROM `%s` WHERE `typeName`='%s' AND `operation`='%s'" % ( self.checkpointsTableName,
+                                                                                           typeName,
+                                                                                           operation ) )
+
+  def __runInTransaction( self, function, *args ):
     """
-    tableName = _getTableName( "bucket", typeName )
-    keyFields = self.dbCatalog[ typeName ][ 'keys' ]
-    deleteQueryLimit = 50
-    deletedBuckets = []
-    for bLimit in range( 0, len( bucketsData ) , deleteQueryLimit ):
-      delCondsSQL = []
-      for record in bucketsData[ bLimit : bLimit + deleteQueryLimit ]:
-        condSQL = []
-        for iPos in range( len( keyFields ) ):
-          field = keyFields[ iPos ]
-          condSQL.append( "`%s`.`%s` = %s" % ( tableName, field, record[ iPos ] ) )
-        condSQL.append( "`%s`.`startTime` = %d" % ( tableName, record[-2] ) )
-        condSQL.append( "`%s`.`bucketLength` = %d" % ( tableName, record[-1] ) )
-        delCondsSQL.append( "(%s)" % " AND ".join( condSQL ) )
-      delSQL = "DELETE FROM `%s` WHERE %s" % ( tableName, " OR ".join( delCondsSQL ) )
-      result = self._update( delSQL, conn = connObj )
-      if not result[ 'OK' ]:
-        self.log.error( "Cannot delete individual records for compaction", result[ 'Message' ] )
+    Execute function( *args, connObj = connObj ) in a transaction of its own, restarting it in case of dead lock
+    """
+    retVal = self._getConnection()
+    if not retVal[ 'OK' ]:
+      return retVal
+    connObj = retVal[ 'Value' ]
+    try:
+      for _i in range( max( 1, self.__deadLockRetries ) ):
+        retVal = self.__startTransaction( connObj )
+        if not retVal[ 'OK' ]:
+          return retVal
+        result = function( *args, connObj = connObj )
+        retVal = result
+        if retVal[ 'OK' ]:
+          retVal = self.__commitTransaction( connObj )
+          if retVal[ 'OK' ]:
+            return result
+        self.__rollbackTransaction( connObj )
+        if retVal[ 'Message' ].find( "try restarting transaction" ) == -1:
+          return retVal
+      return retVal
+    finally:
+      connObj.close()
+
+  def __groupRangesByBuckets( self, typeName, ranges, nowEpoch ):
+    """
+    Group the time ranges that may write to the same buckets, so that they are processed one after
+    the other instead of upserting the same rows in parallel
+
+    :param list ranges: ( rangeStart, rangeEnd, last second the buckets of the range can reach ) tuples, sorted
+    :return: list of lists of ( rangeStart, rangeEnd )
+    """
+    groups = []
+    groupEnd = 0
+    for rangeStart, rangeEnd, lastTime in ranges:
+      firstLength = self.calculateBucketLengthForTime( typeName, nowEpoch, rangeStart )
+      if groups and rangeStart - rangeStart % firstLength < groupEnd:
+        groups[-1].append( ( rangeStart, rangeEnd ) )
       else:
-        deletedBuckets.extend( bucketsData[ bLimit : bLimit + deleteQueryLimit ] )
-    return S_OK( deletedBuckets )
+        groups.append( [ ( rangeStart, rangeEnd ) ] )
+      lastLength = self.calculateBucketLengthForTime( typeName, nowEpoch, lastTime )
+      groupEnd = max( groupEnd, lastTime - lastTime % lastLength + lastLength )
+    return groups
+
+  @staticmethod
+  def __runSequentially( tasks ):
+    """
+    Execute ( function, args ) tasks one after the other, stopping at the first failure
+
+    :return: S_OK( sum of the task results ) or the first error
+    """
+    total = 0
+    for function, args in tasks:
+      retVal = function( *args )
+      if not retVal[ 'OK' ]:
+        return retVal
+      total += retVal[ 'Value' ]
+    return S_OK( total )
+
+  def __runInParallel( self, tasks ):
+    """
+    Execute ( function, args ) tasks in at most CompactionThreads threads
+
+    :return: list of ( result, seconds ) in the order of the tasks
+    """
+    results = [ None ] * len( tasks )
+    tasksQueue = Queue.Queue()
+    for taskPos, task in enumerate( tasks ):
+      tasksQueue.put( ( taskPos, task ) )
+
+    def worker():
+      while True:
+        try:
+          taskPos, ( function, args ) = tasksQueue.get_nowait()
+        except Queue.Empty:
+          return
+        startTime = time.time()
+        try:
+          result = function( *args )
+        except Exception as e: #pylint: disable=broad-except
+          self.log.exception( "Exception in worker thread", lException = e )
+          result = S_ERROR( "Exception in worker thread: %s" % str( e ) )
+        results[ taskPos ] = ( result, time.time() - startTime )
+
+    workers = [ threading.Thread( target = worker ) for _i in range( min( self.__compactionThreads, len( tasks ) ) ) ]
+    for workerThread in workers:
+      workerThread.start()
+    for workerThread in workers:
+      workerThread.join()
+    return results
+
+  @staticmethod
+  def __addPhaseStats( stats, typeName, phase, rows, seconds ):
+    """
+    Add the rows processed by a phase of an operation and the seconds it took
+    """
+    phaseStats = stats.setdefault( typeName, {} ).setdefault( phase, { 'Rows' : 0, 'Seconds' : 0.0 } )
+    phaseStats[ 'Rows' ] += rows
+    phaseStats[ 'Seconds' ] += seconds
+
+  def __logStats( self, logPrefix, stats ):
+    for typeName in sorted( stats ):
+      for phase in sorted( stats[ typeName ] ):
+        self.log.info( "%s %s %s: %d rows in %.2f secs" % ( logPrefix, typeName, phase,
+                                                            stats[ typeName ][ phase ][ 'Rows' ],
+                                                            stats[ typeName ][ phase ][ 'Seconds' ] ) )
 
   def __deleteRecordsOlderThanDataTimespan( self, typeName ):
     """
     IF types define dataTimespan, then records older than datatimespan seconds will be deleted
     automatically
+
+    :return: number of records deleted
     """
     dataTimespan = self.dbCatalog[ typeName ][ 'dataTimespan' ] + self.dbBucketsLength[ typeName ][-1][1]
     if dataTimespan < 86400 * 30:
-      return
-    for table, field in ( ( _getTableName( "type", typeName ), 'endTime' ),
-                          ( _getTableName( "bucket", typeName ), 'startTime' ) ):
+      return 0
+    tablesToClean = [ ( _getTableName( "type", typeName ), 'endTime' ),
+                      ( _getTableName( "bucket", typeName ), 'startTime' ) ]
+    tablesToClean.extend( ( rollup[ 'table' ], 'startTime' ) for rollup in self.dbCatalog[ typeName ][ 'rollups' ] )
+    totalDeleted = 0
+    for table, field in tablesToClean:
       self.log.info( "[COMPACT] Deleting old records for table %s" % table )
       deleteLimit = 100000
       deleted = deleteLimit
@@ -1343,138 +1946,151 @@ class AccountingDB( DB ):
           break
         self.log.info( "[COMPACT] Deleted %d records for %s table" % ( result[ 'Value' ], table ) )
         deleted = result[ 'Value' ]
+        totalDeleted += deleted
         time.sleep( 1 )
+    return totalDeleted
 
   def regenerateBuckets( self, typeName ):
+    """
+    Rebuild the buckets of a type from its records
+
+    The records are split in buckets by time ranges processed in parallel, each in its own transaction
+    that also checkpoints it, the ranges that may write to the same buckets one after the other.
+    Calling it again after an interruption resumes the regeneration
+
+    :return: S_OK( { phase : { 'Rows' : rows, 'Seconds' : seconds } } )
+    """
     if self.__readOnly:
       return S_ERROR( "ReadOnly mode enabled. No modification allowed" )
+    stats = {}
     #Delete old entries if any
     if self.dbCatalog[ typeName ][ 'dataTimespan' ] > 0:
       self.log.info( "[REBUCKET] Deleting records older that timespan for type %s" % typeName )
-      self.__deleteRecordsOlderThanDataTimespan( typeName )
+      startTime = time.time()
+      deleted = self.__deleteRecordsOlderThanDataTimespan( typeName )
+      self.__addPhaseStats( stats, typeName, "old records", deleted, time.time() - startTime )
       self.log.info( "[REBUCKET] Done deleting old records" )
+    retVal = self.__getCheckpoint( typeName, "regenerate" )
+    if not retVal[ 'OK' ]:
+      return retVal
+    nowEpoch, doneRanges = retVal[ 'Value' ]
+    if nowEpoch:
+      self.log.info( "[REBUCKET] Resuming the regeneration of %s started at %s" % ( typeName, Time.fromEpoch( nowEpoch ) ) )
+    else:
+      nowEpoch = int( Time.toEpoch() )
+      self.log.info( "[REBUCKET] Deleting buckets for %s" % typeName )
+      startTime = time.time()
+      retVal = self._update( "DELETE FROM `%s`" % _getTableName( "bucket", typeName ) )
+      if not retVal[ 'OK' ]:
+        return retVal
+      self.__addPhaseStats( stats, typeName, "delete buckets", retVal[ 'Value' ], time.time() - startTime )
+      retVal = self.__checkpointRange( typeName, "regenerate", 0, 0, nowEpoch )
+      if not retVal[ 'OK' ]:
+        return retVal
+
     rawTableName = _getTableName( "type", typeName )
-    #retVal = self.__startTransaction( connObj )
-    #if not retVal[ 'OK' ]:
-    #  return retVal
-    self.log.info( "[REBUCKET] Deleting buckets for %s" % typeName )
-    retVal = self._update( "DELETE FROM `%s`" % _getTableName( "bucket", typeName ) )
+    retVal = self._query( "SELECT %s, MAX( `endTime` ) FROM `%s` GROUP BY 1" % ( _bucketizeDataField( "`startTime`",
+                                                                                                     self.__compactionRangeLength ),
+                                                                                 rawTableName ) )
     if not retVal[ 'OK' ]:
       return retVal
-    #Generate the common part of the query
-    #SELECT fields
-    startTimeTableField = "`%s`.startTime" % rawTableName
-    endTimeTableField = "`%s`.endTime" % rawTableName
-    #Select strings and sum select strings
-    sqlSUMSelectList = []
-    sqlSelectList = []
-    for field in self.dbCatalog[ typeName ][ 'keys' ]:
-      sqlSUMSelectList.append( "`%s`.`%s`" % ( rawTableName, field ) )
-      sqlSelectList.append( "`%s`.`%s`" % ( rawTableName, field ) )
-    for field in self.dbCatalog[ typeName ][ 'values' ]:
-      sqlSUMSelectList.append( "SUM( `%s`.`%s` )" % ( rawTableName, field ) )
-      sqlSelectList.append( "`%s`.`%s`" % ( rawTableName, field ) )
-    sumSelectString = ", ".join( sqlSUMSelectList )
-    selectString = ", ".join( sqlSelectList )
-    #Grouping fields
-    sqlGroupList = []
-    for field in self.dbCatalog[ typeName ][ 'keys' ]:
-      sqlGroupList.append( "`%s`.`%s`" % ( rawTableName, field ) )
-    groupingString = ", ".join( sqlGroupList )
-    #List to contain all queries
-    sqlQueries = []
-    dateInclusiveConditions = []
-    countedField = "`%s`.`%s`" % ( rawTableName, self.dbCatalog[ typeName ][ 'keys' ][0] )
-    lastTime = Time.toEpoch()
-    #Iterate for all ranges
-    for iRange in range( len( self.dbBucketsLength[ typeName ] ) ):
-      bucketTimeSpan = self.dbBucketsLength[ typeName ][iRange][0]
-      bucketLength = self.dbBucketsLength[ typeName ][iRange][1]
-      startRangeTime = lastTime - bucketTimeSpan
-      endRangeTime = lastTime
-      lastTime -= bucketTimeSpan
-      bucketizedStart = _bucketizeDataField( startTimeTableField, bucketLength )
-      bucketizedEnd = _bucketizeDataField( endTimeTableField, bucketLength )
-
-      timeSelectString = "MIN(%s), MAX(%s)" % ( startTimeTableField,
-                                                endTimeTableField )
-      #Is the last bucket?
-      if iRange == len( self.dbBucketsLength[ typeName ] ) - 1:
-        whereString = "%s <= %d" % ( endTimeTableField,
-                                     endRangeTime )
+    #The records starting in a range can be split in buckets up to the end of the longest one
+    ranges = []
+    for row in sorted( retVal[ 'Value' ] ):
+      rangeStart = int( row[0] )
+      rangeEnd = rangeStart + self.__compactionRangeLength
+      if ( 0, rangeStart ) not in doneRanges:
+        ranges.append( ( rangeStart, rangeEnd, max( rangeEnd, int( row[1] ) ) - 1 ) )
+    tasks = []
+    for group in self.__groupRangesByBuckets( typeName, ranges, nowEpoch ):
+      tasks.append( ( self.__runSequentially, ( [ ( self.__runInTransaction, ( self.__regenerateRange, typeName,
+                                                                               rangeStart, rangeEnd, nowEpoch ) )
+                                                  for rangeStart, rangeEnd in group ], ) ) )
+    self.log.info( "[REBUCKET] Rebucketing %d time ranges of %s in %d groups" % ( len( ranges ), typeName, len( tasks ) ) )
+    errorsList = []
+    for retVal, seconds in self.__runInParallel( tasks ):
+      if not retVal[ 'OK' ]:
+        errorsList.append( retVal[ 'Message' ] )
       else:
-        whereString = "%s > %d AND %s <= %d" % (
-            startTimeTableField,
-            startRangeTime,
-            endTimeTableField,
-            endRangeTime)
-      sameBucketCondition = "(%s) = (%s)" % ( bucketizedStart, bucketizedEnd )
-      #Records that fit in a bucket
-      sqlQuery = "SELECT %s, %s, COUNT(%s) FROM `%s` WHERE %s AND %s GROUP BY %s, %s" % (
-          timeSelectString,
-          sumSelectString,
-          countedField,
+        self.__addPhaseStats( stats, typeName, "rebucket", retVal[ 'Value' ], seconds )
+    if errorsList:
+      self.__logStats( "[REBUCKET]", stats )
+      self.log.error( "[REBUCKET] Can't rebucket all the records, the regeneration has to be resumed",
+                      "%s: %s" % ( typeName, errorsList[0] ) )
+      return S_ERROR( "Can't rebucket %d time ranges of %s: %s" % ( len( errorsList ), typeName, errorsList[0] ) )
+
+    for rollup in self.dbCatalog[ typeName ][ 'rollups' ]:
+      startTime = time.time()
+      retVal = self.__buildRollup( typeName, rollup )
+      if not retVal[ 'OK' ]:
+        return retVal
+      self.__addPhaseStats( stats, typeName, "rollups", retVal[ 'Value' ], time.time() - startTime )
+    retVal = self.__clearCheckpoint( typeName, "regenerate" )
+    if not retVal[ 'OK' ]:
+      return retVal
+    self.__logStats( "[REBUCKET]", stats )
+    return S_OK( stats.get( typeName, {} ) )
+
+  def __regenerateRange( self, typeName, rangeStart, rangeEnd, nowEpoch, connObj = False ):
+    """
+    Split in buckets the records of a type starting in a time range. When the buckets of the
+    range are all of the same length, the records fitting in one bucket are summed by the DB
+
+    :return: S_OK( number of records bucketed )
+    """
+    rawTableName = _getTableName( "type", typeName )
+    rangeCond = "`startTime` >= %d AND `startTime` < %d" % ( rangeStart, rangeEnd )
+    keyFields = [ "`%s`" % key for key in self.dbCatalog[ typeName ][ 'keys' ] ]
+    valueFields = [ "`%s`" % value for value in self.dbCatalog[ typeName ][ 'values' ] ]
+    numRecords = 0
+    bucketLength = self.calculateBucketLengthForTime( typeName, nowEpoch, rangeStart )
+    if bucketLength == self.calculateBucketLengthForTime( typeName, nowEpoch, rangeEnd - 1 ):
+      sameBucketCond = "%s = %s" % ( _bucketizeDataField( "`startTime`", bucketLength ),
+                                     _bucketizeDataField( "`endTime`", bucketLength ) )
+      bucketTableName = _getTableName( "bucket", typeName )
+      cmd = "INSERT INTO `%s` ( `startTime`, `bucketLength`, %s, %s, `entriesInBucket` ) " % ( bucketTableName,
+                                                                                             ", ".join( keyFields ),
+                                                                                             ", ".join( valueFields ) )
+      cmd += "SELECT %s, %d, %s, %s, COUNT(*) FROM `%s` WHERE %s AND %s GROUP BY 1, %s " % (
+          _bucketizeDataField( "`startTime`", bucketLength ),
+          bucketLength,
+          ", ".join( keyFields ),
+          ", ".join( "SUM( %s )" % valueField for valueField in valueFields ),
           rawTableName,
-          whereString,
-          sameBucketCondition,
-          groupingString,
-          bucketizedStart)
-      sqlQueries.append( sqlQuery )
-      #Records that fit in more than one bucket
-      sqlQuery = "SELECT %s, %s, %s, 1 FROM `%s` WHERE %s AND NOT %s" % ( startTimeTableField,
-                                                                          endTimeTableField,
-                                                                          selectString,
-                                                                          rawTableName,
-                                                                          whereString,
-                                                                          sameBucketCondition
-                                                                        )
-      sqlQueries.append( sqlQuery )
-      dateInclusiveConditions.append( "( %s )" % whereString )
-    #Query for records that are in between two ranges
-    sqlQuery = "SELECT %s, %s, %s, 1 FROM `%s` WHERE NOT %s" % (
-        startTimeTableField,
-        endTimeTableField,
-        selectString,
-        rawTableName,
-        " AND NOT ".join( dateInclusiveConditions )
-        )
-    sqlQueries.append( sqlQuery )
-    self.log.info( "[REBUCKET] Retrieving data for rebuilding buckets for type %s..." % ( typeName ) )
-    queryNum = 0
-    for sqlQuery in sqlQueries:
-      self.log.info( "[REBUCKET] Executing query #%s..." % queryNum )
-      queryNum += 1
-      retVal = self._query( sqlQuery )
+          rangeCond,
+          sameBucketCond,
+          ", ".join( keyFields ) )
+      cmd += "ON DUPLICATE KEY UPDATE %s" % ", ".join( "%s=%s+VALUES(%s)" % ( valueField, valueField, valueField )
+                                                       for valueField in valueFields + [ "`entriesInBucket`" ] )
+      retVal = self._update( cmd, conn = connObj )
       if not retVal[ 'OK' ]:
-        self.log.error( "[REBUCKET] Can't retrieve data for rebucketing", retVal[ 'Message' ] )
-        #self.__rollbackTransaction( connObj )
         return retVal
-      rawData = retVal[ 'Value' ]
-      self.log.info( "[REBUCKET] Retrieved %s records" % len( rawData ) )
-      rebucketedRecords = 0
-      startQuery = time.time()
-      startBlock = time.time()
-      numRecords = len( rawData )
-      for entry in rawData:
-        startT = entry[0]
-        endT = entry[1]
-        values = entry[2:]
-        retVal = self.__splitInBuckets( typeName, startT, endT, values )
-        if not retVal[ 'OK' ]:
-          #self.__rollbackTransaction( connObj )
-          return retVal
-        rebucketedRecords += 1
-        if rebucketedRecords % 1000 == 0:
-          queryAvg = rebucketedRecords / float( time.time() - startQuery )
-          blockAvg = 1000 / float( time.time() - startBlock )
-          startBlock = time.time()
-          perDone = 100 * rebucketedRecords / float ( numRecords )
-          expectedEnd = str( datetime.timedelta( seconds = int( ( numRecords - rebucketedRecords ) / blockAvg ) ) )
-          self.log.info( "[REBUCKET] Rebucketed %.2f%% %s (%.2f r/s block %.2f r/s query | ETA %s )..." % ( perDone, typeName,
-                                                                                                            blockAvg, queryAvg,
-                                                                                                            expectedEnd ) )
-    #return self.__commitTransaction( connObj )
-    return S_OK()
+      retVal = self._query( "SELECT COUNT(*) FROM `%s` WHERE %s AND %s" % ( rawTableName, rangeCond, sameBucketCond ),
+                            conn = connObj )
+      if not retVal[ 'OK' ]:
+        return retVal
+      numRecords += retVal[ 'Value' ][0][0]
+      rangeCond += " AND NOT %s" % sameBucketCond
+    cmd = "SELECT `startTime`, `endTime`, %s, %s FROM `%s` WHERE %s" % ( ", ".join( keyFields ),
+                                                                         ", ".join( valueFields ),
+                                                                         rawTableName,
+                                                                         rangeCond )
+    retVal = self._query( cmd, conn = connObj )
+    if not retVal[ 'OK' ]:
+      return retVal
+    numKeys = len( keyFields )
+    bucketRows = {}
+    for row in retVal[ 'Value' ]:
+      self.__sumInBucketRows( bucketRows, self.calculateBuckets( typeName, row[0], row[1], nowEpoch ),
+                              row[ 2:2 + numKeys ], list( row[ 2 + numKeys: ] ) + [ 1 ] )
+    numRecords += len( retVal[ 'Value' ] )
+    retVal = self.__writeBucketRows( typeName, bucketRows, connObj = connObj )
+    if not retVal[ 'OK' ]:
+      return retVal
+    retVal = self.__checkpointRange( typeName, "regenerate", 0, rangeStart, rangeEnd, connObj = connObj )
+    if not retVal[ 'OK' ]:
+      return retVal
+    return S_OK( int( numRecords ) )
 
 
   def __startTransaction( self, connObj ):
@@ -1486,6 +2102,51 @@ class AccountingDB( DB ):
   def __rollbackTransaction( self, connObj ):
     return self._query( "ROLLBACK", conn = connObj )
 
+def _keyValueToString( keyValue ):
+  """
+  Cast a key value to string just in case
+  """
+  if not isinstance( keyValue, basestring ):
+    keyValue = str( keyValue )
+  return keyValue
+
+def _normalizeKeyValue( keyValue ):
+  """
+  Key value as stored in the key tables: a string of no more than 64 chars
+  """
+  return _keyValueToString( keyValue )[:64]
+
+def _proportionalPart( value, proportion ):
+  """
+  Proportional part of a value, DECIMAL values read from the buckets keeping their precision
+  """
+  if isinstance( value, Decimal ) and isinstance( proportion, float ):
+    return value * Decimal( repr( proportion ) )
+  return value * proportion
+
+def _spanBucket( startTime, bucketLength, granularity ):
+  """
+  Get the periods of a granularity a bucket spans, as ( startTime, proportion, granularity ) tuples
+  """
+  periodStart = startTime - startTime % granularity
+  endTime = startTime + bucketLength
+  if periodStart + granularity >= endTime:
+    return [ ( periodStart, 1, granularity ) ]
+  periods = []
+  while periodStart < endTime:
+    proportion = float( min( periodStart + granularity, endTime ) - max( periodStart, startTime ) ) / bucketLength
+    periods.append( ( periodStart, proportion, granularity ) )
+    periodStart += granularity
+  return periods
+
+def _sqlNumber( value ):
+  """
+  SQL representation of a number, floats keeping all their digits
+  """
+  if isinstance( value, float ):
+    return repr( value )
+  return str( value )
+
 def _bucketizeDataField( dataField, bucketLength ):
   return "%s - ( %s %% %s )" % ( dataField, dataField, bucketLength )
 
@@ -1499,3 +2160,14 @@ def _getTableName( tableType, typeName, keyName = None ):
     return "ac_%s_%s_%s" % ( tableType, typeName, keyName )
   else:
     raise Exception( "Call to _getTableName with tableType as key but with no keyName" )
+
+def _getRollupTableName( typeName, granularity, rollupKeys, keyFields ):
+  """
+  Generate the table name of a rollup, the keys being hashed if the name is too long
+  """
+  if rollupKeys == keyFields:
+    return "ac_rollup%s_%s" % ( granularity, typeName )
+  tableName = "ac_rollup%s_%s_%s" % ( granularity, typeName, "_".join( rollupKeys ) )
+  if len( tableName ) > 64:
+    tableName = "ac_rollup%s_%s_%s" % ( granularity, typeName, hashlib.md5( ",".join( rollupKeys ) ).hexdigest()[:8] )
+  return tableName
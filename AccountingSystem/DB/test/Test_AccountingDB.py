@@ -0,0 +1,537 @@
+""" Unit tests for the AccountingDB, without MySQL
+"""
+
+# pylint: disable=protected-access,invalid-name
+
+__RCSID__ = "$Id$"
+
+import time
+import unittest
+
+from mock import MagicMock, patch
+
+from DIRAC import gLogger, S_OK, S_ERROR
+from DIRAC.Core.Utilities import Time
+from DIRAC.AccountingSystem.DB.AccountingDB import AccountingDB, _spanBucket
+
+DEADLOCK = "Deadlock found when trying to get lock; try restarting transaction"
+
+class AccountingDBTestCase( unittest.TestCase ):
+  """ Base class building an AccountingDB with a type Test_Job, whose queries are recorded
+  """
+
+  def setUp( self ):
+    gMonitorPatch = patch( 'DIRAC.AccountingSystem.DB.AccountingDB.gMonitor' )
+    gMonitorPatch.start()
+    self.addCleanup( gMonitorPatch.stop )
+    with patch( 'DIRAC.Core.Base.DB.DB.__init__', MagicMock( return_value = None ) ), \
+         patch( 'DIRAC.AccountingSystem.DB.AccountingDB.ThreadPool' ), \
+         patch.object( AccountingDB, 'getCSOption', side_effect = lambda optionName, defaultValue = None: defaultValue ), \
+         patch.object( AccountingDB, '_createTables' ), \
+         patch.object( AccountingDB, '_AccountingDB__loadCatalogFromDB' ), \
+         patch.object( AccountingDB, '_AccountingDB__registerTypes' ), \
+         patch.object( AccountingDB, '_AccountingDB__preloadKeysCache' ):
+      self.db = AccountingDB()
+    self.db.log = gLogger.getSubLogger( 'AccountingDB' )
+    # hourly buckets for a day, daily buckets for a year
+    self.db._AccountingDB__addToCatalog( 'Test_Job', [ 'Site', 'User' ], [ 'CPUTime', 'Jobs' ],
+                                         [ ( 86400, 3600 ), ( 31536000, 86400 ) ] )
+    self.keyIds = { 'Site' : { 'CERN' : 1, 'PIC' : 2 }, 'User' : { 'user1' : 10 } }
+    self.db._AccountingDB__getKeyIds = MagicMock( side_effect = self.getKeyIds )
+    self.db._escapeValues = MagicMock( side_effect = lambda values: S_OK( [ "'%s'" % value for value in values ] ) )
+    self.connection = MagicMock()
+    self.db._getConnection = MagicMock( return_value = S_OK( self.connection ) )
+    self.queries = []
+    self.queryResults = []
+    self.db._query = MagicMock( side_effect = self.query )
+    self.db._update = MagicMock( side_effect = self.update )
+    # start of the hour two hours ago, in the range of the hourly buckets
+    now = int( Time.toEpoch() )
+    self.hourStart = now - now % 3600 - 7200
+
+  def getKeyIds( self, _typeName, keyName, keyValues, insert = True ):
+    """ ids of the known key values """
+    return S_OK( dict( ( value, self.keyIds[ keyName ][ value ] ) for value in keyValues
+                       if value in self.keyIds[ keyName ] ) )
+
+  def query( self, cmd, conn = None ):
+    """ recorded SELECTs and transaction statements, returning the first of queryResults they contain """
+    self.queries.append( cmd )
+    for statement, result in self.queryResults:
+      if statement in cmd:
+        return result
+    return S_OK( () )
+
+  def update( self, cmd, conn = None ):
+    """ recorded modifications """
+    self.queries.append( cmd )
+    return S_OK( 1 )
+
+  def getStatements( self, prefix ):
+    return [ cmd for cmd in self.queries if cmd.startswith( prefix ) ]
+
+class InsertionTestCase( AccountingDBTestCase ):
+  """ Insertion of the records, summed per bucket
+  """
+
+  def test_sumInBucketRows( self ):
+    sumInBucketRows = AccountingDB._AccountingDB__sumInBucketRows
+    bucketRows = {}
+    sumInBucketRows( bucketRows, [ ( 0, 0.75, 3600 ), ( 3600, 0.25, 3600 ) ], [ 1, 10 ], [ 100.0, 4, 1 ] )
+    self.assertEqual( bucketRows, { ( 0, ( 1, 10 ), 3600 ) : [ 75.0, 3.0, 0.75 ],
+                                    ( 3600, ( 1, 10 ), 3600 ) : [ 25.0, 1.0, 0.25 ] } )
+    # Same keys in the same bucket are summed, other keys get their own row
+    sumInBucketRows( bucketRows, [ ( 3600, 1, 3600 ) ], [ 1, 10 ], [ 50.0, 2, 1 ] )
+    sumInBucketRows( bucketRows, [ ( 3600, 1, 3600 ) ], [ 2, 10 ], [ 10.0, 1, 1 ] )
+    self.assertEqual( bucketRows, { ( 0, ( 1, 10 ), 3600 ) : [ 75.0, 3.0, 0.75 ],
+                                    ( 3600, ( 1, 10 ), 3600 ) : [ 75.0, 3.0, 1.25 ],
+                                    ( 3600, ( 2, 10 ), 3600 ) : [ 10.0, 1, 1 ] } )
+
+  def test_insertRecordsBundle( self ):
+    records = [ # spans 2 hourly buckets, 3/4 in the first one
+                ( self.hourStart + 1800, self.hourStart + 4200, [ 'CERN', 'user1', 200, 4 ] ),
+                # same keys, in the second bucket
+                ( self.hourStart + 3600, self.hourStart + 3700, [ 'CERN', 'user1', 50, 1 ] ),
+                # unknown site
+                ( self.hourStart, self.hourStart + 100, [ 'RAL', 'user1', 10, 1 ] ),
+                # missing field
+                ( self.hourStart, self.hourStart + 100, [ 'PIC', 'user1', 10 ] ),
+                ( self.hourStart + 100, self.hourStart + 200, [ 'PIC', 'user1', 10, 1 ] ) ]
+    result = self.db._AccountingDB__insertRecordsBundle( 'Test_Job', records )
+    self.assertTrue( result['OK'] )
+    self.assertEqual( sorted( result['Value'] ), [ 2, 3 ] )
+    self.assertTrue( 'RAL' in result['Value'][2] )
+
+    # All the records in a single transaction
+    self.assertEqual( self.db._getConnection.call_count, 1 )
+    self.assertEqual( self.getStatements( 'START TRANSACTION' ), [ 'START TRANSACTION' ] )
+    self.assertEqual( self.getStatements( 'COMMIT' ), [ 'COMMIT' ] )
+    self.assertEqual( self.getStatements( 'ROLLBACK' ), [] )
+    self.connection.close.assert_called_once_with()
+
+    typeInserts = self.getStatements( 'INSERT INTO `ac_type_Test_Job`' )
+    self.assertEqual( len( typeInserts ), 1 )
+    self.assertEqual( typeInserts[0].count( "( '" ), 3 )
+
+    # One row per bucket and keys, in the order of the unique index
+    bucketInserts = self.getStatements( 'INSERT INTO `ac_bucket_Test_Job`' )
+    self.assertEqual( len( bucketInserts ), 1 )
+    valuesGroups = bucketInserts[0].split( 'VALUES ' )[1].split( ' ON DUPLICATE' )[0]
+    self.assertEqual( valuesGroups, ", ".join( [ "( %d,3600,0.75,1,10,150.0,3.0 )" % self.hourStart,
+                                                 "( %d,3600,1.0,2,10,10.0,1.0 )" % self.hourStart,
+                                                 "( %d,3600,1.25,1,10,100.0,2.0 )" % ( self.hourStart + 3600 ) ] ) )
+
+  def test_insertRecordsBundleFailed( self ):
+    records = [ ( self.hourStart, self.hourStart + 100, [ 'RAL', 'user1', 10, 1 ] ) ]
+    result = self.db._AccountingDB__insertRecordsBundle( 'Test_Job', records )
+    self.assertTrue( result['OK'] )
+    self.assertEqual( sorted( result['Value'] ), [ 0 ] )
+    # Nothing to write
+    self.assertEqual( self.queries, [] )
+
+  def test_keyIdsError( self ):
+    def getKeyIds( typeName, keyName, keyValues, insert = True ):
+      if 'PIC' in keyValues:
+        return S_ERROR( "Data too long for column 'value'" )
+      return self.getKeyIds( typeName, keyName, keyValues, insert )
+    self.db._AccountingDB__getKeyIds = MagicMock( side_effect = getKeyIds )
+    records = [ ( self.hourStart, self.hourStart + 100, [ 'PIC', 'user1', 10, 1 ] ),
+                ( self.hourStart, self.hourStart + 100, [ 'CERN', 'user1', 10, 1 ] ) ]
+    result = self.db._AccountingDB__insertRecordsBundle( 'Test_Job', records )
+    # Only the record with the failing key value is not added
+    self.assertTrue( result['OK'] )
+    self.assertEqual( result['Value'], { 0 : "Data too long for column 'value'" } )
+    typeInserts = self.getStatements( 'INSERT INTO `ac_type_Test_Job`' )
+    self.assertEqual( len( typeInserts ), 1 )
+    self.assertEqual( typeInserts[0].count( "( '" ), 1 )
+    self.assertTrue( "'1'" in typeInserts[0] )
+
+  def test_deadlockRetry( self ):
+    bucketInserts = []
+    def update( cmd, conn = None ):
+      self.queries.append( cmd )
+      if cmd.startswith( 'INSERT INTO `ac_bucket_Test_Job`' ):
+        bucketInserts.append( cmd )
+        if len( bucketInserts ) == 1:
+          return S_ERROR( DEADLOCK )
+      return S_OK( 1 )
+    self.db._update = MagicMock( side_effect = update )
+    records = [ ( self.hourStart, self.hourStart + 100, [ 'CERN', 'user1', 10, 1 ] ) ]
+    result = self.db._AccountingDB__insertRecordsBundle( 'Test_Job', records )
+    self.assertTrue( result['OK'] )
+    self.assertEqual( result['Value'], {} )
+    # The whole transaction is executed again
+    self.assertEqual( self.getStatements( 'START TRANSACTION' ), [ 'START TRANSACTION' ] * 2 )
+    self.assertEqual( self.getStatements( 'ROLLBACK' ), [ 'ROLLBACK' ] )
+    self.assertEqual( self.getStatements( 'COMMIT' ), [ 'COMMIT' ] )
+    self.assertEqual( len( self.getStatements( 'INSERT INTO `ac_type_Test_Job`' ) ), 2 )
+    self.assertEqual( len( bucketInserts ), 2 )
+
+  def test_noRetry( self ):
+    def update( cmd, conn = None ):
+      self.queries.append( cmd )
+      if cmd.startswith( 'INSERT INTO `ac_bucket_Test_Job`' ):
+        return S_ERROR( "Out of range value for column 'CPUTime'" )
+      return S_OK( 1 )
+    self.db._update = MagicMock( side_effect = update )
+    records = [ ( self.hourStart, self.hourStart + 100, [ 'CERN', 'user1', 10, 1 ] ) ]
+    result = self.db._AccountingDB__insertRecordsBundle( 'Test_Job', records )
+    self.assertFalse( result['OK'] )
+    # Only the deadlocks are retried
+    self.assertEqual( self.getStatements( 'START TRANSACTION' ), [ 'START TRANSACTION' ] )
+    self.assertEqual( self.getStatements( 'ROLLBACK' ), [ 'ROLLBACK' ] )
+    self.assertEqual( self.getStatements( 'COMMIT' ), [] )
+    self.connection.close.assert_called_once_with()
+
+  def test_deadlockRetriesExhausted( self ):
+    def update( cmd, conn = None ):
+      self.queries.append( cmd )
+      if cmd.startswith( 'INSERT INTO `ac_bucket_Test_Job`' ):
+        return S_ERROR( DEADLOCK )
+      return S_OK( 1 )
+    self.db._update = MagicMock( side_effect = update )
+    records = [ ( self.hourStart, self.hourStart + 100, [ 'CERN', 'user1', 10, 1 ] ) ]
+    result = self.db._AccountingDB__insertRecordsBundle( 'Test_Job', records )
+    self.assertFalse( result['OK'] )
+    self.assertEqual( len( self.getStatements( 'START TRANSACTION' ) ), 2 )
+    self.assertEqual( len( self.getStatements( 'ROLLBACK' ) ), 2 )
+    self.assertEqual( self.getStatements( 'COMMIT' ), [] )
+
+class RollupTestCase( AccountingDBTestCase ):
+  """ Spreading of the buckets in the rollups, and choice of the rollup of a query
+  """
+
+  def setUp( self ):
+    AccountingDBTestCase.setUp( self )
+    self.db.dbCatalog[ 'Test_Job' ][ 'rollups' ] = [ { 'table' : 'ac_rollup86400_Test_Job_Site', 'granularity' : 86400,
+                                                       'keys' : [ 'Site' ], 'ready' : True },
+                                                     { 'table' : 'ac_rollup3600_Test_Job', 'granularity' : 3600,
+                                                       'keys' : [ 'Site', 'User' ], 'ready' : True },
+                                                     { 'table' : 'ac_rollup86400_Test_Job', 'granularity' : 86400,
+                                                       'keys' : [ 'Site', 'User' ], 'ready' : False } ]
+    self.db._AccountingDB__rollupsCheckTime[ 'Test_Job' ] = time.time()
+    self.selectFields = ( "%s, %s, SUM(%s)", [ 'startTime', 'bucketLength', 'CPUTime' ] )
+
+  def getRollup( self, granularity, condDict, groupFields ):
+    rollup = self.db._AccountingDB__getRollupForQuery( 'Test_Job', granularity, self.selectFields, condDict,
+                                                       groupFields, groupFields )
+    return rollup[ 'table' ] if rollup else None
+
+  def test_spanBucket( self ):
+    # Buckets inside a period
+    self.assertEqual( _spanBucket( 3 * 3600, 3600, 86400 ), [ ( 0, 1, 86400 ) ] )
+    self.assertEqual( _spanBucket( 86400, 86400, 86400 ), [ ( 86400, 1, 86400 ) ] )
+    # Bucket across two days
+    self.assertEqual( _spanBucket( 82800, 7200, 86400 ), [ ( 0, 0.5, 86400 ), ( 86400, 0.5, 86400 ) ] )
+    # Weekly bucket over days
+    periods = _spanBucket( 4 * 86400, 604800, 86400 )
+    self.assertEqual( [ period[0] for period in periods ], [ day * 86400 for day in range( 4, 11 ) ] )
+    self.assertAlmostEqual( sum( period[1] for period in periods ), 1 )
+    # Bucket not aligned on the granularity
+    self.assertEqual( _spanBucket( 1800, 3600, 3600 ), [ ( 0, 0.5, 3600 ), ( 3600, 0.5, 3600 ) ] )
+
+  def test_rollUp( self ):
+    bucketRows = { ( 82800, ( 1, 10 ), 7200 ) : [ 100.0, 2.0, 2.0 ],
+                   ( 3600, ( 1, 11 ), 3600 ) : [ 10.0, 1.0, 1.0 ] }
+    rollup = self.db.dbCatalog[ 'Test_Job' ][ 'rollups' ][0]
+    self.assertEqual( self.db._AccountingDB__rollUp( 'Test_Job', rollup, bucketRows ),
+                      { ( 0, ( 1, ), 86400 ) : [ 60.0, 2.0, 2.0 ],
+                        ( 86400, ( 1, ), 86400 ) : [ 50.0, 1.0, 1.0 ] } )
+
+  def test_getRollupForQuery( self ):
+    groupBySite = ( "%s, %s", [ 'startTime', 'Site' ] )
+    # The coarsest rollup with the keys of the query
+    self.assertEqual( self.getRollup( 86400, {}, groupBySite ), 'ac_rollup86400_Test_Job_Site' )
+    self.assertEqual( self.getRollup( 604800, { 'Site' : [ 'CERN' ] }, groupBySite ), 'ac_rollup86400_Test_Job_Site' )
+    # Granularity of the report not a multiple of the one of the rollup
+    self.assertEqual( self.getRollup( 3600, {}, groupBySite ), 'ac_rollup3600_Test_Job' )
+    self.assertEqual( self.getRollup( 1800, {}, groupBySite ), None )
+    self.assertEqual( self.getRollup( 7200, {}, groupBySite ), 'ac_rollup3600_Test_Job' )
+    # Key missing in the rollup, in the conditions or in the grouping
+    self.assertEqual( self.getRollup( 86400, { 'User' : [ 'user1' ] }, groupBySite ), 'ac_rollup3600_Test_Job' )
+    self.assertEqual( self.getRollup( 86400, {}, ( "%s, %s", [ 'startTime', 'User' ] ) ), 'ac_rollup3600_Test_Job' )
+    # Rollups not ready are not used
+    self.db.dbCatalog[ 'Test_Job' ][ 'rollups' ][1][ 'ready' ] = False
+    self.assertEqual( self.getRollup( 86400, { 'User' : [ 'user1' ] }, groupBySite ), None )
+    self.assertEqual( self.queries, [] )
+
+  def test_readyRollups( self ):
+    # The ready flags are reloaded from the catalog after a while
+    self.db._AccountingDB__rollupsCheckTime[ 'Test_Job' ] = 0
+    self.db._query = MagicMock( return_value = S_OK( ( ( 'ac_rollup86400_Test_Job', ), ) ) )
+    self.assertEqual( self.getRollup( 86400, { 'User' : [ 'user1' ] }, ( "%s", [ 'startTime' ] ) ),
+                      'ac_rollup86400_Test_Job' )
+    self.assertEqual( self.getRollup( 86400, {}, ( "%s, %s", [ 'startTime', 'Site' ] ) ), 'ac_rollup86400_Test_Job' )
+    self.assertEqual( self.db._query.call_count, 1 )
+
+class CompactionTestCase( AccountingDBTestCase ):
+  """ Compaction and regeneration of the buckets, range after range
+  """
+
+  def setUp( self ):
+    AccountingDBTestCase.setUp( self )
+    # Days of the year long enough in the past to be compacted to daily buckets
+    now = int( Time.toEpoch() )
+    self.day1 = now - now % 86400 - 10 * 86400
+    self.day2 = self.day1 + 86400
+    self.rangesQuery = "SELECT `startTime` - ( `startTime` % 86400 ), COUNT(*) FROM `ac_bucket_Test_Job` " \
+                       "WHERE `bucketLength` = 3600"
+    self.checkpointQuery = "SELECT `bucketLength`, `rangeStart`, `rangeEnd` FROM `ac_catalog_Checkpoints` " \
+                           "WHERE `typeName`='Test_Job' AND `operation`="
+    self.recordRangesQuery = "SELECT `startTime` - ( `startTime` % 86400 ), MAX( `endTime` ) FROM `ac_type_Test_Job` " \
+                             "GROUP BY 1"
+
+  def getCheckpoints( self ):
+    return [ cmd.split( "VALUES " )[1] for cmd in self.getStatements( "INSERT INTO `ac_catalog_Checkpoints`" ) ]
+
+  def getRangeConditions( self, prefix ):
+    return sorted( cmd.split( "`startTime` >= " )[1].split( " AND `startTime` < " )[0]
+                   for cmd in self.getStatements( prefix ) )
+
+  def test_getRangesToCompact( self ):
+    self.queryResults = [ ( self.rangesQuery, S_OK( ( ( self.day2, 24 ), ( self.day1, 24 ) ) ) ) ]
+    result = self.db._AccountingDB__getRangesToCompact( 'Test_Job', 3600, self.day2 + 3600 )
+    self.assertEqual( result['Value'], [ ( self.day1, self.day2 ), ( self.day2, self.day2 + 3600 ) ] )
+    self.assertEqual( self.queries, [ "%s AND `startTime` < %d GROUP BY 1" % ( self.rangesQuery, self.day2 + 3600 ) ] )
+
+  def test_compactRangeInDB( self ):
+    result = self.db._AccountingDB__compactRange( 'Test_Job', 3600, self.day1, self.day2, int( Time.toEpoch() ) )
+    self.assertTrue( result['OK'] )
+    rangeCond = "`startTime` >= %d AND `startTime` < %d AND `bucketLength` = 3600" % ( self.day1, self.day2 )
+    self.assertEqual( len( self.queries ), 3 )
+    # The hourly buckets of the range summed in daily buckets by the DB
+    self.assertTrue( self.queries[0].startswith( "INSERT INTO `ac_bucket_Test_Job` ( `startTime`, `bucketLength`, "
+                                                 "`Site`, `User`, `CPUTime`, `Jobs`, `entriesInBucket` ) "
+                                                 "SELECT `startTime` - ( `startTime` % 86400 ), 86400, " ) )
+    self.assertTrue( "WHERE %s GROUP BY 1, `Site`, `User` ON DUPLICATE KEY UPDATE" % rangeCond in self.queries[0] )
+    self.assertEqual( self.queries[1], "DELETE FROM `ac_bucket_Test_Job` WHERE %s" % rangeCond )
+    self.assertEqual( self.getCheckpoints(), [ "( 'Test_Job', 'compact', 3600, %d, %d )" % ( self.day1, self.day2 ) ] )
+
+  def test_compactRangeSplit( self ):
+    nowEpoch = int( Time.toEpoch() )
+    nowEpoch -= nowEpoch % 86400
+    # The range is partly in the last day, whose buckets stay hourly
+    rangeStart = nowEpoch - 2 * 86400 + 3600
+    rangeEnd = rangeStart + 86400
+    self.queryResults = [ ( "FOR UPDATE", S_OK( ( ( rangeStart, 3600, 1, 10, 100.0, 2.0, 1.0 ),
+                                                  ( rangeEnd - 3600, 3600, 1, 10, 10.0, 1.0, 1.0 ) ) ) ) ]
+    result = self.db._AccountingDB__compactRange( 'Test_Job', 3600, rangeStart, rangeEnd, nowEpoch )
+    self.assertEqual( result['Value'], 2 )
+    rangeCond = "`startTime` >= %d AND `startTime` < %d AND `bucketLength` = 3600" % ( rangeStart, rangeEnd )
+    self.assertEqual( self.queries[0], "SELECT `startTime`, `bucketLength`, `Site`, `User`, `CPUTime`, `Jobs`, "
+                                       "`entriesInBucket` FROM `ac_bucket_Test_Job` WHERE %s FOR UPDATE" % rangeCond )
+    self.assertEqual( self.queries[1], "DELETE FROM `ac_bucket_Test_Job` WHERE %s" % rangeCond )
+    # Each bucket split in python to the bucket length of its time
+    valuesGroups = self.queries[2].split( 'VALUES ' )[1].split( ' ON DUPLICATE' )[0]
+    self.assertEqual( valuesGroups, "( %d,86400,1.0,1,10,100.0,2.0 ), ( %d,3600,1.0,1,10,10.0,1.0 )" % (
+        rangeStart - 3600, rangeEnd - 3600 ) )
+    self.assertEqual( self.getCheckpoints(), [ "( 'Test_Job', 'compact', 3600, %d, %d )" % ( rangeStart, rangeEnd ) ] )
+
+  def test_compactRangeRollback( self ):
+    def update( cmd, conn = None ):
+      self.queries.append( cmd )
+      if cmd.startswith( "DELETE" ):
+        return S_ERROR( "Lock wait timeout exceeded" )
+      return S_OK( 1 )
+    self.db._update = MagicMock( side_effect = update )
+    result = self.db._AccountingDB__runInTransaction( self.db._AccountingDB__compactRange, 'Test_Job', 3600,
+                                                      self.day1, self.day2, int( Time.toEpoch() ) )
+    self.assertFalse( result['OK'] )
+    # The summed buckets are rolled back with the failed DELETE, the range is not checkpointed
+    self.assertEqual( self.getStatements( 'ROLLBACK' ), [ 'ROLLBACK' ] )
+    self.assertEqual( self.getStatements( 'COMMIT' ), [] )
+    self.assertEqual( self.getCheckpoints(), [] )
+    self.connection.close.assert_called_once_with()
+
+  def test_compactBuckets( self ):
+    self.queryResults = [ ( self.rangesQuery, S_OK( ( ( self.day1, 24 ), ( self.day2, 24 ) ) ) ) ]
+    result = self.db.compactBuckets()
+    self.assertTrue( result['OK'] )
+    self.assertEqual( result['Value'][ 'Test_Job' ][ 'compact 3600s' ][ 'Rows' ], 2 )
+    # One transaction per range
+    self.assertEqual( len( self.getStatements( 'COMMIT' ) ), 2 )
+    self.assertEqual( self.getRangeConditions( "DELETE FROM `ac_bucket_Test_Job`" ),
+                      [ str( self.day1 ), str( self.day2 ) ] )
+    # The start of the compaction and the ranges are checkpointed, and forgotten at the end
+    checkpoints = self.getCheckpoints()
+    self.assertTrue( checkpoints[0].startswith( "( 'Test_Job', 'compact', 0, 0, " ) )
+    self.assertEqual( sorted( checkpoints[1:] ), [ "( 'Test_Job', 'compact', 3600, %d, %d )" % ( day, day + 86400 )
+                                                   for day in ( self.day1, self.day2 ) ] )
+    self.assertEqual( self.getStatements( "DELETE FROM `ac_catalog_Checkpoints`" ),
+                      [ "DELETE FROM `ac_catalog_Checkpoints` WHERE `typeName`='Test_Job' AND `operation`='compact'" ] )
+
+  def test_compactBucketsResumed( self ):
+    nowEpoch = int( Time.toEpoch() ) - 3600
+    self.queryResults = [ ( self.rangesQuery, S_OK( ( ( self.day1, 24 ), ( self.day2, 24 ) ) ) ),
+                          ( self.checkpointQuery, S_OK( ( ( 0, 0, nowEpoch ), ( 3600, self.day1, self.day2 ) ) ) ) ]
+    result = self.db.compactBuckets()
+    self.assertTrue( result['OK'] )
+    # The time limit of the interrupted compaction, and only the range left
+    self.assertTrue( "`startTime` < %d GROUP BY 1" % ( nowEpoch - nowEpoch % 3600 - 86400 ) in
+                     self.getStatements( self.rangesQuery )[0] )
+    self.assertEqual( self.getRangeConditions( "DELETE FROM `ac_bucket_Test_Job`" ), [ str( self.day2 ) ] )
+    self.assertEqual( self.getCheckpoints(), [ "( 'Test_Job', 'compact', 3600, %d, %d )" % ( self.day2,
+                                                                                            self.day2 + 86400 ) ] )
+    self.assertEqual( len( self.getStatements( "DELETE FROM `ac_catalog_Checkpoints`" ) ), 1 )
+
+  def test_compactBucketsFailed( self ):
+    def update( cmd, conn = None ):
+      self.queries.append( cmd )
+      if cmd.startswith( "DELETE FROM `ac_bucket_Test_Job` WHERE `startTime` >= %d " % self.day2 ):
+        return S_ERROR( "Lock wait timeout exceeded" )
+      return S_OK( 1 )
+    self.db._update = MagicMock( side_effect = update )
+    self.queryResults = [ ( self.rangesQuery, S_OK( ( ( self.day1, 24 ), ( self.day2, 24 ) ) ) ) ]
+    result = self.db.compactBuckets()
+    self.assertTrue( result['OK'] )
+    # The checkpoints are kept for the compaction to be resumed
+    self.assertEqual( self.getCheckpoints()[1:], [ "( 'Test_Job', 'compact', 3600, %d, %d )" % ( self.day1,
+                                                                                                self.day2 ) ] )
+    self.assertEqual( self.getStatements( "DELETE FROM `ac_catalog_Checkpoints`" ), [] )
+
+  def test_regenerateBuckets( self ):
+    self.queryResults = [ ( self.recordRangesQuery, S_OK( ( ( self.day1, self.day1 + 3600 ), ( self.day2, self.day2 + 3600 ) ) ) ),
+                          ( "SELECT COUNT(*) FROM `ac_type_Test_Job`", S_OK( ( ( 5, ), ) ) ) ]
+    result = self.db.regenerateBuckets( 'Test_Job' )
+    self.assertTrue( result['OK'] )
+    self.assertEqual( result['Value'][ 'rebucket' ][ 'Rows' ], 10 )
+    self.assertEqual( result['Value'][ 'delete buckets' ][ 'Rows' ], 1 )
+    self.assertEqual( self.getStatements( "DELETE FROM `ac_bucket_Test_Job`" ), [ "DELETE FROM `ac_bucket_Test_Job`" ] )
+    self.assertEqual( self.getRangeConditions( "INSERT INTO `ac_bucket_Test_Job`" ),
+                      [ str( self.day1 ), str( self.day2 ) ] )
+    checkpoints = self.getCheckpoints()
+    self.assertTrue( checkpoints[0].startswith( "( 'Test_Job', 'regenerate', 0, 0, " ) )
+    self.assertEqual( sorted( checkpoints[1:] ), [ "( 'Test_Job', 'regenerate', 0, %d, %d )" % ( day, day + 86400 )
+                                                   for day in ( self.day1, self.day2 ) ] )
+    self.assertEqual( len( self.getStatements( "DELETE FROM `ac_catalog_Checkpoints`" ) ), 1 )
+
+  def test_regenerateBucketsResumed( self ):
+    nowEpoch = int( Time.toEpoch() ) - 3600
+    self.queryResults = [ ( self.recordRangesQuery, S_OK( ( ( self.day1, self.day1 + 3600 ), ( self.day2, self.day2 + 3600 ) ) ) ),
+                          ( "SELECT COUNT(*) FROM `ac_type_Test_Job`", S_OK( ( ( 5, ), ) ) ),
+                          ( self.checkpointQuery, S_OK( ( ( 0, 0, nowEpoch ), ( 0, self.day1, self.day2 ) ) ) ) ]
+    result = self.db.regenerateBuckets( 'Test_Job' )
+    self.assertTrue( result['OK'] )
+    self.assertEqual( result['Value'][ 'rebucket' ][ 'Rows' ], 5 )
+    # The buckets already regenerated are kept
+    self.assertEqual( self.getStatements( "DELETE FROM `ac_bucket_Test_Job`" ), [] )
+    self.assertEqual( self.getRangeConditions( "INSERT INTO `ac_bucket_Test_Job`" ), [ str( self.day2 ) ] )
+    self.assertEqual( self.getCheckpoints(), [ "( 'Test_Job', 'regenerate', 0, %d, %d )" % ( self.day2,
+                                                                                            self.day2 + 86400 ) ] )
+
+  def test_groupRangesByBuckets( self ):
+    # Weekly buckets over a week ago, daily buckets over a day ago
+    self.db.dbBucketsLength[ 'Test_Job' ] = [ ( 86400, 3600 ), ( 604800, 86400 ), ( 31536000, 604800 ) ]
+    nowEpoch = 1500000000
+    week = 1499904000 - 2 * 604800
+    today = 1499904000
+    days = [ week, week + 86400, week + 6 * 86400, week + 7 * 86400, week + 8 * 86400, today, today + 86400 ]
+    groups = self.db._AccountingDB__groupRangesByBuckets( 'Test_Job', [ ( day, day + 86400, day + 86399 ) for day in days ],
+                                                          nowEpoch )
+    # The days of a week are compacted in the same weekly buckets
+    self.assertEqual( groups, [ [ ( day, day + 86400 ) for day in dayGroup ]
+                                for dayGroup in ( days[:3], days[3:5], days[5:6], days[6:] ) ] )
+    # Records reaching the buckets of the next range
+    groups = self.db._AccountingDB__groupRangesByBuckets( 'Test_Job', [ ( today, today + 86400, today + 86499 ),
+                                                                        ( today + 86400, today + 172800, today + 172799 ) ],
+                                                          nowEpoch )
+    self.assertEqual( groups, [ [ ( today, today + 86400 ), ( today + 86400, today + 172800 ) ] ] )
+
+  def test_regenerateLongRecords( self ):
+    # Records of the first day ending in the second one: both ranges are processed one after the other
+    self.queryResults = [ ( self.recordRangesQuery, S_OK( ( ( self.day1, self.day2 + 3600 ), ( self.day2, self.day2 + 3600 ) ) ) ),
+                          ( "SELECT COUNT(*) FROM `ac_type_Test_Job`", S_OK( ( ( 5, ), ) ) ) ]
+    with patch.object( self.db, '_AccountingDB__runInParallel',
+                       side_effect = lambda tasks: [ ( function( *args ), 0. ) for function, args in tasks ] ) as runInParallel:
+      result = self.db.regenerateBuckets( 'Test_Job' )
+    self.assertTrue( result['OK'] )
+    self.assertEqual( result['Value'][ 'rebucket' ][ 'Rows' ], 10 )
+    self.assertEqual( len( runInParallel.call_args[0][0] ), 1 )
+    self.assertEqual( self.getRangeConditions( "INSERT INTO `ac_bucket_Test_Job`" ), [ str( self.day1 ), str( self.day2 ) ] )
+
+class QueryTestCase( AccountingDBTestCase ):
+  """ Queries of the buckets slice after slice, the slices over being cached
+  """
+
+  def setUp( self ):
+    AccountingDBTestCase.setUp( self )
+    # One bucket per slice: daily slices over a day ago, hourly slices since
+    self.db._AccountingDB__queryCacheSliceBuckets = 1
+    self.db._AccountingDB__queryType = MagicMock( side_effect = self.queryType )
+    # 2017-07-14 02:40:00, the hourly buckets starting at 2017-07-13 02:00:00
+    self.nowEpoch = 1500000000
+    toEpochPatch = patch.object( Time, 'toEpoch', MagicMock( return_value = self.nowEpoch ) )
+    toEpochPatch.start()
+    self.addCleanup( toEpochPatch.stop )
+    self.selectFields = ( "%s, %s, SUM(%s)", [ 'startTime', 'Site', 'CPUTime' ] )
+    self.groupFields = ( "%s, %s", [ 'startTime', 'Site' ] )
+
+  def queryType( self, _typeName, startTime, endTime, _selectFields, condDict, _groupFields, _orderFields,
+                 _tableType, connObj = False, rollup = None, alignTimes = True ):
+    """ one row per slice, modifying the conditions as __queryType does """
+    condDict.pop( 'Site', None )
+    return S_OK( ( ( startTime, endTime, 'CERN' ), ) )
+
+  def query( self, startTime, endTime, condDict, rollup = None ):
+    return self.db._AccountingDB__queryBucketsBySlices( 'Test_Job', startTime, endTime, self.selectFields, condDict,
+                                                        self.groupFields, self.groupFields, rollup = rollup )
+
+  def getSlices( self ):
+    return [ call[0][1:3] for call in self.db._AccountingDB__queryType.call_args_list ]
+
+  def test_slices( self ):
+    condDict = { 'Site' : [ 'CERN' ] }
+    # The first bucket is the one of startTime + 1 hour, the last the one of endTime + 1 hour
+    result = self.query( 1499736200, self.nowEpoch, condDict )
+    self.assertTrue( result['OK'] )
+    expectedSlices = [ ( 1499731200, 1499817599 ), ( 1499817600, 1499903999 ), ( 1499904000, 1499990399 ),
+                       ( 1499990400, 1499993999 ), ( 1499994000, 1499997599 ), ( 1499997600, 1500001199 ),
+                       ( 1500001200, 1500001200 ) ]
+    self.assertEqual( self.getSlices(), expectedSlices )
+    # The rows of the slices in time order
+    self.assertEqual( result['Value'], tuple( ( start, end, 'CERN' ) for start, end in expectedSlices ) )
+    self.assertEqual( condDict, { 'Site' : [ 'CERN' ] } )
+    for call in self.db._AccountingDB__queryType.call_args_list:
+      self.assertFalse( call[1][ 'alignTimes' ] )
+
+    # The slices over are cached, even for a range starting a day later
+    self.db._AccountingDB__queryType.reset_mock()
+    result = self.query( 1499736200 + 86400, self.nowEpoch, condDict )
+    self.assertEqual( result['Value'], tuple( ( start, end, 'CERN' ) for start, end in expectedSlices[1:] ) )
+    # The current slices are not
+    self.assertEqual( self.getSlices(), expectedSlices[5:] )
+
+    # Other conditions, other slices
+    self.db._AccountingDB__queryType.reset_mock()
+    self.query( 1499736200, self.nowEpoch, { 'Site' : [ 'PIC' ] } )
+    self.assertEqual( self.getSlices(), expectedSlices )
+
+  def test_rollupSlices( self ):
+    rollup = { 'table' : 'ac_rollup86400_Test_Job_Site', 'granularity' : 86400, 'keys' : [ 'Site' ], 'ready' : True }
+    result = self.query( 1499736200, self.nowEpoch, {}, rollup = rollup )
+    expectedSlices = [ ( 1499731200, 1499817599 ), ( 1499817600, 1499903999 ), ( 1499904000, 1499990399 ),
+                       ( 1499990400, 1499990400 ) ]
+    self.assertEqual( self.getSlices(), expectedSlices )
+    self.assertEqual( len( result['Value'] ), 4 )
+    for call in self.db._AccountingDB__queryType.call_args_list:
+      self.assertEqual( call[1][ 'rollup' ], rollup )
+    # Not mixed with the slices of the buckets
+    self.db._AccountingDB__queryType.reset_mock()
+    self.query( 1499736200, self.nowEpoch, {} )
+    self.assertEqual( len( self.getSlices() ), 7 )
+    self.db._AccountingDB__queryType.reset_mock()
+    self.query( 1499736200, self.nowEpoch, {}, rollup = rollup )
+    self.assertEqual( self.getSlices(), expectedSlices[3:] )
+
+  def test_queryFailed( self ):
+    self.db._AccountingDB__queryType = MagicMock( side_effect = [ S_OK( ( ( 1, ), ) ), S_ERROR( "Lost connection" ) ] )
+    result = self.query( 1499736200, self.nowEpoch, {} )
+    self.assertFalse( result['OK'] )
+    self.assertEqual( self.db._AccountingDB__queryType.call_count, 2 )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( InsertionTestCase )
+  suite.addTest( unittest.defaultTestLoader.loadTestsFromTestCase( RollupTestCase ) )
+  suite.addTest( unittest.defaultTestLoader.loadTestsFromTestCase( CompactionTestCase ) )
+  suite.addTest( unittest.defaultTestLoader.loadTestsFromTestCase( QueryTestCase ) )
+  testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
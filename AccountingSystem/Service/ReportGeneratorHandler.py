@@ -55,7 +55,11 @@ class ReportGeneratorHandler( RequestHandler ):
     except IOError:
       gLogger.fatal( "Can't write to %s" % dataPath )
       return S_ERROR( "Data location is not writable" )
-    gDataCache.setGraphsLocation( dataPath )
+    # The plots can be shared by several ReportGenerators writing in the same location
+    gDataCache.setGraphsLocation( dataPath,
+                                  maxSize = gConfig.getValue( "%s/MaxPlotsSize" % reportSection, 1024 ) * 1024 * 1024,
+                                  lifeTime = gConfig.getValue( "%s/PlotsLifeTime" % reportSection, 3600 ),
+                                  shared = gConfig.getValue( "%s/SharedDataLocation" % reportSection, False ) )
     gMonitor.registerActivity( "plotsDrawn", "Drawn plot images", "Accounting reports", "plots", gMonitor.OP_SUM )
     gMonitor.registerActivity( "reportsRequested", "Generated reports", "Accounting reports", "reports", gMonitor.OP_SUM )
     return S_OK()
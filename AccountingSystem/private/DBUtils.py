@@ -1,4 +1,5 @@
 import types
+import numpy
 from DIRAC.Core.Utilities import Time
 
 class DBUtils:
@@ -71,6 +72,40 @@ class DBUtils:
     nowEpoch = Time.toEpoch()
     return self._acDB.calculateBucketLengthForTime( self._setup, typeName, nowEpoch, momentEpoch )
 
+  def __spanToGranularityArrays( self, granularity, bucketsData ):
+    """
+    Spread the buckets over the periods of the granularity they span
+
+    :return: array of period start times, and array of the sums for each period,
+             the last column being the sum of the proportions
+    """
+    if not bucketsData:
+      return numpy.zeros( 0, dtype = numpy.int64 ), numpy.zeros( ( 0, 1 ) )
+    bucketDates = numpy.array( [ bucketData[0] for bucketData in bucketsData ], dtype = numpy.int64 )
+    bucketLengths = numpy.array( [ bucketData[1] for bucketData in bucketsData ], dtype = numpy.int64 )
+    #None values become NaN, and then 0
+    bucketValues = numpy.nan_to_num( numpy.array( [ bucketData[2:] for bucketData in bucketsData ], dtype = float ) )
+    bucketEnds = bucketDates + bucketLengths
+    #Buckets already at the granularity or without length go to a single period, as they are
+    singlePeriod = ( bucketLengths == granularity ) | ( bucketLengths == 0 )
+    firstPeriods = numpy.where( bucketLengths == granularity, bucketDates, bucketDates - bucketDates % granularity )
+    numPeriods = numpy.where( singlePeriod, 1, ( bucketEnds - firstPeriods + granularity - 1 ) // granularity )
+    #One row per bucket and period
+    bucketIndexes = numpy.repeat( numpy.arange( len( bucketsData ) ), numPeriods )
+    periodIndexes = numpy.arange( bucketIndexes.size ) - numpy.repeat( numpy.cumsum( numPeriods ) - numPeriods, numPeriods )
+    periodStarts = firstPeriods[ bucketIndexes ] + periodIndexes * granularity
+    periodLengths = numpy.minimum( periodStarts + granularity, bucketEnds[ bucketIndexes ] ) - \
+                    numpy.maximum( periodStarts, bucketDates[ bucketIndexes ] )
+    proportions = numpy.where( singlePeriod[ bucketIndexes ], 1.0,
+                               periodLengths / numpy.maximum( bucketLengths[ bucketIndexes ], 1 ).astype( float ) )
+    #Sum per period
+    periods, periodPositions = numpy.unique( periodStarts, return_inverse = True )
+    spannedValues = numpy.column_stack( ( bucketValues[ bucketIndexes ] * proportions[ :, None ], proportions ) )
+    sums = numpy.zeros( ( len( periods ), spannedValues.shape[1] ) )
+    for column in range( spannedValues.shape[1] ):
+      sums[ :, column ] = numpy.bincount( periodPositions, weights = spannedValues[ :, column ], minlength = len( periods ) )
+    return periods, sums
+
   def _spanToGranularity( self, granularity, bucketsData ):
     """
     bucketsData must be a list of lists where each list contains
@@ -78,44 +113,8 @@ class DBUtils:
       - field 1: bucketLength
       - fields 2-n: numericalFields
     """
-    normData = {}
-
-    def addToNormData( bucketDate, data, proportion = 1.0 ):
-      if bucketDate in normData:
-        for iP in range( len( data ) ):
-          val = data[ iP ]
-          if val == None:
-            val = 0
-          normData[ bucketDate ][iP] += float( val ) * proportion
-        normData[ bucketDate ][ -1 ] += proportion
-      else:
-        normData[ bucketDate ] = []
-        for fD in data:
-          if fD == None:
-            fD = 0
-          normData[ bucketDate ].append( float( fD ) * proportion )
-        normData[ bucketDate ].append( proportion )
-
-    for bucketData in bucketsData:
-      bucketDate = bucketData[0]
-      originalBucketLength = bucketData[1]
-      bucketValues = bucketData[2:]
-      if originalBucketLength == granularity:
-        addToNormData( bucketDate, bucketValues )
-      else:
-        startEpoch = bucketDate
-        endEpoch = bucketDate + originalBucketLength
-        newBucketEpoch = startEpoch - startEpoch % granularity
-        if startEpoch == endEpoch:
-          addToNormData( newBucketEpoch, bucketValues )
-        else:
-          while newBucketEpoch < endEpoch:
-            start = max( newBucketEpoch, startEpoch )
-            end = min( newBucketEpoch + granularity, endEpoch )
-            proportion = float( end - start ) / originalBucketLength
-            addToNormData( newBucketEpoch, bucketValues, proportion )
-            newBucketEpoch += granularity
-    return normData
+    periods, sums = self.__spanToGranularityArrays( granularity, bucketsData )
+    return dict( zip( periods.tolist(), sums.tolist() ) )
 
   def _sumToGranularity( self, granularity, bucketsData ):
     """
@@ -124,10 +123,8 @@ class DBUtils:
       - field 1: bucketLength
       - fields 2-n: numericalFields
     """
-    normData = self._spanToGranularity( granularity, bucketsData )
-    for bDate in normData:
-      del( normData[ bDate ][-1] )
-    return normData
+    periods, sums = self.__spanToGranularityArrays( granularity, bucketsData )
+    return dict( zip( periods.tolist(), sums[ :, :-1 ].tolist() ) )
 
   def _averageToGranularity( self, granularity, bucketsData ):
     """
@@ -136,12 +133,8 @@ class DBUtils:
       - field 1: bucketLength
       - fields 2-n: numericalFields
     """
-    normData = self._spanToGranularity( granularity, bucketsData )
-    for bDate in normData:
-      for iP in range( len( normData[ bDate ] ) ):
-        normData[ bDate ][iP] = float( normData[ bDate ][iP] ) / normData[ bDate ][-1]
-      del( normData[ bDate ][-1] )
-    return normData
+    periods, sums = self.__spanToGranularityArrays( granularity, bucketsData )
+    return dict( zip( periods.tolist(), ( sums[ :, :-1 ] / sums[ :, -1: ] ).tolist() ) )
 
   def _convertNoneToZero( self, bucketsData ):
     """
@@ -224,13 +217,11 @@ class DBUtils:
       - dataDict = { 'key' : { time1 : value,  time2 : value... }, 'key2'.. }
     """
     startBucketEpoch = startEpoch - startEpoch % granularity
+    timeEpochs = range( startBucketEpoch, endEpoch, granularity )
     for key in dataDict:
       currentDict = dataDict[ key ]
-      lastValue = 0
-      for timeEpoch in range( startBucketEpoch, endEpoch, granularity ):
-        if timeEpoch in currentDict:
-          lastValue += currentDict[ timeEpoch ]
-        currentDict[ timeEpoch ] = lastValue
+      accumulated = numpy.cumsum( [ currentDict.get( timeEpoch, 0 ) for timeEpoch in timeEpochs ] )
+      currentDict.update( zip( timeEpochs, accumulated.tolist() ) )
     return dataDict
 
   def stripDataField( self, dataDict, fieldId ):
@@ -0,0 +1,105 @@
+""" Cache of the ids of the values of an accounting key table
+
+    The id of a value never changes once it has been inserted, whichever DataStore did it, so the ids
+    are kept as long as there is room for them, the least recently used ones going first.
+    Values known not to be in the table are kept as well, but only for a short time, as another
+    DataStore may insert them in the meantime.
+"""
+
+import time
+import threading
+import collections
+
+__RCSID__ = "$Id$"
+
+class KeyIdCache( object ):
+  """ Bounded and thread safe { value : id } cache
+  """
+
+  def __init__( self, maxSize = 10000, missingLifeTime = 60 ):
+    """ c'tor
+
+    :param int maxSize: maximum number of ids, and of missing values, to keep
+    :param int missingLifeTime: seconds a value is known to be missing for
+    """
+    self.maxSize = maxSize
+    self.missingLifeTime = missingLifeTime
+    self.__ids = collections.OrderedDict()
+    self.__missing = {}
+    self.__lock = threading.Lock()
+
+  def __len__( self ):
+    return len( self.__ids )
+
+  def getMany( self, values ):
+    """ Cached ids of values
+
+    :param values: iterable of values
+    :return: { value : id } for the values in the cache
+    """
+    keyIds = {}
+    with self.__lock:
+      for value in values:
+        keyId = self.__ids.pop( value, None )
+        if keyId is not None:
+          # Reinserted as the most recently used
+          self.__ids[ value ] = keyId
+          keyIds[ value ] = keyId
+    return keyIds
+
+  def get( self, value ):
+    """ Cached id of a value, None if not cached
+    """
+    return self.getMany( [ value ] ).get( value )
+
+  def addMany( self, keyIds ):
+    """ Add ids to the cache
+
+    :param dict keyIds: { value : id }
+    """
+    with self.__lock:
+      for value, keyId in keyIds.iteritems():
+        self.__missing.pop( value, None )
+        self.__ids.pop( value, None )
+        self.__ids[ value ] = keyId
+      while len( self.__ids ) > self.maxSize:
+        self.__ids.popitem( last = False )
+
+  def add( self, value, keyId ):
+    """ Add the id of a value to the cache
+    """
+    self.addMany( { value : keyId } )
+
+  def setMissing( self, values ):
+    """ Remember that values are not in the table
+
+    :param values: iterable of values
+    """
+    now = time.time()
+    with self.__lock:
+      if len( self.__missing ) >= self.maxSize:
+        for value in [ value for value, expiration in self.__missing.iteritems() if expiration <= now ]:
+          del self.__missing[ value ]
+      for value in values:
+        if len( self.__missing ) >= self.maxSize:
+          break
+        self.__missing[ value ] = now + self.missingLifeTime
+
+  def isMissing( self, value ):
+    """ Whether a value was found not to be in the table a short time ago
+    """
+    with self.__lock:
+      expiration = self.__missing.get( value )
+      if expiration is None:
+        return False
+      if expiration <= time.time():
+        del self.__missing[ value ]
+        return False
+      return True
+
+  def clear( self ):
+    """ Empty the cache
+    """
+    with self.__lock:
+      self.__ids.clear()
+      self.__missing.clear()
@@ -0,0 +1,105 @@
+""" Cache of the results of the queries over the buckets, by time slice
+
+    A report over a sliding time range (e.g. "last day") is split in slices of the time line,
+    the slices of the past being the same from one request to another. Their rows are kept here
+    for a limited time, and as long as there is memory for them, the least recently used
+    ones going first. The expired slices are removed when slices are added, at most once per
+    life time.
+"""
+
+import sys
+import time
+import threading
+import collections
+
+__RCSID__ = "$Id$"
+
+class SliceCache( object ):
+  """ Memory bounded and thread safe { key : rows } cache
+  """
+
+  def __init__( self, maxMemory = 128 * 1024 * 1024, lifeTime = 600 ):
+    """ c'tor
+
+    :param int maxMemory: approximate maximum size of the rows, in bytes
+    :param int lifeTime: seconds the rows are kept for
+    """
+    self.maxMemory = maxMemory
+    self.lifeTime = lifeTime
+    self.__memory = 0
+    # { key : ( expiration time, size, rows ) }
+    self.__slices = collections.OrderedDict()
+    self.__lock = threading.Lock()
+    self.__nextPurge = time.time() + lifeTime
+
+  def __len__( self ):
+    return len( self.__slices )
+
+  def getMemory( self ):
+    """ Approximate size of the cached rows, in bytes
+    """
+    return self.__memory
+
+  def get( self, key ):
+    """ Cached rows for a key, None if they are not cached or have expired
+    """
+    with self.__lock:
+      cachedSlice = self.__slices.pop( key, None )
+      if cachedSlice is None:
+        return None
+      if cachedSlice[0] <= time.time():
+        self.__memory -= cachedSlice[1]
+        return None
+      # Reinserted as the most recently used
+      self.__slices[ key ] = cachedSlice
+      return cachedSlice[2]
+
+  def add( self, key, rows ):
+    """ Add the rows of a key to the cache
+
+    :param key: hashable
+    :param rows: sequence of sequences of values, as returned by a query
+    """
+    size = _getRowsSize( rows )
+    if size > self.maxMemory:
+      return
+    with self.__lock:
+      now = time.time()
+      if now >= self.__nextPurge:
+        self.__purgeExpired( now )
+        self.__nextPurge = now + self.lifeTime
+      previousSlice = self.__slices.pop( key, None )
+      if previousSlice is not None:
+        self.__memory -= previousSlice[1]
+      self.__slices[ key ] = ( now + self.lifeTime, size, rows )
+      self.__memory += size
+      while self.__memory > self.maxMemory:
+        _key, ( _expiration, oldSize, _rows ) = self.__slices.popitem( last = False )
+        self.__memory -= oldSize
+
+  def purgeExpired( self ):
+    """ Remove the expired slices
+    """
+    with self.__lock:
+      self.__purgeExpired( time.time() )
+
+  def __purgeExpired( self, now ):
+    """ Remove the slices expired at a given time, the lock being held
+    """
+    for key in [ key for key, cachedSlice in self.__slices.iteritems() if cachedSlice[0] <= now ]:
+      self.__memory -= self.__slices.pop( key )[1]
+
+  def clear( self ):
+    """ Empty the cache
+    """
+    with self.__lock:
+      self.__slices.clear()
+      self.__memory = 0
+
+def _getRowsSize( rows ):
+  """ Approximate memory used by rows
+  """
+  size = sys.getsizeof( rows )
+  for row in rows:
+    size += sys.getsizeof( row ) + sum( sys.getsizeof( value ) for value in row )
+  return size
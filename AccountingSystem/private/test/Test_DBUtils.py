@@ -0,0 +1,128 @@
+""" Unit tests for the post-processing of the accounting buckets
+"""
+
+__RCSID__ = "$Id$"
+
+import random
+import unittest
+from decimal import Decimal
+
+from DIRAC.AccountingSystem.private.DBUtils import DBUtils
+
+def spanToGranularityLoop( granularity, bucketsData ):
+  """ Reference implementation, spreading the buckets one after the other """
+  normData = {}
+
+  def addToNormData( bucketDate, data, proportion = 1.0 ):
+    if bucketDate in normData:
+      for iP in range( len( data ) ):
+        val = data[ iP ]
+        if val is None:
+          val = 0
+        normData[ bucketDate ][iP] += float( val ) * proportion
+      normData[ bucketDate ][ -1 ] += proportion
+    else:
+      normData[ bucketDate ] = []
+      for fD in data:
+        if fD is None:
+          fD = 0
+        normData[ bucketDate ].append( float( fD ) * proportion )
+      normData[ bucketDate ].append( proportion )
+
+  for bucketData in bucketsData:
+    bucketDate = bucketData[0]
+    originalBucketLength = bucketData[1]
+    bucketValues = bucketData[2:]
+    if originalBucketLength == granularity:
+      addToNormData( bucketDate, bucketValues )
+    else:
+      startEpoch = bucketDate
+      endEpoch = bucketDate + originalBucketLength
+      newBucketEpoch = startEpoch - startEpoch % granularity
+      if startEpoch == endEpoch:
+        addToNormData( newBucketEpoch, bucketValues )
+      else:
+        while newBucketEpoch < endEpoch:
+          start = max( newBucketEpoch, startEpoch )
+          end = min( newBucketEpoch + granularity, endEpoch )
+          proportion = float( end - start ) / originalBucketLength
+          addToNormData( newBucketEpoch, bucketValues, proportion )
+          newBucketEpoch += granularity
+  return normData
+
+def accumulateLoop( granularity, startEpoch, endEpoch, dataDict ):
+  """ Reference implementation, accumulating the values one after the other """
+  startBucketEpoch = startEpoch - startEpoch % granularity
+  for key in dataDict:
+    currentDict = dataDict[ key ]
+    lastValue = 0
+    for timeEpoch in range( startBucketEpoch, endEpoch, granularity ):
+      if timeEpoch in currentDict:
+        lastValue += currentDict[ timeEpoch ]
+      currentDict[ timeEpoch ] = lastValue
+  return dataDict
+
+class DBUtilsTestCase( unittest.TestCase ):
+  """ Compare the NumPy post-processing of the buckets to the loops it replaced
+  """
+
+  def setUp( self ):
+    self.dbUtils = DBUtils( None, 'Test' )
+    self.random = random.Random( 42 )
+
+  def getBucketsData( self ):
+    """ Random buckets, of the lengths of the accounting types, with some None and Decimal values """
+    bucketsData = []
+    for _i in range( self.random.randint( 0, 20 ) ):
+      bucketLength = self.random.choice( [ 0, 300, 900, 3600, 86400, 604800, 1234 ] )
+      if bucketLength:
+        bucketDate = 1500000000 + self.random.randint( 0, 50 ) * bucketLength
+      else:
+        bucketDate = 1500000000 + self.random.randint( 0, 3000000 )
+      values = [ self.random.choice( [ None, 0, self.random.uniform( 0, 1000 ),
+                                       Decimal( '%.3f' % self.random.uniform( 0, 1000 ) ),
+                                       self.random.randint( 0, 1000 ) ] )
+                 for _j in range( 3 ) ]
+      bucketsData.append( [ bucketDate, bucketLength ] + values )
+    return bucketsData
+
+  def assertSameData( self, data, expected ):
+    self.assertEqual( sorted( data ), sorted( expected ) )
+    for bucketDate in expected:
+      self.assertEqual( len( data[ bucketDate ] ), len( expected[ bucketDate ] ) )
+      for value, expectedValue in zip( data[ bucketDate ], expected[ bucketDate ] ):
+        self.assertAlmostEqual( value, expectedValue, delta = 1e-9 * max( 1, abs( expectedValue ) ) )
+
+  def test_spanToGranularity( self ):
+    for _i in range( 500 ):
+      granularity = self.random.choice( [ 900, 3600, 86400, 604800 ] )
+      bucketsData = self.getBucketsData()
+      expected = spanToGranularityLoop( granularity, bucketsData )
+      self.assertSameData( self.dbUtils._spanToGranularity( granularity, bucketsData ), expected )
+
+      summed = dict( ( bucketDate, values[:-1] ) for bucketDate, values in expected.items() )
+      self.assertSameData( self.dbUtils._sumToGranularity( granularity, bucketsData ), summed )
+
+      averaged = dict( ( bucketDate, [ value / values[-1] for value in values[:-1] ] )
+                       for bucketDate, values in expected.items() )
+      self.assertSameData( self.dbUtils._averageToGranularity( granularity, bucketsData ), averaged )
+
+  def test_accumulate( self ):
+    for _i in range( 200 ):
+      granularity = self.random.choice( [ 300, 3600, 86400 ] )
+      startEpoch = 1500000000 + self.random.randint( 0, 100000 )
+      endEpoch = startEpoch + self.random.randint( 0, 50 ) * granularity
+      dataDict = {}
+      for key in ( 'CERN', 'PIC' ):
+        dataDict[ key ] = dict( ( startEpoch - startEpoch % granularity + self.random.randint( 0, 50 ) * granularity,
+                                  self.random.uniform( 0, 100 ) ) for _j in range( self.random.randint( 0, 20 ) ) )
+      expected = accumulateLoop( granularity, startEpoch, endEpoch,
+                                 dict( ( key, dict( values ) ) for key, values in dataDict.items() ) )
+      data = self.dbUtils._accumulate( granularity, startEpoch, endEpoch, dataDict )
+      for key in expected:
+        self.assertSameData( dict( ( epoch, [ value ] ) for epoch, value in data[ key ].items() ),
+                             dict( ( epoch, [ value ] ) for epoch, value in expected[ key ].items() ) )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( DBUtilsTestCase )
+  testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
@@ -0,0 +1,68 @@
+""" Unit tests for the cache of the ids of the accounting key tables
+"""
+
+__RCSID__ = "$Id$"
+
+import time
+import threading
+import unittest
+
+from DIRAC.AccountingSystem.private.KeyIdCache import KeyIdCache
+
+class KeyIdCacheTestCase( unittest.TestCase ):
+  """ Test the KeyIdCache
+  """
+
+  def setUp( self ):
+    self.cache = KeyIdCache( maxSize = 3, missingLifeTime = 0.2 )
+
+  def test_ids( self ):
+    self.cache.addMany( { 'CERN' : 1, 'PIC' : 2 } )
+    self.assertEqual( self.cache.get( 'CERN' ), 1 )
+    self.assertEqual( self.cache.get( 'RAL' ), None )
+    self.assertEqual( self.cache.getMany( [ 'CERN', 'PIC', 'RAL' ] ), { 'CERN' : 1, 'PIC' : 2 } )
+
+  def test_bounded( self ):
+    self.cache.addMany( { 'CERN' : 1, 'PIC' : 2, 'RAL' : 3 } )
+    # CERN is now the most recently used
+    self.cache.get( 'CERN' )
+    self.cache.add( 'IN2P3', 4 )
+    self.assertEqual( len( self.cache ), 3 )
+    self.assertEqual( self.cache.get( 'CERN' ), 1 )
+    self.assertEqual( self.cache.get( 'IN2P3' ), 4 )
+    self.assertEqual( len( self.cache.getMany( [ 'PIC', 'RAL' ] ) ), 1 )
+
+  def test_missing( self ):
+    self.cache.setMissing( [ 'CNAF' ] )
+    self.assertTrue( self.cache.isMissing( 'CNAF' ) )
+    self.assertFalse( self.cache.isMissing( 'CERN' ) )
+    time.sleep( 0.3 )
+    self.assertFalse( self.cache.isMissing( 'CNAF' ) )
+    # Inserted by someone else
+    self.cache.setMissing( [ 'CNAF' ] )
+    self.cache.add( 'CNAF', 5 )
+    self.assertFalse( self.cache.isMissing( 'CNAF' ) )
+    self.assertEqual( self.cache.get( 'CNAF' ), 5 )
+    self.cache.clear()
+    self.assertEqual( len( self.cache ), 0 )
+
+  def test_threads( self ):
+    cache = KeyIdCache( maxSize = 100 )
+
+    def fill( offset ):
+      for i in range( 1000 ):
+        cache.add( 'value%d' % ( ( i + offset ) % 200 ), ( i + offset ) % 200 )
+        cache.getMany( [ 'value%d' % j for j in range( 10 ) ] )
+
+    threads = [ threading.Thread( target = fill, args = ( offset, ) ) for offset in range( 0, 40, 10 ) ]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    self.assertEqual( len( cache ), 100 )
+    for value, keyId in cache.getMany( [ 'value%d' % j for j in range( 200 ) ] ).items():
+      self.assertEqual( value, 'value%d' % keyId )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( KeyIdCacheTestCase )
+  testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
@@ -0,0 +1,70 @@
+""" Unit tests for the cache of the accounting queries by time slice
+"""
+
+__RCSID__ = "$Id$"
+
+import time
+import unittest
+
+from DIRAC.AccountingSystem.private.SliceCache import SliceCache, _getRowsSize
+
+class SliceCacheTestCase( unittest.TestCase ):
+  """ Test the SliceCache
+  """
+
+  def setUp( self ):
+    self.rows = ( ( 1500000000, 'CERN', 3600, 10.0 ), ( 1500003600, 'CERN', 3600, 20.0 ) )
+    self.cache = SliceCache( maxMemory = 3 * _getRowsSize( self.rows ), lifeTime = 0.2 )
+
+  def test_rows( self ):
+    self.cache.add( ( 'query', 1500000000, 1500003600 ), self.rows )
+    self.assertEqual( self.cache.get( ( 'query', 1500000000, 1500003600 ) ), self.rows )
+    self.assertEqual( self.cache.get( ( 'query', 1500000000, 1500007200 ) ), None )
+    self.assertEqual( self.cache.getMemory(), _getRowsSize( self.rows ) )
+    # Replaced
+    self.cache.add( ( 'query', 1500000000, 1500003600 ), self.rows[:1] )
+    self.assertEqual( self.cache.get( ( 'query', 1500000000, 1500003600 ) ), self.rows[:1] )
+    self.assertEqual( self.cache.getMemory(), _getRowsSize( self.rows[:1] ) )
+
+  def test_expired( self ):
+    self.cache.add( 'first', self.rows )
+    time.sleep( 0.3 )
+    self.cache.add( 'second', self.rows )
+    self.cache.purgeExpired()
+    self.assertEqual( len( self.cache ), 1 )
+    self.assertEqual( self.cache.get( 'first' ), None )
+    self.assertEqual( self.cache.get( 'second' ), self.rows )
+    time.sleep( 0.3 )
+    self.assertEqual( self.cache.get( 'second' ), None )
+    self.assertEqual( self.cache.getMemory(), 0 )
+
+  def test_purgedOnAdd( self ):
+    self.cache.add( 'first', self.rows )
+    self.cache.add( 'second', self.rows )
+    time.sleep( 0.3 )
+    # The expired slices do not stay in memory until they are looked for
+    self.cache.add( 'third', self.rows )
+    self.assertEqual( len( self.cache ), 1 )
+    self.assertEqual( self.cache.getMemory(), _getRowsSize( self.rows ) )
+
+  def test_memory( self ):
+    for key in ( 'first', 'second', 'third' ):
+      self.cache.add( key, self.rows )
+    # first is now the most recently used
+    self.cache.get( 'first' )
+    self.cache.add( 'fourth', self.rows )
+    self.assertEqual( len( self.cache ), 3 )
+    self.assertEqual( self.cache.get( 'second' ), None )
+    self.assertEqual( self.cache.get( 'first' ), self.rows )
+    self.assertTrue( self.cache.getMemory() <= self.cache.maxMemory )
+    # Too big to be cached at all
+    self.cache.add( 'big', self.rows * 4 )
+    self.assertEqual( self.cache.get( 'big' ), None )
+    self.assertEqual( len( self.cache ), 3 )
+    self.cache.clear()
+    self.assertEqual( len( self.cache ), 0 )
+    self.assertEqual( self.cache.getMemory(), 0 )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( SliceCacheTestCase )
+  testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
@@ -16,6 +16,9 @@ class ExecutorMindHandler( RequestHandler ):
   MSG_DEFINITIONS = { 'ProcessTask' : { 'taskId' : ( types.IntType, types.LongType ),
                                         'taskStub' : types.StringTypes,
                                         'eType' : types.StringTypes },
+                      'ProcessTasks' : { 'taskIds' : types.ListType,
+                                         'taskStubs' : types.ListType,
+                                         'eType' : types.StringTypes },
                       'TaskDone' : { 'taskId' : ( types.IntType, types.LongType ),
                                      'taskStub' : types.StringTypes },
                       'TaskFreeze' : { 'taskId' : ( types.IntType, types.LongType ),
@@ -31,8 +34,10 @@ class ExecutorMindHandler( RequestHandler ):
 
   class MindCallbacks( ExecutorDispatcherCallbacks ):
 
-    def __init__( self, sendTaskCB, dispatchCB, disconnectCB, taskProcCB, taskFreezeCB, taskErrCB ):
+    def __init__( self, sendTaskCB, dispatchCB, disconnectCB, taskProcCB, taskFreezeCB, taskErrCB,
+                  sendTasksCB = None ):
       self.__sendTaskCB = sendTaskCB
+      self.__sendTasksCB = sendTasksCB
       self.__dispatchCB = dispatchCB
       self.__disconnectCB = disconnectCB
       self.__taskProcDB = taskProcCB
@@ -43,6 +48,11 @@ class ExecutorMindHandler( RequestHandler ):
     def cbSendTask( self, taskId, taskObj, eId, eType ):
       return self.__sendTaskCB( taskId, taskObj, eId, eType )
 
+    def cbSendTasks( self, taskIds, taskObjs, eId, eType ):
+      if not self.__sendTasksCB:
+        return ExecutorDispatcherCallbacks.cbSendTasks( self, taskIds, taskObjs, eId, eType )
+      return self.__sendTasksCB( taskIds, taskObjs, eId, eType )
+
     def cbDispatch( self, taskId, taskObj, pathExecuted ):
       return self.__dispatchCB( taskId, taskObj, pathExecuted )
 
@@ -71,7 +81,8 @@ class ExecutorMindHandler( RequestHandler ):
                                                          cls.__execDisconnected,
                                                          cls.exec_taskProcessed,
                                                          cls.exec_taskFreeze,
-                                                         cls.exec_taskError )
+                                                         cls.exec_taskError,
+                                                         cls.__sendTasks )
     cls.__eDispatch.setCallbacks( cls.__callbacks )
     cls.__allowedClients = []
     if cls.log.shown( "VERBOSE" ):
@@ -86,7 +97,7 @@ class ExecutorMindHandler( RequestHandler ):
     cls.__allowedClients = aClients
 
   @classmethod
-  def __sendTask( self, taskId, taskObj, eId, eType ):
+  def __prepareTaskStub( self, taskId, taskObj, eId ):
     try:
       result = self.exec_prepareToSend( taskId, taskObj, eId )
       if not result[ 'OK' ]:
@@ -101,6 +112,11 @@ class ExecutorMindHandler( RequestHandler ):
       return S_ERROR( "Cannot serialize task %s: %s" % ( taskId, str( excp ) ) )
     if not isReturnStructure( result ):
       raise Exception( "exec_serializeTask does not return a return structure" )
+    return result
+
+  @classmethod
+  def __sendTask( self, taskId, taskObj, eId, eType ):
+    result = self.__prepareTaskStub( taskId, taskObj, eId )
     if not result[ 'OK' ]:
       return result
     taskStub = result[ 'Value' ]
@@ -113,6 +129,25 @@ class ExecutorMindHandler( RequestHandler ):
     msgObj.eType = eType
     return self.srv_msgSend( eId, msgObj )
 
+  @classmethod
+  def __sendTasks( self, taskIds, taskObjs, eId, eType ):
+    """ Send a batch of tasks for the same executor type in one message
+    """
+    taskStubs = []
+    for taskId in taskIds:
+      result = self.__prepareTaskStub( taskId, taskObjs[ taskId ], eId )
+      if not result[ 'OK' ]:
+        return result
+      taskStubs.append( result[ 'Value' ] )
+    result = self.srv_msgCreate( "ProcessTasks" )
+    if not result[ 'OK' ]:
+      return result
+    msgObj = result[ 'Value' ]
+    msgObj.taskIds = list( taskIds )
+    msgObj.taskStubs = taskStubs
+    msgObj.eType = eType
+    return self.srv_msgSend( eId, msgObj )
+
   @classmethod
   def __execDisconnected( cls, trid ):
     result = cls.srv_disconnectClient( trid )
@@ -138,7 +173,12 @@ class ExecutorMindHandler( RequestHandler ):
       numTasks = max( 1, int( kwargs[ 'maxTasks' ] ) )
     except:
       numTasks = 1
-    self.__eDispatch.addExecutor( trid, kwargs[ 'executorTypes' ] )
+    #Executors not sending maxBatch do not understand ProcessTasks messages
+    try:
+      maxBatch = max( 1, int( kwargs[ 'maxBatch' ] ) )
+    except:
+      maxBatch = 1
+    self.__eDispatch.addExecutor( trid, kwargs[ 'executorTypes' ], numTasks, maxBatch )
     return self.exec_executorConnected( trid, kwargs[ 'executorTypes' ] )
 
   auth_conn_drop = [ 'all' ]
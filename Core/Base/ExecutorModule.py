@@ -36,6 +36,7 @@ class ExecutorModule( object ):
                                                       *exeName.split( "/" ) )
     cls.__defaults[ 'ReconnectRetries' ] = 10
     cls.__defaults[ 'ReconnectSleep' ] = 5
+    cls.__defaults[ 'MaxBatchSize' ] = 1
     cls.__defaults[ 'shifterProxy' ] = ''
     cls.__defaults[ 'shifterProxyLocation' ] = os.path.join( cls.__defaults[ 'WorkDirectory' ],
                                                              '.shifterCred' )
@@ -130,10 +131,21 @@ class ExecutorModule( object ):
       raise Exception( "deserializeTask does not return a return structure" )
     return result
 
+  def __preProcess( self, taskObjs ):
+    try:
+      result = self.preProcessTasks( taskObjs )
+    except Exception as excp:
+      gLogger.exception( "Exception while preprocessing tasks", lException = excp )
+      return S_ERROR( "Cannot preprocess tasks: %s" % str( excp ) )
+    if not isReturnStructure( result ):
+      raise Exception( "preProcessTasks does not return a return structure" )
+    if not result[ 'OK' ]:
+      #Preprocessing is just an optimization, tasks can still be processed one by one
+      self.log.warn( "Could not preprocess tasks", result[ 'Message' ] )
+    return result
+
   def _ex_processTask( self, taskId, taskStub ):
     self.__properties[ 'shifterProxy' ] = self.ex_getOption( 'shifterProxy' )
-    self.__freezeTime = 0
-    self.__fastTrackEnabled = True
     self.log.verbose( "Task %s: Received" % str( taskId ) )
     result = self.__deserialize( taskId, taskStub )
     if not result[ 'OK' ]:
@@ -144,6 +156,43 @@ class ExecutorModule( object ):
     result = self.__installShifterProxy()
     if not result[ 'OK' ]:
       return result
+    self.__preProcess( { taskId : taskObj } )
+    return self.__processTaskObj( taskId, taskObj )
+
+  def _ex_processTasks( self, tasks ):
+    """ Process a batch of ( taskId, taskStub ) tasks for the same executor type.
+        Returns a list of ( taskId, taskStub, result ) where result is what _ex_processTask would have returned.
+        Unlike in _ex_processTask, an exception processing a task only fails that task
+    """
+    self.__properties[ 'shifterProxy' ] = self.ex_getOption( 'shifterProxy' )
+    self.log.verbose( "Received batch of %s tasks" % len( tasks ) )
+    results = []
+    taskObjs = []
+    for taskId, taskStub in tasks:
+      result = self.__deserialize( taskId, taskStub )
+      if not result[ 'OK' ]:
+        self.log.error( "Can not deserialize task", "Task %s: %s" % ( str( taskId ), result[ 'Message' ] ) )
+        results.append( ( taskId, taskStub, result ) )
+        continue
+      taskObjs.append( ( taskId, taskStub, result[ 'Value' ] ) )
+    #Shifter proxy?
+    result = self.__installShifterProxy()
+    if not result[ 'OK' ]:
+      return result
+    if taskObjs:
+      self.__preProcess( dict( [ ( taskId, taskObj ) for taskId, _taskStub, taskObj in taskObjs ] ) )
+    for taskId, taskStub, taskObj in taskObjs:
+      try:
+        result = self.__processTaskObj( taskId, taskObj )
+      except Exception as excp:
+        gLogger.exception( "Error while processing task %s" % taskId, lException = excp )
+        result = S_ERROR( "Error processing task %s: %s" % ( taskId, excp ) )
+      results.append( ( taskId, taskStub, result ) )
+    return S_OK( results )
+
+  def __processTaskObj( self, taskId, taskObj ):
+    self.__freezeTime = 0
+    self.__fastTrackEnabled = True
     #Execute!
     result = self.processTask( taskId, taskObj )
     if not isReturnStructure( result ):
@@ -203,3 +252,14 @@ class ExecutorModule( object ):
 
   def processTask( self, taskId, taskObj ):
     raise Exception( "Method processTask has to be coded!" )
+
+  ####
+  # Can overwrite this functions
+  ####
+
+  def preProcessTasks( self, taskObjs ):
+    """ Called with all the tasks received together ( taskId -> taskObj ) before processing them one by one.
+        Executors can do here bulk queries for all the tasks and keep the results for processTask.
+        Batches bigger than one task are only received if the MaxBatchSize option is set
+    """
+    return S_OK()
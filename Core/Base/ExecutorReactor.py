@@ -64,6 +64,7 @@ class ExecutorReactor( object ):
       self.__mindName = mindName
       self.__modules = {}
       self.__maxTasks = 1
+      self.__maxBatch = 1
       self.__reconnectSleep = 1
       self.__reconnectRetries = 10
       self.__extraArgs = {}
@@ -77,17 +78,24 @@ class ExecutorReactor( object ):
     def addModule( self, name, exeClass ):
       self.__modules[ name ] = exeClass
       self.__maxTasks = max( self.__maxTasks, exeClass.ex_getOption( "MaxTasks" ) )
+      self.__maxBatch = max( self.__maxBatch, exeClass.ex_getOption( "MaxBatchSize" ) )
       self.__reconnectSleep = max( self.__reconnectSleep, exeClass.ex_getOption( "ReconnectSleep" ) )
       self.__reconnectRetries = max( self.__reconnectRetries, exeClass.ex_getOption( "ReconnectRetries" ) )
       self.__extraArgs[ name ] = exeClass.ex_getExtraArguments()
 
+    def __connectArgs( self ):
+      #Each task in a batch takes one of the slots
+      return { 'executorTypes' : list( self.__modules.keys() ),
+               'maxTasks' : max( self.__maxTasks, self.__maxBatch ),
+               'maxBatch' : self.__maxBatch,
+               'extraArgs' : self.__extraArgs }
+
     def connect( self ):
       self.__msgClient = MessageClient( self.__mindName )
       self.__msgClient.subscribeToMessage( 'ProcessTask', self.__processTask )
+      self.__msgClient.subscribeToMessage( 'ProcessTasks', self.__processTasks )
       self.__msgClient.subscribeToDisconnect( self.__disconnected )
-      result = self.__msgClient.connect( executorTypes = list( self.__modules.keys() ),
-                                         maxTasks = self.__maxTasks,
-                                         extraArgs = self.__extraArgs )
+      result = self.__msgClient.connect( **self.__connectArgs() )
       if result[ 'OK' ]:
         self.__aliveLock.alive()
         gLogger.info( "Connected to %s" % self.__mindName )
@@ -97,9 +105,7 @@ class ExecutorReactor( object ):
       retryCount = 0
       while True:
         gLogger.notice( "Trying to reconnect to %s" % self.__mindName )
-        result = self.__msgClient.connect( executorTypes = list( self.__modules.keys() ),
-                                           maxTasks = self.__maxTasks,
-                                           extraArgs = self.__extraArgs )
+        result = self.__msgClient.connect( **self.__connectArgs() )
 
         if result[ 'OK' ]:
           if retryCount >= self.__reconnectRetries:
@@ -156,7 +162,26 @@ class ExecutorReactor( object ):
       result = self.__moduleProcess( eType, taskId, taskStub )
       if not result[ 'OK' ]:
         return self.__sendExecutorError( eType, taskId, result[ 'Message' ] )
-      msgName, taskStub, extra = result[ 'Value' ]
+      return self.__sendTaskResult( eType, taskId, result[ 'Value' ] )
+
+    def __processTasks( self, msgObj ):
+      eType = msgObj.eType
+      tasks = zip( msgObj.taskIds, msgObj.taskStubs )
+      if not tasks:
+        return S_OK()
+
+      result = self.__moduleProcessBatch( eType, tasks )
+      if not result[ 'OK' ]:
+        #The mind puts back in the queue all the tasks of the executor
+        return self.__sendExecutorError( eType, tasks[0][0], result[ 'Message' ] )
+      for taskId, taskResult in result[ 'Value' ]:
+        result = self.__sendTaskResult( eType, taskId, taskResult )
+        if not result[ 'OK' ]:
+          gLogger.error( "Could not send task result", "Task %s: %s" % ( taskId, result[ 'Message' ] ) )
+      return S_OK()
+
+    def __sendTaskResult( self, eType, taskId, taskResult ):
+      msgName, taskStub, extra = taskResult
 
       result = self.__msgClient.createMessage( msgName )
       if not result[ 'OK' ]:
@@ -185,7 +210,33 @@ class ExecutorReactor( object ):
         return S_ERROR( "Error processing task %s: %s" % ( taskId, excp ) )
 
       self.__storeInstance( eType, modInstance )
+      return self.__taskResult( eType, taskId, taskStub, result, fastTrackLevel )
 
+    def __moduleProcessBatch( self, eType, tasks ):
+      result = self.__getInstance( eType )
+      if not result[ 'OK' ]:
+        return result
+      modInstance = result[ 'Value' ]
+      try:
+        result = modInstance._ex_processTasks( tasks )
+      except Exception as excp:
+        gLogger.exception( "Error while processing batch of %s tasks" % len( tasks ), lException = excp )
+        return S_ERROR( "Error processing batch of %s tasks: %s" % ( len( tasks ), excp ) )
+
+      self.__storeInstance( eType, modInstance )
+
+      if not result[ 'OK' ]:
+        return result
+      taskResults = []
+      for taskId, taskStub, taskResult in result[ 'Value' ]:
+        result = self.__taskResult( eType, taskId, taskStub, taskResult )
+        if not result[ 'OK' ]:
+          #Only this task failed, do not drop the whole executor
+          result = S_OK( ( 'TaskError', taskStub, "Error: %s" % result[ 'Message' ] ) )
+        taskResults.append( ( taskId, result[ 'Value' ] ) )
+      return S_OK( taskResults )
+
+    def __taskResult( self, eType, taskId, taskStub, result, fastTrackLevel = 0 ):
       if not result[ 'OK' ]:
         return S_OK( ( 'TaskError', taskStub, "Error: %s" % result[ 'Message' ] ) )
       taskStub, freezeTime, fastTrackType = result[ 'Value' ]
@@ -3,7 +3,11 @@
 
 __RCSID__ = "$Id$"
 
+import base64
+import zlib
+
 from DIRAC.Core.DISET.private.InnerRPCClient import InnerRPCClient
+from DIRAC.Core.Utilities import DEncode
 
 class _MagicMethod( object ):
 
@@ -53,3 +57,25 @@ def executeRPCStub( rpcStub ):
   rpcFunc = getattr( rpcClient, rpcStub[1] )
   #Reproduce the call
   return rpcFunc( *rpcStub[2] )
+
+def encodeRPCStub( rpcStub, compress = False ):
+  """
+  Serialize a stub to play it back later. A compressed stub is base64 encoded and
+  prefixed by "Z:", which is not a DEncode type, so that it can still be stored as text
+  """
+  if compress:
+    return "Z:%s" % base64.b64encode( zlib.compress( DEncode.encode( rpcStub ), 9 ) )
+  return DEncode.encode( rpcStub )
+
+def decodeRPCStub( data ):
+  """
+  Deserialize a stub serialized by encodeRPCStub, compressed or not
+
+  :return: ( rpcStub, length of the serialized stub )
+  """
+  if data.startswith( "Z:" ):
+    try:
+      data = zlib.decompress( base64.b64decode( data[2:] ) )
+    except ( TypeError, zlib.error ) as e:
+      raise ValueError( "Cannot uncompress the stub: %s" % str( e ) )
+  return DEncode.decode( data )
@@ -4,7 +4,9 @@ Elasticsearch database.
 
 """
 import os
+import time
 import tempfile
+import threading
 
 from datetime import datetime
 from datetime import timedelta
@@ -12,7 +14,7 @@ from datetime import timedelta
 from elasticsearch import Elasticsearch
 from elasticsearch_dsl import Search, Q, A
 from elasticsearch.exceptions import ConnectionError, TransportError, NotFoundError
-from elasticsearch.helpers import BulkIndexError, bulk
+from elasticsearch.helpers import streaming_bulk
 
 from DIRAC import gLogger, S_OK, S_ERROR
 from DIRAC.Core.Utilities import Time
@@ -21,6 +23,10 @@ from DIRAC.Core.Security import Locations, X509Chain
 
 __RCSID__ = "$Id$"
 
+# Status of the bulk items worth sending again: the cluster is overloaded (429, 503),
+# or could not be reached at all ('N/A')
+RETRYABLE_BULK_STATUS = ( 429, 502, 503, 504, 'N/A' )
+
 def getCert():
   """
   get the host certificate
@@ -73,10 +79,14 @@ class ElasticSearchDB( object ):
   :param str gDebugFile: is used to save the debug information to a file
   :param int timeout: the default time out to Elasticsearch
   :param int RESULT_SIZE: The number of data points which will be returned by the query.
+  :param int __maxBulkRetries: number of times the documents rejected by an overloaded cluster are sent again
+  :param int __bulkRetryDelay: seconds before the first retry, doubled at each retry
   """
   __chunk_size = 1000
   __url = ""
   __timeout = 120
+  __maxBulkRetries = 3
+  __bulkRetryDelay = 1
   clusterName = ''
   RESULT_SIZE = 10000
   ########################################################################
@@ -92,6 +102,9 @@ class ElasticSearchDB( object ):
     """
     self.__indexPrefix = indexPrefix
     self._connected = False
+    # { index prefix : ( end of the period, full index name ) }
+    self.__periodIndexes = {}
+    self.__periodIndexesLock = threading.Lock()
     if user and password:
       self.__url = "https://%s:%s@%s:%d" % ( user, password, host, port )
     else:
@@ -236,6 +249,10 @@ class ElasticSearchDB( object ):
 
     if retVal.get( 'acknowledged' ):
       #if the value exists and the value is not None
+      with self.__periodIndexesLock:
+        for indexPrefix, ( _periodEnd, periodIndexName ) in self.__periodIndexes.items():
+          if periodIndexName == indexName:
+            del self.__periodIndexes[indexPrefix]
       return S_OK( indexName )
     else:
       return S_ERROR( retVal )
@@ -261,6 +278,31 @@ class ElasticSearchDB( object ):
       return S_ERROR( res )
 
 
+  def getFullIndexName( self, indexPrefix, mapping = None ):
+    """
+    It returns the name of the index of the current period (day) for an index prefix. The index is created
+    if it does not exist yet. The name is only computed, and the index looked for, once per period.
+
+    :param str indexPrefix: it is the index name.
+    :param dict mapping: the configuration of the index, used if it has to be created.
+    """
+    now = time.time()
+    with self.__periodIndexesLock:
+      periodIndex = self.__periodIndexes.get( indexPrefix )
+    if periodIndex and now < periodIndex[0]:
+      return S_OK( periodIndex[1] )
+
+    today = datetime.today()
+    indexName = generateFullIndexName( indexPrefix, today )
+    if not self.exists( indexName ):
+      retVal = self.createIndex( indexPrefix, mapping if mapping else {} )
+      if not retVal['OK']:
+        return retVal
+    nextDay = datetime( today.year, today.month, today.day ) + timedelta( days = 1 )
+    with self.__periodIndexesLock:
+      self.__periodIndexes[indexPrefix] = ( time.mktime( nextDay.timetuple() ), indexName )
+    return S_OK( indexName )
+
   def bulk_index( self, indexprefix, doc_type, data, mapping = None ):
     """
     :param str indexPrefix: it is the index name.
@@ -269,52 +311,71 @@ class ElasticSearchDB( object ):
     :type data: python:list
     """
     gLogger.info( "%d records will be insert to %s" % ( len( data ), doc_type ) )
-    if mapping is None:
-      mapping = {}
+    retVal = self.getFullIndexName( indexprefix, mapping )
+    if not retVal['OK']:
+      return retVal
+    indexName = retVal['Value']
+    gLogger.debug( "inserting datat to %s index" % indexName )
+
+    retVal = self.bulkIndexRecords( indexName, doc_type, data )
+    if not retVal['OK']:
+      return retVal
+    result = retVal['Value']
+    if result['Failed'] or result['Errors']:
+      return S_ERROR( "%d records out of %d not inserted to %s" % ( len( data ) - result['Indexed'],
+                                                                    len( data ),
+                                                                    indexName ) )
+    # we have inserted all documents...
+    return S_OK( result['Indexed'] )
+
+  def bulkIndexRecords( self, indexName, doc_type, records ):
+    """
+    It streams the records to an index, in chunks. The records rejected because the cluster is overloaded
+    or not reachable are sent again, waiting longer and longer between the retries.
 
-    indexName = generateFullIndexName( indexprefix )
-    gLogger.debug("inserting datat to %s index" % indexName)
-    if not self.exists( indexName ):
-      retVal = self.createIndex( indexprefix, mapping )
-      if not retVal['OK']:
-        return retVal
-    docs = []
-    for row in data:
-      body = {
-          '_index': indexName,
-          '_type': doc_type,
-          '_source': {}
-      }
-      body['_source'] = row
-
-      if 'timestamp' not in row:
-        gLogger.warn( "timestamp is not given! Note: the actual time is used!" )
-
-      timestamp = row.get( 'timestamp', int( Time.toEpoch() ) ) #if the timestamp is not provided, we use the current utc time.
+    :param str indexName: the full name of the index
+    :param str doc_type: the type of the document
+    :param records: contains a list of dictionary
+    :type records: python:list
+    :return: S_OK( { 'Indexed' : number of records inserted,
+                     'Failed' : records which could still be inserted later,
+                     'Errors' : number of records rejected for good, e.g. because they do not match the mapping } )
+    """
+    indexed = 0
+    errors = 0
+    for retry in xrange( self.__maxBulkRetries + 1 ):
+      if retry:
+        delay = self.__bulkRetryDelay * 2 ** ( retry - 1 )
+        gLogger.warn( "Records not inserted to %s" % indexName, "%d, retrying in %d s" % ( len( records ), delay ) )
+        time.sleep( delay )
+
+      failed = []
+      position = 0
       try:
-        if isinstance(timestamp, datetime):
-          body['_source']['timestamp'] = int( timestamp.strftime('%s') ) * 1000
-        elif isinstance(timestamp, basestring):
-          timeobj = datetime.strptime( timestamp, '%Y-%m-%d %H:%M:%S.%f' )
-          body['_source']['timestamp'] = int( timeobj.strftime('%s') ) * 1000
-        else: #we assume  the timestamp is an unix epoch time (integer).
-          body['_source']['timestamp'] = timestamp  * 1000
-      except (TypeError, ValueError) as e:
-        # in case we are not able to convert the timestamp to epoch time....
-        gLogger.error( "Wrong timestamp", e )
-        body['_source']['timestamp'] = int( Time.toEpoch() ) * 1000
-      docs += [body]
-    try:
-      res = bulk( self.__client, docs, chunk_size = self.__chunk_size )
-    except BulkIndexError as e:
-      return S_ERROR( e )
-
-    if res[0] == len( docs ):
-      # we have inserted all documents...
-      return S_OK( len( docs ) )
-    else:
-      return S_ERROR( res )
-    return res
+        for success, item in streaming_bulk( self.__client,
+                                             _generateBulkActions( indexName, doc_type, records ),
+                                             chunk_size = self.__chunk_size,
+                                             raise_on_error = False,
+                                             raise_on_exception = False ):
+          if success:
+            indexed += 1
+          else:
+            itemResult = item.values()[0]
+            if itemResult.get( 'status' ) in RETRYABLE_BULK_STATUS:
+              failed.append( records[position] )
+            else:
+              errors += 1
+              gLogger.error( "Record rejected by %s" % indexName, itemResult.get( 'error' ) )
+          position += 1
+      except TransportError as e:
+        gLogger.error( "Bulk insertion to %s failed" % indexName, e )
+        failed.extend( records[position:] )
+
+      records = failed
+      if not records:
+        break
+
+    return S_OK( { 'Indexed' : indexed, 'Failed' : records, 'Errors' : errors } )
 
   def getUniqueValue( self, indexName, key, orderBy = False ):
     """
@@ -323,7 +384,7 @@ class ElasticSearchDB( object ):
     It returns a list of unique value for a certain key from the dictionary.
     """
 
-    query = self._Search( indexName )
+    query = self._Search( indexName ).params( ignore_unavailable = True )
 
     endDate = datetime.utcnow()
 
@@ -363,11 +424,101 @@ class ElasticSearchDB( object ):
     gLogger.debug( "Nb of unique rows retrieved", len( values ) )
     return S_OK( values )
 
+  def getUniqueValues( self, indexName, keys, startTime, endTime = None ):
+    """
+    It returns the unique values of several keys, with a single request for all the keys. The values are paged
+    with composite aggregations, so there is no limit on their number. If the cluster does not know about
+    composite aggregations, getUniqueValue is used for each key, as many values as RESULT_SIZE being returned.
+
+    :param str indexName: the name, or comma separated names, of the indexes, missing indexes are ignored
+    :param keys: the keys
+    :type keys: python:list
+    :param int startTime: epoch time of the first documents looked at
+    :param int endTime: epoch time of the last documents looked at, now by default
+    :return: S_OK( { key : sorted list of values } )
+    """
+    if endTime is None:
+      endTime = int( Time.toEpoch() )
+    timeFilter = { 'range': { 'timestamp': { 'gte': int( startTime ) * 1000,
+                                             'lte': int( endTime ) * 1000 } } }
+    values = dict( ( key, set() ) for key in keys )
+    # { key : composite key of the last value returned }, None before the first page
+    afterKeys = dict( ( key, None ) for key in keys )
+    while afterKeys:
+      aggs = {}
+      for key, afterKey in afterKeys.iteritems():
+        aggs[key] = { 'composite': { 'size': self.RESULT_SIZE,
+                                     'sources': [ { key: { 'terms': { 'field': key } } } ] } }
+        if afterKey:
+          aggs[key]['composite']['after'] = afterKey
+      body = { 'size': 0, 'query': { 'bool': { 'filter': [ timeFilter ] } }, 'aggs': aggs }
+      gLogger.debug( "Query", body )
+      try:
+        result = self.__client.search( index = indexName, body = body, ignore_unavailable = True )
+      except TransportError as e:
+        if e.status_code != 400:
+          return S_ERROR( e )
+        gLogger.verbose( "Composite aggregations not supported", e )
+        return self.__getUniqueValuesByKey( indexName, keys )
+
+      aggregations = result.get( 'aggregations', {} )
+      for key in afterKeys.keys():
+        buckets = aggregations.get( key, {} ).get( 'buckets', [] )
+        values[key].update( bucket['key'][key] for bucket in buckets )
+        if len( buckets ) < self.RESULT_SIZE:
+          del afterKeys[key]
+        else:
+          afterKeys[key] = aggregations[key].get( 'after_key', buckets[-1]['key'] )
+
+    return S_OK( dict( ( key, sorted( keyValues ) ) for key, keyValues in values.iteritems() ) )
+
+  def __getUniqueValuesByKey( self, indexName, keys ):
+    """
+    It returns the unique values of the keys, with a terms aggregation for each key.
+    """
+    values = {}
+    for key in keys:
+      retVal = self.getUniqueValue( indexName, key )
+      if not retVal['OK']:
+        return retVal
+      values[key] = sorted( retVal['Value'] )
+    return S_OK( values )
 
-def generateFullIndexName( indexName ):
+def generateFullIndexName( indexName, day = None ):
   """
   Given an index prefix we create the actual index name. Each day an index is created.
   :param str indexName: it is the name of the index
+  :param datetime day: the day of the index, today by default
+  """
+  if day is None:
+    day = datetime.today()
+  return "%s-%s" % ( indexName, day.strftime( "%Y-%m-%d" ) )
+
+def _generateBulkActions( indexName, doc_type, records ):
   """
-  today = datetime.today().strftime( "%Y-%m-%d" )
-  return "%s-%s" % ( indexName, today )
+  It generates the bulk actions inserting the records, with their timestamp in milliseconds.
+  The records themselves are not modified, so that they can be sent again.
+  """
+  for row in records:
+    source = dict( row )
+
+    if 'timestamp' not in row:
+      gLogger.warn( "timestamp is not given! Note: the actual time is used!" )
+
+    timestamp = row.get( 'timestamp', int( Time.toEpoch() ) ) #if the timestamp is not provided, we use the current utc time.
+    try:
+      if isinstance( timestamp, datetime ):
+        source['timestamp'] = int( timestamp.strftime( '%s' ) ) * 1000
+      elif isinstance( timestamp, basestring ):
+        timeobj = datetime.strptime( timestamp, '%Y-%m-%d %H:%M:%S.%f' )
+        source['timestamp'] = int( timeobj.strftime( '%s' ) ) * 1000
+      else: #we assume  the timestamp is an unix epoch time (integer).
+        source['timestamp'] = timestamp * 1000
+    except ( TypeError, ValueError ) as e:
+      # in case we are not able to convert the timestamp to epoch time....
+      gLogger.error( "Wrong timestamp", e )
+      source['timestamp'] = int( Time.toEpoch() ) * 1000
+
+    yield { '_index': indexName,
+            '_type': doc_type,
+            '_source': source }
@@ -16,20 +16,23 @@ class ExecutorState( object ):
     self.__lock = threading.Lock()
     self.__typeToId = {}
     self.__maxTasks = {}
+    self.__maxBatch = {}
     self.__execTasks = {}
     self.__taskInExec = {}
 
   def _internals( self ):
     return { 'type2id' : dict( self.__typeToId ),
              'maxTasks' : dict( self.__maxTasks ),
+             'maxBatch' : dict( self.__maxBatch ),
              'execTasks' : dict( self.__execTasks ),
              'tasksInExec' : dict( self.__taskInExec ),
              'locked' : self.__lock.locked() }
 
-  def addExecutor( self, eId, eTypes, maxTasks = 1 ):
+  def addExecutor( self, eId, eTypes, maxTasks = 1, maxBatch = 1 ):
     self.__lock.acquire()
     try:
       self.__maxTasks[ eId ] = max( 1, maxTasks )
+      self.__maxBatch[ eId ] = max( 1, maxBatch )
       if eId not in self.__execTasks:
         self.__execTasks[ eId ] = set()
       if type( eTypes ) not in ( types.ListType, types.TupleType ):
@@ -53,6 +56,7 @@ class ExecutorState( object ):
         tasks.append( taskId )
       self.__execTasks.pop( eId )
       self.__maxTasks.pop( eId )
+      self.__maxBatch.pop( eId )
       return tasks
     finally:
       self.__lock.release()
@@ -75,6 +79,22 @@ class ExecutorState( object ):
     except KeyError:
       return 0
 
+  def batchSize( self, eId ):
+    """ Number of tasks to send in one go to an executor. Executors accepting batches
+        only get tasks when a whole batch fits or when they are not processing anything
+    """
+    try:
+      maxBatch = self.__maxBatch[ eId ]
+      busy = len( self.__execTasks[ eId ] )
+    except KeyError:
+      return 1
+    if maxBatch == 1:
+      return 1
+    freeSlots = self.freeSlots( eId )
+    if busy and freeSlots < maxBatch:
+      return 0
+    return max( 1, min( maxBatch, freeSlots ) )
+
   def getFreeExecutors( self, eType ):
     execs = {}
     try:
@@ -95,6 +115,8 @@ class ExecutorState( object ):
     maxFreeSlots = 0
     try:
       for eId in self.__typeToId[ eType ]:
+        if not self.batchSize( eId ):
+          continue
         freeSlots = self.freeSlots( eId )
         if freeSlots > maxFreeSlots:
           maxFreeSlots = freeSlots
@@ -201,6 +223,32 @@ class ExecutorQueues:
     #Not found. release and return None
     return None
 
+  def popTasks( self, eTypes, numTasks = 1 ):
+    """ Pop up to numTasks tasks waiting for the same executor type.
+        Returns ( [ taskIds ], eType ) or None if there is nothing waiting
+    """
+    if type( eTypes ) not in ( types.ListType, types.TupleType ):
+      eTypes = [ eTypes ]
+    self.__lock.acquire()
+    try:
+      for eType in eTypes:
+        try:
+          queue = self.__queues[ eType ]
+        except KeyError:
+          continue
+        if not queue:
+          continue
+        taskIds = queue[ :numTasks ]
+        del( queue[ :numTasks ] )
+        for taskId in taskIds:
+          del( self.__taskInQueue[ taskId ] )
+        self.__lastUse[ eType ] = time.time()
+        self.__log.verbose( "Popped tasks %s from executor %s waiting queue" % ( taskIds, eType ) )
+        return ( taskIds, eType )
+    finally:
+      self.__lock.release()
+    return None
+
   def getState( self ):
     self.__lock.acquire()
     try:
@@ -248,6 +296,13 @@ class ExecutorDispatcherCallbacks:
   def cbSendTask( self, taskId, taskObj, eId, eType ):
     return S_ERROR( "No send task callback defined" )
 
+  def cbSendTasks( self, taskIds, taskObjs, eId, eType ):
+    for taskId in taskIds:
+      result = self.cbSendTask( taskId, taskObjs[ taskId ], eId, eType )
+      if not result[ 'OK' ]:
+        return result
+    return S_OK()
+
   def cbDisconectExecutor( self, eId ):
     return S_ERROR( "No disconnect callback defined" )
 
@@ -356,7 +411,7 @@ class ExecutorDispatcher:
         pass
     self.__monitor.addMark( "executors", len( self.__idMap ) )
 
-  def addExecutor( self, eId, eTypes, maxTasks = 1 ):
+  def addExecutor( self, eId, eTypes, maxTasks = 1, maxBatch = 1 ):
     self.__log.verbose( "Adding new %s executor to the pool %s" % ( eId, ", ".join ( eTypes ) ) )
     self.__executorsLock.acquire()
     try:
@@ -365,7 +420,7 @@ class ExecutorDispatcher:
       if type( eTypes ) not in ( types.ListType, types.TupleType ):
         eTypes = [ eTypes ]
       self.__idMap[ eId ] = list( eTypes )
-      self.__states.addExecutor( eId, eTypes, maxTasks )
+      self.__states.addExecutor( eId, eTypes, maxTasks, maxBatch )
       for eType in eTypes:
         if eType not in self.__execTypes:
           self.__execTypes[ eType ] = 0
@@ -773,19 +828,39 @@ class ExecutorDispatcher:
         except ValueError:
           pass
         searchTypes.append( eType )
-    pData = self.__queues.popTask( searchTypes ) 
+    numTasks = self.__states.batchSize( eId )
+    if not numTasks:
+      self.__log.verbose( "Executor %s is waiting for a full batch" % eId )
+      return S_OK()
+    pData = self.__queues.popTasks( searchTypes, numTasks )
     if pData == None:
       self.__log.verbose( "No more tasks for %s" % eTypes )
       return S_OK()
-    taskId, eType = pData
-    self.__log.verbose( "Sending task %s to %s=%s" % ( taskId, eType, eId ) )
-    self.__states.addTask( eId, taskId )
-    result = self.__msgTaskToExecutor( taskId, eId, eType )
+    taskIds, eType = pData
+    if len( taskIds ) == 1:
+      taskId = taskIds[0]
+      self.__log.verbose( "Sending task %s to %s=%s" % ( taskId, eType, eId ) )
+      self.__states.addTask( eId, taskId )
+      result = self.__msgTaskToExecutor( taskId, eId, eType )
+      if not result[ 'OK' ]:
+        self.__queues.pushTask( eType, taskId, ahead = True )
+        self.__states.removeTask( taskId )
+        return result
+      return S_OK( taskId )
+    #Tasks removed while waiting in the queue are not sent
+    taskIds = [ taskId for taskId in taskIds if taskId in self.__tasks ]
+    if not taskIds:
+      return self.__sendTaskToExecutor( eId, eTypes )
+    self.__log.verbose( "Sending %s tasks to %s=%s" % ( len( taskIds ), eType, eId ) )
+    for taskId in taskIds:
+      self.__states.addTask( eId, taskId )
+    result = self.__msgTasksToExecutor( taskIds, eId, eType )
     if not result[ 'OK' ]:
-      self.__queues.pushTask( eType, taskId, ahead = True )
-      self.__states.removeTask( taskId )
+      for taskId in reversed( taskIds ):
+        self.__queues.pushTask( eType, taskId, ahead = True )
+        self.__states.removeTask( taskId )
       return result
-    return S_OK( taskId )
+    return S_OK( taskIds )
 
   def __msgTaskToExecutor( self, taskId, eId, eType ):
     try:
@@ -808,6 +883,27 @@ class ExecutorDispatcher:
     self.removeExecutor( eId )
     return S_ERROR( "Exception while sending task to executor" )
 
+  def __msgTasksToExecutor( self, taskIds, eId, eType ):
+    taskObjs = {}
+    sendTime = time.time()
+    for taskId in taskIds:
+      try:
+        eTask = self.__tasks[ taskId ]
+      except KeyError:
+        return S_ERROR( "Task %s has been deleted" % taskId )
+      eTask.sendTime = sendTime
+      taskObjs[ taskId ] = eTask.taskObj
+    try:
+      result = self.__cbHolder.cbSendTasks( taskIds, taskObjs, eId, eType )
+    except:
+      self.__log.exception( "Exception while sending tasks to executor" )
+      return S_ERROR( "Exception while sending tasks to executor" )
+    if isReturnStructure( result ):
+      return result
+    errMsg = "Send tasks callback did not send back an S_OK/S_ERROR structure"
+    self.__log.fatal( errMsg )
+    return S_ERROR( errMsg )
+
 if __name__ == "__main__":
   def testExecState():
     execState = ExecutorState()
@@ -10,6 +10,7 @@
 """
 
 import datetime
+import numpy
 
 from pylab import setp
 from matplotlib.patches import Polygon
@@ -73,14 +74,10 @@ class BarGraph( PlotBase ):
       start_plot = date2num( datetime.datetime.fromtimestamp(to_timestamp(self.prefs['starttime'])))
       end_plot = date2num( datetime.datetime.fromtimestamp(to_timestamp(self.prefs['endtime'])))
 
-    nKeys = self.gdata.getNumberOfKeys()
-    tmp_b = []
     if self.prefs.has_key('log_yaxis'):
-      tmp_b = [0.001]*nKeys
-      ymin = 0.001
+      base = 0.001
     else:
-      tmp_b = [0.]*nKeys
-      ymin = 0.
+      base = 0.
 
     self.polygons = []
     self.lines = []
@@ -97,41 +94,25 @@ class BarGraph( PlotBase ):
       else:
         labels = [(color,0.)]
 
-    seq_b = [(self.gdata.max_num_key+width,0.0),(self.gdata.min_num_key,0.0)]
+    seq_b = numpy.array( [(self.gdata.max_num_key+width,0.0),(self.gdata.min_num_key,0.0)] )
     zorder = 0.0
     dpi = self.prefs.get('dpi',100)
-    for label,num in labels:
+    # Each bar is drawn by its four corners, all the bars of a label making one polygon
+    keys, tops = self.gdata.getStackedNumData( [ label for label, _num in labels ], base )
+    tmp_x = numpy.column_stack( ( keys, keys, keys+width, keys+width ) ).ravel() + offset
+    bottom = numpy.empty( len( keys ) )
+    bottom.fill( 0.001 )
+    for (label,num), top in zip( labels, tops ):
       color = self.palette.getColor(label)
-      ind = 0
-      tmp_x = []
-      tmp_y = []
-      tmp_t = []
-      plot_data = self.gdata.getPlotNumData(label)
-      for key, value, error in plot_data:
-        if value is None:
-          value = 0.
-
-        tmp_x.append( offset+key )
-        #tmp_y.append( ymin )
-        tmp_y.append( 0.001 )
-        tmp_x.append( offset+key )
-        tmp_y.append( float(value)+tmp_b[ind] )
-        tmp_x.append( offset+key+width )
-        tmp_y.append( float(value)+tmp_b[ind] )
-        tmp_x.append( offset+key+width )
-        #tmp_y.append( ymin )
-        tmp_y.append( 0.001 )
-        tmp_t.append(float(value)+tmp_b[ind])
-        ind += 1
-      seq_t = zip(tmp_x,tmp_y)
-      seq = seq_t+seq_b
+      tmp_y = numpy.column_stack( ( bottom, top, top, bottom ) ).ravel()
+      seq = numpy.vstack( ( numpy.column_stack( ( tmp_x, tmp_y ) ), seq_b ) )
       poly = Polygon( seq, facecolor=color, fill=True,
                       linewidth=pixelToPoint(0.2,dpi),
                       zorder=zorder)
       self.ax.add_patch( poly )
       self.polygons.append( poly )
-      tmp_b = list(tmp_t)
       zorder -= 0.1
+    tmp_b = tops[-1]
 
     tight_bars_flag = self.prefs.get('tight_bars',False)
     if tight_bars_flag:
@@ -141,16 +122,16 @@ class BarGraph( PlotBase ):
     #for idx in range(len(pivots)):
     #    self.coords[ pivots[idx] ] = self.bars[idx]
 
-    ymax = max(tmp_b)
+    ymax = tmp_b.max()
     ymax *= 1.1
 
     if self.prefs.has_key('log_yaxis'):
       ymin = 0.001
     else:
-      ymin = min( tmp_b, 0. )
+      ymin = min( tmp_b.min(), 0. )
       ymin *= 1.1
 
-    xmax=max(tmp_x)
+    xmax=tmp_x.max()
     if self.log_xaxis:
       xmin = 0.001
     else:
@@ -167,7 +148,7 @@ class BarGraph( PlotBase ):
       if start_plot and end_plot:
         self.ax.set_xlim( xmin=start_plot, xmax=end_plot)
       else:
-        self.ax.set_xlim( xmin=min(tmp_x), xmax=max(tmp_x))
+        self.ax.set_xlim( xmin=tmp_x.min(), xmax=tmp_x.max())
 
   def x_formatter_cb( self, ax ):
     if self.gdata.key_type == "string":
@@ -25,15 +25,34 @@ class Graph(object):
 
   def __init__( self, *args, **kw ):
     super( Graph, self ).__init__( *args, **kw )
+    self.figure = None
+    self.canvas = None
+
+  def getFigure( self ):
+    """ Get the figure to draw the graph on. The figure and its canvas are created
+        once and cleared to be reused by the next graphs
+    """
+
+    if self.figure is None:
+      self.figure = Figure()
+      self.canvas = FigureCanvasAgg( self.figure )
+    else:
+      self.figure.clf()
+    return self.figure
+
+  def clear( self ):
+    """ Release what was drawn on the figure, keeping the figure for the next graph
+    """
+
+    if self.figure is not None:
+      self.figure.clf()
 
   def layoutFigure(self,legend):
 
     prefs = self.prefs
 
     # Get the main Figure object
-    #self.figure = Figure()
     figure = self.figure
-    self.canvas = FigureCanvasAgg(figure)
 
     dpi = prefs['dpi']
     width = float(prefs['width'])
@@ -153,9 +172,7 @@ class Graph(object):
     """ Make an empty text image
     """
 
-    self.figure = Figure()
-    figure = self.figure
-    self.canvas = FigureCanvasAgg(figure)
+    figure = self.getFigure()
 
     prefs = self.prefs
     dpi = prefs['dpi']
@@ -248,7 +265,7 @@ class Graph(object):
       graphData[0].initialize(key_type='string')
 
     legend = Legend(graphData[0],None,prefs)
-    self.figure = Figure()
+    self.getFigure()
 
     # Make Water Mark
     image = prefs.get('watermark',None)
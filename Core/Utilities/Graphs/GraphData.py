@@ -52,7 +52,36 @@ def get_key_type( keys ):
 
   return key_type
 
+def parse_datum( data ):
+  """ Parse a data value, either a number, a "value::error" string or a ( value, error ) tuple
+
+      :return: ( value, error ), None for what is not a number
+  """
+
+  if type( data ) in types.StringTypes and "::" in data:
+    datum,error = data.split("::")
+  elif type( data ) == types.TupleType:
+    datum,error = data
+  else:
+    error = 0.
+    datum = data
+
+  try:
+    resultD = float( datum )
+  except:
+    resultD = None
+  try:
+    resultE = float( error )
+  except:
+    resultE = None
+
+  return ( resultD, resultE )
+
 class GraphData:
+  """ GraphData keeps the values of a plot with several labels in a 2-D array, one row per label
+      and one column per key, so that the labels are sorted, stacked, cumulated and folded into
+      'Others' with array operations rather than key by key
+  """
 
   def __init__( self, data = {} ):
 
@@ -60,7 +89,10 @@ class GraphData:
     self.all_keys = []
     self.labels = []
     self.label_values = []
+    # Row of each label in the values array
     self.subplots = {}
+    self.values = None
+    self.errors = None
     self.plotdata = None
     self.data = dict( data )
     self.key_type = 'string'
@@ -87,42 +119,104 @@ class GraphData:
     start = time.time()
 
     if type( self.data[keys[0]] ) == types.DictType:
-      for key in self.data:
-        self.subplots[key] = PlotData( self.data[key], key_type = key_type )
+      self.plotdata = None
+      self.initializeValues( key_type )
     else:
+      self.subplots = {}
       self.plotdata = PlotData( self.data, key_type = key_type )
+      self.all_keys = self.plotdata.getKeys()
+      if key_type:
+        self.key_type = key_type
+      else:
+        self.key_type = get_key_type( self.all_keys )
 
     if DEBUG:
       print "Time: plot data", time.time() - start, len( self.subplots )
 
-    if self.plotdata:
-      self.all_keys = self.plotdata.getKeys()
+    self.sortKeys()
+    self.makeNumKeys()
+
+    self.sortLabels()
+
+  def initializeValues( self, key_type = None ):
+    """ Fill the values and errors arrays from the data of the labels, NaN standing
+        for the missing values
+    """
+
+    raw_keys = set()
+    for label_data in self.data.values():
+      raw_keys.update( label_data )
+    raw_type = key_type if key_type else get_key_type( raw_keys )
+    if raw_type == "time":
+      parsed_keys = dict( ( key, to_timestamp( key ) ) for key in raw_keys )
     else:
-      tmpset = set()
-      for sub in self.subplots.values():
-        for key in sub.getKeys():
-          tmpset.add( key )
-      self.all_keys = list( tmpset )
+      parsed_keys = dict( ( key, key ) for key in raw_keys )
 
+    self.all_keys = sorted( set( parsed_keys.values() ) )
     if key_type:
       self.key_type = key_type
     else:
       self.key_type = get_key_type( self.all_keys )
-    self.sortKeys()
-    self.makeNumKeys()
+    key_index = dict( ( key, ind ) for ind, key in enumerate( self.all_keys ) )
+    column = dict( ( key, key_index[parsed_key] ) for key, parsed_key in parsed_keys.items() )
 
-    self.sortLabels()
+    self.subplots = {}
+    self.values = numpy.empty( ( len( self.data ), len( self.all_keys ) ) )
+    self.values.fill( numpy.nan )
+    self.errors = numpy.zeros( ( len( self.data ), len( self.all_keys ) ) )
+    for row, ( label, label_data ) in enumerate( self.data.items() ):
+      self.subplots[label] = row
+      if not label_data:
+        continue
+      columns = [ column[key] for key in label_data ]
+      # Plain numbers are converted at once, None values becoming NaN
+      try:
+        values = numpy.array( label_data.values(), numpy.float64 )
+      except ( TypeError, ValueError ):
+        values = None
+      if values is not None and values.ndim == 1:
+        self.values[row, columns] = values
+        continue
+      parsed = [ parse_datum( datum ) for datum in label_data.values() ]
+      self.values[row, columns] = numpy.array( [ p[0] for p in parsed ], numpy.float64 )
+      self.errors[row, columns] = numpy.array( [ p[1] or 0. for p in parsed ], numpy.float64 )
 
   def expandKeys( self ):
+    """ Fill zero values into the missing keys
+    """
 
     if not self.plotdata:
-      for sub in self.subplots:
-        self.subplots[sub].expandKeys( self.all_keys )
+      self.values[numpy.isnan( self.values )] = 0.
 
   def isSimplePlot( self ):
 
     return not self.plotdata is None
 
+  def getLabelStats( self, stat ):
+    """ Get a statistic of the values of each label, ignoring the missing ones:
+          max_value - the max value
+          last_value - the last value
+          sum - the sum of values
+          avg_nozeros - the average of the non zero values
+
+        :return: dict { label : value }
+    """
+
+    valid = ~numpy.isnan( self.values )
+    has_values = valid.any( axis = 1 )
+    if stat == 'max_value':
+      stats = numpy.where( valid, self.values, -numpy.inf ).max( axis = 1 )
+    elif stat == 'last_value':
+      last = self.values.shape[1] - 1 - valid[:, ::-1].argmax( axis = 1 )
+      stats = self.values[numpy.arange( len( last ) ), last]
+    else:
+      stats = numpy.where( valid, self.values, 0. ).sum( axis = 1 )
+      if stat == 'avg_nozeros':
+        count = ( valid & ( self.values != 0. ) ).sum( axis = 1 )
+        stats = numpy.where( count > 0, stats / numpy.maximum( count, 1 ), 0. )
+    stats = numpy.where( has_values, stats, 0. )
+    return dict( ( label, float( stats[row] ) ) for label, row in self.subplots.items() )
+
   def sortLabels( self, sort_type = 'max_value', reverse_order=False ):
     """ Sort labels with a specified method:
           alpha - alphabetic order
@@ -141,38 +235,18 @@ class GraphData:
           self.labels.reverse()  
         self.label_values = [ self.plotdata.parsed_data[l] for l in self.labels]
     else:
-      if sort_type == 'max_value':
-        pairs = zip( self.subplots.keys(), self.subplots.values() )
-        reverse = not reverse_order
-        pairs.sort( key = lambda x: x[1].max_value, reverse = reverse )
-        self.labels = [ x[0] for x in pairs ]
-        self.label_values = [ x[1].max_value for x in pairs ]
-      elif sort_type == 'last_value':
-        pairs = zip( self.subplots.keys(), self.subplots.values() )
-        reverse = not reverse_order
-        pairs.sort( key = lambda x: x[1].last_value, reverse = reverse )
-        self.labels = [ x[0] for x in pairs ]
-        self.label_values = [ x[1].last_value for x in pairs ]        
-      elif sort_type == 'sum':
-        pairs = []
-        for key in self.subplots:
-          pairs.append( ( key, self.subplots[key].sum_value ) )
+      if sort_type in [ 'max_value', 'last_value', 'sum', 'avg_nozeros' ]:
+        stats = self.getLabelStats( sort_type )
         reverse = not reverse_order
-        pairs.sort( key = lambda x: x[1], reverse = reverse )
-        self.labels = [ x[0] for x in pairs ]
-        self.label_values = [ x[1] for x in pairs ]
+        self.labels = sorted( self.subplots, key = lambda label: stats[label], reverse = reverse )
+        self.label_values = [ stats[label] for label in self.labels ]
       elif sort_type == 'alpha':
         self.labels = self.subplots.keys()
         self.labels.sort()
         if reverse_order:
           self.labels.reverse()  
-        self.label_values = [ self.subplots[x].sum_value for x in self.labels ]
-      elif sort_type == 'avg_nozeros':
-        pairs = zip( self.subplots.keys(), self.subplots.values() )
-        reverse = not reverse_order
-        pairs.sort( key = lambda x: x[1].avg_nozeros, reverse = reverse )
-        self.labels = [ x[0] for x in pairs ]
-        self.label_values = [ x[1].avg_nozeros for x in pairs ] 
+        stats = self.getLabelStats( 'sum' )
+        self.label_values = [ stats[label] for label in self.labels ]
       else:
         self.labels = self.subplots.keys()
         if reverse_order:
@@ -219,11 +293,8 @@ class GraphData:
 
     if self.plotdata:
       self.plotdata.makeCumulativePlot()
-    if self.truncated:
-      self.otherPlot.makeCumulativePlot()
     if self.subplots:
-      for label in self.subplots:
-        self.subplots[label].makeCumulativePlot()
+      self.values = numpy.cumsum( self.values, axis = 1 )
 
     self.sortLabels( sort_type = 'last_value' )
 
@@ -265,6 +336,18 @@ class GraphData:
     else:
       return len( self.labels )
 
+  def getLabelValues( self, label ):
+    """ Get the values and errors of a label as arrays, the values of the 'Others' label
+        being the sums of the labels beyond the truncation limit
+    """
+
+    if label == "Others" and self.truncated:
+      rows = [ self.subplots[l] for l in self.labels[self.truncated:] ]
+      others = self.values[rows]
+      return numpy.where( numpy.isnan( others ), 0., others ).sum( axis = 0 ), numpy.zeros( len( self.all_keys ) )
+    row = self.subplots[label]
+    return self.values[row], self.errors[row]
+
   def getPlotNumData( self, label = None, zipFlag = True ):
     """ Get the plot data in a numeric form
     """
@@ -275,22 +358,36 @@ class GraphData:
       else:
         return self.plotdata.getValues()
     elif label is not None:
-      if label == "Others":
-        return self.otherPlot.getPlotDataForNumKeys( self.all_num_keys )
-      else:
-        return self.subplots[label].getPlotDataForNumKeys( self.all_num_keys )
+      values, errors = self.getLabelValues( label )
+      return [ ( key, None if value != value else value, error )
+               for key, value, error in zip( self.all_num_keys, values.tolist(), errors.tolist() ) ]
     else:
       # Get the sum of all the subplots
       self.expandKeys()
-      arrays = []
-      for label in self.subplots:
-        arrays.append( numpy.array( [ x[1] for x in self.subplots[label].getPlotDataForNumKeys( self.all_num_keys, True )] ) )
-      sum_array = sum( arrays )
+      sum_array = self.values.sum( axis = 0 )
       if zipFlag:
         return zip( self.all_num_keys, list( sum_array ) )
       else:
         return sum_array
 
+  def getStackedNumData( self, labels, base = 0. ):
+    """ Get the numeric keys and the tops of the labels stacked one on the other in the given order,
+        the missing values counting as zeros
+
+        :param list labels: labels from the bottom of the stack, ignored for a simple plot
+        :param float base: bottom of the stack
+        :return: array of keys, array of the tops with one row per label
+    """
+
+    if self.plotdata:
+      num_keys = numpy.array( self.plotdata.getNumKeys(), numpy.float64 )
+      values = numpy.array( [ self.plotdata.getValues() ], numpy.float64 )
+    else:
+      num_keys = numpy.array( self.all_num_keys, numpy.float64 )
+      values = numpy.vstack( [ self.getLabelValues( label )[0] for label in labels ] )
+    values = numpy.where( numpy.isnan( values ), 0., values )
+    return num_keys, base + numpy.cumsum( values, axis = 0 )
+
   def truncateLabels( self, limit = 10 ):
     """ Truncate the number of labels to the limit, leave the most important
         ones, accumulate the rest in the 'Others' label 
@@ -304,19 +401,6 @@ class GraphData:
 
     self.truncated = limit
 
-    new_labels = self.labels[:limit]
-    new_labels.append( 'Others' )
-
-    other_data = {}
-    for key in self.all_keys:
-      other_data[key] = 0.
-    for label in self.labels:
-      if label not in new_labels:
-        for key in self.all_keys:
-          if self.subplots[label].parsed_data.has_key( key ):
-            other_data[key] += self.subplots[label].parsed_data[key]
-    self.otherPlot = PlotData( other_data )
-
   def getStats( self ):
     """ Get statistics of the graph data
     """
@@ -507,25 +591,8 @@ class PlotData:
     """
     Parse the specific data value; this is the identity.
     """
-    
-    if type( data ) in types.StringTypes and "::" in data:
-      datum,error = data.split("::")
-    elif type( data ) == types.TupleType:
-      datum,error = data
-    else:  
-      error = 0.  
-      datum = data
-    
-    try:
-      resultD = float( datum )
-    except:
-      resultD = None
-    try:
-      resultE = float( error )
-    except:
-      resultE = None
-        
-    return ( resultD, resultE )
+
+    return parse_datum( data )
 
   def parseData( self, key_type = None ):
     """
@@ -623,6 +690,10 @@ class PlotData:
 
     return self.values
 
+  def getErrors( self ):
+
+    return self.errors
+
   def getMaxValue( self ):
 
     return max( self.values )
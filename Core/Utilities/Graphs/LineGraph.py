@@ -17,6 +17,7 @@ from DIRAC.Core.Utilities.Graphs.GraphUtilities import to_timestamp, PrettyDateL
 from matplotlib.patches import Polygon
 from matplotlib.dates import date2num
 import datetime
+import numpy
 
 class LineGraph( PlotBase ):
 
@@ -40,14 +41,10 @@ class LineGraph( PlotBase ):
 
     tmp_x = []; tmp_y = []
 
-    labels = self.gdata.getLabels()
-    nKeys = self.gdata.getNumberOfKeys()
-    tmp_b = []
-    for n in range(nKeys):
-      if self.prefs.has_key('log_yaxis'):
-        tmp_b.append(0.001)
-      else:
-        tmp_b.append(0.)
+    if self.prefs.has_key('log_yaxis'):
+      base = 0.001
+    else:
+      base = 0.
 
     start_plot = 0
     end_plot = 0
@@ -56,7 +53,7 @@ class LineGraph( PlotBase ):
       end_plot = date2num( datetime.datetime.fromtimestamp(to_timestamp(self.prefs['endtime'])))
 
     self.polygons = []
-    seq_b = [(self.gdata.max_num_key,0.0),(self.gdata.min_num_key,0.0)]
+    seq_b = numpy.array( [(self.gdata.max_num_key,0.0),(self.gdata.min_num_key,0.0)] )
     zorder = 0.0
     labels = self.gdata.getLabels()
     labels.reverse()
@@ -71,32 +68,22 @@ class LineGraph( PlotBase ):
       else:
         labels = [(color,0.)]
 
-    for label,num in labels:
+    tmp_x, tops = self.gdata.getStackedNumData( [ label for label, _num in labels ], base )
+    for (label,num), tmp_y in zip( labels, tops ):
 
       color = self.palette.getColor(label)
-      ind = 0
-      tmp_x = []
-      tmp_y = []
-      plot_data = self.gdata.getPlotNumData(label)
-      for key, value, error in plot_data:
-        if value is None:
-          value = 0.
-        tmp_x.append( key )
-        tmp_y.append( float(value)+tmp_b[ind] )
-        ind += 1
-      seq_t = zip(tmp_x,tmp_y)
-      seq = seq_t+seq_b
+      seq = numpy.vstack( ( numpy.column_stack( ( tmp_x, tmp_y ) ), seq_b ) )
       poly = Polygon( seq, facecolor=color, fill=True, linewidth=.2, zorder=zorder)
       self.ax.add_patch( poly )
       self.polygons.append( poly )
-      tmp_b = list(tmp_y)
       zorder -= 0.1
+    tmp_b = tops[-1]
 
-    ymax = max( tmp_b ); ymax *= 1.1
-    ymin = min( tmp_b, 0. ); ymin *= 1.1
+    ymax = tmp_b.max(); ymax *= 1.1
+    ymin = min( tmp_b.min(), 0. ); ymin *= 1.1
     if self.prefs.has_key('log_yaxis'):
       ymin = 0.001
-    xmax=max(tmp_x)
+    xmax=tmp_x.max()
     if self.log_xaxis:
       xmin = 0.001
     else:
@@ -113,7 +100,7 @@ class LineGraph( PlotBase ):
       if start_plot and end_plot:
         self.ax.set_xlim( xmin=start_plot, xmax=end_plot)
       else:
-        self.ax.set_xlim( xmin=min(tmp_x), xmax=max(tmp_x))
+        self.ax.set_xlim( xmin=tmp_x.min(), xmax=tmp_x.max())
 
   def x_formatter_cb( self, ax ):
     if self.gdata.key_type == "string":
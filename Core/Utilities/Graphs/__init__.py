@@ -7,6 +7,8 @@
 
 __RCSID__ = "$Id$"
 
+import threading
+
 # Make sure the the Agg backend is used despite arbitrary configuration
 import matplotlib
 matplotlib.use( 'agg' )
@@ -108,6 +110,9 @@ graph_thumbnail_prefs = {
   'tight_bars':True
 }
 
+# Graph objects, with their matplotlib figure and canvas, are reused by the graphs made in the same thread
+gThreadGraphs = threading.local()
+
 def graph( data, fileName, *args, **kw ):
 
   prefs = evalPrefs( *args, **kw )
@@ -125,9 +130,15 @@ def graph( data, fileName, *args, **kw ):
   elif graph_size == "large":
     defaults = graph_large_prefs
 
-  graph = Graph()
-  graph.makeGraph( data, common_prefs, defaults, prefs )
-  graph.writeGraph( fileName, 'PNG' )
+  graph = getattr( gThreadGraphs, 'graph', None )
+  if graph is None:
+    graph = Graph()
+    gThreadGraphs.graph = graph
+  try:
+    graph.makeGraph( data, common_prefs, defaults, prefs )
+    graph.writeGraph( fileName, 'PNG' )
+  finally:
+    graph.clear()
   return DIRAC.S_OK( {'plot':fileName} )
 
 def __checkKW( kw ):
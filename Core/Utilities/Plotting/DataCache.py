@@ -1,4 +1,8 @@
 """ Accounting Cache
+
+    The report data are kept in memory and the plots in a size bounded directory, which
+    can be shared by several services. Identical requests arriving at the same time are
+    served by one computation.
 """
 
 __RCSID__ = "$Id$"
@@ -7,8 +11,10 @@ import os.path
 import time
 import threading
 
-from DIRAC import S_OK, S_ERROR, gLogger, rootPath, gConfig
+from DIRAC import S_OK, gLogger, rootPath, gConfig
 from DIRAC.Core.Utilities.DictCache import DictCache
+from DIRAC.Core.Utilities.Plotting.PlotFileCache import PlotFileCache
+from DIRAC.Core.Utilities.Plotting.SingleFlight import SingleFlight
 
 
 class DataCache( object ):
@@ -21,29 +27,44 @@ class DataCache( object ):
     self.purgeThread.setDaemon( 1 )
     self.purgeThread.start()
     self.__dataCache = DictCache()
-    self.__graphCache = DictCache( deleteFunction = self._deleteGraph )
     self.__dataLifeTime = 600
-    self.__graphLifeTime = 3600
+    self.__graphCache = PlotFileCache( self.graphsLocation, lifeTime = 3600 )
+    self.__dataFlights = SingleFlight()
+    self.__graphFlights = SingleFlight()
+
+  def setGraphsLocation( self, graphsDir, maxSize = None, lifeTime = None, shared = False ):
+    """ Set the directory of the plots
 
-  def setGraphsLocation( self, graphsDir ):
+    :param str graphsDir: directory of the plots
+    :param int maxSize: maximum size of the plots in bytes
+    :param int lifeTime: seconds a plot is reused for
+    :param bool shared: whether other services write their plots in the same directory
+    """
     self.graphsLocation = graphsDir
-    for graphName in os.listdir( self.graphsLocation ):
-      if graphName.find( ".png" ) > 0:
-        graphLocation = "%s/%s" % ( self.graphsLocation, graphName )
-        gLogger.verbose( "Purging %s" % graphLocation )
-        os.unlink( graphLocation )
+    if maxSize:
+      self.__graphCache.maxSize = maxSize
+    if lifeTime:
+      self.__graphCache.lifeTime = lifeTime
+    self.__graphCache.setLocation( graphsDir, shared = shared )
 
   def purgeExpired( self ):
     while self.alive:
       time.sleep( 600 )
-      self.__graphCache.purgeExpired()
+      self.__graphCache.purge()
       self.__dataCache.purgeExpired()
 
   def getReportData( self, reportRequest, reportHash, dataFunc ):
     """
     Get report data from cache if exists, else generate it
     """
-    reportData = self.__dataCache.get( reportHash )   
+    reportData = self.__dataCache.get( reportHash )
+    if reportData:
+      return S_OK( reportData )
+    return self.__dataFlights.do( reportHash, self.__generateReportData, reportRequest, reportHash, dataFunc )
+
+  def __generateReportData( self, reportRequest, reportHash, dataFunc ):
+    # Generated meanwhile by the request this one waited for
+    reportData = self.__dataCache.get( reportHash )
     if not reportData:
       retVal = dataFunc( reportRequest )
       if not retVal[ 'OK' ]:
@@ -54,46 +75,40 @@ class DataCache( object ):
 
   def getReportPlot( self, reportRequest, reportHash, reportData, plotFunc ):
     """
-    Get report data from cache if exists, else generate it
+    Get report plot from cache if exists, else generate it
     """
-    plotDict = self.__graphCache.get( reportHash )
-    if not plotDict:
-      basePlotFileName = "%s/%s" % ( self.graphsLocation, reportHash )
-      retVal = plotFunc( reportRequest, reportData, basePlotFileName )
-      if not retVal[ 'OK' ]:
-        return retVal
-      plotDict = retVal[ 'Value' ]
-      if plotDict[ 'plot' ]:
-        plotDict[ 'plot' ] = "%s.png" % reportHash
-      if plotDict[ 'thumbnail' ]:
-        plotDict[ 'thumbnail' ] = "%s.thb.png" % reportHash
-      self.__graphCache.add( reportHash, self.__graphLifeTime, plotDict )
+    retVal = self.__graphFlights.do( reportHash, self.__generateReportPlot, reportRequest, reportHash,
+                                     reportData, plotFunc )
+    if not retVal[ 'OK' ]:
+      return retVal
+    # Each request gets its own copy
+    return S_OK( dict( retVal[ 'Value' ] ) )
+
+  def __generateReportPlot( self, reportRequest, reportHash, reportData, plotFunc ):
+    plotFile = "%s.png" % reportHash
+    thumbnailFile = "%s.thb.png" % reportHash
+    if self.__graphCache.exists( plotFile ):
+      if not self.__graphCache.exists( thumbnailFile ):
+        thumbnailFile = False
+      return S_OK( { 'plot' : plotFile, 'thumbnail' : thumbnailFile } )
+
+    prefix = self.__graphCache.getTemporaryPrefix()
+    basePlotFileName = self.__graphCache.getPath( prefix + reportHash )
+    retVal = plotFunc( reportRequest, reportData, basePlotFileName )
+    if not retVal[ 'OK' ]:
+      self.__graphCache.discard( prefix, [ thumbnailFile, plotFile ] )
+      return retVal
+    plotDict = retVal[ 'Value' ]
+    if plotDict[ 'plot' ]:
+      plotDict[ 'plot' ] = plotFile
+    if plotDict[ 'thumbnail' ]:
+      plotDict[ 'thumbnail' ] = thumbnailFile
+    # The thumbnail first: a plot found in the cache has its thumbnail already there
+    retVal = self.__graphCache.publish( prefix, [ plotDict[ key ] for key in ( 'thumbnail', 'plot' ) if plotDict[ key ] ] )
+    if not retVal[ 'OK' ]:
+      gLogger.error( "Cannot cache the plot", retVal[ 'Message' ] )
+      return retVal
     return S_OK( plotDict )
 
   def getPlotData( self, plotFileName ):
-    filename = "%s/%s" % ( self.graphsLocation, plotFileName )
-    try:
-      fd = file( filename, "rb" )
-      data = fd.read()
-      fd.close()
-    except Exception as e:
-      return S_ERROR( "Can't open file %s: %s" % ( plotFileName, str( e ) ) )
-    return S_OK( data )
-
-  def _deleteGraph( self, plotDict ):
-    try:
-      for key in plotDict:
-        value = plotDict[ key ]
-        if value:
-          fPath = os.path.join( self.graphsLocation, str( value ) )
-          if os.path.isfile( fPath ):
-            gLogger.info( "Deleting plot from cache", value )
-            os.unlink( fPath )
-          else:
-            gLogger.info( "Plot has already been deleted", value )
-    except:
-      pass
-
-
-
-
+    return self.__graphCache.read( plotFileName )
@@ -0,0 +1,177 @@
+""" Directory of plot files bounded in size
+
+    The plots are looked up by the name of their files, which is derived from the hash of
+    the request. The files older than their life time are removed and, when the files take
+    more than the maximum size, the least recently used plots are removed first.
+
+    The directory can be shared by several services, which then reuse each other's plots:
+    the files are written under a temporary name then renamed, so a plot is never seen
+    half written, and the last use of a plot is recorded as the access time of its files.
+"""
+
+__RCSID__ = "$Id$"
+
+import os
+import time
+import uuid
+import threading
+
+from DIRAC import S_OK, S_ERROR, gLogger
+
+class PlotFileCache( object ):
+  """ Size bounded, LRU cache of plot files
+  """
+
+  def __init__( self, location = None, maxSize = 1024 * 1024 * 1024, lifeTime = 3600, shared = False ):
+    """ c'tor
+
+    :param str location: directory of the plots
+    :param int maxSize: maximum size of the plots, in bytes
+    :param int lifeTime: seconds a plot can be used for after it has been made
+    :param bool shared: whether other services use the same directory
+    """
+    self.location = location
+    self.maxSize = maxSize
+    self.lifeTime = lifeTime
+    self.shared = shared
+    # Size of the plots since the last purge
+    self.__size = 0
+    self.__lock = threading.Lock()
+
+  def setLocation( self, location, shared = False ):
+    """ Set the directory of the plots. The plots already there are removed,
+        unless the directory is shared with other services
+    """
+    self.location = location
+    self.shared = shared
+    if shared:
+      self.purge()
+      return
+    for fileName in os.listdir( self.location ):
+      if fileName.find( ".png" ) > 0:
+        gLogger.verbose( "Purging %s" % self.getPath( fileName ) )
+        self.__unlink( fileName )
+    self.__size = 0
+
+  def getPath( self, fileName ):
+    """ Path of a file of the cache
+    """
+    return os.path.join( self.location, fileName )
+
+  def getTemporaryPrefix( self ):
+    """ Prefix of the names to write the files of a plot under, before they are published
+    """
+    return "tmp-%s-" % uuid.uuid4().hex
+
+  def exists( self, fileName ):
+    """ Whether a file is in the cache and can still be used, in which case it is
+        marked as the most recently used
+    """
+    path = self.getPath( fileName )
+    try:
+      fileStat = os.stat( path )
+      if fileStat.st_mtime + self.lifeTime <= time.time():
+        return False
+      os.utime( path, ( time.time(), fileStat.st_mtime ) )
+    except OSError:
+      return False
+    return True
+
+  def publish( self, prefix, fileNames ):
+    """ Rename the files written with a temporary prefix to their final names,
+        in the order given, and make room for them
+
+    :param str prefix: temporary prefix, from getTemporaryPrefix
+    :param list fileNames: final names of the files
+    """
+    for fileName in fileNames:
+      try:
+        self.__size += os.stat( self.getPath( prefix + fileName ) ).st_size
+        os.rename( self.getPath( prefix + fileName ), self.getPath( fileName ) )
+      except OSError as e:
+        return S_ERROR( "Cannot publish plot %s: %s" % ( fileName, str( e ) ) )
+    if self.__size > self.maxSize:
+      self.purge()
+    return S_OK()
+
+  def discard( self, prefix, fileNames ):
+    """ Remove the files written with a temporary prefix
+    """
+    for fileName in fileNames:
+      self.__unlink( prefix + fileName )
+
+  def read( self, fileName ):
+    """ Get the contents of a file, marked as the most recently used
+    """
+    path = self.getPath( fileName )
+    try:
+      with open( path, "rb" ) as fd:
+        data = fd.read()
+        modificationTime = os.fstat( fd.fileno() ).st_mtime
+    except Exception as e:  # pylint: disable=broad-except
+      return S_ERROR( "Can't open file %s: %s" % ( fileName, str( e ) ) )
+    try:
+      os.utime( path, ( time.time(), modificationTime ) )
+    except OSError:
+      pass
+    return S_OK( data )
+
+  def purge( self ):
+    """ Remove the expired plots, then the least recently used ones until the plots
+        fit in the maximum size
+    """
+    if not self.location:
+      return
+    with self.__lock:
+      now = time.time()
+      # { name of the plot : [ size, last use, files, expired ] }
+      plots = {}
+      try:
+        fileNames = os.listdir( self.location )
+      except OSError as e:
+        gLogger.warn( "Can't purge the plots", "%s: %s" % ( self.location, str( e ) ) )
+        return
+      for fileName in fileNames:
+        if fileName.find( ".png" ) <= 0:
+          continue
+        try:
+          fileStat = os.stat( self.getPath( fileName ) )
+        except OSError:
+          continue
+        # Half written or left by a failed plot
+        if fileName.startswith( "tmp-" ):
+          if fileStat.st_mtime + self.lifeTime <= now:
+            self.__unlink( fileName )
+          continue
+        # The files of a plot, e.g. the plot and its thumbnail, go together
+        plot = plots.setdefault( fileName.split( "." )[0], [ 0, 0, [], False ] )
+        plot[0] += fileStat.st_size
+        plot[1] = max( plot[1], fileStat.st_atime )
+        plot[2].append( fileName )
+        plot[3] = plot[3] or fileStat.st_mtime + self.lifeTime <= now
+
+      size = 0
+      for plotName in plots.keys():
+        if plots[ plotName ][3]:
+          for fileName in plots.pop( plotName )[2]:
+            self.__unlink( fileName )
+        else:
+          size += plots[ plotName ][0]
+      removed = 0
+      for plotSize, _lastUse, fileNames, _expired in sorted( plots.values(), key = lambda plot: plot[1] ):
+        if size <= self.maxSize:
+          break
+        for fileName in fileNames:
+          self.__unlink( fileName )
+        size -= plotSize
+        removed += 1
+      if removed:
+        gLogger.info( "Removed %d least recently used plots to fit in %d bytes" % ( removed, self.maxSize ) )
+      self.__size = size
+
+  def __unlink( self, fileName ):
+    try:
+      os.unlink( self.getPath( fileName ) )
+    except OSError:
+      # Already removed, by another service if the directory is shared
+      pass
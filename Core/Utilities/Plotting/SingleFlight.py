@@ -0,0 +1,60 @@
+""" Collapse concurrent identical requests into one computation
+
+    When several threads ask for the same plot at the same time, only the first one makes it,
+    the others wait for it and get its result.
+"""
+
+__RCSID__ = "$Id$"
+
+import threading
+
+class SingleFlight( object ):
+  """ Run a function once for all the threads asking for the same key at the same time
+  """
+
+  def __init__( self ):
+    self.__lock = threading.Lock()
+    # { key : Flight }
+    self.__flights = {}
+
+  def __len__( self ):
+    return len( self.__flights )
+
+  def do( self, key, func, *args, **kwargs ):
+    """ Call func( *args, **kwargs ), unless a call for the same key is running: wait for it instead
+
+    :param key: hashable identifying the request
+    :return: what func returned, to all the threads waiting for the key. If func raised an exception,
+             it is raised in all of them
+    """
+    with self.__lock:
+      flight = self.__flights.get( key )
+      leader = flight is None
+      if leader:
+        flight = Flight()
+        self.__flights[ key ] = flight
+
+    if leader:
+      try:
+        flight.result = func( *args, **kwargs )
+      except Exception as e:  # pylint: disable=broad-except
+        flight.exception = e
+      finally:
+        with self.__lock:
+          del self.__flights[ key ]
+        flight.done.set()
+    else:
+      flight.done.wait()
+
+    if flight.exception is not None:
+      raise flight.exception
+    return flight.result
+
+class Flight( object ):
+  """ Result of a call, awaited by the threads asking for the same key
+  """
+
+  def __init__( self ):
+    self.done = threading.Event()
+    self.result = None
+    self.exception = None
@@ -0,0 +1,94 @@
+""" Unit tests for the size bounded directory of plots
+"""
+
+__RCSID__ = "$Id$"
+
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+from DIRAC.Core.Utilities.Plotting.PlotFileCache import PlotFileCache
+
+class PlotFileCacheTestCase( unittest.TestCase ):
+  """ Test the PlotFileCache
+  """
+
+  def setUp( self ):
+    self.location = tempfile.mkdtemp()
+    self.cache = PlotFileCache( maxSize = 3000, lifeTime = 60 )
+    self.cache.setLocation( self.location )
+
+  def tearDown( self ):
+    shutil.rmtree( self.location )
+
+  def __makePlot( self, name, size = 1000, thumbnail = False ):
+    prefix = self.cache.getTemporaryPrefix()
+    fileNames = [ "%s.png" % name ]
+    if thumbnail:
+      fileNames.insert( 0, "%s.thb.png" % name )
+    for fileName in fileNames:
+      with open( self.cache.getPath( prefix + fileName ), "w" ) as fd:
+        fd.write( "x" * size )
+    # Not seen before being published
+    self.assertFalse( self.cache.exists( fileNames[-1] ) )
+    self.assertTrue( self.cache.publish( prefix, fileNames )[ 'OK' ] )
+
+  def __setTimes( self, fileName, accessTime, modificationTime ):
+    os.utime( self.cache.getPath( fileName ), ( accessTime, modificationTime ) )
+
+  def test_plots( self ):
+    self.__makePlot( 'plot1' )
+    self.assertTrue( self.cache.exists( 'plot1.png' ) )
+    self.assertEqual( self.cache.read( 'plot1.png' )[ 'Value' ], "x" * 1000 )
+    self.assertFalse( self.cache.read( 'plot2.png' )[ 'OK' ] )
+    self.assertEqual( sorted( os.listdir( self.location ) ), [ 'plot1.png' ] )
+    # Plots of a previous run
+    PlotFileCache( maxSize = 3000 ).setLocation( self.location )
+    self.assertEqual( os.listdir( self.location ), [] )
+
+  def test_expired( self ):
+    self.__makePlot( 'plot1' )
+    self.__makePlot( 'plot2' )
+    prefix = self.cache.getTemporaryPrefix()
+    with open( self.cache.getPath( prefix + 'plot3.png' ), "w" ) as fd:
+      fd.write( "x" )
+    for fileName in ( 'plot1.png', prefix + 'plot3.png' ):
+      self.__setTimes( fileName, time.time(), time.time() - 120 )
+    self.assertFalse( self.cache.exists( 'plot1.png' ) )
+    self.cache.purge()
+    self.assertEqual( os.listdir( self.location ), [ 'plot2.png' ] )
+
+  def test_lru( self ):
+    now = time.time()
+    self.__makePlot( 'plot1', thumbnail = True )
+    self.__makePlot( 'plot2' )
+    for fileName, lastUse in ( ( 'plot1.thb.png', now - 30 ), ( 'plot1.png', now - 30 ), ( 'plot2.png', now - 20 ) ):
+      self.__setTimes( fileName, lastUse, lastUse )
+    self.cache.exists( 'plot1.png' )
+    # Over the limit: plot2, the least recently used, goes
+    self.__makePlot( 'plot3' )
+    self.assertEqual( sorted( os.listdir( self.location ) ), [ 'plot1.png', 'plot1.thb.png', 'plot3.png' ] )
+    # A plot goes with its thumbnail
+    self.__setTimes( 'plot3.png', now, now )
+    self.__setTimes( 'plot1.png', now - 10, now - 10 )
+    self.__makePlot( 'plot4' )
+    self.assertEqual( sorted( os.listdir( self.location ) ), [ 'plot3.png', 'plot4.png' ] )
+
+  def test_shared( self ):
+    self.__makePlot( 'plot1' )
+    other = PlotFileCache( maxSize = 3000, lifeTime = 60 )
+    other.setLocation( self.location, shared = True )
+    self.assertTrue( other.exists( 'plot1.png' ) )
+    self.assertEqual( other.read( 'plot1.png' )[ 'Value' ], "x" * 1000 )
+
+  def test_missingLocation( self ):
+    # e.g. a process using the cache without having created the directory
+    other = PlotFileCache( maxSize = 3000, lifeTime = 60 )
+    other.location = os.path.join( self.location, 'missing' )
+    other.purge()
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( PlotFileCacheTestCase )
+  testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
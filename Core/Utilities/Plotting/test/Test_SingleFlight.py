@@ -0,0 +1,61 @@
+""" Unit tests for the collapsing of the concurrent identical requests
+"""
+
+__RCSID__ = "$Id$"
+
+import time
+import threading
+import unittest
+
+from DIRAC.Core.Utilities.Plotting.SingleFlight import SingleFlight
+
+class SingleFlightTestCase( unittest.TestCase ):
+  """ Test the SingleFlight
+  """
+
+  def setUp( self ):
+    self.flights = SingleFlight()
+    self.calls = []
+
+  def __slowCall( self, value ):
+    self.calls.append( value )
+    time.sleep( 0.2 )
+    if value == 'error':
+      raise ValueError( value )
+    return { 'OK' : True, 'Value' : value }
+
+  def __runThreads( self, keys ):
+    results = {}
+
+    def request( index, key ):
+      try:
+        results[ index ] = self.flights.do( key, self.__slowCall, key )
+      except ValueError as e:
+        results[ index ] = e
+
+    threads = [ threading.Thread( target = request, args = ( index, key ) ) for index, key in enumerate( keys ) ]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    return [ results[ index ] for index in range( len( keys ) ) ]
+
+  def test_collapsed( self ):
+    results = self.__runThreads( [ 'plot1' ] * 5 + [ 'plot2' ] * 3 )
+    self.assertEqual( sorted( self.calls ), [ 'plot1', 'plot2' ] )
+    self.assertEqual( [ result[ 'Value' ] for result in results ], [ 'plot1' ] * 5 + [ 'plot2' ] * 3 )
+    self.assertEqual( len( self.flights ), 0 )
+    # Nothing is kept once the call is over
+    self.flights.do( 'plot1', self.__slowCall, 'plot1' )
+    self.assertEqual( len( self.calls ), 3 )
+
+  def test_exception( self ):
+    results = self.__runThreads( [ 'error' ] * 3 )
+    self.assertEqual( self.calls, [ 'error' ] )
+    for result in results:
+      self.assertTrue( isinstance( result, ValueError ) )
+    self.assertEqual( len( self.flights ), 0 )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( SingleFlightTestCase )
+  testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
@@ -6,6 +6,11 @@
 """ The Process Monitor utility allows to calculate cumulative CPU time and memory
     for a given PID and it's process group.  This is only implemented for linux /proc
     file systems but could feasibly be extended in the future.
+
+    The process tree is read directly from /proc without spawning any helper
+    command. The PIDs found in the tree are remembered, so that processes
+    orphaned since the previous call keep being accounted. The cgroup accounting
+    of the current process (cgroup v1 or v2) can also be retrieved.
 """
 
 import os
@@ -13,10 +18,11 @@ import re
 import platform
 
 from DIRAC import gLogger, S_OK, S_ERROR
-from DIRAC.Core.Utilities.Subprocess import shellCall
 
 __RCSID__ = "$Id$"
 
+CGROUP_ROOT = '/sys/fs/cgroup'
+
 class ProcessMonitor( object ):
 
   #############################################################################
@@ -25,6 +31,19 @@ class ProcessMonitor( object ):
     """
     self.log = gLogger.getSubLogger( 'ProcessMonitor' )
     self.osType = platform.uname()
+    self.clockTicks = 100
+    self.pageSize = 4096
+    try:
+      self.clockTicks = os.sysconf( 'SC_CLK_TCK' )
+      self.pageSize = os.sysconf( 'SC_PAGESIZE' )
+    except ( ValueError, OSError, AttributeError ):
+      pass
+    # { monitored PID : { PID : start time } } of the processes seen in its tree
+    self.knownPIDs = {}
+    # Whether /proc/<pid>/task/<tid>/children can be used to walk the tree
+    self.childrenFileSupported = None
+    # { resource : accounting file } for the cgroup of this process
+    self.cgroupFiles = None
 
   #############################################################################
   def getCPUConsumed( self, pid ):
@@ -47,21 +66,60 @@ class ProcessMonitor( object ):
       self.log.warn( 'Platform %s is not supported' % ( currentOS ) )
       return S_ERROR( 'Unsupported platform' )
 
+  def getResourceConsumed( self, pid ):
+    """Returns CPU, memory and IO consumed for supported platforms when supplied a PID.
+    """
+    currentOS = self.__checkCurrentOS()
+    if currentOS.lower() == 'linux':
+      return self.getResourceConsumedLinux( pid )
+    else:
+      self.log.warn( 'Platform %s is not supported' % ( currentOS ) )
+      return S_ERROR( 'Unsupported platform' )
+
   def getResourceConsumedLinux( self, pid ):
-    """Returns the CPU consumed given a PID assuming a proc file system exists.
+    """Returns the CPU, memory and IO consumed given a PID assuming a proc file system exists.
+       The values are summed over the process tree of the PID.
     """
     pid = str( pid )
-    masterProcPath = '/proc/%s/stat' % ( pid )
-    if not os.path.exists( masterProcPath ):
+    result = self.__getProcInfoLinux( pid )
+    if not result['OK']:
       return S_ERROR( 'Process %s does not exist' % ( pid ) )
+    procGroup = result['Value'][4]
 
-    #Get the current process list
-    pidListResult = self.__getProcListLinux()
-    if not pidListResult['OK']:
-      return pidListResult
+    infoDict = self.__getProcessTreeLinux( pid, procGroup )
+    infoDict[pid] = result['Value']
 
-    pidList = pidListResult['Value']
-    return self.__getChildResourceConsumedLinux( pid, pidList )
+    cpu = 0.
+    vsize = 0.
+    rss = 0.
+    for info in infoDict.values():
+      contribution = sum( [ float( value ) for value in info[13:17] ] ) / self.clockTicks
+      cpu += contribution
+      vsize += float( info[22] )
+      rss += float( info[23] ) * self.pageSize
+      self.log.debug( 'Added %s to CPU total (now %s) from PID %s %s' % ( contribution, cpu, info[0], info[1] ) )
+    if cpu == 0:
+      self.log.error( 'Consumed CPU is found to be 0' )
+      self.log.info( 'Contributing processes:' )
+      for info in infoDict.values():
+        self.log.info( '  PID:', info )
+
+    readBytes = 0
+    writeBytes = 0
+    for childPID in infoDict:
+      ioDict = self.__getProcIOLinux( childPID )
+      readBytes += ioDict.get( 'read_bytes', 0 )
+      writeBytes += ioDict.get( 'write_bytes', 0 )
+
+    # Remember the tree for the next call to still account the processes that get orphaned
+    self.knownPIDs[pid] = dict( [ ( childPID, info[21] ) for childPID, info in infoDict.items() ] )
+
+    return S_OK( { "CPU": cpu,
+                   "Vsize": vsize,
+                   "RSS": rss,
+                   "ReadBytes": readBytes,
+                   "WriteBytes": writeBytes,
+                   "Processes": len( infoDict ) } )
 
   #############################################################################
   def getCPUConsumedLinux( self, pid ):
@@ -87,90 +145,180 @@ class ProcessMonitor( object ):
     self.log.verbose( 'Current memory estimate is Vsize: %s, RSS: %s' % ( vsize, rss ) )
     return S_OK( {'Vsize': vsize, 'RSS': rss } )
 
-
   #############################################################################
-  def __getProcListLinux( self ):
-    """Gets list of process IDs from /proc/*.
+  def getCGroupResourceConsumed( self ):
+    """ Get the CPU (s), memory (bytes) and IO (bytes) accounted to the cgroup
+        of the current process, for cgroup v2 or v1 hierarchies.
+        Only the available values are returned.
     """
-    result = shellCall( 10, 'ls -d /proc/[0-9]*' )
+    if self.cgroupFiles is None:
+      self.cgroupFiles = self.__getCGroupFiles()
+    if not self.cgroupFiles:
+      return S_ERROR( 'No cgroup accounting available' )
 
-    if not result['OK']:
-      if not 'Value' in result:
-        return result
-    procList = result['Value'][1].replace( '/proc/', '' ).split( '\n' )
+    resultDict = {}
+    try:
+      if 'cpu.stat' in self.cgroupFiles:
+        for line in self.__readLines( self.cgroupFiles['cpu.stat'] ):
+          key, value = line.split()
+          if key == 'usage_usec':
+            resultDict['CPU'] = float( value ) / 1000000.
+      if 'cpuacct.usage' in self.cgroupFiles:
+        resultDict['CPU'] = float( self.__readLines( self.cgroupFiles['cpuacct.usage'] )[0] ) / 1000000000.
+      for memFile in ( 'memory.current', 'memory.usage_in_bytes' ):
+        if memFile in self.cgroupFiles:
+          resultDict['Memory'] = float( self.__readLines( self.cgroupFiles[memFile] )[0] )
+      if 'io.stat' in self.cgroupFiles:
+        readBytes = writeBytes = 0
+        for line in self.__readLines( self.cgroupFiles['io.stat'] ):
+          for item in line.split()[1:]:
+            key, value = item.split( '=' )
+            if key == 'rbytes':
+              readBytes += int( value )
+            elif key == 'wbytes':
+              writeBytes += int( value )
+        resultDict['ReadBytes'] = readBytes
+        resultDict['WriteBytes'] = writeBytes
+      if 'blkio.throttle.io_service_bytes' in self.cgroupFiles:
+        readBytes = writeBytes = 0
+        for line in self.__readLines( self.cgroupFiles['blkio.throttle.io_service_bytes'] ):
+          items = line.split()
+          if len( items ) == 3 and items[1] == 'Read':
+            readBytes += int( items[2] )
+          elif len( items ) == 3 and items[1] == 'Write':
+            writeBytes += int( items[2] )
+        resultDict['ReadBytes'] = readBytes
+        resultDict['WriteBytes'] = writeBytes
+    except ( IOError, OSError, ValueError, IndexError ) as e:
+      self.log.warn( 'Failed to read cgroup accounting', repr( e ) )
+      return S_ERROR( 'Failed to read cgroup accounting' )
+
+    return S_OK( resultDict )
 
-    return S_OK( procList )
+  #############################################################################
+  def __getCGroupFiles( self ):
+    """ Locate the accounting files of the cgroup(s) of the current process
+    """
+    cgroupFiles = {}
+    try:
+      lines = self.__readLines( '/proc/self/cgroup' )
+    except ( IOError, OSError ):
+      return cgroupFiles
+
+    for line in lines:
+      items = line.split( ':', 2 )
+      if len( items ) != 3:
+        continue
+      _hierarchy, controllers, path = items
+      path = path.lstrip( '/' )
+      if not controllers:
+        # cgroup v2 unified hierarchy
+        candidates = ( 'cpu.stat', 'memory.current', 'io.stat' )
+        directories = [ CGROUP_ROOT, os.path.join( CGROUP_ROOT, 'unified' ) ]
+      else:
+        candidates = ( 'cpuacct.usage', 'memory.usage_in_bytes', 'blkio.throttle.io_service_bytes' )
+        directories = [ os.path.join( CGROUP_ROOT, controllers ) ]
+        directories += [ os.path.join( CGROUP_ROOT, controller ) for controller in controllers.split( ',' ) ]
+      for directory in directories:
+        for candidate in candidates:
+          filePath = os.path.join( directory, path, candidate )
+          if candidate not in cgroupFiles and os.path.isfile( filePath ):
+            cgroupFiles[candidate] = filePath
+
+    self.log.verbose( 'cgroup accounting files:', cgroupFiles )
+    return cgroupFiles
 
   #############################################################################
-  def __getChildResourceConsumedLinux( self, pid, pidList, infoDict = None ):
-    """Adds contributions to CPU total from child processes recursively.
+  def __getProcessTreeLinux( self, pid, procGroup ):
+    """ Get the stat information of all the descendants of the PID, plus the
+        processes previously found in its tree which have been orphaned since
     """
-    childCPU = 0
-    vsize = 0
-    rss = 0
-    pageSize = os.sysconf('SC_PAGESIZE')
-    if not infoDict:
-      infoDict = {}
-      for pidCheck in pidList:
-        info = self.__getProcInfoLinux( pidCheck )
+    if self.childrenFileSupported is None:
+      self.childrenFileSupported = os.path.exists( '/proc/self/task/%s/children' % os.getpid() )
+
+    infoDict = {}
+    if self.childrenFileSupported:
+      toCheck = [ pid ]
+      while toCheck:
+        parentPID = toCheck.pop()
+        for childPID in self.__getChildrenLinux( parentPID ):
+          if childPID in infoDict or childPID == pid:
+            continue
+          info = self.__getProcInfoLinux( childPID )
+          if info['OK']:
+            infoDict[childPID] = info['Value']
+            toCheck.append( childPID )
+    else:
+      # Read all the processes once and walk the tree from the parent PIDs
+      childrenDict = {}
+      allInfoDict = {}
+      for procPID in self.__getProcListLinux():
+        info = self.__getProcInfoLinux( procPID )
         if info['OK']:
-          infoDict[pidCheck] = info['Value']
-
-    procGroup = self.__getProcGroupLinux( pid )
-    if not procGroup['OK']:
-      return procGroup
-
-    procGroup = procGroup['Value'].strip()
-
-    for pidCheck, info in infoDict.items():
-      if pidCheck in infoDict and info[3] == pid:
-        contribution = float( info[13] ) / 100 + float( info[14] ) / 100 + float( info[15] ) / 100 + float( info[16] ) / 100
-        childCPU += contribution
-        vsize += float( info[22] )
-        rss += float( info[23] ) * pageSize
-        self.log.debug( 'Added %s to CPU total (now %s) from child PID %s %s' % ( contribution, childCPU, info[0], info[1] ) )
-        del infoDict[pidCheck]
-        result = self.__getChildResourceConsumedLinux( pidCheck, pidList, infoDict )
-        if result['OK']:
-          childCPU += result['Value']['CPU']
-          vsize += result['Value']['Vsize']
-          rss += result['Value']['RSS']
-
-
-    #Next add any contributions from orphan processes in same process group
-    for pidCheck, info in infoDict.items():
-      if pidCheck in infoDict and info[3] == 1 and info[4] == procGroup:
-        contribution = float( info[13] ) / 100 + float( info[14] ) / 100 + float( info[15] ) / 100 + float( info[16] ) / 100
-        childCPU += contribution
-        vsize += float( info[22] )
-        rss += float( info[23] ) * pageSize
-        self.log.debug( 'Added %s to CPU total (now %s) from orphan PID %s %s' % ( contribution, childCPU, info[0], info[1] ) )
-        del infoDict[pidCheck]
-
-    #Finally add the parent itself
-    if pid in infoDict:
-      info = infoDict[pid]
-      contribution = float( info[13] ) / 100 + float( info[14] ) / 100 + float( info[15] ) / 100 + float( info[16] ) / 100
-      childCPU += contribution
-      vsize += float( info[22] )
-      rss += float( info[23] ) * pageSize
-      self.log.debug( 'Added %s to CPU total (now %s) from PID %s %s' % ( contribution, childCPU, info[0], info[1] ) )
-      del infoDict[pid]
-
-      # Some debug printout if 0 CPU is determined
-      if childCPU == 0:
-        self.log.error( 'Consumed CPU is found to be 0' )
-        self.log.info( 'Contributing processes:' )
-        for pidCheck in pidList:
-          if pidCheck not in infoDict:
-            info = self.__getProcInfoLinux( pidCheck )
-            if info['OK']:
-              self.log.info( '  PID:', info['Value'] )
-
-    return S_OK( { "CPU": childCPU,
-                   "Vsize": vsize,
-                   "RSS": rss } )
+          allInfoDict[procPID] = info['Value']
+          childrenDict.setdefault( info['Value'][3], [] ).append( procPID )
+      toCheck = [ pid ]
+      while toCheck:
+        parentPID = toCheck.pop()
+        for childPID in childrenDict.get( parentPID, [] ):
+          if childPID not in infoDict and childPID != pid:
+            infoDict[childPID] = allInfoDict[childPID]
+            toCheck.append( childPID )
+
+    # Processes seen before in the tree and now orphaned, if they were not replaced. Whatever the way
+    # the tree is walked, an orphan is only accounted for if it was seen in the tree before
+    for knownPID, startTime in self.knownPIDs.get( pid, {} ).items():
+      if knownPID in infoDict or knownPID == pid:
+        continue
+      info = self.__getProcInfoLinux( knownPID )
+      if info['OK'] and info['Value'][21] == startTime and info['Value'][4] == procGroup:
+        infoDict[knownPID] = info['Value']
+
+    return infoDict
+
+  #############################################################################
+  def __getChildrenLinux( self, pid ):
+    """ Get the children PIDs of all the threads of a process
+    """
+    children = []
+    try:
+      for tid in os.listdir( '/proc/%s/task' % pid ):
+        with open( '/proc/%s/task/%s/children' % ( pid, tid ), 'r' ) as childrenFile:
+          children.extend( childrenFile.read().split() )
+    except ( IOError, OSError ):
+      pass
+    return children
 
+  #############################################################################
+  def __getProcListLinux( self ):
+    """Gets list of process IDs from /proc/*.
+    """
+    try:
+      return [ procPID for procPID in os.listdir( '/proc' ) if procPID.isdigit() ]
+    except OSError as e:
+      self.log.warn( 'Could not list /proc', repr( e ) )
+      return []
+
+  #############################################################################
+  def __getProcIOLinux( self, pid ):
+    """ Read /proc/PID/io, which might not be readable
+    """
+    ioDict = {}
+    try:
+      for line in self.__readLines( '/proc/%s/io' % pid ):
+        key, value = line.split( ':' )
+        ioDict[key] = int( value )
+    except ( IOError, OSError, ValueError ):
+      pass
+    return ioDict
+
+  #############################################################################
+  @staticmethod
+  def __readLines( filePath ):
+    """ Read all the lines of a small file
+    """
+    with open( filePath, 'r' ) as fd:
+      return fd.read().splitlines()
 
   #############################################################################
   def __getProcInfoLinux( self, pid ):
@@ -391,18 +539,12 @@ class ProcessMonitor( object ):
         procStat = fopen.readline()
     except Exception:
       return S_ERROR( 'Not able to check %s' % pid )
-    return S_OK( procStat.split( ' ' ) )
-
-  #############################################################################
-  def __getProcGroupLinux( self, pid ):
-    """Returns UID for given PID.
-    """
-    result = shellCall( 10, 'ps --no-headers -o pgrp -p %s' % ( pid ) )
-    if not result['OK']:
-      if  not 'Value' in result:
-        return result
-
-    return S_OK( result['Value'][1] )
+    # The executable name is in parentheses and may contain spaces
+    nameStart = procStat.find( '(' )
+    nameEnd = procStat.rfind( ')' )
+    if nameStart < 0 or nameEnd < nameStart:
+      return S_ERROR( 'Not able to parse %s' % procPath )
+    return S_OK( [ procStat[:nameStart].strip(), procStat[nameStart:nameEnd + 1] ] + procStat[nameEnd + 1:].split() )
 
   #############################################################################
   def __checkCurrentOS( self ):
@@ -0,0 +1,69 @@
+""" Unit tests for the ExecutorDispatcher task batching
+"""
+
+__RCSID__ = "$Id$"
+
+import unittest
+
+from DIRAC import S_OK
+from DIRAC.Core.Utilities.ExecutorDispatcher import ExecutorQueues, ExecutorDispatcher, ExecutorDispatcherCallbacks
+
+class RecordingCallbacks( ExecutorDispatcherCallbacks ):
+  """ Dispatch every task to "type1" once and record what is sent
+  """
+
+  def __init__( self ):
+    self.sent = []
+    self.batches = []
+
+  def cbDispatch( self, taskId, taskObj, pathExecuted ):
+    if pathExecuted:
+      return S_OK()
+    return S_OK( "type1" )
+
+  def cbSendTask( self, taskId, taskObj, eId, eType ):
+    self.sent.append( taskId )
+    return S_OK()
+
+  def cbSendTasks( self, taskIds, taskObjs, eId, eType ):
+    self.batches.append( list( taskIds ) )
+    return S_OK()
+
+class ExecutorDispatcherTestCase( unittest.TestCase ):
+
+  def test_popTasks( self ):
+    eQ = ExecutorQueues()
+    for i in range( 5 ):
+      eQ.pushTask( "type1", "t%s" % i )
+    self.assertEqual( eQ.popTasks( "type2", 3 ), None )
+    self.assertEqual( eQ.popTasks( [ "type2", "type1" ], 3 ), ( [ "t0", "t1", "t2" ], "type1" ) )
+    self.assertEqual( eQ.popTasks( "type1", 3 ), ( [ "t3", "t4" ], "type1" ) )
+    self.assertEqual( eQ.popTasks( "type1", 3 ), None )
+    self.assertEqual( eQ.waitingTasks( "type1" ), 0 )
+
+  def test_batchSending( self ):
+    cbs = RecordingCallbacks()
+    eD = ExecutorDispatcher()
+    eD.setCallbacks( cbs )
+    # Tasks wait in the queue until an executor connects
+    eD.setFreezeOnUnknownExecutor( False )
+    eD.addExecutor( "e0", [ "type1" ], 1 )
+    for i in range( 4 ):
+      eD.addTask( i, "task%s" % i )
+    # Only one slot so tasks go one by one
+    self.assertEqual( cbs.sent, [ 0 ] )
+    eD.addExecutor( "e1", [ "type1" ], 3, 3 )
+    self.assertEqual( cbs.batches, [ [ 1, 2, 3 ] ] )
+    eD.addTask( 4, "task4" )
+    eD.addTask( 5, "task5" )
+    # The next batch is sent once the whole batch fits
+    self.assertTrue( eD.taskProcessed( "e1", 1 )[ 'OK' ] )
+    self.assertTrue( eD.taskProcessed( "e1", 2 )[ 'OK' ] )
+    self.assertEqual( len( cbs.batches ), 1 )
+    self.assertTrue( eD.taskProcessed( "e1", 3 )[ 'OK' ] )
+    self.assertEqual( cbs.batches, [ [ 1, 2, 3 ], [ 4, 5 ] ] )
+    self.assertEqual( cbs.sent, [ 0 ] )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( ExecutorDispatcherTestCase )
+  testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
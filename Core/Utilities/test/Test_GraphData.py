@@ -0,0 +1,74 @@
+""" Unit tests for the GraphData of the DIRAC Graphs
+"""
+
+__RCSID__ = "$Id$"
+
+import unittest
+
+import numpy
+
+from DIRAC.Core.Utilities.Graphs.GraphData import GraphData
+
+class GraphDataTestCase( unittest.TestCase ):
+  """ Test the GraphData
+  """
+
+  def setUp( self ):
+    self.t0 = 1500000000
+    self.data = { 'CERN' : { self.t0 : 10., self.t0 + 3600 : 20., self.t0 + 7200 : 5. },
+                  'PIC' : { self.t0 : 1., self.t0 + 7200 : '2::0.5' },
+                  'RAL' : { self.t0 + 3600 : 2.5, self.t0 + 7200 : None },
+                  'CNAF' : { self.t0 : ( 4., 1. ) } }
+
+  def test_labels( self ):
+    gdata = GraphData( self.data )
+    self.assertEqual( gdata.key_type, 'time' )
+    self.assertEqual( gdata.getNumberOfKeys(), 3 )
+    self.assertEqual( gdata.getLabels(), [ ( 'CERN', 20. ), ( 'CNAF', 4. ), ( 'RAL', 2.5 ), ( 'PIC', 2. ) ] )
+    gdata.sortLabels( 'sum' )
+    self.assertEqual( gdata.labels, [ 'CERN', 'CNAF', 'PIC', 'RAL' ] )
+    self.assertEqual( gdata.label_values, [ 35., 4., 3., 2.5 ] )
+    gdata.sortLabels( 'last_value', reverse_order = True )
+    self.assertEqual( gdata.labels[:2], [ 'PIC', 'RAL' ] )
+    gdata.sortLabels( 'alpha' )
+    self.assertEqual( gdata.labels, [ 'CERN', 'CNAF', 'PIC', 'RAL' ] )
+
+  def test_plotData( self ):
+    gdata = GraphData( self.data )
+    numKeys = gdata.all_num_keys
+    self.assertEqual( gdata.getPlotNumData( 'PIC' ), [ ( numKeys[0], 1., 0. ), ( numKeys[1], None, 0. ),
+                                                       ( numKeys[2], 2., 0.5 ) ] )
+    self.assertEqual( gdata.getPlotNumData( 'RAL' )[2], ( numKeys[2], None, 0. ) )
+    self.assertEqual( gdata.getPlotNumData( 'CNAF' )[0], ( numKeys[0], 4., 1. ) )
+    self.assertEqual( list( gdata.getPlotNumData( zipFlag = False ) ), [ 15., 22.5, 7. ] )
+    keys, tops = gdata.getStackedNumData( [ 'PIC', 'CERN' ], base = 1. )
+    self.assertEqual( list( keys ), numKeys )
+    self.assertEqual( tops.tolist(), [ [ 2., 1., 3. ], [ 12., 21., 8. ] ] )
+
+  def test_truncate( self ):
+    gdata = GraphData( self.data )
+    gdata.truncateLabels( 2 )
+    self.assertEqual( gdata.getNumberOfLabels(), 3 )
+    self.assertEqual( gdata.getLabels(), [ ( 'CERN', 20. ), ( 'CNAF', 4. ), ( 'Others', 4.5 ) ] )
+    self.assertEqual( [ value for _key, value, _error in gdata.getPlotNumData( 'Others' ) ], [ 1., 2.5, 2. ] )
+
+  def test_cumulative( self ):
+    gdata = GraphData( self.data )
+    gdata.truncateLabels( 2 )
+    gdata.makeCumulativeGraph()
+    self.assertEqual( gdata.getLabels(), [ ( 'CERN', 35. ), ( 'CNAF', 4. ), ( 'Others', 5.5 ) ] )
+    self.assertEqual( [ value for _key, value, _error in gdata.getPlotNumData( 'CERN' ) ], [ 10., 30., 35. ] )
+    self.assertEqual( [ value for _key, value, _error in gdata.getPlotNumData( 'Others' ) ], [ 1., 3.5, 5.5 ] )
+    self.assertTrue( numpy.allclose( gdata.getStats(), ( 15., 44.5, 97. / 3, 44.5 ) ) )
+
+  def test_simplePlot( self ):
+    gdata = GraphData( { 'CERN' : 10., 'PIC' : 20. } )
+    self.assertTrue( gdata.isSimplePlot() )
+    self.assertEqual( gdata.getLabels(), [ ( 'PIC', 20. ), ( 'CERN', 10. ) ] )
+    self.assertEqual( gdata.getPlotNumData( 'SimplePlot' ), [ ( 0, 20., 0. ), ( 1, 10., 0. ) ] )
+    keys, tops = gdata.getStackedNumData( [ 'SimplePlot' ] )
+    self.assertEqual( ( list( keys ), tops.tolist() ), ( [ 0., 1. ], [ [ 20., 10. ] ] ) )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( GraphDataTestCase )
+  testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
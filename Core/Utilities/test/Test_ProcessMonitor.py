@@ -0,0 +1,80 @@
+""" Unit tests for the ProcessMonitor utility
+"""
+
+__RCSID__ = "$Id$"
+
+import os
+import signal
+import subprocess
+import time
+import unittest
+
+from DIRAC.Core.Utilities.ProcessMonitor import ProcessMonitor
+
+class ProcessMonitorTestCase( unittest.TestCase ):
+  """ Test the resources accounting over a process tree
+  """
+
+  def setUp( self ):
+    self.pm = ProcessMonitor()
+    # In its own process group, so that no orphan is left behind
+    self.child = subprocess.Popen( [ 'sh', '-c', 'sleep 5 & sleep 5' ], preexec_fn = os.setsid )
+    time.sleep( 0.5 )
+
+  def tearDown( self ):
+    os.killpg( self.child.pid, signal.SIGKILL )
+    self.child.wait()
+
+  def test_getResourceConsumed( self ):
+    res = self.pm.getResourceConsumed( os.getpid() )
+    self.assertTrue( res['OK'] )
+    for key in ( 'CPU', 'Vsize', 'RSS', 'ReadBytes', 'WriteBytes' ):
+      self.assertTrue( key in res['Value'] )
+    # this process, sh and the two sleeps
+    self.assertEqual( res['Value']['Processes'], 4 )
+    self.assertTrue( res['Value']['RSS'] > 0 )
+
+  def test_fullScan( self ):
+    res = self.pm.getResourceConsumed( os.getpid() )
+    self.assertTrue( res['OK'] )
+    self.pm.childrenFileSupported = False
+    resScan = self.pm.getResourceConsumed( os.getpid() )
+    self.assertTrue( resScan['OK'] )
+    self.assertEqual( res['Value']['Processes'], resScan['Value']['Processes'] )
+
+  def test_orphans( self ):
+    # sh runs a shell leaving a sleep behind after one second
+    orphanMaker = subprocess.Popen( [ 'sh', '-c', 'sh -c "sleep 5 & sleep 1"; sleep 5' ], preexec_fn = os.setsid )
+    try:
+      time.sleep( 0.5 )
+      monitors = [ ProcessMonitor(), ProcessMonitor() ]
+      monitors[1].childrenFileSupported = False
+      for monitor in monitors:
+        self.assertTrue( monitor.getResourceConsumed( orphanMaker.pid )['OK'] )
+      time.sleep( 1.5 )
+      # The orphan seen before is still accounted for, with both ways of walking the tree
+      processes = [ monitor.getResourceConsumed( orphanMaker.pid )['Value']['Processes'] for monitor in monitors ]
+      self.assertEqual( processes[0], processes[1] )
+      # but not by monitors which never saw it in the tree
+      for childrenFileSupported in ( None, False ):
+        monitor = ProcessMonitor()
+        monitor.childrenFileSupported = childrenFileSupported
+        self.assertEqual( monitor.getResourceConsumed( orphanMaker.pid )['Value']['Processes'], processes[0] - 1 )
+    finally:
+      os.killpg( orphanMaker.pid, signal.SIGKILL )
+      orphanMaker.wait()
+
+  def test_unknownPID( self ):
+    res = self.pm.getResourceConsumed( 999999999 )
+    self.assertFalse( res['OK'] )
+
+  def test_CPUAndMemory( self ):
+    res = self.pm.getCPUConsumed( os.getpid() )
+    self.assertTrue( res['OK'] )
+    res = self.pm.getMemoryConsumed( os.getpid() )
+    self.assertTrue( res['OK'] )
+    self.assertEqual( sorted( res['Value'] ), [ 'RSS', 'Vsize' ] )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( ProcessMonitorTestCase )
+  testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
@@ -2,6 +2,8 @@
 
 __RCSID__ = "$Id$"
 
+import os
+
 from DIRAC                                                                     import gLogger, S_OK, S_ERROR
 from DIRAC.Core.Base.DB                                                        import DB
 from DIRAC.DataManagementSystem.DB.FileCatalogComponents.DirectoryMetadata     import DirectoryMetadata
@@ -59,6 +61,8 @@ class FileCatalogDB( DB ):
     self.validReplicaStatus = databaseConfig['ValidReplicaStatus']
     self.visibleFileStatus = databaseConfig['VisibleFileStatus']
     self.visibleReplicaStatus = databaseConfig['VisibleReplicaStatus']
+    # Log the new files and metadata changes for the consumers of getFileChanges
+    self.fileLog = databaseConfig['FileLog']
 
     try:
       # Obtain the plugins to be used for DB interaction
@@ -416,6 +420,12 @@ class FileCatalogDB( DB ):
       return res
     failed.update( res['Value']['Failed'] )
     successful = res['Value']['Successful']
+    if self.fileLog and successful:
+      res = self.fileManager._findFileIDs( successful.keys() )
+      if res['OK']:
+        res = self.__logChanges( fileIDs = res['Value']['Successful'].values() )
+      if not res['OK']:
+        gLogger.error( "Failed to log the new files", res['Message'] )
     return S_OK( {'Successful':successful, 'Failed':failed} )
 
   def setFileStatus( self, lfns, credDict ):
@@ -1052,12 +1062,27 @@ class FileCatalogDB( DB ):
       return result
     if not result['Value']['Successful']:
       return S_ERROR( 'Failed to determine the path type' )
-    if result['Value']['Successful'][path]:
+    isDirectory = result['Value']['Successful'][path]
+    if isDirectory:
       # This is a directory
-      return self.dmeta.setMetadata( path, metadataDict, credDict )
+      result = self.dmeta.setMetadata( path, metadataDict, credDict )
     else:
       # This is a file
-      return self.fmeta.setMetadata( path, metadataDict, credDict )
+      result = self.fmeta.setMetadata( path, metadataDict, credDict )
+    if not result['OK'] or not self.fileLog:
+      return result
+
+    if isDirectory:
+      res = self.dtree.findDir( path )
+      if res['OK']:
+        res = self.__logChanges( dirIDs = [res['Value']] )
+    else:
+      res = self.fileManager._findFileIDs( [path] )
+      if res['OK']:
+        res = self.__logChanges( fileIDs = res['Value']['Successful'].values() )
+    if not res['OK']:
+      gLogger.error( "Failed to log the metadata change", "%s: %s" % ( path, res['Message'] ) )
+    return result
 
   def setMetadataBulk( self, pathMetadataDict, credDict ):
     """  Add metadata for the given paths
@@ -1110,6 +1135,88 @@ class FileCatalogDB( DB ):
       # This is a file
       return self.fmeta.removeMetadata( path, metadata, credDict )
 
+  #######################################################################
+  #
+  #  Change log methods
+  #
+
+  def __logChanges( self, fileIDs = None, dirIDs = None ):
+    """ Append new files and metadata changes to the FC_FileLog table
+    """
+    values = [ "(%d,0,UTC_TIMESTAMP())" % int( fileID ) for fileID in ( fileIDs or [] ) ]
+    values += [ "(0,%d,UTC_TIMESTAMP())" % int( dirID ) for dirID in ( dirIDs or [] ) if dirID ]
+    if not values:
+      return S_OK()
+    req = "INSERT INTO FC_FileLog (FileID,DirID,LogTime) VALUES %s" % ','.join( values )
+    return self._update( req )
+
+  def getFileChanges( self, fromLogID, maxEntries, credDict ):
+    """ Get the files added or whose metadata were set, and the directories whose metadata were set,
+        after a given entry of the change log, with their metadata (including the inherited ones)
+
+    :param int fromLogID: last entry already consumed, 0 for the beginning of the log
+    :param int maxEntries: maximum number of entries returned, 0 to only get the last entry of the log
+    :return: S_OK( { 'LastLogID' : last entry returned, 'Files' : { lfn : metadata },
+                     'Directories' : { path : metadata } } )
+    """
+    if not self.fileLog:
+      return S_ERROR( "The change log of the catalog is not enabled" )
+
+    if not maxEntries:
+      result = self._query( "SELECT MAX(LogID) FROM FC_FileLog" )
+      if not result['OK']:
+        return result
+      return S_OK( { 'LastLogID' : long( result['Value'][0][0] or 0 ), 'Files' : {}, 'Directories' : {} } )
+
+    req = "SELECT LogID,FileID,DirID FROM FC_FileLog WHERE LogID>%d ORDER BY LogID LIMIT %d" % ( int( fromLogID ),
+                                                                                              int( maxEntries ) )
+    result = self._query( req )
+    if not result['OK']:
+      return result
+    lastLogID = long( fromLogID )
+    fileIDs = set()
+    dirIDs = set()
+    for logID, fileID, dirID in result['Value']:
+      lastLogID = long( logID )
+      if fileID:
+        fileIDs.add( fileID )
+      if dirID:
+        dirIDs.add( dirID )
+
+    # The metadata of a directory is the same for all the files in it
+    dirMetadata = {}
+    def getDirMetadata( path ):
+      if path not in dirMetadata:
+        res = self.dmeta.getDirectoryMetadata( path, credDict )
+        dirMetadata[path] = res['Value'] if res['OK'] else {}
+      return dirMetadata[path]
+
+    files = {}
+    lfns = {}
+    if fileIDs:
+      result = self.fileManager._getFileLFNs( list( fileIDs ) )
+      if not result['OK']:
+        return result
+      # The files may have been removed since
+      lfns = result['Value']['Successful']
+    if lfns:
+      result = self.fmeta._getFileUserMetadataByID( lfns.keys(), credDict )
+      if not result['OK']:
+        return result
+      fileMetadata = result['Value']
+      for fileID, lfn in lfns.iteritems():
+        files[lfn] = dict( getDirMetadata( os.path.dirname( lfn ) ) )
+        files[lfn].update( fileMetadata.get( fileID, {} ) )
+
+    directories = {}
+    for dirID in dirIDs:
+      result = self.dtree.getDirectoryPath( dirID )
+      # The directory may have been removed since
+      if result['OK']:
+        directories[result['Value']] = getDirMetadata( result['Value'] )
+
+    return S_OK( { 'LastLogID' : lastLogID, 'Files' : files, 'Directories' : directories } )
+
   #######################################################################
   #
   #  Catalog admin methods
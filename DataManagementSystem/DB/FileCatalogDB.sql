@@ -272,3 +272,13 @@ CREATE TABLE FC_FileAncestors (
   UNIQUE INDEX (FileID,AncestorID)
 ) ENGINE = INNODB;
 
+
+-- ------------------------------------------------------------------------------
+
+CREATE TABLE FC_FileLog (
+  LogID BIGINT AUTO_INCREMENT PRIMARY KEY,
+  FileID INT NOT NULL DEFAULT 0,
+  DirID INT NOT NULL DEFAULT 0,
+  LogTime DATETIME NOT NULL,
+  INDEX (LogTime)
+) ENGINE = INNODB;
@@ -329,6 +329,16 @@ CREATE TABLE FC_DatasetAnnotations (
 
 -- ------------------------------------------------------------------------------
 
+CREATE TABLE FC_FileLog (
+  LogID BIGINT AUTO_INCREMENT PRIMARY KEY,
+  FileID INT NOT NULL DEFAULT 0,
+  DirID INT NOT NULL DEFAULT 0,
+  LogTime DATETIME NOT NULL,
+  INDEX (LogTime)
+) ENGINE = INNODB;
+
+-- ------------------------------------------------------------------------------
+
 
 
 -- ps_find_dir : returns the dir id and the depth of a directory from its name
@@ -58,7 +58,8 @@ def initializeFileCatalogHandler( serviceInfo ):
                     'ValidFileStatus'     : ['AprioriGood','Trash','Removing','Probing'],
                     'ValidReplicaStatus'  : ['AprioriGood','Trash','Removing','Probing'],
                     'VisibleFileStatus'   : ['AprioriGood'],
-                    'VisibleReplicaStatus': ['AprioriGood']}
+                    'VisibleReplicaStatus': ['AprioriGood'],
+                    'FileLog'             : False }
   for configKey in sorted( defaultConfig.keys() ):
     defaultValue = defaultConfig[configKey]
     configValue = getServiceOption( serviceInfo, configKey, defaultValue )
@@ -499,6 +500,12 @@ class FileCatalogHandler( RequestHandler ):
     """
     return gFileCatalogDB.fmeta.findFilesByMetadata( metaDict, path, self.getRemoteCredentials() )
 
+  types_getFileChanges = [ [IntType, LongType], [IntType, LongType] ]
+  def export_getFileChanges( self, fromLogID, maxEntries ):
+    """ Get the files added or whose metadata were set after a given entry of the change log
+    """
+    return gFileCatalogDB.getFileChanges( fromLogID, maxEntries, self.getRemoteCredentials() )
+
   types_getReplicasByMetadata = [ DictType, StringTypes, BooleanType ]
   def export_getReplicasByMetadata( self, metaDict, path = '/', allStatus = False ):
     """ Find all the files satisfying the given metadata set
@@ -3,74 +3,68 @@
 
 __RCSID__ = "$Id$"
 
-import os.path
 import time
 import threading
 
-from DIRAC import S_OK, S_ERROR, gLogger
-from DIRAC.Core.Utilities.DictCache import DictCache
+from DIRAC import S_OK
 from DIRAC.Core.Utilities.Graphs import graph
+from DIRAC.Core.Utilities.Plotting.PlotFileCache import PlotFileCache
+from DIRAC.Core.Utilities.Plotting.SingleFlight import SingleFlight
 
 class PlotCache:
 
   def __init__( self, plotsLocation = False ):
     self.plotsLocation = plotsLocation
     self.alive = True
-    self.__graphCache = DictCache( deleteFunction = _deleteGraph )
     self.__graphLifeTime = 600
+    self.__graphCache = PlotFileCache( plotsLocation, lifeTime = self.__graphLifeTime )
+    self.__graphFlights = SingleFlight()
     self.purgeThread = threading.Thread( target = self.purgeExpired )
     self.purgeThread.start()
 
-  def setPlotsLocation( self, plotsDir ):
+  def setPlotsLocation( self, plotsDir, maxSize = None, shared = False ):
     self.plotsLocation = plotsDir
-    for plot in os.listdir( self.plotsLocation ):
-      if plot.find( ".png" ) > 0:
-        plotLocation = "%s/%s" % ( self.plotsLocation, plot )
-        gLogger.verbose( "Purging %s" % plotLocation )
-        os.unlink( plotLocation )
+    if maxSize:
+      self.__graphCache.maxSize = maxSize
+    self.__graphCache.setLocation( plotsDir, shared = shared )
 
   def purgeExpired( self ):
     while self.alive:
       time.sleep( self.__graphLifeTime )
-      self.__graphCache.purgeExpired()
+      self.__graphCache.purge()
 
   def getPlot( self, plotHash, plotData, plotMetadata, subplotMetadata ):
     """
     Get plot from the cache if exists, else generate it
     """
+    retVal = self.__graphFlights.do( plotHash, self.__generatePlot, plotHash, plotData, plotMetadata, subplotMetadata )
+    if not retVal[ 'OK' ]:
+      return retVal
+    return S_OK( dict( retVal[ 'Value' ] ) )
 
-    plotDict = self.__graphCache.get( plotHash )
-    if plotDict is None:
-      basePlotFileName = "%s/%s.png" % ( self.plotsLocation, plotHash )
-      if subplotMetadata:
-        retVal = graph( plotData, basePlotFileName, plotMetadata, metadata = subplotMetadata )
-      else:
-        retVal = graph( plotData, basePlotFileName, plotMetadata )
+  def __generatePlot( self, plotHash, plotData, plotMetadata, subplotMetadata ):
+    plotFile = "%s.png" % plotHash
+    if self.__graphCache.exists( plotFile ):
+      return S_OK( { 'plot' : plotFile } )
+
+    prefix = self.__graphCache.getTemporaryPrefix()
+    basePlotFileName = self.__graphCache.getPath( prefix + plotFile )
+    if subplotMetadata:
+      retVal = graph( plotData, basePlotFileName, plotMetadata, metadata = subplotMetadata )
+    else:
+      retVal = graph( plotData, basePlotFileName, plotMetadata )
+    if not retVal[ 'OK' ]:
+      self.__graphCache.discard( prefix, [ plotFile ] )
+      return retVal
+    plotDict = retVal[ 'Value' ]
+    if plotDict[ 'plot' ]:
+      plotDict[ 'plot' ] = plotFile
+      retVal = self.__graphCache.publish( prefix, [ plotFile ] )
       if not retVal[ 'OK' ]:
         return retVal
-      plotDict = retVal[ 'Value' ]
-      if plotDict[ 'plot' ]:
-        plotDict[ 'plot' ] = os.path.basename( basePlotFileName )
-      self.__graphCache.add( plotHash, self.__graphLifeTime, plotDict )
     return S_OK( plotDict )
 
   def getPlotData( self, plotFileName ):
-    filename = "%s/%s" % ( self.plotsLocation, plotFileName )
-    try:
-      fd = file( filename, "rb" )
-      data = fd.read()
-      fd.close()
-    except Exception, v:
-      return S_ERROR( "Can't open file %s: %s" % ( plotFileName, str( v ) ) )
-    return S_OK( data )
-
-def _deleteGraph( plotDict ):
-  try:
-    for key in plotDict:
-      value = plotDict[ key ]
-      if value and os.path.isfile( value ):
-        os.unlink( value )
-  except:
-    pass
+    return self.__graphCache.read( plotFileName )
 
 gPlotCache = PlotCache()
@@ -36,7 +36,9 @@ def initializePlottingHandler( serviceInfo ):
     gLogger.fatal( "Can't write to %s" % dataPath )
     return S_ERROR( "Data location is not writable" )
 
-  gPlotCache.setPlotsLocation( dataPath )
+  gPlotCache.setPlotsLocation( dataPath,
+                              maxSize = gConfig.getValue( "%s/MaxPlotsSize" % plottingSection, 1024 ) * 1024 * 1024,
+                              shared = gConfig.getValue( "%s/SharedDataLocation" % plottingSection, False ) )
   gMonitor.registerActivity( "plotsDrawn", "Drawn plot images", "Plotting requests", "plots", gMonitor.OP_SUM )
   return S_OK()
 
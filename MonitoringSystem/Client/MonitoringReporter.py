@@ -8,6 +8,8 @@ It provides two failover mechanism:
 2.) If a MQ is available, we store the messages in MQ service.
 
 Note: In order to not send too many rows to the db we use  __maxRecordsInABundle.
+The MonitoringDB only queues the records it is given, they are inserted to elasticsearch in the background,
+so that commit does not wait for the insertion.
 
 """
 
@@ -128,7 +130,9 @@ class MonitoringReporter( object ):
             else:
               return res  # in case of MQ problem
           else:
-            gLogger.warn( "Failed to insert the records: %s", retVal['Message'] )
+            # the records are kept in memory for the next commit
+            gLogger.warn( "Failed to insert the records:", retVal['Message'] )
+            break
     except Exception as e:  # pylint: disable=broad-except
       gLogger.exception( "Error committing", lException = e )
       return S_ERROR( "Error committing %s" % repr( e ).replace( ',)', ')' ) )
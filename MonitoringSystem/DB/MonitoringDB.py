@@ -1,24 +1,57 @@
 """
 It is a wrapper on top of Elasticsearch. It is used to manage the DIRAC monitoring types.
+
+The records are inserted in the background by a BulkIngester, unless the BulkIngest option
+of the database section is False. The BulkIngestBatchSize, BulkIngestFlushPeriod and
+BulkIngestMaxBacklog options of the section configure it.
+
+The results of the queries over buckets are cached for QueryCacheLifeTime seconds (0 disables the cache),
+and the values of the keys of each type for KeyValuesLifeTime seconds, all of them being looked for again
+every KeyValuesFullRefresh seconds.
 """
+import time
 import datetime
+import threading
 
-from DIRAC import S_OK, S_ERROR, gLogger
+from DIRAC import S_OK, S_ERROR, gLogger, gConfig
 from DIRAC.Core.Base.ElasticDB import ElasticDB
+from DIRAC.Core.Utilities.DictCache import DictCache
 from DIRAC.Core.Utilities.ElasticSearchDB import generateFullIndexName
 from DIRAC.ConfigurationSystem.Client.Helpers import CSGlobals
+from DIRAC.ConfigurationSystem.Client.PathFinder import getDatabaseSection
 
 from DIRAC.MonitoringSystem.private.TypeLoader import TypeLoader
+from DIRAC.MonitoringSystem.private.BulkIngester import BulkIngester
 
 __RCSID__ = "$Id$"
 
 ########################################################################
 class MonitoringDB( ElasticDB ):
 
+  # Maximum number of daily indexes named in a query, a wildcard is used beyond
+  __maxQueryIndexes = 40
+  # Seconds the values of the keys are looked for before their last update,
+  # as the records are inserted some time after their timestamp
+  __keyValuesMargin = 3600
+
   def __init__( self, name = 'Monitoring/MonitoringDB', readOnly = False ):
     super( MonitoringDB, self ).__init__( 'MonitoringDB', name, CSGlobals.getSetup().lower() )
     self.__readonly = readOnly
     self.__documents = {}
+    self.__bulkIngester = None
+    dbSection = getDatabaseSection( name )
+    if gConfig.getValue( "%s/BulkIngest" % dbSection, True ):
+      self.__bulkIngester = BulkIngester( self,
+                                          gConfig.getValue( "%s/BulkIngestBatchSize" % dbSection, 5000 ),
+                                          gConfig.getValue( "%s/BulkIngestFlushPeriod" % dbSection, 10 ),
+                                          gConfig.getValue( "%s/BulkIngestMaxBacklog" % dbSection, 500000 ) )
+    self.__queryCacheLifeTime = gConfig.getValue( "%s/QueryCacheLifeTime" % dbSection, 600 )
+    self.__queryCache = DictCache()
+    self.__keyValuesLifeTime = gConfig.getValue( "%s/KeyValuesLifeTime" % dbSection, 300 )
+    self.__keyValuesFullRefresh = gConfig.getValue( "%s/KeyValuesFullRefresh" % dbSection, 86400 )
+    # { type name : { 'Values' : { key : list of values }, 'Update' : time, 'FullUpdate' : time } }
+    self.__keyValues = {}
+    self.__keyValuesLock = threading.Lock()
     self.__loadIndexes()
 
   def __loadIndexes( self ):
@@ -91,14 +124,50 @@ class MonitoringDB( ElasticDB ):
 
   def getKeyValues( self, typeName ):
     """
-    Get all values for a given key field in a type
+    Get all values for a given key field in a type. The values are cached: once they are older than
+    KeyValuesLifeTime, only the values of the recent documents are looked for and added. All the values
+    of the last 30 days are looked for again every KeyValuesFullRefresh seconds.
     """
-    keyValuesDict = {}
+    now = time.time()
+    with self.__keyValuesLock:
+      cached = self.__keyValues.get( typeName )
+    if cached and now - cached['Update'] < self.__keyValuesLifeTime:
+      return S_OK( _copyResult( cached['Values'] ) )
 
     retVal = self.getIndexName( typeName )
     if not retVal['OK']:
       return retVal
-    indexName = "%s*" % ( retVal['Value'] )
+    indexPrefix = retVal['Value']
+
+    if cached and now - cached['FullUpdate'] < self.__keyValuesFullRefresh:
+      keys = cached['Values'].keys()
+      startTime = cached['Update'] - self.__keyValuesMargin
+      fullUpdate = cached['FullUpdate']
+    else:
+      retVal = self.__getKeys( typeName, indexPrefix )
+      if not retVal['OK']:
+        return retVal
+      keys = retVal['Value']
+      startTime = now - 30 * 86400
+      fullUpdate = now
+
+    retVal = self.getUniqueValues( self.__getIndexesForPeriod( indexPrefix, startTime ), keys, startTime )
+    if not retVal['OK']:
+      return retVal
+    keyValuesDict = retVal['Value']
+    if fullUpdate != now:
+      for key, values in cached['Values'].iteritems():
+        keyValuesDict[key] = sorted( set( keyValuesDict.get( key, [] ) ).union( values ) )
+
+    with self.__keyValuesLock:
+      self.__keyValues[typeName] = { 'Values' : keyValuesDict, 'Update' : now, 'FullUpdate' : fullUpdate }
+    return S_OK( _copyResult( keyValuesDict ) )
+
+  def __getKeys( self, typeName, indexPrefix ):
+    """
+    It returns the key fields of a type, from the mapping of its indexes.
+    """
+    indexName = "%s*" % ( indexPrefix )
     retVal = self.getDocTypes( indexName )
     if not retVal['OK']:
       return retVal
@@ -110,13 +179,55 @@ class MonitoringDB( ElasticDB ):
       #this is only happen when we the index is created and we were not able to send records to the index.
       #There is no data in the index we can not create the plot.
       return S_ERROR( "%s empty and can not retrive the Type of the index" % indexName )
-    for i in docs[typeName]['properties']:
-      if i not in monfields and not i.startswith( 'time' ):
-        retVal = self.getUniqueValue( indexName, i )
-        if not retVal['OK']:
-          return retVal
-        keyValuesDict[i] = retVal['Value']
-    return S_OK( keyValuesDict )
+    return S_OK( [ i for i in docs[typeName]['properties'] if i not in monfields and not i.startswith( 'time' ) ] )
+
+  def __getIndexesForPeriod( self, indexPrefix, startTime ):
+    """
+    It returns the indexes which can contain documents more recent than startTime. A document goes to
+    the index of the day it is inserted, so that the indexes of the days before startTime are left aside.
+
+    :param str indexPrefix: the index prefix of a type
+    :param int startTime: epoch time
+    :return: comma separated list of index names, or a wildcard if there are too many of them
+    """
+    # one day of margin, for the time zones and the clocks of the hosts inserting the records
+    lastDay = datetime.date.today() + datetime.timedelta( days = 1 )
+    firstDay = min( datetime.date.fromtimestamp( startTime ) - datetime.timedelta( days = 1 ), lastDay )
+    nbDays = ( lastDay - firstDay ).days + 1
+    if nbDays > self.__maxQueryIndexes:
+      return "%s*" % indexPrefix
+    return ",".join( generateFullIndexName( indexPrefix, firstDay + datetime.timedelta( days = day ) )
+                     for day in xrange( nbDays ) )
+
+  def __cachedQuery( self, queryFunction, typeName, startTime, endTime, interval, selectFields, condDict, grouping,
+                     metainfo ):
+    """
+    It runs a query over buckets, with its time range extended to whole buckets, so that the result can be cached
+    for the requests made while the buckets stay the same. The result is kept QueryCacheLifeTime seconds once all
+    its buckets are over, and one minute at most otherwise.
+    """
+    intervalSeconds = _getIntervalSeconds( interval )
+    if intervalSeconds:
+      startTime -= startTime % intervalSeconds
+      endTime += intervalSeconds - 1 - endTime % intervalSeconds
+    if not self.__queryCacheLifeTime or not intervalSeconds:
+      return queryFunction( typeName, startTime, endTime, interval, selectFields, condDict, grouping, metainfo )
+
+    cacheKey = ( queryFunction, typeName, startTime, endTime, interval, tuple( selectFields ),
+                 tuple( sorted( ( cond, tuple( values ) ) for cond, values in condDict.iteritems() ) ), grouping,
+                 repr( sorted( metainfo.items() ) ) if metainfo else '' )
+    result = self.__queryCache.get( cacheKey )
+    if result is None:
+      retVal = queryFunction( typeName, startTime, endTime, interval, selectFields, condDict, grouping, metainfo )
+      if not retVal['OK']:
+        return retVal
+      result = retVal['Value']
+      lifeTime = self.__queryCacheLifeTime
+      if endTime >= time.time():
+        lifeTime = min( lifeTime, 60 )
+      self.__queryCache.purgeExpired()
+      self.__queryCache.add( cacheKey, lifeTime, result )
+    return S_OK( _copyResult( result ) )
 
   def retrieveBucketedData( self, typeName, startTime, endTime, interval, selectFields, condDict, grouping, metainfo ):
     """
@@ -131,6 +242,13 @@ class MonitoringDB( ElasticDB ):
                    * value -> list of possible values
 
     """
+    return self.__cachedQuery( self.__retrieveBucketedData, typeName, startTime, endTime, interval, selectFields,
+                               condDict, grouping, metainfo )
+
+  def __retrieveBucketedData( self, typeName, startTime, endTime, interval, selectFields, condDict, grouping, metainfo ):
+    """
+    It queries the data of retrieveBucketedData
+    """
 
     retVal = self.getIndexName( typeName )
     if not retVal['OK']:
@@ -140,7 +258,7 @@ class MonitoringDB( ElasticDB ):
     if metainfo and metainfo.get( 'metric', 'sum' ) == 'avg':
       isAvgAgg = True
 
-    indexName = "%s*" % ( retVal['Value'] )
+    indexName = self.__getIndexesForPeriod( retVal['Value'], startTime )
     q = [self._Q( 'range',
                   timestamp = {'lte':endTime * 1000,
                                'gte': startTime * 1000} )]
@@ -171,7 +289,7 @@ class MonitoringDB( ElasticDB ):
                    buckets_path = 'end_data>avg_monthly_sales',
                    gap_policy = 'insert_zeros' )
 
-    s = self._Search( indexName )
+    s = self._Search( indexName ).params( ignore_unavailable = True )
     s = s.filter( 'bool', must = q )
     s.aggs.bucket( '2', a1 )
     #s.fields( ['timestamp'] + selectFields )
@@ -181,6 +299,9 @@ class MonitoringDB( ElasticDB ):
     gLogger.debug( "Query result", len( retVal ) )
 
     result = {}
+    if '2' not in retVal.aggregations:
+      # none of the indexes exist
+      return S_OK( result )
     for i in retVal.aggregations['2'].buckets:
       if isAvgAgg:
         result[i.key] = i.avg_total_jobs.value
@@ -229,6 +350,14 @@ class MonitoringDB( ElasticDB ):
                    * value -> list of possible values
 
     """
+    return self.__cachedQuery( self.__retrieveAggregatedData, typeName, startTime, endTime, interval, selectFields,
+                               condDict, grouping, metainfo )
+
+  def __retrieveAggregatedData( self, typeName, startTime, endTime, interval, selectFields, condDict, grouping,
+                                metainfo ):
+    """
+    It queries the data of retrieveAggregatedData
+    """
 #    {'query': {'bool': {'filter': [{'bool': {'must': [{'range': {'timestamp': {'gte': 1474271462000, 'lte': 1474357862000}}}]}}]}}, 'aggs': {'end_data': {'date_histogram': {'field': 'timestamp', 'interval': '30m'}, 'aggs': {'tt': {'terms': {'field': 'component', 'size': 10000}, 'aggs': {'m1': {'avg': {'
 #    field': 'threads'}}}}}}}}
 #
@@ -249,7 +378,7 @@ class MonitoringDB( ElasticDB ):
     # default is average
     aggregator = metainfo.get( 'metric', 'avg' )
 
-    indexName = "%s*" % ( retVal['Value'] )
+    indexName = self.__getIndexesForPeriod( retVal['Value'], startTime )
     q = [self._Q( 'range',
                   timestamp = {'lte':endTime * 1000,
                                'gte': startTime * 1000} )]
@@ -266,7 +395,7 @@ class MonitoringDB( ElasticDB ):
     a1 = self._A( 'terms', field = grouping, size = self.RESULT_SIZE )
     a1.metric( 'm1', aggregator, field = selectFields[0] )
 
-    s = self._Search( indexName )
+    s = self._Search( indexName ).params( ignore_unavailable = True )
     s = s.filter( 'bool', must = q )
     s.aggs.bucket( 'end_data',
                    'date_histogram',
@@ -280,6 +409,9 @@ class MonitoringDB( ElasticDB ):
     retVal = s.execute()
 
     result = {}
+    if 'end_data' not in retVal.aggregations:
+      # none of the indexes exist
+      return S_OK( result )
     for bucket in retVal.aggregations['end_data'].buckets:
       # each bucket key is a time (unix epoch and usual datetime
       bucketTime = bucket.key / 1000
@@ -307,7 +439,7 @@ class MonitoringDB( ElasticDB ):
 
   def put( self, records, monitoringType ):
     """
-    It is used to insert the data to El.
+    It is used to insert the data to El. The records are only queued if they are inserted in the background.
 
     :param records: it is a list of documents (dictionary)
     :param str monitoringType: is the type of the monitoring
@@ -319,8 +451,29 @@ class MonitoringDB( ElasticDB ):
     if not res['OK']:
       return res
     indexName = res['Value']
+    if self.__bulkIngester:
+      return self.__bulkIngester.add( indexName, monitoringType, records, mapping )
     return self.bulk_index( indexName, monitoringType, records, mapping )
 
+  def flush( self, timeout = 60 ):
+    """
+    It waits for the records queued by put to be inserted.
+
+    :param int timeout: maximum number of seconds to wait for
+    """
+    if self.__bulkIngester:
+      return self.__bulkIngester.flush( timeout )
+    return S_OK()
+
+  def getIngestStats( self ):
+    """
+    It returns the gauges of the background insertion of the records: 'Backlog', 'Throughput', and the
+    number of records 'Indexed', 'Retried', 'Errors' and 'Refused'. See BulkIngester.getStats
+    """
+    if not self.__bulkIngester:
+      return S_ERROR( "The records are not inserted in the background" )
+    return S_OK( self.__bulkIngester.getStats() )
+
   def __getMapping( self, monitoringType ):
     """
     It returns the mapping of a certain monitoring type
@@ -468,3 +621,27 @@ class MonitoringDB( ElasticDB ):
 
 
     return self.__getRawData( typeName, condDict )
+
+def _getIntervalSeconds( interval ):
+  """
+  It returns the number of seconds of an Elasticsearch interval, for example '30m', None if the interval
+  is not a fixed number of seconds.
+  """
+  units = { 's' : 1, 'm' : 60, 'h' : 3600, 'd' : 86400, 'w' : 604800 }
+  try:
+    return int( interval[:-1] ) * units[interval[-1]]
+  except ( KeyError, ValueError, IndexError, TypeError ):
+    return None
+
+def _copyResult( result ):
+  """
+  It returns a copy of a cached result, the callers modifying the dictionaries of the values.
+  """
+  copied = {}
+  for key, value in result.iteritems():
+    if isinstance( value, dict ):
+      value = dict( value )
+    elif isinstance( value, list ):
+      value = list( value )
+    copied[key] = value
+  return copied
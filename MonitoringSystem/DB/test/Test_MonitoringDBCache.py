@@ -0,0 +1,75 @@
+""" Unit tests for the caches of the MonitoringDB queries
+"""
+
+__RCSID__ = "$Id$"
+
+import time
+import unittest
+
+from mock import MagicMock, patch
+
+from DIRAC import S_OK
+import DIRAC.MonitoringSystem.DB.MonitoringDB as moduleTested
+
+class MonitoringDBCacheTestCase( unittest.TestCase ):
+  """ Test the caches of the MonitoringDB, without Elasticsearch
+  """
+
+  def setUp( self ):
+    with patch( 'DIRAC.Core.Base.ElasticDB.ElasticDB.__init__', MagicMock( return_value = None ) ), \
+         patch( 'DIRAC.MonitoringSystem.DB.MonitoringDB.getDatabaseSection',
+                MagicMock( return_value = '/Systems/Monitoring/Test/Databases/MonitoringDB' ) ), \
+         patch( 'DIRAC.MonitoringSystem.DB.MonitoringDB.TypeLoader' ) as typeLoader:
+      typeLoader.return_value.getTypes.return_value = {}
+      self.db = moduleTested.MonitoringDB()
+    self.db.getIndexName = MagicMock( return_value = S_OK( 'test_wmshistory-index' ) )
+
+  def test_intervalSeconds( self ):
+    self.assertEqual( moduleTested._getIntervalSeconds( '30m' ), 1800 )
+    self.assertEqual( moduleTested._getIntervalSeconds( '2w' ), 2 * 604800 )
+    self.assertEqual( moduleTested._getIntervalSeconds( '1M' ), None )
+
+  def test_bucketedData( self ):
+    query = MagicMock( return_value = S_OK( { 'CERN' : { 1500001200 : 4.0 } } ) )
+    self.db._MonitoringDB__retrieveBucketedData = query
+    result = self.db.retrieveBucketedData( 'WMSHistory', 1500000100, 1500003500, '30m', [ 'Jobs' ],
+                                           { 'Site' : [ 'CERN' ] }, 'Site', {} )
+    self.assertEqual( result['Value'], { 'CERN' : { 1500001200 : 4.0 } } )
+    # The time range is extended to whole buckets
+    self.assertEqual( query.call_args[0][1:3], ( 1499999400, 1500004799 ) )
+    # The cached result is not modified by the callers
+    result['Value']['CERN'][1500001200] = 0.
+    # Same buckets
+    result = self.db.retrieveBucketedData( 'WMSHistory', 1500000500, 1500004000, '30m', [ 'Jobs' ],
+                                           { 'Site' : [ 'CERN' ] }, 'Site', {} )
+    self.assertEqual( result['Value'], { 'CERN' : { 1500001200 : 4.0 } } )
+    self.assertEqual( query.call_count, 1 )
+    # Other conditions
+    self.db.retrieveBucketedData( 'WMSHistory', 1500000000, 1500002000, '30m', [ 'Jobs' ],
+                                  { 'Site' : [ 'PIC' ] }, 'Site', {} )
+    self.assertEqual( query.call_count, 2 )
+
+  def test_keyValues( self ):
+    self.db._MonitoringDB__keyValuesLifeTime = 0.2
+    self.db._MonitoringDB__documents = { 'WMSHistory' : { 'monitoringFields' : [ 'Jobs' ] } }
+    properties = { 'Site' : {}, 'User' : {}, 'Jobs' : {}, 'timestamp' : {} }
+    self.db.getDocTypes = MagicMock( return_value = S_OK( { 'WMSHistory' : { 'properties' : properties } } ) )
+    self.db.getUniqueValues = MagicMock( side_effect = [ S_OK( { 'Site' : [ 'CERN' ], 'User' : [ 'user1' ] } ),
+                                                         S_OK( { 'Site' : [ 'PIC' ], 'User' : [] } ) ] )
+    expected = { 'Site' : [ 'CERN' ], 'User' : [ 'user1' ] }
+    self.assertEqual( self.db.getKeyValues( 'WMSHistory' )['Value'], expected )
+    self.assertEqual( self.db.getKeyValues( 'WMSHistory' )['Value'], expected )
+    self.assertEqual( self.db.getUniqueValues.call_count, 1 )
+    self.assertTrue( self.db.getUniqueValues.call_args[0][2] < time.time() - 29 * 86400 )
+
+    time.sleep( 0.3 )
+    # Only the values of the recent records are looked for
+    self.assertEqual( self.db.getKeyValues( 'WMSHistory' )['Value'], { 'Site' : [ 'CERN', 'PIC' ],
+                                                                       'User' : [ 'user1' ] } )
+    self.assertEqual( self.db.getUniqueValues.call_count, 2 )
+    self.assertTrue( self.db.getUniqueValues.call_args[0][2] > time.time() - 86400 )
+    self.assertEqual( self.db.getDocTypes.call_count, 1 )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( MonitoringDBCacheTestCase )
+  testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
@@ -13,6 +13,8 @@ from DIRAC.Core.Utilities.Plotting import gDataCache
 from DIRAC.Core.Utilities.Plotting.FileCoding import extractRequestFromFileId
 from DIRAC.Core.Utilities.Plotting.Plots import generateErrorMessagePlot
 from DIRAC.Core.Utilities.File import mkDir
+from DIRAC.Core.Utilities.ThreadScheduler import gThreadScheduler
+from DIRAC.FrameworkSystem.Client.MonitoringClient import gMonitor
 
 from DIRAC.MonitoringSystem.DB.MonitoringDB import MonitoringDB
 from DIRAC.MonitoringSystem.private.MainReporter import MainReporter
@@ -55,8 +57,25 @@ class MonitoringHandler( RequestHandler ):
       return S_ERROR( "Data location is not writable: %s" % repr( err ) )
     gDataCache.setGraphsLocation( dataPath )
 
+    if cls.__db.getIngestStats()['OK']:
+      gMonitor.registerActivity( "ingestBacklog", "Monitoring records waiting to be inserted",
+                                 "Monitoring", "Records", gMonitor.OP_MEAN )
+      gMonitor.registerActivity( "ingestThroughput", "Monitoring records inserted",
+                                 "Monitoring", "Records/s", gMonitor.OP_MEAN )
+      gThreadScheduler.addPeriodicTask( 60, cls.__reportIngestStats )
+
     return S_OK()
 
+  @classmethod
+  def __reportIngestStats( cls ):
+    """
+    It reports the gauges of the background insertion of the records
+    """
+    result = cls.__db.getIngestStats()
+    if result['OK']:
+      gMonitor.addMark( "ingestBacklog", result['Value']['Backlog'] )
+      gMonitor.addMark( "ingestThroughput", result['Value']['Throughput'] )
+
 
   types_listUniqueKeyValues = [ basestring ]
   def export_listUniqueKeyValues( self, typeName ):
@@ -343,3 +362,12 @@ class MonitoringHandler( RequestHandler ):
     """
     
     return self.__db.put( recordsToInsert, monitoringType )
+
+  types_getIngestStats = []
+  def export_getIngestStats( self ):
+    """
+    It returns the gauges of the background insertion of the records to the db: the 'Backlog' of records
+    waiting to be inserted, the 'Throughput' in records per second, and the number of records 'Indexed',
+    'Retried', rejected by the db ('Errors') or refused because the backlog was full ('Refused').
+    """
+    return self.__db.getIngestStats()
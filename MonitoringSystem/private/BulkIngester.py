@@ -0,0 +1,239 @@
+"""
+Background insertion of the monitoring records to Elasticsearch.
+
+The records given to the MonitoringDB are queued here, per monitoring type, and a thread streams
+them to their index when BatchSize records are waiting, or every FlushPeriod seconds. The records
+which could not be inserted because the cluster is overloaded are queued again, as long as the
+backlog does not exceed MaxBacklog records. The records still queued are flushed at exit, or when
+the BulkIngester is closed.
+"""
+
+import time
+import atexit
+import threading
+import collections
+
+from DIRAC import S_OK, S_ERROR, gLogger
+
+__RCSID__ = "$Id$"
+
+class BulkIngester( object ):
+
+  """
+  .. class:: BulkIngester
+
+  :param object __db: the ElasticSearchDB the records are inserted to
+  :param __queues: { monitoring type : { 'indexName', 'mapping', 'records' } }
+  :type __queues: python:dict
+  :param int __backlog: number of records queued
+  """
+
+  def __init__( self, db, batchSize = 5000, flushPeriod = 10, maxBacklog = 500000 ):
+    """ c'tor
+
+    :param object db: the ElasticSearchDB the records are inserted to
+    :param int batchSize: number of queued records triggering an insertion
+    :param int flushPeriod: maximum number of seconds a record is queued for, if the db is available
+    :param int maxBacklog: maximum number of records queued, the records given beyond are refused
+    """
+    self.log = gLogger.getSubLogger( 'BulkIngester' )
+    self.batchSize = batchSize
+    self.flushPeriod = flushPeriod
+    self.maxBacklog = maxBacklog
+    self.__db = db
+    self.__queues = collections.OrderedDict()
+    self.__backlog = 0
+    self.__inFlight = 0
+    self.__flushRequested = False
+    self.__stopped = False
+    self.__condition = threading.Condition()
+    self.__thread = None
+    # counters of records since the start
+    self.__stats = { 'Indexed' : 0, 'Retried' : 0, 'Errors' : 0, 'Refused' : 0 }
+    # ( time, records indexed ) of the last minute
+    self.__history = collections.deque()
+    atexit.register( self.close )
+
+  def add( self, indexName, monitoringType, records, mapping = None ):
+    """
+    It queues records to be inserted to the db.
+
+    :param str indexName: the index prefix of the monitoring type
+    :param str monitoringType: the monitoring type, used as doc_type
+    :param records: contains a list of dictionary
+    :type records: python:list
+    :param dict mapping: the mapping used to create the index
+    :return: S_OK( number of records queued ), S_ERROR if the backlog is full or the BulkIngester stopped
+    """
+    with self.__condition:
+      if self.__stopped:
+        self.__stats['Refused'] += len( records )
+        return S_ERROR( "Monitoring records not queued: the insertion is stopped" )
+      if self.__backlog + len( records ) > self.maxBacklog:
+        self.__stats['Refused'] += len( records )
+        return S_ERROR( "Too many monitoring records waiting to be inserted (%d)" % self.__backlog )
+      queue = self.__queues.setdefault( monitoringType, { 'records' : [] } )
+      queue['indexName'] = indexName
+      queue['mapping'] = mapping
+      queue['records'].extend( records )
+      self.__backlog += len( records )
+      if self.__thread is None:
+        self.__thread = threading.Thread( target = self.__run, name = 'BulkIngester' )
+        self.__thread.setDaemon( True )
+        self.__thread.start()
+      elif self.__backlog >= self.batchSize:
+        self.__condition.notify_all()
+    return S_OK( len( records ) )
+
+  def flush( self, timeout = 60 ):
+    """
+    It inserts the queued records now and waits for them to be inserted.
+
+    :param int timeout: maximum number of seconds to wait for
+    """
+    deadline = time.time() + timeout
+    with self.__condition:
+      if self.__thread is None:
+        return S_OK()
+      if self.__stopped:
+        if self.__backlog:
+          return S_ERROR( "%d monitoring records not inserted: the insertion is stopped" % self.__backlog )
+        return S_OK()
+      self.__flushRequested = True
+      self.__condition.notify_all()
+      while self.__backlog or self.__inFlight:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+          return S_ERROR( "%d monitoring records still waiting to be inserted" % ( self.__backlog + self.__inFlight ) )
+        self.__condition.wait( remaining )
+    return S_OK()
+
+  def stop( self, timeout = 60 ):
+    """
+    It stops the thread once the records being inserted are, the records queued are kept.
+
+    :param int timeout: maximum number of seconds to wait for the thread
+    """
+    with self.__condition:
+      self.__stopped = True
+      self.__condition.notify_all()
+      thread = self.__thread
+    if thread is not None and thread is not threading.current_thread():
+      thread.join( timeout )
+
+  def close( self, timeout = None ):
+    """
+    It inserts the queued records and stops the thread, called at exit.
+
+    :param int timeout: maximum number of seconds to wait for the insertion, 3 flush periods by default
+    """
+    if timeout is None:
+      timeout = 3 * self.flushPeriod
+    result = self.flush( timeout )
+    self.stop()
+    return result
+
+  def getStats( self ):
+    """
+    It returns the gauges of the ingestion.
+
+    :return: dict with the 'Backlog' (records queued or being inserted), the 'Throughput' (records inserted per second
+             over the last minute), and the number of records 'Indexed', 'Retried' (queued again), rejected by the db
+             ('Errors') and refused because the backlog was full ('Refused') since the start
+    """
+    with self.__condition:
+      stats = dict( self.__stats )
+      stats['Backlog'] = self.__backlog + self.__inFlight
+      stats['Throughput'] = self.__getThroughput()
+    return stats
+
+  def __getThroughput( self ):
+    """
+    Records inserted per second over the last minute
+    """
+    now = time.time()
+    while self.__history and self.__history[0][0] < now - 60:
+      self.__history.popleft()
+    return sum( indexed for _insertionTime, indexed in self.__history ) / 60.
+
+  def __run( self ):
+    """
+    Thread inserting the records when a batch is ready, or every flushPeriod seconds
+    """
+    # after a failure, the next insertion waits for the end of the period, whatever the backlog
+    failing = False
+    while True:
+      with self.__condition:
+        deadline = time.time() + self.flushPeriod
+        while ( failing or self.__backlog < self.batchSize ) and not self.__flushRequested and not self.__stopped:
+          remaining = deadline - time.time()
+          if remaining <= 0:
+            break
+          self.__condition.wait( remaining )
+        if self.__stopped:
+          return
+        self.__flushRequested = False
+        queues = self.__queues
+        self.__queues = collections.OrderedDict()
+        self.__inFlight = self.__backlog
+        self.__backlog = 0
+
+      failing = False
+      for monitoringType, queue in queues.iteritems():
+        try:
+          if not self.__insert( monitoringType, queue ):
+            failing = True
+        except Exception as e:  # pylint: disable=broad-except
+          self.log.exception( "Error inserting %s records" % monitoringType, lException = e )
+          self.__requeue( monitoringType, queue, queue['records'] )
+          failing = True
+
+      with self.__condition:
+        self.__inFlight = 0
+        self.__condition.notify_all()
+
+  def __insert( self, monitoringType, queue ):
+    """
+    It streams the records of a monitoring type to the index of the current period.
+
+    :return: False if some records have been queued again
+    """
+    records = queue['records']
+    start = time.time()
+    retVal = self.__db.getFullIndexName( queue['indexName'], queue['mapping'] )
+    if retVal['OK']:
+      retVal = self.__db.bulkIndexRecords( retVal['Value'], monitoringType, records )
+    if not retVal['OK']:
+      self.log.error( "Failed to insert %s records" % monitoringType, retVal['Message'] )
+      self.__requeue( monitoringType, queue, records )
+      return False
+
+    result = retVal['Value']
+    self.log.verbose( "%s records inserted" % monitoringType,
+                      "%d in %.2f s" % ( result['Indexed'], time.time() - start ) )
+    with self.__condition:
+      self.__stats['Indexed'] += result['Indexed']
+      self.__stats['Errors'] += result['Errors']
+      self.__inFlight -= result['Indexed'] + result['Errors']
+      self.__history.append( ( time.time(), result['Indexed'] ) )
+    if result['Failed']:
+      self.__requeue( monitoringType, queue, result['Failed'] )
+      return False
+    return True
+
+  def __requeue( self, monitoringType, queue, records ):
+    """
+    It queues again records which could not be inserted, before the records queued since.
+    """
+    with self.__condition:
+      self.__inFlight -= len( records )
+      pending = self.__queues.setdefault( monitoringType, { 'indexName' : queue['indexName'],
+                                                            'mapping' : queue['mapping'],
+                                                            'records' : [] } )
+      kept = max( 0, min( len( records ), self.maxBacklog - self.__backlog ) )
+      if kept < len( records ):
+        self.log.error( "Monitoring backlog full, dropping %s records" % monitoringType, len( records ) - kept )
+        self.__stats['Refused'] += len( records ) - kept
+      pending['records'][:0] = records[:kept]
+      self.__backlog += kept
+      self.__stats['Retried'] += kept
@@ -0,0 +1,123 @@
+""" Unit tests for the background insertion of the monitoring records
+"""
+
+__RCSID__ = "$Id$"
+
+import threading
+import unittest
+
+from DIRAC import S_OK, S_ERROR
+from DIRAC.MonitoringSystem.private.BulkIngester import BulkIngester
+
+class FakeElasticSearchDB( object ):
+  """ Records the bulk insertions, rejecting the records of the first calls if asked to
+  """
+
+  def __init__( self, rejections = 0 ):
+    self.rejections = rejections
+    self.bulks = []
+    self.records = []
+    self.lock = threading.Lock()
+
+  def getFullIndexName( self, indexPrefix, _mapping = None ):
+    return S_OK( "%s-2017-01-01" % indexPrefix )
+
+  def bulkIndexRecords( self, indexName, doc_type, records ):
+    with self.lock:
+      self.bulks.append( ( indexName, doc_type, len( records ) ) )
+      if self.rejections:
+        self.rejections -= 1
+        return S_OK( { 'Indexed' : 1, 'Failed' : records[1:], 'Errors' : 0 } )
+      self.records.extend( records )
+      return S_OK( { 'Indexed' : len( records ), 'Failed' : [], 'Errors' : 0 } )
+
+class BulkIngesterTestCase( unittest.TestCase ):
+  """ Test the BulkIngester
+  """
+
+  def setUp( self ):
+    self.records = [ { 'timestamp' : 1500000000 + i, 'Jobs' : i } for i in range( 10 ) ]
+    self.ingesters = []
+
+  def tearDown( self ):
+    for ingester in self.ingesters:
+      ingester.stop()
+
+  def getIngester( self, db, **kwargs ):
+    ingester = BulkIngester( db, **kwargs )
+    self.ingesters.append( ingester )
+    return ingester
+
+  def test_batchSize( self ):
+    db = FakeElasticSearchDB()
+    ingester = self.getIngester( db, batchSize = 10, flushPeriod = 60 )
+    self.assertEqual( ingester.add( 'test_wmshistory', 'WMSHistory', self.records[:5] )['Value'], 5 )
+    self.assertEqual( ingester.getStats()['Backlog'], 5 )
+    ingester.add( 'test_wmshistory', 'WMSHistory', self.records[5:] )
+    self.assertTrue( ingester.flush( 5 )['OK'] )
+    self.assertEqual( db.records, self.records )
+    self.assertEqual( db.bulks, [ ( 'test_wmshistory-2017-01-01', 'WMSHistory', 10 ) ] )
+    stats = ingester.getStats()
+    self.assertEqual( stats['Backlog'], 0 )
+    self.assertEqual( stats['Indexed'], 10 )
+    self.assertTrue( stats['Throughput'] > 0 )
+
+  def test_flushPeriod( self ):
+    db = FakeElasticSearchDB()
+    ingester = self.getIngester( db, batchSize = 1000, flushPeriod = 0.2 )
+    ingester.add( 'test_wmshistory', 'WMSHistory', self.records[:2] )
+    ingester.add( 'test_componentmonitoring', 'ComponentMonitoring', self.records[2:] )
+    self.assertTrue( ingester.flush( 5 )['OK'] )
+    self.assertEqual( sorted( db.bulks ), [ ( 'test_componentmonitoring-2017-01-01', 'ComponentMonitoring', 8 ),
+                                            ( 'test_wmshistory-2017-01-01', 'WMSHistory', 2 ) ] )
+
+  def test_retry( self ):
+    db = FakeElasticSearchDB( rejections = 2 )
+    ingester = self.getIngester( db, batchSize = 1000, flushPeriod = 0.1 )
+    ingester.add( 'test_wmshistory', 'WMSHistory', self.records )
+    self.assertTrue( ingester.flush( 5 )['OK'] )
+    self.assertEqual( [ nbRecords for _index, _type, nbRecords in db.bulks ], [ 10, 9, 8 ] )
+    # The records rejected are sent again first
+    self.assertEqual( db.records, self.records[2:] )
+    stats = ingester.getStats()
+    self.assertEqual( stats['Indexed'], 10 )
+    self.assertEqual( stats['Retried'], 17 )
+
+  def test_backlog( self ):
+    db = FakeElasticSearchDB()
+    db.getFullIndexName = lambda indexPrefix, mapping = None: S_ERROR( "Not available" )
+    ingester = self.getIngester( db, batchSize = 1000, flushPeriod = 0.1, maxBacklog = 15 )
+    self.assertTrue( ingester.add( 'test_wmshistory', 'WMSHistory', self.records )['OK'] )
+    self.assertFalse( ingester.add( 'test_wmshistory', 'WMSHistory', self.records )['OK'] )
+    self.assertFalse( ingester.flush( 0.5 )['OK'] )
+    stats = ingester.getStats()
+    self.assertEqual( stats['Backlog'], 10 )
+    self.assertEqual( stats['Refused'], 10 )
+    self.assertEqual( stats['Indexed'], 0 )
+
+  def test_stop( self ):
+    db = FakeElasticSearchDB()
+    ingester = self.getIngester( db, batchSize = 1000, flushPeriod = 60 )
+    ingester.add( 'test_wmshistory', 'WMSHistory', self.records[:5] )
+    thread = [ t for t in threading.enumerate() if t.name == 'BulkIngester' ][-1]
+    # The queued records are inserted before the thread stops
+    self.assertTrue( ingester.close( 5 )['OK'] )
+    self.assertFalse( thread.is_alive() )
+    self.assertEqual( db.records, self.records[:5] )
+    # Nothing is queued after
+    self.assertFalse( ingester.add( 'test_wmshistory', 'WMSHistory', self.records[5:] )['OK'] )
+    self.assertTrue( ingester.close()['OK'] )
+    self.assertEqual( ingester.getStats()['Refused'], 5 )
+
+  def test_stopWithBacklog( self ):
+    db = FakeElasticSearchDB()
+    db.getFullIndexName = lambda indexPrefix, mapping = None: S_ERROR( "Not available" )
+    ingester = self.getIngester( db, batchSize = 1000, flushPeriod = 0.1 )
+    ingester.add( 'test_wmshistory', 'WMSHistory', self.records )
+    ingester.stop( 5 )
+    self.assertFalse( ingester.flush( 5 )['OK'] )
+    self.assertEqual( ingester.getStats()['Backlog'], 10 )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( BulkIngesterTestCase )
+  testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
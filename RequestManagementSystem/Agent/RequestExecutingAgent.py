@@ -34,6 +34,7 @@ from DIRAC.ConfigurationSystem.Client import PathFinder
 from DIRAC.Core.Utilities.ProcessPool import ProcessPool
 from DIRAC.RequestManagementSystem.Client.ReqClient import ReqClient
 from DIRAC.RequestManagementSystem.private.RequestTask import RequestTask
+from DIRAC.RequestManagementSystem.private.RequestBatchTask import RequestBatchTask
 
 from DIRAC.Core.Utilities.DErrno import cmpError
 import errno
@@ -85,6 +86,8 @@ class RequestExecutingAgent( AgentModule ):
   __requestClient = None
   # # Size of the bulk if use of getRequests. If 0, use getRequest
   __bulkRequest = 0
+  # # RequestIDs of the requests executed by each RequestBatchTask
+  __batchTasks = {}
 
   def __init__( self, *args, **kwargs ):
     """ c'tor """
@@ -120,6 +123,8 @@ class RequestExecutingAgent( AgentModule ):
 
 
     self.timeOuts = dict()
+    # # max number of requests whose waiting operations are executed together
+    self.batchSizes = dict()
 
     # # handlers dict
     self.handlersDict = dict()
@@ -140,12 +145,21 @@ class RequestExecutingAgent( AgentModule ):
 
       self.handlersDict[opHandler] = opLocation
 
+      # # FTS transfers are scheduled per operation, they cannot be batched
+      batchSize = gConfig.getValue( "%s/%s/BatchSize" % ( opHandlersPath, opHandler ), 1 )
+      if batchSize > 1 and gConfig.getValue( "%s/%s/FTSMode" % ( opHandlersPath, opHandler ), False ):
+        self.log.warn( "%s operations cannot be batched in FTS mode" % opHandler )
+        batchSize = 1
+      self.batchSizes[opHandler] = batchSize
+
     self.log.info( "Operation handlers:" )
     for item in enumerate ( self.handlersDict.items() ):
       opHandler = item[1][0]
-      self.log.info( "[%s] %s: %s (timeout: %d s + %d s per file)" % ( item[0], item[1][0], item[1][1],
-                                                                   self.timeOuts[opHandler]['PerOperation'],
-                                                                   self.timeOuts[opHandler]['PerFile'] ) )
+      self.log.info( "[%s] %s: %s (timeout: %d s + %d s per file, batch of %d requests)" % \
+                     ( item[0], item[1][0], item[1][1],
+                       self.timeOuts[opHandler]['PerOperation'],
+                       self.timeOuts[opHandler]['PerFile'],
+                       self.batchSizes[opHandler] ) )
 
     # # common monitor activity
     gMonitor.registerActivity( "Iteration", "Agent Loops",
@@ -156,6 +170,7 @@ class RequestExecutingAgent( AgentModule ):
                                "RequestExecutingAgent", "Requests/min", gMonitor.OP_SUM )
     # # create request dict
     self.__requestCache = dict()
+    self.__batchTasks = dict()
 
     self.FTSMode = self.am_getOption( "FTSMode", False )
 
@@ -222,7 +237,9 @@ class RequestExecutingAgent( AgentModule ):
           for rmsFile in waitingOp.get( 'Value', [] ):
             rmsFile.Attempt += 1
 
-      reset = self.requestClient().putRequest( request, useFailoverProxy = False, retryMainService = 2 )
+      # # only what changed since the request was read is sent back, if possible
+      reset = self.requestClient().putRequest( request, useFailoverProxy = False, retryMainService = 2,
+                                               useDelta = True )
       if not reset["OK"]:
         return S_ERROR( "putRequest: unable to reset request %s: %s" % ( requestID, reset["Message"] ) )
     else:
@@ -285,9 +302,7 @@ class RequestExecutingAgent( AgentModule ):
 
       self.log.info( "execute: will execute %s requests " % len( requestsToExecute ) )
 
-      for request in requestsToExecute:
-        # # set task id
-        taskID = request.RequestID
+      for requests in self.batchRequests( requestsToExecute ):
 
         self.log.info( "processPool tasks idle = %s working = %s" % ( self.processPool().getNumIdleProcesses(),
                                                                       self.processPool().getNumWorkingProcesses() ) )
@@ -303,43 +318,65 @@ class RequestExecutingAgent( AgentModule ):
             if looping:
               self.log.info( "Free slot found after %d seconds" % looping * self.__poolSleep )
             looping = 0
-            # # save current request in cache
-            res = self.cacheRequest( request )
-            if not res['OK']:
-              if cmpError( res, errno.EALREADY ):
-                # The request is already in the cache, skip it
+            # # save current requests in cache and serialize them to JSON
+            toExecute = []
+            for request in requests:
+              res = self.cacheRequest( request )
+              if not res['OK']:
+                if cmpError( res, errno.EALREADY ):
+                  # The request is already in the cache, skip it
+                  continue
+                # There are too many requests in the cache, commit suicide
+                self.log.error( res['Message'], '(%d requests): put back all requests and exit cycle' % len( self.__requestCache ) )
+                self.putAllRequests()
+                return res
+              result = request.toJSON()
+              if not result['OK']:
+                self.__requestCache.pop( request.RequestID )
                 continue
-              # There are too many requests in the cache, commit suicide
-              self.log.error( res['Message'], '(%d requests): put back all requests and exit cycle' % len( self.__requestCache ) )
-              self.putAllRequests()
-              return res
-            # # serialize to JSON
-            result = request.toJSON()
-            if not result['OK']:
-              continue
-            requestJSON = result['Value']
-            self.log.info( "spawning task for request '%s/%s'" % ( request.RequestID, request.RequestName ) )
-            timeOut = self.getTimeout( request )
-            enqueue = self.processPool().createAndQueueTask( RequestTask,
-                                                             kwargs = { "requestJSON" : requestJSON,
-                                                                        "handlersDict" : self.handlersDict,
-                                                                        "csPath" : self.__configPath,
-                                                                        "agentName": self.agentName },
+              toExecute.append( ( request, result['Value'] ) )
+            if not toExecute:
+              break
+
+            request = toExecute[0][0]
+            # # set task id
+            taskID = request.RequestID
+            timeOut = sum( self.getTimeout( request ) for request, _requestJSON in toExecute )
+            taskKwargs = { "handlersDict" : self.handlersDict,
+                           "csPath" : self.__configPath,
+                           "agentName": self.agentName }
+            if len( toExecute ) == 1:
+              self.log.info( "spawning task for request '%s/%s'" % ( request.RequestID, request.RequestName ) )
+              taskClass = RequestTask
+              taskKwargs["requestJSON"] = toExecute[0][1]
+            else:
+              self.log.info( "spawning task for %d requests: %s" % ( len( toExecute ),
+                                                                     ",".join( str( request.RequestID )
+                                                                               for request, _requestJSON in toExecute ) ) )
+              taskClass = RequestBatchTask
+              taskKwargs["requestsJSON"] = [ requestJSON for _request, requestJSON in toExecute ]
+              self.__batchTasks[taskID] = [ request.RequestID for request, _requestJSON in toExecute ]
+            enqueue = self.processPool().createAndQueueTask( taskClass,
+                                                             kwargs = taskKwargs,
                                                              taskID = taskID,
                                                              blocking = True,
                                                              usePoolCallbacks = True,
                                                              timeOut = timeOut )
             if not enqueue["OK"]:
               self.log.error( enqueue["Message"] )
+              # # back to the RequestDB as they were
+              self.__batchTasks.pop( taskID, None )
+              for request, _requestJSON in toExecute:
+                self.putRequest( request.RequestID )
             else:
               self.log.debug( "successfully enqueued task '%s'" % taskID )
               # # update monitor
-              gMonitor.addMark( "Processed", 1 )
+              gMonitor.addMark( "Processed", len( toExecute ) )
               # # update request counter
-              taskCounter += 1
+              taskCounter += len( toExecute )
               # # task created, a little time kick to proceed
               time.sleep( 0.1 )
-              break
+            break
 
     self.log.info( 'Flushing callbacks (%d requests still in cache)' % len( self.__requestCache ) )
     processed = self.processPool().processResults()
@@ -348,6 +385,30 @@ class RequestExecutingAgent( AgentModule ):
     # # clean return
     return S_OK()
 
+  def batchRequests( self, requests ):
+    """ group the requests that can be executed by the same RequestBatchTask: same owner and waiting
+        operations with files, of the same type, SEs and catalogs, for handlers with a BatchSize above 1
+
+    :param list requests: Request instances
+    :return: list of lists of Request instances
+    """
+    batches = []
+    groups = {}
+    for request in requests:
+      operation = request.getWaiting().get( 'Value' )
+      batchSize = self.batchSizes.get( operation.Type, 1 ) if operation else 1
+      if batchSize < 2 or operation.Status != "Waiting" or not len( operation ):
+        batches.append( [ request ] )
+        continue
+      key = ( request.OwnerDN, request.OwnerGroup, operation.Type, operation.SourceSE, operation.TargetSE,
+              operation.Catalog, operation.Arguments )
+      group = groups.setdefault( key, [] )
+      group.append( request )
+      if len( group ) == batchSize:
+        batches.append( groups.pop( key ) )
+    batches += groups.values()
+    return batches
+
   def getTimeout( self, request ):
     """ get timeout for request """
     timeout = 0
@@ -373,12 +434,24 @@ class RequestExecutingAgent( AgentModule ):
   def resultCallback( self, taskID, taskResult ):
     """ definition of request callback function
 
-    :param str taskID: Request.RequestID
-    :param dict taskResult: task result S_OK(Request)/S_ERROR(Message)
+    :param str taskID: Request.RequestID, of the first request for a RequestBatchTask
+    :param dict taskResult: task result S_OK(Request)/S_ERROR(Message),
+                            S_OK( { RequestID : S_OK(Request)/S_ERROR(Message) } ) for a RequestBatchTask
     """
+    if taskID in self.__batchTasks:
+      for requestID in self.__batchTasks.pop( taskID ):
+        requestResult = taskResult
+        if taskResult["OK"]:
+          requestResult = taskResult["Value"].get( requestID, S_ERROR( "No result for request %s" % requestID ) )
+        self.__putRequestResult( requestID, requestResult )
+    else:
+      self.__putRequestResult( taskID, taskResult )
+
+  def __putRequestResult( self, requestID, taskResult ):
+    """ put back a request given its task result """
     # # clean cache
-    res = self.putRequest( taskID, taskResult )
-    self.log.info( "callback: %s result is %s(%s), put %s(%s)" % ( taskID,
+    res = self.putRequest( requestID, taskResult )
+    self.log.info( "callback: %s result is %s(%s), put %s(%s)" % ( requestID,
                                                       "S_OK" if taskResult["OK"] else "S_ERROR",
                                                       taskResult["Value"].Status if taskResult["OK"] else taskResult["Message"],
                                                       "S_OK" if res['OK'] else 'S_ERROR',
@@ -392,4 +465,5 @@ class RequestExecutingAgent( AgentModule ):
     :param Exception taskException: Exception instance
     """
     self.log.error( "exceptionCallback: %s was hit by exception %s" % ( taskID, taskException ) )
-    self.putRequest( taskID )
+    for requestID in self.__batchTasks.pop( taskID, [ taskID ] ):
+      self.putRequest( requestID )
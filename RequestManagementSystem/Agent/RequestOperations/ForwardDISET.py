@@ -28,8 +28,7 @@ __RCSID__ = "$Id $"
 # # imports
 from DIRAC import S_OK, S_ERROR, gConfig
 from DIRAC.RequestManagementSystem.private.OperationHandlerBase import OperationHandlerBase
-from DIRAC.Core.DISET.RPCClient import executeRPCStub
-from DIRAC.Core.Utilities import DEncode
+from DIRAC.Core.DISET.RPCClient import executeRPCStub, decodeRPCStub
 from DIRAC.ConfigurationSystem.Client.ConfigurationData import gConfigurationData
 
 ########################################################################
@@ -52,7 +51,7 @@ class ForwardDISET( OperationHandlerBase ):
     """ execute RPC stub """
     # # decode arguments
     try:
-      decode, length = DEncode.decode( self.operation.Arguments )
+      decode, length = decodeRPCStub( self.operation.Arguments )
       self.log.debug( "decoded len=%s val=%s" % ( length, decode ) )
     except ValueError, error:
       self.log.exception( error )
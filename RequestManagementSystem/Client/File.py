@@ -24,7 +24,7 @@ from types import StringTypes
 
 from DIRAC import S_OK, S_ERROR
 from DIRAC.Core.Utilities.File import checkGuid
-from DIRAC.RequestManagementSystem.private.JSONUtils import RMSEncoder
+from DIRAC.RequestManagementSystem.private.JSONUtils import RMSEncoder, getChangedAttributes
 
 
 ########################################################################
@@ -86,6 +86,9 @@ class File( object ):
 
     self.initialLoading = False
 
+    # # state as read from the DB, reference for _getDelta
+    self._loadedState = dict( fromDict ) if fromDict.get( 'FileID' ) else None
+
   @property
   def LFN( self ):
     """ LFN prop """
@@ -151,14 +154,14 @@ class File( object ):
     if value == 'Done':
       self.Error = ''
 
-    updateTime = ( self._Status != value )
-    if updateTime and self._parent:
+    oldStatus = self.Status
+    if oldStatus != value and self._parent:
       self._parent.LastUpdate = datetime.datetime.utcnow().replace( microsecond = 0 )
 
     self._Status = value
 
     if self._parent:
-      self._parent._notify()
+      self._parent._fileStatusChanged( oldStatus, value )
 
   def __str__( self ):
     """ str operator """
@@ -174,6 +177,19 @@ class File( object ):
     except Exception as e:
       return S_ERROR( str( e ) )
 
+  def _getDelta( self ):
+    """ Returns the attributes changed since the File was loaded from the DB,
+        or None if it was not loaded from the DB
+    """
+    # _loadedState is not there for the objects built by SQLAlchemy
+    if not getattr( self, '_loadedState', None ) or not getattr( self, 'FileID', 0 ):
+      return None
+    return getChangedAttributes( self._loadedState, self._getJSONData(), ( 'FileID', 'OperationID' ) )
+
+  def _resetDelta( self ):
+    """ The current state becomes the reference for _getDelta """
+    self._loadedState = self._getJSONData() if getattr( self, 'FileID', 0 ) else None
+
   def _getJSONData( self ):
     """ Returns the data that have to be serialized by JSON """
     attrNames = ['FileID', 'OperationID', "Status", "LFN",
@@ -21,7 +21,7 @@ import json
 # # from DIRAC
 from DIRAC import S_OK, S_ERROR
 from DIRAC.RequestManagementSystem.Client.File import File
-from DIRAC.RequestManagementSystem.private.JSONUtils import RMSEncoder
+from DIRAC.RequestManagementSystem.private.JSONUtils import RMSEncoder, getChangedAttributes
 
 
 
@@ -93,9 +93,11 @@ class Operation( object ):
                else {}
 
 
+    nbFiles = 0
     if "Files" in fromDict:
       for fileDict in fromDict.get( "Files", [] ):
         self.addFile( File( fileDict ) )
+        nbFiles += 1
 
       del fromDict["Files"]
 
@@ -108,11 +110,42 @@ class Operation( object ):
       if value:
         setattr( self, key, value )
 
+    # # state as read from the DB, reference for _getDelta
+    self._loadedState = None
+    if fromDict.get( 'OperationID' ):
+      self._loadedState = dict( fromDict )
+      self._loadedState['Files'] = nbFiles
+
 
   # # protected methods for parent only
+  def _getFileStatusCounts( self ):
+    """ number of files per status, built on demand and then kept up to date by _fileStatusChanged
+
+    The counts are rebuilt if files were added or removed behind our back (e.g. by SQLAlchemy)
+    """
+    counts = getattr( self, '_fileStatusCounts', None )
+    if counts is None or sum( counts.itervalues() ) != len( self.__files__ ):
+      counts = {}
+      for opFile in self.__files__:
+        counts[opFile.Status] = counts.get( opFile.Status, 0 ) + 1
+      self._fileStatusCounts = counts
+    return counts
+
+  def _fileStatusChanged( self, oldStatus, newStatus ):
+    """ notify self about the status change of one of its files """
+    counts = getattr( self, '_fileStatusCounts', None )
+    if counts is not None and oldStatus != newStatus:
+      if counts.get( oldStatus ):
+        counts[oldStatus] -= 1
+        counts[newStatus] = counts.get( newStatus, 0 ) + 1
+      else:
+        # # out of sync, rebuild them
+        self._fileStatusCounts = None
+    self._notify()
+
   def _notify( self ):
     """ notify self about file status change """
-    fStatus = set( self.fileStatusList() )
+    fStatus = set( status for status, count in self._getFileStatusCounts().iteritems() if count )
     if fStatus == set( ['Failed'] ):
       # All files Failed -> Failed
       newStatus = 'Failed'
@@ -132,8 +165,9 @@ class Operation( object ):
         self._LastUpdate = datetime.datetime.utcnow().replace( microsecond = 0 )
 
     self._Status = newStatus
+    # # the request statuses are only evaluated when needed
     if self._parent:
-      self._parent._notify()
+      self._parent._operationStatusChanged()
 
   def _setQueued( self, caller ):
     """ don't touch """
@@ -164,6 +198,9 @@ class Operation( object ):
     if opFile not in self:
       self.__files__.append( opFile )
       opFile._parent = self
+      counts = getattr( self, '_fileStatusCounts', None )
+      if counts is not None:
+        counts[opFile.Status] = counts.get( opFile.Status, 0 ) + 1
     self._notify()
 
   # # helpers for looping
@@ -178,12 +215,14 @@ class Operation( object ):
   def __delitem__( self, i ):
     """ remove file from op, only if OperationID is NOT set """
     self.__files__.__delitem__( i )
+    self._fileStatusCounts = None
     self._notify()
 
   def __setitem__( self, i, opFile ):
     """ overwrite opFile """
     self.__files__.__setitem__( i, opFile )
     opFile._parent = self
+    self._fileStatusCounts = None
     self._notify()
 
   def fileStatusList( self ):
@@ -237,6 +276,9 @@ class Operation( object ):
   @property
   def Status( self ):
     """ Status prop """
+    # # the parent may have to set us Waiting or Queued
+    if self._parent and getattr( self._parent, '_statusChanged', False ):
+      self._parent._notify()
     return self._Status
 
   @Status.setter
@@ -329,6 +371,37 @@ class Operation( object ):
       return S_ERROR( str( e ) )
 
 
+  def _getDelta( self ):
+    """ Returns the attributes changed since the Operation was loaded from the DB
+
+    :return: tuple ( { attrName : value }, { FileID : { attrName : value } } ), or None if
+             the Operation was not loaded from the DB or Files were added or removed since
+    """
+    # _loadedState is not there for the objects built by SQLAlchemy
+    loadedState = getattr( self, '_loadedState', None )
+    if not loadedState or not getattr( self, 'OperationID', 0 ):
+      return None
+    if len( self.__files__ ) != loadedState['Files']:
+      return None
+    filesDelta = {}
+    for opFile in self.__files__:
+      fileDelta = opFile._getDelta()
+      if fileDelta is None:
+        return None
+      if fileDelta:
+        filesDelta[opFile.FileID] = fileDelta
+    opDelta = getChangedAttributes( loadedState, self._getJSONData(), ( 'OperationID', 'RequestID' ) )
+    return opDelta, filesDelta
+
+  def _resetDelta( self ):
+    """ The current state becomes the reference for _getDelta """
+    self._loadedState = None
+    if getattr( self, 'OperationID', 0 ):
+      self._loadedState = self._getJSONData()
+      self._loadedState['Files'] = len( self.__files__ )
+    for opFile in self.__files__:
+      opFile._resetDelta()
+
   def _getJSONData( self ):
     """ Returns the data that have to be serialized by JSON """
 
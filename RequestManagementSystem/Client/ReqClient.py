@@ -64,13 +64,14 @@ class ReqClient( Client ):
       self.__requestValidator = RequestValidator()
     return self.__requestValidator
 
-  def putRequest( self, request, useFailoverProxy = True, retryMainService = 0 ):
+  def putRequest( self, request, useFailoverProxy = True, retryMainService = 0, useDelta = False ):
     """Put request to RequestManager
 
       :param self: self reference
       :param ~Request.Request request: Request instance
       :param bool useFailoverProxy: if False, will not attempt to forward the request to ReqProxies
       :param int retryMainService: Amount of time we retry on the main ReqHandler in case of failures
+      :param bool useDelta: if True and the request was read from the RequestDB, only send what changed since
 
       :return: S_OK/S_ERROR
     """
@@ -79,6 +80,15 @@ class ReqClient( Client ):
     if not valid["OK"]:
       self.log.error( "putRequest: request not valid", "%s" % valid["Message"] )
       return valid
+
+    if useDelta:
+      updateRequest = self.__updateRequest( request, retryMainService )
+      if updateRequest["OK"]:
+        return updateRequest
+      self.log.verbose( "putRequest: cannot send the changes only, putting the whole request",
+                        updateRequest["Message"] )
+    # # From now on, we don't know what is in the DB
+    request.resetDelta( persisted = False )
     # # dump to json
     requestJSON = request.toJSON()
     if not requestJSON["OK"]:
@@ -119,6 +129,35 @@ class ReqClient( Client ):
     errorsDict["Message"] = "ReqClient.putRequest: unable to set request '%s'" % request.RequestName
     return errorsDict
 
+  def __updateRequest( self, request, retryMainService = 0 ):
+    """ Send to the RequestManager only the attributes of the request that changed since it was read
+
+      :param ~Request.Request request: Request instance, as read from the RequestManager
+      :param int retryMainService: Amount of time we retry in case of failures
+
+      :return: S_OK/S_ERROR
+    """
+    delta = request.getDelta()
+    if not delta["OK"]:
+      return delta
+    delta = delta["Value"]
+    # # needed by the RequestManager to compute the NotBefore
+    waitingOp = request.getWaiting().get( "Value" )
+    attempts = [ opFile.Attempt for opFile in waitingOp if opFile.Status == "Waiting" ] if waitingOp else []
+    delta["MaxWaitingAttempt"] = max( attempts ) if attempts else None
+    deltaJSON = json.dumps( delta )
+
+    retryMainService += 1
+    while retryMainService:
+      retryMainService -= 1
+      updateRequest = self._getRPC().updateRequest( deltaJSON )
+      if updateRequest["OK"]:
+        request.resetDelta()
+        return updateRequest
+      if retryMainService:
+        time.sleep( random.randint( 1, 5 ) )
+    return updateRequest
+
   def getRequest( self, requestID = 0 ):
     """Get request from RequestDB
 
@@ -359,6 +398,21 @@ class ReqClient( Client ):
                       "%s: %s" % ( jobIDs, requests["Message"] ) )
     return requests
 
+  def getRequestsStatusChanges( self, requestIDs, since = None ):
+    """ get the status of the requests updated since a given time
+
+    :param self: self reference
+    :param requestIDs: list of request IDs (integers)
+    :type requestIDs: python:list
+    :param str since: UTC time, all the requests if None
+    :return: S_ERROR or S_OK( { requestID : status } )
+    """
+    self.log.debug( "getRequestsStatusChanges: attempt to get the status of %d requests" % len( requestIDs ) )
+    requestsStatus = self._getRPC().getRequestsStatusChanges( [int( reqID ) for reqID in requestIDs], since )
+    if not requestsStatus["OK"]:
+      self.log.error( "getRequestsStatusChanges: unable to get the status of the requests", requestsStatus["Message"] )
+    return requestsStatus
+
   def readRequestsForJobs( self, jobIDs ):
     """ read requests for jobs
 
@@ -485,8 +539,8 @@ def printOperation( indexOperation, verbose = True, onlyFailed = False ):
     prStr += ' - '
   prStr += 'Created %s, Updated %s' % ( op.CreationTime, op.LastUpdate )
   if op.Type == 'ForwardDISET' and op.Arguments:
-    from DIRAC.Core.Utilities import DEncode
-    decode, _length = DEncode.decode( op.Arguments )
+    from DIRAC.Core.DISET.RPCClient import decodeRPCStub
+    decode, _length = decodeRPCStub( op.Arguments )
     if verbose:
       output = ''
       prettyPrint( decode, offset = 10 )
@@ -23,7 +23,7 @@ import json
 from DIRAC import S_OK, S_ERROR
 from DIRAC.Core.Security.ProxyInfo import getProxyInfo
 from DIRAC.RequestManagementSystem.Client.Operation import Operation
-from DIRAC.RequestManagementSystem.private.JSONUtils import RMSEncoder
+from DIRAC.RequestManagementSystem.private.JSONUtils import RMSEncoder, getChangedAttributes
 from DIRAC.DataManagementSystem.Utilities.DMSHelpers import DMSHelpers
 
 from types import NoneType
@@ -99,9 +99,11 @@ class Request( object ):
                 else {}
 
 
+    nbOperations = 0
     if "Operations" in fromDict:
       for opDict in fromDict.get( "Operations", [] ):
         self +=Operation( opDict )
+        nbOperations += 1
 
       del fromDict["Operations"]
 
@@ -117,9 +119,20 @@ class Request( object ):
 
     self._notify()
 
+    # # state as read from the DB, reference for getDelta
+    self._loadedState = None
+    if fromDict.get( 'RequestID' ):
+      self._loadedState = dict( fromDict )
+      self._loadedState['Operations'] = nbOperations
+
+
+  def _operationStatusChanged( self ):
+    """ the status of an operation changed: statuses will be evaluated again when read """
+    self._statusChanged = True
 
   def _notify( self ):
     """ simple state machine for sub request statuses """
+    self._statusChanged = False
     # # update operations statuses
     self.__waiting = None
 
@@ -133,9 +146,8 @@ class Request( object ):
     opStatusList = [ ( op.Status, op ) for op in self ]
 
 
-    while opStatusList:
-      # # Scan all status in order!
-      opStatus, op = opStatusList.pop( 0 )
+    # # Scan all status in order!
+    for opStatus, op in opStatusList:
 
       # # Failed -> Failed
       if opStatus == "Failed" and self.__waiting is None:
@@ -386,6 +398,58 @@ class Request( object ):
     return S_OK( jsonStr )
 
 
+  def getDelta( self ):
+    """ Get the attributes of the Request, its Operations and Files that changed since it was
+        loaded from the DB. Status and NotBefore of the Request are always part of it.
+
+    :return: S_OK( { 'RequestID' : int, 'Request' : { attrName : value },
+                     'Operations' : { OperationID : { attrName : value } },
+                     'Files' : { FileID : { attrName : value } } } )
+             S_ERROR if the request was not loaded from the DB or Operations/Files were added or removed since
+    """
+    # _loadedState is not there for the objects built by SQLAlchemy
+    loadedState = getattr( self, '_loadedState', None )
+    if not loadedState or not getattr( self, 'RequestID', 0 ):
+      return S_ERROR( "Request was not loaded from the DB" )
+    if len( self.__operations__ ) != loadedState['Operations']:
+      return S_ERROR( "Operations were added or removed" )
+
+    operationsDelta = {}
+    filesDelta = {}
+    for op in self.__operations__:
+      opDelta = op._getDelta()
+      if opDelta is None:
+        return S_ERROR( "Operation or Files were added or removed" )
+      if opDelta[0]:
+        operationsDelta[op.OperationID] = opDelta[0]
+      filesDelta.update( opDelta[1] )
+
+    jsonData = self._getJSONData()
+    requestDelta = getChangedAttributes( loadedState, jsonData, ( 'RequestID', ) )
+    for attrName in ( 'Status', 'NotBefore' ):
+      requestDelta[attrName] = jsonData.get( attrName )
+
+    return S_OK( { 'RequestID' : self.RequestID,
+                   'Request' : requestDelta,
+                   'Operations' : operationsDelta,
+                   'Files' : filesDelta } )
+
+  def resetDelta( self, persisted = True ):
+    """ To be called once the Request was put back in the DB
+
+    :param bool persisted: if True, the DB is known to have the current state, which becomes the
+                           reference for getDelta. Otherwise, getDelta will not be usable anymore.
+    """
+    if not persisted:
+      self._loadedState = None
+      return
+    self._loadedState = None
+    if getattr( self, 'RequestID', 0 ):
+      self._loadedState = self._getJSONData()
+      self._loadedState['Operations'] = len( self.__operations__ )
+    for op in self.__operations__:
+      op._resetDelta()
+
   def _getJSONData( self ):
     """ Returns the data that have to be serialized by JSON """
 
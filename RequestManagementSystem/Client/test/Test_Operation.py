@@ -196,6 +196,27 @@ class OperationTests( unittest.TestCase ):
     op.OperationID = 1
     del op[0]
 
+  def test06StatusCounts( self ):
+    """ file status counts kept up to date """
+    op = Operation()
+    for i in range( 100 ):
+      op.addFile( File( { "LFN" : "/a/b/%s" % i } ) )
+    self.assertEqual( op._getFileStatusCounts(), { "Waiting" : 100 } )
+
+    for opFile in op[:99]:
+      opFile.Status = "Done"
+    self.assertEqual( op._getFileStatusCounts(), { "Waiting" : 1, "Done" : 99 } )
+    self.assertEqual( op.Status, "Queued", "1. wrong status %s" % op.Status )
+
+    op[99].Status = "Failed"
+    self.assertEqual( op.Status, "Failed", "2. wrong status %s" % op.Status )
+
+    # # files changed behind our back
+    op._fileStatusCounts = None
+    del op[99]
+    self.assertEqual( op._getFileStatusCounts(), { "Done" : 99 } )
+    self.assertEqual( op.Status, "Done", "3. wrong status %s" % op.Status )
+
 
 
 
@@ -472,6 +472,40 @@ class RequestTests( unittest.TestCase ):
         self.assertEqual( len( r[2] ), 1, 'Wrong number of files: %d' % len( r[1] ) )
         self.assertEqual( len( r[3] ), 2, 'Wrong number of files: %d' % len( r[1] ) )
 
+  def test_09Delta( self ):
+    """ only the changed attributes are in the delta """
+    fromDB = { "RequestID" : 1, "RequestName" : "delta", "Status" : "Waiting",
+               "Operations" : [ { "OperationID" : 10, "RequestID" : 1, "Type" : "ReplicateAndRegister",
+                                  "Status" : "Waiting", "TargetSE" : "CERN-USER",
+                                  "Files" : [ { "FileID" : 100 + i, "OperationID" : 10, "Status" : "Waiting",
+                                                "LFN" : "/a/b/c%d" % i, "Attempt" : 1, "Size" : 0 } for i in range( 3 ) ] } ] }
+    r = Request( fromDB )
+    r[0][1].Status = "Done"
+    r[0][2].Attempt += 1
+    delta = r.getDelta()
+    self.assertEqual( delta["OK"], True, delta.get( "Message" ) )
+    delta = delta["Value"]
+    self.assertEqual( delta["RequestID"], 1 )
+    self.assertEqual( sorted( delta["Files"] ), [ 101, 102 ] )
+    self.assertEqual( delta["Files"][101]["Status"], "Done" )
+    self.assertEqual( delta["Files"][102], { "Attempt" : 2 } )
+    self.assertEqual( "Status" in delta["Request"], True )
+
+    # # nothing changed anymore once it is persisted
+    r.resetDelta()
+    delta = r.getDelta()["Value"]
+    self.assertEqual( delta["Files"], {} )
+    self.assertEqual( delta["Operations"], {} )
+
+    # # new file: the whole request has to be put
+    f = File()
+    f.LFN = "/a/b/new"
+    r[0].addFile( f )
+    self.assertEqual( r.getDelta()["OK"], False )
+
+    # # a new request cannot be updated
+    self.assertEqual( Request( { "RequestName" : "new" } ).getDelta()["OK"], False )
+
 # # test execution
 if __name__ == "__main__":
 
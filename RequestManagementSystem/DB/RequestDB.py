@@ -17,12 +17,13 @@
     db holding Request, Operation and File
 """
 import random
+import json
 
 import datetime
 
 from sqlalchemy.orm.exc import NoResultFound
 from sqlalchemy.orm import relationship, backref, sessionmaker, joinedload_all, mapper
-from sqlalchemy.sql import update
+from sqlalchemy.sql import update, select, bindparam, and_
 from sqlalchemy import create_engine, func, Table, Column, MetaData, ForeignKey, \
                        Integer, String, DateTime, Enum, BLOB, BigInteger, distinct
 
@@ -263,6 +264,94 @@ class RequestDB( object ):
       session.close()
 
 
+  @staticmethod
+  def __toColumnValues( table, attrs ):
+    """ Keep the attributes that are plain columns of the table, and convert the dates """
+    values = {}
+    for attrName, value in attrs.iteritems():
+      if attrName not in table.c:
+        continue
+      column = table.c[attrName]
+      # IDs are managed by the DB
+      if column.primary_key or column.foreign_keys:
+        continue
+      if isinstance( value, unicode ):
+        # the JSON decoded strings may not be ASCII
+        value = value.encode( 'utf-8' )
+      if isinstance( value, str ) and isinstance( column.type, DateTime ):
+        value = datetime.datetime.strptime( value, Request._datetimeFormat )
+      values[attrName] = value
+    return values
+
+  def __bulkUpdate( self, session, table, idName, attrsPerID, whereClause ):
+    """ Update the rows of a table given their ID, with one executemany per set of updated columns
+
+    :param session: current session
+    :param table: Table to update
+    :param str idName: name of the primary key column
+    :param dict attrsPerID: { ID : { attrName : value } }
+    :param whereClause: extra condition the rows have to match
+    """
+    rowsPerColumns = {}
+    for rowID, attrs in attrsPerID.iteritems():
+      values = self.__toColumnValues( table, attrs )
+      if not values:
+        continue
+      # bind parameters cannot have the name of the columns
+      row = dict( ( 'b_%s' % colName, value ) for colName, value in values.iteritems() )
+      row['b_id'] = int( rowID )
+      rowsPerColumns.setdefault( tuple( sorted( values ) ), [] ).append( row )
+
+    for columns, rows in rowsPerColumns.iteritems():
+      stmt = update( table )\
+             .where( and_( table.c[idName] == bindparam( 'b_id' ), whereClause ) )\
+             .values( dict( ( colName, bindparam( 'b_%s' % colName ) ) for colName in columns ) )
+      session.execute( stmt, rows )
+
+  def updateRequest( self, requestID, requestAttrs, operationAttrs, fileAttrs ):
+    """ update only the given attributes of a request already in the db, instead of merging it entirely
+
+    :param int requestID: request's ID
+    :param dict requestAttrs: { attrName : value } for the Request
+    :param dict operationAttrs: { OperationID : { attrName : value } }
+    :param dict fileAttrs: { FileID : { attrName : value } }
+    """
+    session = self.DBSession()
+    try:
+      status = session.query( Request._Status )\
+                      .filter( Request.RequestID == requestID )\
+                      .one()
+      if status[0] == 'Canceled':
+        self.log.info( "Request %s was canceled, don't put it back" % requestID )
+        return S_OK( requestID )
+
+      requestValues = self.__toColumnValues( requestTable, requestAttrs )
+      if requestValues:
+        session.execute( update( requestTable )
+                         .where( requestTable.c.RequestID == requestID )
+                         .values( requestValues ) )
+
+      # Only touch the operations and files of this request
+      if operationAttrs:
+        self.__bulkUpdate( session, operationTable, 'OperationID', operationAttrs,
+                           operationTable.c.RequestID == requestID )
+      if fileAttrs:
+        operationIDs = select( [operationTable.c.OperationID] ).where( operationTable.c.RequestID == requestID )
+        self.__bulkUpdate( session, fileTable, 'FileID', fileAttrs,
+                           fileTable.c.OperationID.in_( operationIDs ) )
+
+      session.commit()
+      return S_OK( requestID )
+
+    except NoResultFound:
+      return S_ERROR( "updateRequest: no request with ID %s" % requestID )
+    except Exception as e:
+      session.rollback()
+      self.log.exception( "updateRequest: unexpected exception", lException = e )
+      return S_ERROR( "updateRequest: unexpected exception %s" % e )
+    finally:
+      session.close()
+
   def getScheduledRequest( self, operationID ):
     session = self.DBSession()
     try:
@@ -386,6 +475,43 @@ class RequestDB( object ):
       session.close()
 
 
+  def __getWaitingRequestIDs( self, session, numberOfRequest ):
+    """ IDs of the oldest Waiting requests that can be executed now
+    """
+    now = datetime.datetime.utcnow().replace( microsecond = 0 )
+    requestIDs = session.query( Request.RequestID )\
+                        .filter( Request._Status == 'Waiting' )\
+                        .filter( Request._NotBefore < now )\
+                        .order_by( Request._LastUpdate )\
+                        .limit( numberOfRequest )\
+                        .all()
+    return [ridTuple[0] for ridTuple in requestIDs]
+
+  def __claimWaitingRequests( self, session, numberOfRequest ):
+    """ Set up to numberOfRequest Waiting requests to Assigned and return their IDs
+
+        Each request is claimed in its own short transaction that only succeeds if the request
+        is still Waiting: requests taken meanwhile by another agent are skipped, not waited for
+    """
+    # Some spare candidates, in case others are claimed concurrently
+    candidateIDs = self.__getWaitingRequestIDs( session, 2 * numberOfRequest )
+    session.commit()
+
+    lastUpdate = datetime.datetime.utcnow().strftime( Request._datetimeFormat )
+    requestIDs = []
+    for requestID in candidateIDs:
+      if len( requestIDs ) >= numberOfRequest:
+        break
+      updateRet = session.execute( update( Request )\
+                                   .where( Request.RequestID == requestID )\
+                                   .where( Request._Status == 'Waiting' )\
+                                   .values( {Request._Status : 'Assigned',
+                                             Request._LastUpdate : lastUpdate} ) )
+      session.commit()
+      if updateRet.rowcount:
+        requestIDs.append( requestID )
+    return requestIDs
+
   def getBulkRequests( self, numberOfRequest = 10, assigned = True ):
     """ read as many requests as requested for execution
 
@@ -403,38 +529,20 @@ class RequestDB( object ):
     requestDict = {}
 
     try:
-      # If we are here, the request MUST exist, so no try catch
-      # the joinedload_all is to force the non-lazy loading of all the attributes, especially _parent
-      try:
-        now = datetime.datetime.utcnow().replace( microsecond = 0 )
-        requestIDs = session.query( Request.RequestID )\
-                          .with_for_update()\
-                          .filter( Request._Status == 'Waiting' )\
-                          .filter( Request._NotBefore < now )\
-                          .order_by( Request._LastUpdate )\
-                          .limit( numberOfRequest )\
-                          .all()
-
-        requestIDs = [ridTuple[0] for ridTuple in requestIDs]
-        log.debug( "Got request ids %s" % requestIDs )
+      if assigned:
+        requestIDs = self.__claimWaitingRequests( session, numberOfRequest )
+      else:
+        requestIDs = self.__getWaitingRequestIDs( session, numberOfRequest )
+      log.debug( "Got request ids %s" % requestIDs )
 
+      if requestIDs:
+        # the joinedload_all is to force the non-lazy loading of all the attributes, especially _parent
         requests = session.query( Request )\
                           .options( joinedload_all( '__operations__.__files__' ) )\
                           .filter( Request.RequestID.in_( requestIDs ) )\
                           .all()
         log.debug( "Got %s Request objects " % len( requests ) )
         requestDict = dict( ( req.RequestID, req ) for req in requests )
-      # No Waiting requests
-      except NoResultFound, e:
-        pass
-
-      if assigned and requestDict:
-        session.execute( update( Request )\
-                         .where( Request.RequestID.in_( requestDict.keys() ) )\
-                         .values( {Request._Status : 'Assigned',
-                                   Request._LastUpdate : datetime.datetime.utcnow()\
-                                                        .strftime( Request._datetimeFormat )} )
-                       )
       session.commit()
 
       session.expunge_all()
@@ -448,6 +556,73 @@ class RequestDB( object ):
 
     return S_OK( requestDict )
 
+  @staticmethod
+  def __rowToJSONData( row ):
+    """ Columns of a Request, Operation or File row, as in their _getJSONData
+    """
+    jsonData = {}
+    for attrName, value in row.items():
+      if isinstance( value, datetime.datetime ):
+        # We convert date time to a string
+        value = value.strftime( Request._datetimeFormat )
+      jsonData[attrName] = value
+    return jsonData
+
+  def getBulkRequestsJSON( self, numberOfRequest = 10, assigned = True ):
+    """ Same as getBulkRequests, but the requests are directly serialized out of one flat query
+        per table, without building the SQLAlchemy objects. Meant for requests with many files.
+
+    :param int numberOfRequest: Number of Request we want (default 10)
+    :param bool assigned: if True, the status of the selected requests are set to assign
+
+    :returns: a dictionary of Request JSON strings, as given by Request.toJSON, indexed on the RequestID
+    """
+    session = self.DBSession()
+    log = self.log.getSubLogger( 'getBulkRequestsJSON' if assigned else 'peekBulkRequestsJSON' )
+
+    requestDict = {}
+
+    try:
+      if assigned:
+        requestIDs = self.__claimWaitingRequests( session, numberOfRequest )
+      else:
+        requestIDs = self.__getWaitingRequestIDs( session, numberOfRequest )
+      log.debug( "Got request ids %s" % requestIDs )
+
+      if requestIDs:
+        for row in session.execute( select( [requestTable] )\
+                                    .where( requestTable.c.RequestID.in_( requestIDs ) ) ):
+          reqData = self.__rowToJSONData( row )
+          reqData['Operations'] = []
+          requestDict[row['RequestID']] = reqData
+
+        opDict = {}
+        for row in session.execute( select( [operationTable] )\
+                                    .where( operationTable.c.RequestID.in_( requestIDs ) )\
+                                    .order_by( operationTable.c.RequestID, operationTable.c.Order ) ):
+          opData = self.__rowToJSONData( row )
+          opData['Files'] = []
+          requestDict[row['RequestID']]['Operations'].append( opData )
+          opDict[row['OperationID']] = opData
+
+        if opDict:
+          for row in session.execute( select( [fileTable] )\
+                                      .where( fileTable.c.OperationID == operationTable.c.OperationID )\
+                                      .where( operationTable.c.RequestID.in_( requestIDs ) )\
+                                      .order_by( fileTable.c.FileID ) ):
+            opDict[row['OperationID']]['Files'].append( self.__rowToJSONData( row ) )
+      session.commit()
+
+    except Exception as e:
+      session.rollback()
+      log.exception( "unexpected exception", lException = e )
+      return S_ERROR( "getBulkRequestsJSON: unexpected exception : %s" % e )
+    finally:
+      session.close()
+
+    log.debug( "Got %s requests" % len( requestDict ) )
+    return S_OK( dict( ( requestID, json.dumps( reqData ) ) for requestID, reqData in requestDict.iteritems() ) )
+
 
 
   def peekRequest( self, requestID ):
@@ -765,6 +940,34 @@ class RequestDB( object ):
     return S_OK( reqDict )
 
 
+  def getRequestsStatusChanges( self, requestIDs, since = None ):
+    """ get the status of the requests updated since a given time
+
+    :param requestIDs: list of request IDs
+    :type requestIDs: python:list
+    :param since: UTC time, all the requests if None
+    :return: S_OK( { requestID : status } ) for the requests found
+    """
+    self.log.debug( "getRequestsStatusChanges: got %d requestIDs to check" % len( requestIDs ) )
+    if not requestIDs:
+      return S_OK( {} )
+
+    session = self.DBSession()
+    try:
+      statusQuery = session.query( Request.RequestID, Request._Status )\
+                           .filter( Request.RequestID.in_( set( requestIDs ) ) )
+      if since:
+        statusQuery = statusQuery.filter( Request._LastUpdate >= since )
+      statusDict = dict( ( reqID, status ) for reqID, status in statusQuery.all() )
+    except Exception as e:
+      self.log.exception( "getRequestsStatusChanges: unexpected exception", lException = e )
+      return S_ERROR( "getRequestsStatusChanges: unexpected exception : %s" % e )
+    finally:
+      session.close()
+
+    return S_OK( statusDict )
+
+
   def readRequestsForJobs( self, jobIDs = None ):
     """ read request for jobs
 
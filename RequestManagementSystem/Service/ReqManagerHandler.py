@@ -57,6 +57,19 @@ class ReqManagerHandler( RequestHandler ):
       cls.__validator = RequestValidator()
     return cls.__validator.validate( request )
 
+  @classmethod
+  def __getExtraDelay( cls, maxWaitingAttempt ):
+    """ delay to apply to a request put back in the DB
+
+    :param maxWaitingAttempt: highest Attempt of the Waiting files of the Waiting operation, if any
+    """
+    # If it is a constant delay, just set it
+    if cls.constantRequestDelay:
+      return datetime.timedelta( minutes = cls.constantRequestDelay )
+    # In case it is the first attempt, extraDelay is 0
+    # maxWaitingAttempt can be None if the operation has no File, like the ForwardDiset
+    return datetime.timedelta( minutes = 2 * math.log( maxWaitingAttempt ) if maxWaitingAttempt else 0 )
+
   types_getRequestIDForName = [ StringTypes ]
   @classmethod
   def export_getRequestIDForName( cls, requestName ):
@@ -107,19 +120,14 @@ class ReqManagerHandler( RequestHandler ):
     if request.Status not in Request.FINAL_STATES and ( not request.NotBefore or request.NotBefore < now ) :
       # We don't delay if it is the first insertion
       if getattr( request, 'RequestID', 0 ):
-        # If it is a constant delay, just set it
-        if cls.constantRequestDelay:
-          extraDelay = datetime.timedelta( minutes = cls.constantRequestDelay )
-        else:
-          # If there is a waiting Operation with Files
-          op = request.getWaiting().get( 'Value' )
-          if op and len( op ):
-            attemptList = [ opFile.Attempt for opFile in op if opFile.Status == "Waiting" ]
-            if attemptList:
-              maxWaitingAttempt = max( [ opFile.Attempt for opFile in op if opFile.Status == "Waiting" ] )
-              # In case it is the first attempt, extraDelay is 0
-              # maxWaitingAttempt can be None if the operation has no File, like the ForwardDiset
-              extraDelay = datetime.timedelta( minutes = 2 * math.log( maxWaitingAttempt )  if maxWaitingAttempt else 0 )
+        maxWaitingAttempt = None
+        # If there is a waiting Operation with Files
+        op = request.getWaiting().get( 'Value' )
+        if op and len( op ):
+          attemptList = [ opFile.Attempt for opFile in op if opFile.Status == "Waiting" ]
+          if attemptList:
+            maxWaitingAttempt = max( attemptList )
+        extraDelay = cls.__getExtraDelay( maxWaitingAttempt )
 
         request.NotBefore = now + extraDelay
 
@@ -129,6 +137,34 @@ class ReqManagerHandler( RequestHandler ):
     gLogger.info( "putRequest: Attempting to set request '%s'" % requestName )
     return cls.__requestDB.putRequest( request )
 
+  types_updateRequest = [ StringTypes ]
+  @classmethod
+  def export_updateRequest( cls, deltaJSON ):
+    """ update a request already in the RequestDB with only the attributes that changed
+
+    :param cls: class ref
+    :param str deltaJSON: changes as given by Request.getDelta, plus the MaxWaitingAttempt, serialized to JSON
+    """
+    delta = json.loads( deltaJSON )
+    requestID = delta["RequestID"]
+    requestAttrs = delta["Request"]
+
+    now = datetime.datetime.utcnow().replace( microsecond = 0 )
+    notBefore = requestAttrs.get( "NotBefore" )
+    if notBefore:
+      notBefore = datetime.datetime.strptime( notBefore, Request._datetimeFormat )
+    if requestAttrs.get( "Status" ) not in Request.FINAL_STATES and ( not notBefore or notBefore < now ):
+      extraDelay = cls.__getExtraDelay( delta.get( "MaxWaitingAttempt" ) )
+      requestAttrs["NotBefore"] = now + extraDelay
+      gLogger.info( "updateRequest: request %s not before %s (extra delay %s)" % ( requestID,
+                                                                                 requestAttrs["NotBefore"],
+                                                                                 extraDelay ) )
+
+    gLogger.info( "updateRequest: %s operations and %s files changed in request %s" % ( len( delta["Operations"] ),
+                                                                                        len( delta["Files"] ),
+                                                                                        requestID ) )
+    return cls.__requestDB.updateRequest( requestID, requestAttrs, delta["Operations"], delta["Files"] )
+
   types_getScheduledRequest = [ ( IntType, LongType ) ]
   @classmethod
   def export_getScheduledRequest( cls , operationID ):
@@ -175,22 +211,13 @@ class ReqManagerHandler( RequestHandler ):
 
         :return S_OK( {Failed : message, Successful : list of Request.toJSON()} )
     """
-    getRequests = cls.__requestDB.getBulkRequests( numberOfRequest = numberOfRequest, assigned = assigned )
+    # The requests are serialized straight from the DB rows, without building Request objects
+    getRequests = cls.__requestDB.getBulkRequestsJSON( numberOfRequest = numberOfRequest, assigned = assigned )
     if not getRequests["OK"]:
       gLogger.error( "getRequests: %s" % getRequests["Message"] )
       return getRequests
     if getRequests["Value"]:
-      getRequests = getRequests["Value"]
-      toJSONDict = {"Successful" : {}, "Failed" : {}}
-
-      for rId in getRequests:
-        toJSON = getRequests[rId].toJSON()
-        if not toJSON["OK"]:
-          gLogger.error( toJSON["Message"] )
-          toJSONDict["Failed"][rId] = toJSON["Message"]
-        else:
-          toJSONDict["Successful"][rId] = toJSON["Value"]
-      return S_OK( toJSONDict )
+      return S_OK( {"Successful" : getRequests["Value"], "Failed" : {}} )
     return S_OK()
 
 
@@ -274,6 +301,12 @@ class ReqManagerHandler( RequestHandler ):
     """ Select the request IDs for supplied jobIDs """
     return cls.__requestDB.getRequestIDsForJobs( jobIDs )
 
+  types_getRequestsStatusChanges = [ ListType ]
+  @classmethod
+  def export_getRequestsStatusChanges( cls, requestIDs, since = None ):
+    """ Get the status of the requests updated since a given UTC time (all of them if None) """
+    return cls.__requestDB.getRequestsStatusChanges( requestIDs, since )
+
   types_readRequestsForJobs = [ ListType ]
   @classmethod
   def export_readRequestsForJobs( cls, jobIDs ):
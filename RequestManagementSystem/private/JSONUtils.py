@@ -10,3 +10,17 @@ class RMSEncoder( json.JSONEncoder ):
       return obj._getJSONData()
     else:
       return json.JSONEncoder.default( self, obj )
+
+def getChangedAttributes( loadedState, jsonData, idNames ):
+  """ Compare the JSON data of a Request, Operation or File with the state it was loaded with.
+      The IDs and the sub objects (Operations, Files) are not considered.
+
+  :param dict loadedState: attributes as read from the DB
+  :param dict jsonData: current attributes, as given by _getJSONData
+  :param idNames: names of the ID attributes
+
+  :return: dict { attrName : value } of the attributes that changed
+  """
+  return dict( ( attrName, value ) for attrName, value in jsonData.iteritems()
+               if attrName not in idNames and not isinstance( value, list )
+               and loadedState.get( attrName ) != value )
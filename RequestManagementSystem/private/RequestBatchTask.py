@@ -0,0 +1,222 @@
+""" :mod: RequestBatchTask
+
+    ======================
+
+    .. module: RequestBatchTask
+
+    :synopsis: processing of several requests sharing the same waiting operation
+
+    Task to be used inside ProcessTask created in RequestExecutingAgent, for requests of the same owner
+    whose waiting operations have the same type, source and target SEs and catalogs.
+
+    The waiting files of all these operations are put in a single operation, processed by one call to
+    the operation handler, so that the proxy, catalog and SE setup as well as the bulk DataManager calls
+    are done once for all the requests. The results are then copied back to the files of each request,
+    and the remaining operations of each request are executed as in RequestTask.
+"""
+__RCSID__ = "$Id $"
+
+# # imports
+import os
+# # from DIRAC
+from DIRAC import S_OK, S_ERROR, gLogger
+from DIRAC.FrameworkSystem.Client.MonitoringClient import gMonitor
+from DIRAC.RequestManagementSystem.Client.Request import Request
+from DIRAC.RequestManagementSystem.Client.Operation import Operation
+from DIRAC.RequestManagementSystem.Client.File import File
+from DIRAC.RequestManagementSystem.private.RequestTask import RequestTask
+
+########################################################################
+class RequestBatchTask( RequestTask ):
+  """
+  .. class:: RequestBatchTask
+
+  processing task for a batch of requests
+  """
+  # # File attributes that the handlers may set, copied back to the requests
+  FILE_ATTRIBUTES = ( "PFN", "Checksum", "ChecksumType", "GUID", "Size" )
+
+  def __init__( self, requestsJSON, handlersDict, csPath, agentName, standalone = False, requestClient = None ):
+    """c'tor
+
+    :param self: self reference
+    :param list requestsJSON: requests serialized to JSON, all of the same owner
+    :param dict handlersDict: operation handlers
+    """
+    RequestTask.__init__( self, requestsJSON[0], handlersDict, csPath, agentName,
+                          standalone = standalone, requestClient = requestClient )
+    self.requests = [ self.request ] + [ Request( requestJSON ) for requestJSON in requestsJSON[1:] ]
+    self.log = gLogger.getSubLogger( "pid_%s/batch_%s" % ( os.getpid(), self.request.RequestName ) )
+
+  def __setRequest( self, request ):
+    """ make :request: the current one for the RequestTask methods """
+    self.request = request
+    self.log = gLogger.getSubLogger( "pid_%s/%s" % ( os.getpid(), request.RequestName ) )
+
+  def __call__( self ):
+    """ batch processing
+
+    :return: S_OK( { RequestID : S_OK( Request ) / S_ERROR } )
+    """
+    self.log.debug( "about to execute %d requests" % len( self.requests ) )
+    gMonitor.addMark( "RequestAtt", len( self.requests ) )
+
+    # # same owner for all: only one proxy to set up
+    setupProxy = self.setupProxy()
+    if not setupProxy["OK"]:
+      for request in self.requests:
+        self.__setRequest( request )
+        self.failOnProxyError( setupProxy["Message"] )
+      return S_OK( dict( ( request.RequestID, S_OK( request ) ) for request in self.requests ) )
+    shifter = setupProxy["Value"]["Shifter"]
+    proxyFile = setupProxy["Value"]["ProxyFile"]
+
+    results = {}
+    batch = self.executeBatchOperation( shifter )
+    if not batch["OK"]:
+      results = dict( ( request.RequestID, batch ) for request in self.requests )
+    else:
+      # # carry on with the requests, as a RequestTask would do
+      for request in self.requests:
+        self.__setRequest( request )
+        if request.Status == "Waiting" and request.getWaiting()["Value"] not in batch["Value"]:
+          executed = self.executeOperations( shifter )
+          if not executed["OK"]:
+            results[request.RequestID] = executed
+
+    # # not a shifter at all? delete temp proxy file
+    if not shifter:
+      os.unlink( proxyFile )
+
+    gMonitor.flush()
+
+    for request in self.requests:
+      if request.RequestID not in results:
+        self.__setRequest( request )
+        results[request.RequestID] = self.finalizeRequest()
+    return S_OK( results )
+
+  def executeBatchOperation( self, shifter ):
+    """ execute the waiting operation of all the requests with a single handler call
+
+    :param list shifter: shifters matching the requests owner
+    :return: S_OK( list of the operations that have still to be executed ) or S_ERROR
+    """
+    operations = [ request.getWaiting()["Value"] for request in self.requests ]
+    template = operations[0]
+
+    # # a request only holding the operation, as handlers need its parent
+    batchRequest = Request()
+    batchRequest.RequestName = "batch_of_%d_requests" % len( self.requests )
+    batchRequest.OwnerDN = self.request.OwnerDN
+    batchRequest.OwnerGroup = self.request.OwnerGroup
+    batchOperation = self.__newOperation( template )
+    batchRequest.addOperation( batchOperation )
+    notBefore = batchRequest.NotBefore
+
+    # # one file per LFN, the same LFN can be in several requests
+    filesPerLFN = {}
+    for operation in operations:
+      for opFile in operation:
+        if opFile.Status == "Waiting":
+          filesPerLFN.setdefault( opFile.LFN, [] ).append( opFile )
+    batchFiles = []
+    for lfn, opFiles in filesPerLFN.iteritems():
+      batchFile = File()
+      batchFile.LFN = lfn
+      for attrName in self.FILE_ATTRIBUTES + ( "Error", ):
+        setattr( batchFile, attrName, getattr( opFiles[0], attrName ) )
+      batchFile.Attempt = max( opFile.Attempt for opFile in opFiles )
+      batchOperation.addFile( batchFile )
+      batchFiles.append( ( batchFile, batchFile.Attempt, opFiles ) )
+
+    self.log.info( "executing operation '%s' for %d files of %d requests" % ( batchOperation.Type,
+                                                                              len( batchFiles ),
+                                                                              len( self.requests ) ) )
+    pluginName = self.getPluginName( self.handlersDict.get( batchOperation.Type ) )
+    try:
+      if pluginName:
+        gMonitor.addMark( "%s%s" % ( pluginName, "Att" ), len( operations ) )
+      exe = self.executeHandler( batchOperation, shifter )
+      if not exe["OK"]:
+        self.log.error( "unable to process operation %s: %s" % ( batchOperation.Type, exe["Message"] ) )
+        for operation in operations:
+          operation.Error = exe["Message"]
+        return S_OK( operations )
+      exe = exe["Value"]
+    except Exception, error:
+      self.log.exception( "hit by exception: %s" % str( error ) )
+      if pluginName:
+        gMonitor.addMark( "%s%s" % ( pluginName, "Fail" ), len( operations ) )
+      gMonitor.addMark( "RequestFail", len( operations ) )
+      return S_ERROR( error )
+
+    # # fan the results out to the files of each request
+    for batchFile, attempt, opFiles in batchFiles:
+      for opFile in opFiles:
+        opFile.Attempt += batchFile.Attempt - attempt
+        for attrName in self.FILE_ATTRIBUTES:
+          if getattr( opFile, attrName ) != getattr( batchFile, attrName ):
+            setattr( opFile, attrName, getattr( batchFile, attrName ) )
+        opFile.Error = batchFile.Error
+        if opFile.Status != batchFile.Status:
+          opFile.Status = batchFile.Status
+
+    for request, operation in zip( self.requests, operations ):
+      self.__setRequest( request )
+      # # the status of an operation with files follows the statuses of its files, already copied
+      failedFiles = [ opFile for opFile in operation if opFile.Status == "Failed" ]
+      if batchOperation.Error and failedFiles:
+        operation.Error = batchOperation.Error
+      if batchOperation.Status == "Failed" and not len( operation ):
+        operation.Status = "Failed"
+      if batchRequest.NotBefore != notBefore:
+        request.NotBefore = batchRequest.NotBefore
+      self.__copyNewOperations( batchRequest, batchOperation, request, operation )
+      if not exe["OK"]:
+        self.log.error( "unable to process operation %s: %s" % ( operation.Type, exe["Message"] ) )
+        if pluginName:
+          gMonitor.addMark( "%s%s" % ( pluginName, "Fail" ), 1 )
+        gMonitor.addMark( "RequestFail", 1 )
+        self.checkJobExists( operation )
+      # # operation status check
+      if operation.Status == "Done" and pluginName:
+        gMonitor.addMark( "%s%s" % ( pluginName, "OK" ), 1 )
+      elif operation.Status == "Failed" and pluginName:
+        gMonitor.addMark( "%s%s" % ( pluginName, "Fail" ), 1 )
+
+    # # as in RequestTask, only carry on after a successful operation
+    return S_OK( [ operation for operation in operations if operation.Status != "Done" ] )
+
+  @staticmethod
+  def __newOperation( operation ):
+    """ an Operation without files, with the same type, SEs, catalogs and arguments as :operation: """
+    newOperation = Operation()
+    for attrName in ( "Type", "SourceSE", "TargetSE", "Catalog", "Arguments" ):
+      value = getattr( operation, attrName )
+      if value:
+        setattr( newOperation, attrName, value )
+    return newOperation
+
+  @staticmethod
+  def __copyNewOperations( batchRequest, batchOperation, request, operation ):
+    """ operations inserted by the handler (e.g. registration of the replicas) go to the request,
+        with the files of this request only
+    """
+    lfns = set( opFile.LFN for opFile in operation )
+    previous = operation
+    for newOperation in batchRequest:
+      if newOperation is batchOperation:
+        continue
+      newFiles = [ opFile for opFile in newOperation if opFile.LFN in lfns ]
+      if not newFiles:
+        continue
+      copyOperation = RequestBatchTask.__newOperation( newOperation )
+      for newFile in newFiles:
+        copyFile = File()
+        copyFile.LFN = newFile.LFN
+        for attrName in RequestBatchTask.FILE_ATTRIBUTES + ( "Error", ):
+          setattr( copyFile, attrName, getattr( newFile, attrName ) )
+        copyOperation.addFile( copyFile )
+      request.insertAfter( copyOperation, previous )
+      previous = copyOperation
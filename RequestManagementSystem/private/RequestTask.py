@@ -242,7 +242,8 @@ class RequestTask( object ):
 
   def updateRequest( self ):
     """ put back request to the RequestDB """
-    updateRequest = self.requestClient.putRequest( self.request, useFailoverProxy = False, retryMainService = 2 )
+    updateRequest = self.requestClient.putRequest( self.request, useFailoverProxy = False, retryMainService = 2,
+                                                   useDelta = True )
     if not updateRequest["OK"]:
       self.log.error( updateRequest["Message"] )
     return updateRequest
@@ -256,21 +257,96 @@ class RequestTask( object ):
     # # setup proxy for request owner
     setupProxy = self.setupProxy()
     if not setupProxy["OK"]:
-      self.request.Error = setupProxy["Message"]
-      if 'has no proxy registered' in setupProxy["Message"]:
-        self.log.error( 'Request set to Failed:', setupProxy["Message"] )
-        # If user is no longer registered, fail the request
-        for operation in self.request:
-          for opFile in operation:
-            opFile.Status = 'Failed'
-          operation.Status = 'Failed'
-      else:
-        self.log.error( setupProxy["Message"] )
+      self.failOnProxyError( setupProxy["Message"] )
       return S_OK( self.request )
     shifter = setupProxy["Value"]["Shifter"]
     proxyFile = setupProxy["Value"]["ProxyFile"]
 
-    error = None
+    executed = self.executeOperations( shifter )
+
+    # # not a shifter at all? delete temp proxy file
+    if not shifter:
+      os.unlink( proxyFile )
+
+    gMonitor.flush()
+
+    if not executed["OK"]:
+      return executed
+
+    return self.finalizeRequest()
+
+  def failOnProxyError( self, error ):
+    """ set the request error when the owner proxy could not be set up,
+        and fail it if its owner is not registered anymore
+
+    :param str error: error message
+    """
+    self.request.Error = error
+    if 'has no proxy registered' in error:
+      self.log.error( 'Request set to Failed:', error )
+      # If user is no longer registered, fail the request
+      for operation in self.request:
+        for opFile in operation:
+          opFile.Status = 'Failed'
+        operation.Status = 'Failed'
+    else:
+      self.log.error( error )
+
+  def executeHandler( self, operation, shifter ):
+    """ execute the handler of an operation with the request owner proxy
+
+    :param ~Operation.Operation operation: Operation instance
+    :param list shifter: shifters matching the request owner
+    :return: S_OK( handler result ) or S_ERROR if there is no handler
+    :raises: whatever the handler raises
+    """
+    handler = self.getHandler( operation )
+    if not handler["OK"]:
+      return handler
+    handler = handler["Value"]
+    # # set shifters list in the handler
+    handler.shifter = shifter
+    if self.standalone:
+      useServerCertificate = gConfig.useServerCertificate()
+    else:
+      # Always use server certificates if executed within an agent
+      useServerCertificate = True
+    # Always use request owner proxy
+    if useServerCertificate:
+      gConfigurationData.setOptionInCFG( '/DIRAC/Security/UseServerCertificate', 'false' )
+    try:
+      exe = handler()
+    finally:
+      if useServerCertificate:
+        gConfigurationData.setOptionInCFG( '/DIRAC/Security/UseServerCertificate', 'true' )
+    return S_OK( exe )
+
+  def checkJobExists( self, operation ):
+    """ fail the operation if the job of the request does not exist anymore
+
+    :param ~Operation.Operation operation: Operation instance that just failed
+    """
+    if not self.request.JobID:
+      return
+    # Check if the job exists
+    monitorServer = RPCClient( "WorkloadManagement/JobMonitoring", useCertificates = True )
+    res = monitorServer.getJobPrimarySummary( int( self.request.JobID ) )
+    if not res["OK"]:
+      self.log.error( "RequestTask: Failed to get job %d status" % self.request.JobID )
+    elif not res['Value']:
+      self.log.warn( "RequestTask: job %d does not exist (anymore): failed request" % self.request.JobID )
+      for opFile in operation:
+        opFile.Status = 'Failed'
+      if operation.Status != 'Failed':
+        operation.Status = 'Failed'
+      self.request.Error = 'Job no longer exists'
+
+  def executeOperations( self, shifter ):
+    """ execute the waiting operations of the request, until one is not done
+
+    :param list shifter: shifters matching the request owner
+    :return: S_OK, or S_ERROR if there is no waiting operation
+    """
     while self.request.Status == "Waiting":
 
       # # get waiting operation
@@ -281,58 +357,29 @@ class RequestTask( object ):
       operation = operation["Value"]
       self.log.info( "executing operation #%s '%s'" % ( operation.Order, operation.Type ) )
 
-      # # and handler for it
-      handler = self.getHandler( operation )
-      if not handler["OK"]:
-        self.log.error( "unable to process operation %s: %s" % ( operation.Type, handler["Message"] ) )
-        # gMonitor.addMark( "%s%s" % ( operation.Type, "Fail" ), 1 )
-        operation.Error = handler["Message"]
-        break
-
-      handler = handler["Value"]
-      # # set shifters list in the handler
-      handler.shifter = shifter
-      # # and execute
+      # # and execute its handler
       pluginName = self.getPluginName( self.handlersDict.get( operation.Type ) )
-      if self.standalone:
-        useServerCertificate = gConfig.useServerCertificate()
-      else:
-        # Always use server certificates if executed within an agent
-        useServerCertificate = True
       try:
         if pluginName:
           gMonitor.addMark( "%s%s" % ( pluginName, "Att" ), 1 )
-        # Always use request owner proxy
-        if useServerCertificate:
-          gConfigurationData.setOptionInCFG( '/DIRAC/Security/UseServerCertificate', 'false' )
-        exe = handler()
-        if useServerCertificate:
-          gConfigurationData.setOptionInCFG( '/DIRAC/Security/UseServerCertificate', 'true' )
+        exe = self.executeHandler( operation, shifter )
+        if not exe["OK"]:
+          self.log.error( "unable to process operation %s: %s" % ( operation.Type, exe["Message"] ) )
+          # gMonitor.addMark( "%s%s" % ( operation.Type, "Fail" ), 1 )
+          operation.Error = exe["Message"]
+          break
+        exe = exe["Value"]
         if not exe["OK"]:
           self.log.error( "unable to process operation %s: %s" % ( operation.Type, exe["Message"] ) )
           if pluginName:
             gMonitor.addMark( "%s%s" % ( pluginName, "Fail" ), 1 )
           gMonitor.addMark( "RequestFail", 1 )
-          if self.request.JobID:
-            # Check if the job exists
-            monitorServer = RPCClient( "WorkloadManagement/JobMonitoring", useCertificates = True )
-            res = monitorServer.getJobPrimarySummary( int( self.request.JobID ) )
-            if not res["OK"]:
-              self.log.error( "RequestTask: Failed to get job %d status" % self.request.JobID )
-            elif not res['Value']:
-              self.log.warn( "RequestTask: job %d does not exist (anymore): failed request" % self.request.JobID )
-              for opFile in operation:
-                opFile.Status = 'Failed'
-              if operation.Status != 'Failed':
-                operation.Status = 'Failed'
-              self.request.Error = 'Job no longer exists'
+          self.checkJobExists( operation )
       except Exception, error:
         self.log.exception( "hit by exception: %s" % str( error ) )
         if pluginName:
           gMonitor.addMark( "%s%s" % ( pluginName, "Fail" ), 1 )
         gMonitor.addMark( "RequestFail", 1 )
-        if useServerCertificate:
-          gConfigurationData.setOptionInCFG( '/DIRAC/Security/UseServerCertificate', 'true' )
         break
 
       # # operation status check
@@ -344,15 +391,13 @@ class RequestTask( object ):
         # # no update for waiting or all files scheduled
         break
 
-    # # not a shifter at all? delete temp proxy file
-    if not shifter:
-      os.unlink( proxyFile )
-
-    gMonitor.flush()
+    return S_OK()
 
-    if error:
-      return S_ERROR( error )
+  def finalizeRequest( self ):
+    """ put back the request if it is done, and finalize its job if any
 
+    :return: S_OK( request ) or S_ERROR
+    """
     # # request done?
     if self.request.Status == "Done":
       # # update request to the RequestDB
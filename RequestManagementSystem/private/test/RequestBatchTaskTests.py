@@ -0,0 +1,128 @@
+""" :mod: RequestBatchTaskTests
+    =======================
+
+    .. module: RequestBatchTaskTests
+    :synopsis: test cases for RequestBatchTask class
+
+    test cases for RequestBatchTask class
+"""
+__RCSID__ = "$Id $"
+
+# # imports
+import unittest
+import importlib
+from mock import MagicMock
+# # from DIRAC
+from DIRAC import S_OK
+from DIRAC.RequestManagementSystem.Client.Request import Request
+from DIRAC.RequestManagementSystem.Client.Operation import Operation
+from DIRAC.RequestManagementSystem.Client.File import File
+# # SUT
+from DIRAC.RequestManagementSystem.private.RequestBatchTask import RequestBatchTask
+
+########################################################################
+class RequestBatchTaskTests( unittest.TestCase ):
+  """
+  .. class:: RequestBatchTaskTests
+
+  """
+
+  def setUp( self ):
+    """ test case set up """
+    self.handlersDict = { "RemoveFile" : "DIRAC/DataManagementSystem/Agent/RequestOperations/RemoveFile" }
+    self.requests = []
+    for reqID, lfns in ( ( 1, [ "/a/b/1", "/a/b/2" ] ), ( 2, [ "/a/b/2", "/a/b/3" ] ) ):
+      req = Request()
+      req.RequestName = "batch%s" % reqID
+      req.OwnerGroup = "lhcb_user"
+      req.OwnerDN = "/DC=ch/DC=cern/CN=someone"
+      op = Operation( { "Type": "RemoveFile" } )
+      for lfn in lfns:
+        op.addFile( File( { "LFN" : lfn } ) )
+      req.addOperation( op )
+      req.RequestID = reqID
+      self.requests.append( req )
+
+    rt = importlib.import_module( 'DIRAC.RequestManagementSystem.private.RequestTask' )
+    rt.gMonitor = MagicMock()
+    rt.Operations = MagicMock()
+    rt.CS = MagicMock()
+    rbt = importlib.import_module( 'DIRAC.RequestManagementSystem.private.RequestBatchTask' )
+    rbt.gMonitor = MagicMock()
+
+    self.task = RequestBatchTask( [ req.toJSON()["Value"] for req in self.requests ], self.handlersDict,
+                                  'csPath', 'RequestManagement/RequestExecutingAgent', requestClient = MagicMock() )
+    self.task.setupProxy = MagicMock( return_value = S_OK( { "Shifter" : [ "DataManager" ], "ProxyFile" : "/tmp/proxy" } ) )
+    self.task.updateRequest = MagicMock( return_value = S_OK() )
+    self.handledOperations = []
+
+  def tearDown( self ):
+    """ test case tear down """
+    del self.task
+    del self.requests
+
+  def executeHandler( self, operation, _shifter ):
+    """ removes everything but /a/b/3 """
+    self.handledOperations.append( operation )
+    for opFile in operation:
+      opFile.Attempt += 1
+      if opFile.LFN == "/a/b/3":
+        opFile.Error = "no way"
+      else:
+        opFile.Status = "Done"
+    return S_OK( S_OK() )
+
+  def testBatch( self ):
+    """ one handler call for both requests, results fanned out """
+    self.task.executeHandler = self.executeHandler
+    ret = self.task()
+    self.assertEqual( ret["OK"], True )
+    self.assertEqual( sorted( ret["Value"] ), [ 1, 2 ] )
+    self.assertEqual( len( self.handledOperations ), 1 )
+    # # the same LFN is only processed once
+    self.assertEqual( sorted( opFile.LFN for opFile in self.handledOperations[0] ), [ "/a/b/1", "/a/b/2", "/a/b/3" ] )
+
+    req1 = ret["Value"][1]["Value"]
+    req2 = ret["Value"][2]["Value"]
+    self.assertEqual( req1.Status, "Done" )
+    self.assertEqual( [ opFile.Status for opFile in req2[0] ], [ "Done", "Waiting" ] )
+    self.assertEqual( [ opFile.Attempt for opFile in req2[0] ], [ 1, 1 ] )
+    self.assertEqual( req2[0][1].Error, "no way" )
+    self.assertEqual( req2.Status, "Waiting" )
+    # # only the done request is put back by the task
+    self.assertEqual( self.task.updateRequest.call_count, 1 )
+
+  def failingHandler( self, operation, _shifter ):
+    """ removes /a/b/2, /a/b/1 is to be retried and /a/b/3 fails for good """
+    self.handledOperations.append( operation )
+    for opFile in operation:
+      if opFile.LFN == "/a/b/3":
+        opFile.Error = "no way"
+        opFile.Status = "Failed"
+      elif opFile.LFN == "/a/b/2":
+        opFile.Status = "Done"
+    operation.Error = "some files failed"
+    return S_OK( S_OK() )
+
+  def testBatchFailed( self ):
+    """ only the operations with a failed file get the error of the batch """
+    self.task.executeHandler = self.failingHandler
+    ret = self.task()
+    self.assertEqual( ret["OK"], True )
+    req1 = ret["Value"][1]["Value"]
+    req2 = ret["Value"][2]["Value"]
+    self.assertEqual( [ opFile.Status for opFile in req1[0] ], [ "Waiting", "Done" ] )
+    self.assertFalse( req1[0].Error )
+    self.assertEqual( req1.Status, "Waiting" )
+    self.assertEqual( [ opFile.Status for opFile in req2[0] ], [ "Done", "Failed" ] )
+    self.assertEqual( req2[0].Status, "Failed" )
+    self.assertEqual( req2[0].Error, "some files failed" )
+    self.assertEqual( req2.Status, "Failed" )
+
+
+# # tests execution
+if __name__ == "__main__":
+  testLoader = unittest.TestLoader()
+  requestBatchTaskTests = testLoader.loadTestsFromTestCase( RequestBatchTaskTests )
+  suite = unittest.TestSuite( [ requestBatchTaskTests ] )
+  unittest.TextTestRunner( verbosity = 3 ).run( suite )
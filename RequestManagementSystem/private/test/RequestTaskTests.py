@@ -81,6 +81,27 @@ class RequestTaskTests( unittest.TestCase ):
     ret = self.task.setupProxy()
     print ret
 
+  def testHandlerException( self ):
+    """ a handler raising stops the execution, the request is still given back """
+    rt = importlib.import_module( 'DIRAC.RequestManagementSystem.private.RequestTask' )
+    rt.gMonitor = MagicMock()
+    self.req.addOperation( Operation( { "Type": "ForwardDISET", "Arguments" : "tts10:helloWorldee" } ) )
+    self.task = RequestTask( self.req.toJSON()["Value"], self.handlersDict, 'csPath', 'RequestManagement/RequestExecutingAgent',
+                             requestClient = self.mockRC )
+    self.task.executeHandler = Mock( side_effect = RuntimeError( "handler crashed" ) )
+    ret = self.task.executeOperations( [] )
+    self.assertEqual( ret["OK"], True )
+    self.assertEqual( self.task.executeHandler.call_count, 1 )
+    self.assertEqual( self.task.request.Status, "Waiting" )
+
+    # # the request is finalized and returned, with its changes
+    self.task.setupProxy = Mock( return_value = { "OK" : True, "Value" : { "Shifter" : [ "DataManager" ],
+                                                                          "ProxyFile" : "/tmp/proxy" } } )
+    self.task.request[0].Status = "Done"
+    ret = self.task()
+    self.assertEqual( ret["OK"], True )
+    self.assertEqual( ret["Value"][0].Status, "Done" )
+
 
 # # tests execution
 if __name__ == "__main__":
@@ -2,6 +2,9 @@
 """
 
 # imports
+import os
+import shutil
+import tempfile
 import unittest
 import importlib
 from mock import MagicMock
@@ -51,9 +54,16 @@ class TestCase( unittest.TestCase ):
     self.action.am_getOption = self.mockAM
     self.agent.log.setLevel( 'DEBUG' )
 
+    # The cache file of the action, read by the agent, in a directory of the test
+    self.cacheDir = tempfile.mkdtemp()
+    self.action.cacheFile = self.agent.cacheFile = os.path.join( self.cacheDir, 'cache.db' )
+
     self.tc_mock = MagicMock()
     self.tm_mock = MagicMock()
 
+  def tearDown( self ):
+    shutil.rmtree( self.cacheDir )
+
 
 class EmailActionSuccess(TestCase):
 
@@ -65,6 +75,7 @@ class EmailAgentSuccess(TestCase):
 
   def test__getData( self ):
     self.agent.diracAdmin = MagicMock()
+    self.assertTrue( self.action.run()['OK'] )
     res = self.agent.execute()
     self.assertTrue( res['OK'] )
 
@@ -24,7 +24,8 @@ class FileCatalogClient( FileCatalogClientBase ):
                    'findDirectoriesByMetadata','getReplicasByMetadata','findFilesByMetadataDetailed',
                    'findFilesByMetadataWeb','getCompatibleMetadata','getMetadataSet', 'getDatasets',
                    'getFileDescendents', 'getFileAncestors', 'getDirectoryUserMetadata', 'getFileUserMetadata',
-                   'checkDataset', 'getDatasetParameters', 'getDatasetFiles', 'getDatasetAnnotation']
+                   'checkDataset', 'getDatasetParameters', 'getDatasetFiles', 'getDatasetAnnotation',
+                   'getFileChanges']
 
   WRITE_METHODS = ['createLink', 'removeLink', 'addFile', 'setFileStatus', 'addReplica', 'removeReplica',
                    'removeFile', 'setReplicaStatus', 'setReplicaHost', 'setReplicaProblematic', 'createDirectory',
@@ -38,7 +39,8 @@ class FileCatalogClient( FileCatalogClientBase ):
                     'setMetadataBulk','removeMetadata','getDirectoryUserMetadata','findDirectoriesByMetadata',
                     'getReplicasByMetadata','findFilesByMetadataDetailed','findFilesByMetadataWeb',
                     'getCompatibleMetadata', 'addMetadataSet', 'getMetadataSet', 'getFileUserMetadata', 'getLFNForGUID',
-                    'addUser', 'deleteUser', 'addGroup', 'deleteGroup', 'repairCatalog', 'rebuildDirectoryUsage' ]
+                    'addUser', 'deleteUser', 'addGroup', 'deleteGroup', 'repairCatalog', 'rebuildDirectoryUsage',
+                    'getFileChanges' ]
 
   ADMIN_METHODS = [ 'addUser', 'deleteUser', 'addGroup', 'deleteGroup', 'getUsers', 'getGroups',
                     'getCatalogCounters', 'repairCatalog', 'rebuildDirectoryUsage' ]
@@ -553,6 +555,12 @@ class FileCatalogClient( FileCatalogClientBase ):
 
 
 
+  def getFileChanges( self, fromLogID, maxEntries, timeout = 120 ):
+    """ Get the files added or whose metadata were set after a given entry of the change log
+    """
+    return self._getRPC( timeout = timeout ).getFileChanges( fromLogID, maxEntries )
+
+
   def getCompatibleMetadata( self, metaDict, path = '/', timeout = 120 ):
     """ Get metadata values compatible with the given metadata subset
     """
@@ -21,39 +21,56 @@ def getFilesToStage( lfnList, jobState = None, checkOnlyTapeSEs = None, jobLog =
   if not lfnList:
     return S_OK( {'onlineLFNs':[], 'offlineLFNs': {}, 'failedLFNs':[], 'absentLFNs':{}} )
 
-  dm = DataManager()
   if isinstance( lfnList, basestring ):
     lfnList = [lfnList]
 
-  lfnListReplicas = dm.getReplicasForJobs( lfnList, getUrl = False )
+  result = getFilesToStageForJobs( { None : lfnList }, jobState = jobState,
+                                   checkOnlyTapeSEs = checkOnlyTapeSEs, jobLog = jobLog )
+  if not result['OK']:
+    return result
+  return result['Value'][None]
+
+def getFilesToStageForJobs( jobLFNs, jobState = None, checkOnlyTapeSEs = None, jobLog = None ):
+  """ Same as getFilesToStage for several lists of LFNs ( e.g. jobID -> input data of the job ),
+      looking up each distinct file only once in the catalog and at the SEs.
+      If given, the credentials of the owner of jobState are used for all the lists.
+
+      Returns S_OK( { key : result of getFilesToStage for the LFNs of key } )
+  """
+  lfnSet = set( lfn for lfnList in jobLFNs.itervalues() for lfn in lfnList )
+  if not lfnSet:
+    return S_OK( dict( ( key, getFilesToStage( [] ) ) for key in jobLFNs ) )
+
+  dm = DataManager()
+  lfnListReplicas = dm.getReplicasForJobs( list( lfnSet ), getUrl = False )
   if not lfnListReplicas['OK']:
     return lfnListReplicas
+  catalogFailed = lfnListReplicas['Value']['Failed']
+  lfnListReplicas = lfnListReplicas['Value']['Successful']
 
-  offlineLFNsDict = {}
-  onlineLFNs = {}
-  offlineLFNs = {}
-  absentLFNs = {}
-  failedLFNs = set()
-  if lfnListReplicas['Value']['Failed']:
-    # Check if files are not existing
-    for lfn, reason in lfnListReplicas['Value']['Failed'].iteritems():
-      # FIXME: awful check until FC returns a proper error
-      if cmpError( reason, errno.ENOENT ) or 'No such file' in reason:
-        # The file doesn't exist, job must be Failed
-        # FIXME: it is not possible to return here an S_ERROR(), return the message only
-        absentLFNs[lfn] = S_ERROR( errno.ENOENT, 'File not in FC' )['Message']
-    if absentLFNs:
-      return S_OK( {'onlineLFNs':list( onlineLFNs ), 'offlineLFNs': offlineLFNsDict, 'failedLFNs':list( failedLFNs ), 'absentLFNs':absentLFNs} )
-    return S_ERROR( "Failures in getting replicas" )
+  # Lists with files not properly resolved in the catalog are not checked at the SEs
+  lfnsNotChecked = set()
+  if catalogFailed:
+    lfnsToCheck = set()
+    for lfnList in jobLFNs.itervalues():
+      if set( lfnList ) & set( catalogFailed ):
+        lfnsNotChecked.update( lfnList )
+      else:
+        lfnsToCheck.update( lfnList )
+    lfnsNotChecked -= lfnsToCheck
 
-  lfnListReplicas = lfnListReplicas['Value']['Successful']
   # If a file is reported here at a tape SE, it is not at a disk SE as we use disk in priority
   # We shall check all file anyway in order to make sure they exist
   seToLFNs = dict()
   for lfn, ses in lfnListReplicas.iteritems():
+    if lfn in lfnsNotChecked:
+      continue
     for se in ses:
       seToLFNs.setdefault( se, list() ).append( lfn )
 
+  onlineLFNs = {}
+  offlineLFNs = {}
+  absentLFNs = {}
   if seToLFNs:
     if jobState:
       # Get user name and group from the job state
@@ -78,32 +95,62 @@ def getFilesToStage( lfnList, jobState = None, checkOnlyTapeSEs = None, jobLog =
 
     if not result['OK']:
       return result
-    failedLFNs = set( lfnList ) - set( onlineLFNs ) - set( offlineLFNs ) - set( absentLFNs )
-
-    # Get the online SEs
-    dmsHelper = DMSHelpers()
-    onlineSEs = set( se for ses in onlineLFNs.values() for se in ses )
-    onlineSites = set( dmsHelper.getLocalSiteForSE( se ).get( 'Value' ) for se in onlineSEs ) - {None}
-    for lfn in offlineLFNs:
-      ses = offlineLFNs[lfn]
-      if len( ses ) == 1:
-        # No choice, let's go
-        offlineLFNsDict.setdefault( ses[0], list() ).append( lfn )
-        continue
-      # Try and get an SE at a site already with online files
-      found = False
-      if onlineSites:
-        # If there is at least one online site, select one
-        for se in ses:
-          site = dmsHelper.getLocalSiteForSE( se )
-          if site in onlineSites:
-            offlineLFNsDict.setdefault( se, list() ).append( lfn )
-            found = True
-            break
-      # No online site found in common, select randomly
-      if not found:
-        offlineLFNsDict.setdefault( random.choice( ses ), list() ).append( lfn )
 
+  dmsHelper = DMSHelpers()
+  resultDict = {}
+  for key, lfnList in jobLFNs.iteritems():
+    resultDict[key] = _getFilesToStageForList( lfnList, catalogFailed, onlineLFNs, offlineLFNs, absentLFNs,
+                                               dmsHelper )
+  return S_OK( resultDict )
+
+def _getFilesToStageForList( lfnList, catalogFailed, allOnlineLFNs, allOfflineLFNs, allAbsentLFNs, dmsHelper ):
+  """ Build the getFilesToStage result for lfnList out of the status of all the files checked,
+      the lists of SEs are copied as the results of the different lists are handed out separately
+  """
+  lfnSet = set( lfnList )
+  failedInCatalog = lfnSet & set( catalogFailed )
+  if failedInCatalog:
+    absentLFNs = {}
+    # Check if files are not existing
+    for lfn in failedInCatalog:
+      reason = catalogFailed[lfn]
+      # FIXME: awful check until FC returns a proper error
+      if cmpError( reason, errno.ENOENT ) or 'No such file' in reason:
+        # The file doesn't exist, job must be Failed
+        # FIXME: it is not possible to return here an S_ERROR(), return the message only
+        absentLFNs[lfn] = S_ERROR( errno.ENOENT, 'File not in FC' )['Message']
+    if absentLFNs:
+      return S_OK( {'onlineLFNs':[], 'offlineLFNs': {}, 'failedLFNs':[], 'absentLFNs':absentLFNs} )
+    return S_ERROR( "Failures in getting replicas" )
+
+  onlineLFNs = dict( ( lfn, list( allOnlineLFNs[lfn] ) ) for lfn in lfnSet if lfn in allOnlineLFNs )
+  offlineLFNs = dict( ( lfn, list( allOfflineLFNs[lfn] ) ) for lfn in lfnSet if lfn in allOfflineLFNs )
+  absentLFNs = dict( ( lfn, allAbsentLFNs[lfn] ) for lfn in lfnSet if lfn in allAbsentLFNs )
+  failedLFNs = lfnSet - set( onlineLFNs ) - set( offlineLFNs ) - set( absentLFNs )
+
+  # Get the online SEs
+  onlineSEs = set( se for ses in onlineLFNs.values() for se in ses )
+  onlineSites = set( dmsHelper.getLocalSiteForSE( se ).get( 'Value' ) for se in onlineSEs ) - {None}
+  offlineLFNsDict = {}
+  for lfn in offlineLFNs:
+    ses = offlineLFNs[lfn]
+    if len( ses ) == 1:
+      # No choice, let's go
+      offlineLFNsDict.setdefault( ses[0], list() ).append( lfn )
+      continue
+    # Try and get an SE at a site already with online files
+    found = False
+    if onlineSites:
+      # If there is at least one online site, select one
+      for se in ses:
+        site = dmsHelper.getLocalSiteForSE( se ).get( 'Value' )
+        if site in onlineSites:
+          offlineLFNsDict.setdefault( se, list() ).append( lfn )
+          found = True
+          break
+    # No online site found in common, select randomly
+    if not found:
+      offlineLFNsDict.setdefault( random.choice( ses ), list() ).append( lfn )
 
   return S_OK( {'onlineLFNs':list( onlineLFNs ), 'offlineLFNs': offlineLFNsDict, 'failedLFNs':list( failedLFNs ), 'absentLFNs':absentLFNs, 'onlineSites':onlineSites} )
 
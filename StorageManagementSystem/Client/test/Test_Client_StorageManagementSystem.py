@@ -7,7 +7,7 @@ import unittest
 from mock import MagicMock, patch
 
 from DIRAC import S_OK, S_ERROR
-from DIRAC.StorageManagementSystem.Client.StorageManagerClient import getFilesToStage
+from DIRAC.StorageManagementSystem.Client.StorageManagerClient import getFilesToStage, getFilesToStageForJobs
 from DIRAC.DataManagementSystem.Client.test.mock_DM import dm_mock
 import errno
 
@@ -117,6 +117,25 @@ class StorageManagerSuccess( ClientsTestCase ):
     self.assertEqual( res['Value']['absentLFNs'], {} )
     self.assertEqual( res['Value']['failedLFNs'], ['/a/lfn/1.txt'] )
 
+  @patch( "DIRAC.StorageManagementSystem.Client.StorageManagerClient.DataManager", return_value = dm_mock )
+  @patch( "DIRAC.StorageManagementSystem.Client.StorageManagerClient.StorageElement", return_value = mockObjectSE2 )
+  def test_getFilesToStageForJobs( self, _patch, _patched ):
+    """ Test where several jobs share the same file, that is checked only once
+    """
+    mockObjectSE2.getFileMetadata.reset_mock()
+    res = getFilesToStageForJobs( {1:['/a/lfn/2.txt'], 2:['/a/lfn/2.txt']}, checkOnlyTapeSEs = False )
+    self.assertTrue( res['OK'] )
+    self.assertEqual( sorted( res['Value'] ), [1, 2] )
+    for jobRes in res['Value'].values():
+      self.assertTrue( jobRes['OK'] )
+      self.assertEqual( jobRes['Value']['onlineLFNs'], ['/a/lfn/2.txt'] )
+      self.assertEqual( jobRes['Value']['offlineLFNs'], {} )
+    # One call per SE of the replicas, whatever the number of jobs
+    self.assertEqual( mockObjectSE2.getFileMetadata.call_count, 2 )
+    # The results of the jobs are independent
+    res['Value'][1]['Value']['onlineLFNs'].append( '/a/lfn/1.txt' )
+    self.assertEqual( res['Value'][2]['Value']['onlineLFNs'], ['/a/lfn/2.txt'] )
+
 
 if __name__ == '__main__':
   suite = unittest.defaultTestLoader.loadTestsFromTestCase( ClientsTestCase )
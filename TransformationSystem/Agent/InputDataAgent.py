@@ -4,6 +4,11 @@ Update the transformation files of active transformations given an InputDataQuer
 Possibility to speedup the query time by only fetching files that were added since the last iteration.
 Use the CS option RefreshOnly (False by default) and set the DateKey (empty by default) to the meta data
 key set in the DIRAC FileCatalog.
+
+Alternatively, with the CS option UseChangeFeed (False by default), only the entries added to the change log of the
+DIRAC FileCatalog (FileLog option of the service) since the previous cycle are read, and the new files are matched
+against the input data queries in memory. A full query is still made for a transformation the first time it is seen,
+every FullUpdatePeriod seconds, and after its files could not be added.
 '''
 
 import time
@@ -15,6 +20,7 @@ from DIRAC.Core.Base.AgentModule                             import AgentModule
 from DIRAC.TransformationSystem.Client.TransformationClient  import TransformationClient
 from DIRAC.Resources.Catalog.FileCatalogClient               import FileCatalogClient
 from DIRAC.ConfigurationSystem.Client.Helpers.Operations     import Operations
+from DIRAC.DataManagementSystem.Client.MetaQuery             import MetaQuery
 
 __RCSID__ = "$Id$"
 
@@ -35,6 +41,10 @@ class InputDataAgent( AgentModule ):
     self.fullUpdatePeriod = self.am_getOption( 'FullUpdatePeriod', 86400 )
     self.refreshonly = self.am_getOption( 'RefreshOnly', False )
     self.dateKey = self.am_getOption( 'DateKey', None )
+    self.useChangeFeed = self.am_getOption( 'UseChangeFeed', False )
+    self.changeFeedChunkSize = self.am_getOption( 'ChangeFeedChunkSize', 10000 )
+    # Last entry of the catalog change log already consumed
+    self.lastLogID = None
 
     self.transClient = TransformationClient()
     self.metadataClient = FileCatalogClient()
@@ -74,7 +84,13 @@ class InputDataAgent( AgentModule ):
       gLogger.error( "InputDataAgent.execute: Failed to get transformations.", result['Message'] )
       return S_OK()
 
+    # Changes of the catalog since the last cycle, None if only full queries can be made
+    changes = None
+    if self.useChangeFeed:
+      changes = self.__getCatalogChanges()
+
     # Process each transformation
+    processed = set()
     for transDict in result['Value']:
       transID = long( transDict['TransformationID'] )
       res = self.transClient.getTransformationInputDataQuery( transID )
@@ -83,44 +99,46 @@ class InputDataAgent( AgentModule ):
           gLogger.info( "InputDataAgent.execute: No input data query found for transformation %d" % transID )
         else:
           gLogger.error( "InputDataAgent.execute: Failed to get input data query for %d" % transID, res['Message'] )
+        self.fullTimeLog.pop( transID, None )
         continue
       inputDataQuery = res['Value']
+      processed.add( transID )
 
-      if self.refreshonly:
-        # Determine the correct time stamp to use for this transformation
-        if self.timeLog.has_key( transID ):
-          if self.fullTimeLog.has_key( transID ):
-            # If it is more than a day since the last reduced query, make a full query just in case
-            if ( datetime.datetime.utcnow() - self.fullTimeLog[transID] ) < datetime.timedelta( seconds = self.fullUpdatePeriod ):
-              timeStamp = self.timeLog[transID]
-              if self.dateKey:
-                inputDataQuery[self.dateKey] = ( timeStamp - datetime.timedelta( seconds = 10 ) ).strftime( '%Y-%m-%d %H:%M:%S' )
-              else:
-                gLogger.error( "DateKey was not set in the CS, cannot use the RefreshOnly" )
-            else:
-              self.fullTimeLog[transID] = datetime.datetime.utcnow()
-        self.timeLog[transID] = datetime.datetime.utcnow()
-        if not self.fullTimeLog.has_key( transID ):
+      lfnList = None
+      if changes is not None and transID in self.fullTimeLog and \
+         ( datetime.datetime.utcnow() - self.fullTimeLog[transID] ) < datetime.timedelta( seconds = self.fullUpdatePeriod ):
+        start = time.time()
+        lfnList = self.__matchChanges( inputDataQuery, changes )
+        gLogger.verbose( "Change log matching time: %.2f seconds." % ( time.time() - start ) )
+        if lfnList is not None:
+          gLogger.info( "%d new files for transformation %d in the catalog change log" % ( len( lfnList ), transID ) )
+
+      if lfnList is None:
+        if self.useChangeFeed:
           self.fullTimeLog[transID] = datetime.datetime.utcnow()
+        elif self.refreshonly:
+          self.__setDateKey( transID, inputDataQuery )
 
-      # Perform the query to the metadata catalog
-      gLogger.verbose( "Using input data query for transformation %d: %s" % ( transID, str( inputDataQuery ) ) )
-      start = time.time()
-      result = self.metadataClient.findFilesByMetadata( inputDataQuery )
-      rtime = time.time() - start
-      gLogger.verbose( "Metadata catalog query time: %.2f seconds." % ( rtime ) )
-      if not result['OK']:
-        gLogger.error( "InputDataAgent.execute: Failed to get response from the metadata catalog", result['Message'] )
-        continue
-      lfnList = result['Value']
+        # Perform the query to the metadata catalog
+        gLogger.verbose( "Using input data query for transformation %d: %s" % ( transID, str( inputDataQuery ) ) )
+        start = time.time()
+        result = self.metadataClient.findFilesByMetadata( inputDataQuery )
+        rtime = time.time() - start
+        gLogger.verbose( "Metadata catalog query time: %.2f seconds." % ( rtime ) )
+        if not result['OK']:
+          gLogger.error( "InputDataAgent.execute: Failed to get response from the metadata catalog", result['Message'] )
+          if self.useChangeFeed:
+            self.fullTimeLog.pop( transID, None )
+          continue
+        lfnList = result['Value']
 
-      # Check if the number of files has changed since the last cycle
-      nlfns = len( lfnList )
-      gLogger.info( "%d files returned for transformation %d from the metadata catalog" % ( nlfns, int( transID ) ) )
-      if self.fileLog.has_key( transID ):
-        if nlfns == self.fileLog[transID]:
-          gLogger.verbose( 'No new files in metadata catalog since last check' )
-      self.fileLog[transID] = nlfns
+        # Check if the number of files has changed since the last cycle
+        nlfns = len( lfnList )
+        gLogger.info( "%d files returned for transformation %d from the metadata catalog" % ( nlfns, int( transID ) ) )
+        if self.fileLog.has_key( transID ):
+          if nlfns == self.fileLog[transID]:
+            gLogger.verbose( 'No new files in metadata catalog since last check' )
+        self.fileLog[transID] = nlfns
 
       # Add any new files to the transformation
       addedLfns = []
@@ -132,9 +150,12 @@ class InputDataAgent( AgentModule ):
         if not result['OK']:
           gLogger.warn( "InputDataAgent.execute: failed to add lfns to transformation", result['Message'] )
           self.fileLog[transID] = 0
+          if self.useChangeFeed:
+            # These files are not in the change log any more: make a full query at the next cycle
+            self.fullTimeLog.pop( transID, None )
         else:
           if result['Value']['Failed']:
-            for lfn, error in res['Value']['Failed'].items():
+            for lfn, error in result['Value']['Failed'].items():
               gLogger.warn( "InputDataAgent.execute: Failed to add %s to transformation" % lfn, error )
           if result['Value']['Successful']:
             for lfn, status in result['Value']['Successful'].items():
@@ -142,4 +163,108 @@ class InputDataAgent( AgentModule ):
                 addedLfns.append( lfn )
             gLogger.info( "InputDataAgent.execute: Added %d files to transformation" % len( addedLfns ) )
 
+    if self.useChangeFeed:
+      # The changes read in this cycle are lost for the transformations not processed (not active,
+      # no input data query...): they will need a full query
+      for transID in set( self.fullTimeLog ) - processed:
+        del self.fullTimeLog[transID]
+
     return S_OK()
+
+  ##############################################################################
+  def __setDateKey( self, transID, inputDataQuery ):
+    ''' Determine the correct time stamp to use for this transformation with RefreshOnly
+    '''
+    if self.timeLog.has_key( transID ):
+      if self.fullTimeLog.has_key( transID ):
+        # If it is more than a day since the last reduced query, make a full query just in case
+        if ( datetime.datetime.utcnow() - self.fullTimeLog[transID] ) < datetime.timedelta( seconds = self.fullUpdatePeriod ):
+          timeStamp = self.timeLog[transID]
+          if self.dateKey:
+            inputDataQuery[self.dateKey] = ( timeStamp - datetime.timedelta( seconds = 10 ) ).strftime( '%Y-%m-%d %H:%M:%S' )
+          else:
+            gLogger.error( "DateKey was not set in the CS, cannot use the RefreshOnly" )
+        else:
+          self.fullTimeLog[transID] = datetime.datetime.utcnow()
+    self.timeLog[transID] = datetime.datetime.utcnow()
+    if not self.fullTimeLog.has_key( transID ):
+      self.fullTimeLog[transID] = datetime.datetime.utcnow()
+
+  ##############################################################################
+  def __getCatalogChanges( self ):
+    ''' Read the change log of the catalog from the last entry consumed
+
+    :return: dict with the metadata of the changed 'Files' and 'Directories' and the 'TypeDict' of the
+             metadata fields, or None if only full queries can be made
+    '''
+    if self.lastLogID is None:
+      # All the transformations get a full query in this first cycle
+      res = self.metadataClient.getFileChanges( 0, 0 )
+      if not res['OK']:
+        gLogger.error( "InputDataAgent.execute: Failed to get the catalog change log", res['Message'] )
+      else:
+        self.lastLogID = res['Value']['LastLogID']
+      return None
+
+    start = time.time()
+    files = {}
+    directories = {}
+    while True:
+      res = self.metadataClient.getFileChanges( self.lastLogID, self.changeFeedChunkSize )
+      if not res['OK']:
+        gLogger.error( "InputDataAgent.execute: Failed to get the catalog change log", res['Message'] )
+        # The entries already read would be lost
+        self.fullTimeLog = {}
+        return None
+      files.update( res['Value']['Files'] )
+      directories.update( res['Value']['Directories'] )
+      if res['Value']['LastLogID'] == self.lastLogID:
+        break
+      self.lastLogID = res['Value']['LastLogID']
+
+    res = self.metadataClient.getMetadataFields()
+    if not res['OK']:
+      gLogger.error( "InputDataAgent.execute: Failed to get the metadata fields", res['Message'] )
+      self.fullTimeLog = {}
+      return None
+    typeDict = dict( res['Value']['FileMetaFields'] )
+    typeDict.update( res['Value']['DirectoryMetaFields'] )
+
+    gLogger.info( "%d files and %d directories changed in the catalog (%.2f seconds)" % ( len( files ),
+                                                                                          len( directories ),
+                                                                                          time.time() - start ) )
+    return { 'Files' : files, 'Directories' : directories, 'TypeDict' : typeDict }
+
+  ##############################################################################
+  def __matchChanges( self, inputDataQuery, changes ):
+    ''' The files of the catalog changes matching an input data query
+
+    :return: list of LFNs, None if the query cannot be evaluated from the changes
+    '''
+    typeDict = changes['TypeDict']
+    if not set( inputDataQuery ).issubset( typeDict ):
+      return None
+
+    metaQuery = MetaQuery( inputDataQuery, typeDict )
+    lfnList = []
+    for lfn, metadata in changes['Files'].iteritems():
+      res = metaQuery.applyQuery( metadata )
+      if not res['OK']:
+        gLogger.warn( "InputDataAgent.execute: Failed to apply the input data query to %s" % lfn, res['Message'] )
+        return None
+      if res['Value']:
+        lfnList.append( lfn )
+
+    # The files below a directory whose metadata were set are looked for,
+    # unless the metadata of the directory already exclude them
+    for path, metadata in changes['Directories'].iteritems():
+      dirQuery = dict( ( meta, value ) for meta, value in inputDataQuery.iteritems() if meta in metadata )
+      res = MetaQuery( dirQuery, typeDict ).applyQuery( metadata )
+      if res['OK'] and not res['Value']:
+        continue
+      res = self.metadataClient.findFilesByMetadata( inputDataQuery, path )
+      if not res['OK']:
+        gLogger.error( "InputDataAgent.execute: Failed to get response from the metadata catalog", res['Message'] )
+        return None
+      lfnList += res['Value']
+    return lfnList
@@ -0,0 +1,130 @@
+""" Persistent replica cache of the TransformationAgent
+
+    One SQLite file per transformation, holding one row per LFN with its SEs and the time it was
+    cached at (indexed, for the expiry). Updates only touch the rows concerned, and as the
+    database is in WAL mode, readers are not blocked by a writer.
+"""
+
+import os
+import time
+import sqlite3
+
+from DIRAC.Core.Utilities.List import breakListIntoChunks
+
+__RCSID__ = "$Id$"
+
+# SQLite limits the number of variables in a statement
+MAX_VARIABLES = 500
+
+class ReplicaCache( object ):
+  """ Replicas of the files of a transformation, cached on disk
+  """
+
+  def __init__( self, fileName, timeout = 60 ):
+    """ c'tor
+
+    :param str fileName: SQLite file, created if needed
+    :param int timeout: seconds to wait for a lock
+    """
+    self.fileName = fileName
+    self.timeout = timeout
+    conn = self.__connect()
+    try:
+      conn.execute( "PRAGMA journal_mode=WAL" )
+      with conn:
+        conn.execute( "CREATE TABLE IF NOT EXISTS Replicas ( LFN TEXT PRIMARY KEY, SEs TEXT, UpdateTime REAL )" )
+        conn.execute( "CREATE INDEX IF NOT EXISTS UpdateTimeIndex ON Replicas ( UpdateTime )" )
+    finally:
+      conn.close()
+
+  def __connect( self ):
+    """ A new connection, as they cannot be shared between threads
+    """
+    conn = sqlite3.connect( self.fileName, timeout = self.timeout )
+    conn.text_factory = str
+    return conn
+
+  def getReplicas( self, lfns ):
+    """ Cached replicas for a list of LFNs
+
+    :param lfns: iterable of LFNs
+    :return: { lfn : [SEs] } for the LFNs in the cache
+    """
+    replicas = {}
+    conn = self.__connect()
+    try:
+      for chunk in breakListIntoChunks( list( lfns ), MAX_VARIABLES ):
+        query = "SELECT LFN, SEs FROM Replicas WHERE LFN IN (%s)" % ','.join( '?' * len( chunk ) )
+        for lfn, ses in conn.execute( query, chunk ):
+          replicas[lfn] = ses.split( ',' ) if ses else []
+    finally:
+      conn.close()
+    return replicas
+
+  def addReplicas( self, replicas, updateTime = None ):
+    """ Add or replace replicas
+
+    :param dict replicas: { lfn : [SEs] }
+    :param float updateTime: time they were obtained, now by default
+    """
+    if not replicas:
+      return
+    if updateTime is None:
+      updateTime = time.time()
+    conn = self.__connect()
+    try:
+      with conn:
+        conn.executemany( "INSERT OR REPLACE INTO Replicas ( LFN, SEs, UpdateTime ) VALUES ( ?, ?, ? )",
+                          ( ( lfn, ','.join( ses ), updateTime ) for lfn, ses in replicas.iteritems() ) )
+    finally:
+      conn.close()
+
+  def removeLFNs( self, lfns ):
+    """ Remove LFNs from the cache
+
+    :return: number of LFNs removed
+    """
+    if not lfns:
+      return 0
+    conn = self.__connect()
+    try:
+      with conn:
+        return conn.executemany( "DELETE FROM Replicas WHERE LFN = ?", ( ( lfn, ) for lfn in lfns ) ).rowcount
+    finally:
+      conn.close()
+
+  def removeOlderThan( self, timeLimit ):
+    """ Remove the replicas cached before a given time
+
+    :param float timeLimit: time in seconds since the epoch
+    :return: number of LFNs removed
+    """
+    conn = self.__connect()
+    try:
+      with conn:
+        return conn.execute( "DELETE FROM Replicas WHERE UpdateTime < ?", ( timeLimit, ) ).rowcount
+    finally:
+      conn.close()
+
+  def clear( self ):
+    """ Remove all replicas
+
+    :return: number of LFNs removed
+    """
+    return self.removeOlderThan( float( 'inf' ) )
+
+  def count( self ):
+    """ Number of LFNs in the cache
+    """
+    conn = self.__connect()
+    try:
+      return conn.execute( "SELECT COUNT(*) FROM Replicas" ).fetchone()[0]
+    finally:
+      conn.close()
+
+  def remove( self ):
+    """ Remove the cache files
+    """
+    for fileName in ( self.fileName, self.fileName + '-wal', self.fileName + '-shm' ):
+      if os.path.exists( fileName ):
+        os.remove( fileName )
@@ -53,6 +53,12 @@ class TaskManagerAgentBase( AgentModule, TransformationAgentsUtilities ):
     self.pluginLocation = ''
     self.bulkSubmissionFlag = False
 
+    # Only get the status changes of the jobs and requests since the previous update of each transformation,
+    # with a full update every fullUpdatePeriod seconds
+    self.useStatusChanges = False
+    self.fullUpdatePeriod = 21600
+    self.statusUpdateTimes = {}
+
     # for the threading
     self.transQueue = Queue()
     self.transInQueue = []
@@ -80,6 +86,10 @@ class TaskManagerAgentBase( AgentModule, TransformationAgentsUtilities ):
     # Bulk submission flag
     self.bulkSubmissionFlag = self.am_getOption( 'BulkSubmission', False )
 
+    # Change driven status updates
+    self.useStatusChanges = self.am_getOption( 'UseStatusChanges', self.useStatusChanges )
+    self.fullUpdatePeriod = self.am_getOption( 'FullUpdatePeriod', self.fullUpdatePeriod )
+
     # setting up the threading
     maxNumberOfThreads = self.am_getOption( 'maxNumberOfThreads', 15 )
     threadPool = ThreadPool( maxNumberOfThreads, maxNumberOfThreads )
@@ -291,6 +301,28 @@ class TaskManagerAgentBase( AgentModule, TransformationAgentsUtilities ):
         self._logDebug( "transInQueue = ", self.transInQueue,
                         method = method, transID = transID )
 
+  #############################################################################
+
+  def _getStatusChangesSince( self, operation, transID ):
+    """ The UTC time since which the status changes have to be considered, None for a full update
+    """
+    if not self.useStatusChanges:
+      return None
+    updateTimes = self.statusUpdateTimes.get( ( operation, transID ) )
+    if not updateTimes or \
+       datetime.datetime.utcnow() - updateTimes['Full'] > datetime.timedelta( seconds = self.fullUpdatePeriod ):
+      return None
+    # The tasks and files updated in the last 10 minutes are not selected, plus some margin for the clocks
+    return ( updateTimes['Last'] - datetime.timedelta( minutes = 15 ) ).strftime( '%Y-%m-%d %H:%M:%S' )
+
+  def _setStatusUpdateTime( self, operation, transID, startTime, since ):
+    """ Record a successful update started at startTime
+    """
+    updateTimes = self.statusUpdateTimes.setdefault( ( operation, transID ), {} )
+    updateTimes['Last'] = startTime
+    if since is None:
+      updateTimes['Full'] = startTime
+
   #############################################################################
   # real operations done
 
@@ -299,6 +331,9 @@ class TaskManagerAgentBase( AgentModule, TransformationAgentsUtilities ):
     """
     transID = transIDOPBody.keys()[0]
     method = 'updateTaskStatus'
+    startTime = datetime.datetime.utcnow()
+    since = self._getStatusChangesSince( method, transID )
+    sinceArgs = {'since': since} if since else {}
 
     # Get the tasks which are in an UPDATE state
     updateStatus = self.am_getOption( 'TaskUpdateStatus', ['Checking', 'Deleted', 'Killed', 'Staging', 'Stalled',
@@ -319,6 +354,7 @@ class TaskManagerAgentBase( AgentModule, TransformationAgentsUtilities ):
     if not transformationTasks['Value']:
       self._logVerbose( "No tasks found to update",
                         method = method, transID = transID )
+      self._setStatusUpdateTime( method, transID, startTime, since )
       return transformationTasks
 
     # Get status for the transformation tasks
@@ -336,11 +372,14 @@ class TaskManagerAgentBase( AgentModule, TransformationAgentsUtilities ):
       self._logVerbose( "Getting %d tasks status" %
                         len( transformationTasks['Value'] ),
                         method = method, transID = transID )
+    if since:
+      self._logVerbose( "Only considering the tasks updated since %s" % since,
+                        method = method, transID = transID )
     updated = {}
     for nb, taskChunk in enumerate( breakListIntoChunks( transformationTasks['Value'], chunkSize )
                                     if chunkSize else
                                     [transformationTasks['Value']] ):
-      submittedTaskStatus = clients['TaskManager'].getSubmittedTaskStatus( taskChunk )
+      submittedTaskStatus = clients['TaskManager'].getSubmittedTaskStatus( taskChunk, **sinceArgs )
       if not submittedTaskStatus['OK']:
         self._logError( "Failed to get updated task states:", submittedTaskStatus['Message'],
                         method = method, transID = transID )
@@ -364,6 +403,7 @@ class TaskManagerAgentBase( AgentModule, TransformationAgentsUtilities ):
     for status, nb in updated.iteritems():
       self._logInfo( "Updated %d tasks to status %s" % ( nb, status ),
                      method = method, transID = transID )
+    self._setStatusUpdateTime( method, transID, startTime, since )
     return S_OK()
 
   def updateFileStatus( self, transIDOPBody, clients ):
@@ -371,6 +411,9 @@ class TaskManagerAgentBase( AgentModule, TransformationAgentsUtilities ):
     """
     transID = transIDOPBody.keys()[0]
     method = 'updateFileStatus'
+    startTime = datetime.datetime.utcnow()
+    since = self._getStatusChangesSince( method, transID )
+    sinceArgs = {'since': since} if since else {}
 
     timeStamp = str( datetime.datetime.utcnow() - datetime.timedelta( minutes = 10 ) )
 
@@ -385,6 +428,7 @@ class TaskManagerAgentBase( AgentModule, TransformationAgentsUtilities ):
     if not transformationFiles['Value']:
       self._logInfo( "No files to be updated",
                      method = method, transID = transID )
+      self._setStatusUpdateTime( method, transID, startTime, since )
       return transformationFiles
 
     # Get the status of the transformation files
@@ -403,7 +447,7 @@ class TaskManagerAgentBase( AgentModule, TransformationAgentsUtilities ):
       fileChunk = []
       for taskID in taskIDs:
         fileChunk += taskFiles[taskID]
-      submittedFileStatus = clients['TaskManager'].getSubmittedFileStatus( fileChunk )
+      submittedFileStatus = clients['TaskManager'].getSubmittedFileStatus( fileChunk, **sinceArgs )
       if not submittedFileStatus['OK']:
         self._logError( "Failed to get updated file states for transformation:", submittedFileStatus['Message'],
                         method = method, transID = transID )
@@ -433,6 +477,7 @@ class TaskManagerAgentBase( AgentModule, TransformationAgentsUtilities ):
     for status, nb in updated.iteritems():
       self._logInfo( "Updated %d files to status %s" % ( nb, status ),
                      method = method, transID = transID )
+    self._setStatusUpdateTime( method, transID, startTime, since )
     return S_OK()
 
   def checkReservedTasks( self, transIDOPBody, clients ):
@@ -5,6 +5,7 @@ import time
 import Queue
 import os
 import datetime
+import calendar
 import pickle
 
 from DIRAC                                                          import S_OK, S_ERROR
@@ -13,8 +14,10 @@ from DIRAC.Core.Utilities.ThreadPool                                import Threa
 from DIRAC.Core.Utilities.ThreadSafe                                import Synchronizer
 from DIRAC.Core.Utilities.List                                      import breakListIntoChunks, randomize
 from DIRAC.ConfigurationSystem.Client.Helpers.Operations            import Operations
+from DIRAC.FrameworkSystem.Client.MonitoringClient                  import gMonitor
 from DIRAC.TransformationSystem.Client.TransformationClient         import TransformationClient
 from DIRAC.TransformationSystem.Agent.TransformationAgentsUtilities import TransformationAgentsUtilities
+from DIRAC.TransformationSystem.Agent.ReplicaCache                  import ReplicaCache
 from DIRAC.DataManagementSystem.Client.DataManager                  import DataManager
 
 __RCSID__ = "$Id$"
@@ -22,6 +25,12 @@ __RCSID__ = "$Id$"
 AGENT_NAME = 'Transformation/TransformationAgent'
 gSynchro = Synchronizer()
 
+# Stages a transformation goes through, with the method executing each of them
+STAGES = ( ( 'Files', '_getFilesStage' ),
+           ( 'Replicas', '_getReplicasStage' ),
+           ( 'Plugin', '_runPluginStage' ),
+           ( 'Tasks', '_createTasksStage' ) )
+
 class TransformationAgent( AgentModule, TransformationAgentsUtilities ):
   """ Usually subclass of AgentModule
   """
@@ -44,6 +53,8 @@ class TransformationAgent( AgentModule, TransformationAgentsUtilities ):
     # parameters for the threading
     self.transQueue = Queue.Queue()
     self.transInQueue = []
+    # queues between the stages, the first stage reads from transQueue
+    self.stageQueues = []
 
     # parameters for caching
     self.workDirectory = ''
@@ -54,8 +65,6 @@ class TransformationAgent( AgentModule, TransformationAgentsUtilities ):
     # Validity of the cache
     self.replicaCache = None
     self.replicaCacheValidity = None
-    self.writingCache = False
-    self.removedFromCache = 0
 
     self.noUnusedDelay = 0
     self.unusedFiles = {}
@@ -86,27 +95,33 @@ class TransformationAgent( AgentModule, TransformationAgentsUtilities ):
     # clients
     self.transfClient = TransformationClient()
 
-    # for caching using a pickle file
+    # for caching using one SQLite file per transformation
     self.workDirectory = self.am_getWorkDirectory()
-    self.cacheFile = os.path.join( self.workDirectory, 'ReplicaCache.pkl' )
+    self.cacheFile = os.path.join( self.workDirectory, 'ReplicaCache.db' )
     self.controlDirectory = self.am_getControlDirectory()
 
     # remember the offset if any in TS
     self.lastFileOffset = {}
 
-    # Validity of the cache
+    # Validity of the cache, the ReplicaCache objects are indexed by transID
     self.replicaCache = {}
     self.replicaCacheValidity = self.am_getOption( 'ReplicaCacheValidity', 2 )
 
     self.noUnusedDelay = self.am_getOption( 'NoUnusedDelay', 6 )
 
-    # Get it threaded
+    # Get it threaded: each stage has its own workers, and a bounded queue in front of it such that
+    # the stages of different transformations overlap without piling up work in memory
     maxNumberOfThreads = self.am_getOption( 'maxThreadsInPool', 1 )
-    threadPool = ThreadPool( maxNumberOfThreads, maxNumberOfThreads )
-    self.log.info( "Multithreaded with %d threads" % maxNumberOfThreads )
-
-    for i in xrange( maxNumberOfThreads ):
-      threadPool.generateJobAndQueueIt( self._execute, [i] )
+    stageQueueSize = self.am_getOption( 'StageQueueSize', 2 )
+    self.stageQueues = [self.transQueue] + [Queue.Queue( stageQueueSize ) for _stage in STAGES[1:]]
+    stageWorkers = [self.am_getOption( '%sWorkers' % stageName, maxNumberOfThreads ) for stageName, _method in STAGES]
+    threadPool = ThreadPool( sum( stageWorkers ), sum( stageWorkers ) )
+    for stageIndex, ( stageName, _method ) in enumerate( STAGES ):
+      self.log.info( "%d threads for the %s stage" % ( stageWorkers[stageIndex], stageName ) )
+      gMonitor.registerActivity( "%sStageTime" % stageName, "Time spent in the %s stage" % stageName,
+                                 AGENT_NAME, "Seconds", gMonitor.OP_MEAN )
+      for i in xrange( stageWorkers[stageIndex] ):
+        threadPool.generateJobAndQueueIt( self._executeStage, [stageIndex, i] )
 
     self.log.info( "Will treat the following transformation types: %s" % str( self.transformationTypes ) )
 
@@ -123,7 +138,6 @@ class TransformationAgent( AgentModule, TransformationAgentsUtilities ):
       while self.transInThread:
         time.sleep( 2 )
       self._logInfo( "Threads are empty, terminating the agent..." , method = method )
-    self.__writeCache()
     return S_OK()
 
   def execute( self ):
@@ -193,41 +207,81 @@ class TransformationAgent( AgentModule, TransformationAgentsUtilities ):
     return {'TransformationClient': threadTransformationClient,
             'DataManager': threadDataManager}
 
-  def _execute( self, threadID ):
-    """ thread - does the real job: processing the transformations to be processed
+  def _executeStage( self, stageIndex, threadID ):
+    """ thread - executes one stage for the transformations it gets from the stage queue,
+        and passes them to the next stage
     """
+    stageName, stageMethod = STAGES[stageIndex]
+    stageMethod = getattr( self, stageMethod )
+    nextQueue = self.stageQueues[stageIndex + 1] if stageIndex + 1 < len( STAGES ) else None
 
     # Each thread will have its own clients
     clients = self._getClients()
 
     while True:
-      transDict = self.transQueue.get()
+      transContext = self.stageQueues[stageIndex].get()
+      if not stageIndex:
+        transContext = {'TransDict': transContext, 'StartTime': time.time(), 'StageTimes': {}}
+      transID = None
+      goOn = False
       try:
-        transID = long( transDict['TransformationID'] )
+        transID = long( transContext['TransDict']['TransformationID'] )
         if transID not in self.transInQueue:
-          break
-        self.transInThread[transID] = ' [Thread%d] [%s] ' % ( threadID, str( transID ) )
-        self._logInfo( "Processing transformation %s." % transID, transID = transID )
+          # The agent is finalizing
+          continue
+        self.transInThread[transID] = ' [%s%d] [%s] ' % ( stageName, threadID, str( transID ) )
+        if not stageIndex:
+          self._logInfo( "Processing transformation %s." % transID, transID = transID )
         startTime = time.time()
-        res = self.processTransformation( transDict, clients )
+        res = stageMethod( transContext, clients )
+        stageTime = time.time() - startTime
+        transContext['StageTimes'][stageName] = stageTime
+        gMonitor.addMark( "%sStageTime" % stageName, stageTime )
         if not res['OK']:
           self._logInfo( "Failed to process transformation:", res['Message'], transID = transID )
+        else:
+          goOn = res['Value'] and nextQueue is not None
       except Exception as x:
-        self._logException( 'Exception in plugin', lException = x, transID = transID )
+        self._logException( 'Exception in %s stage' % stageName, lException = x, transID = transID )
       finally:
-        if not transID:
-          transID = 'None'
-        self._logInfo( "Processed transformation in %.1f seconds" % ( time.time() - startTime ), transID = transID )
-        if transID in self.transInQueue:
-          self.transInQueue.remove( transID )
-        self.transInThread.pop( transID, None )
-        self._logVerbose( "%d transformations still in queue" % len( self.transInQueue ) )
+        if goOn:
+          nextQueue.put( transContext )
+        else:
+          self.__endProcessing( transID, transContext )
     return S_OK()
 
+  def __endProcessing( self, transID, transContext ):
+    """ the transformation went through all the stages, or stopped at one of them
+    """
+    if not transID:
+      transID = 'None'
+    self._logInfo( "Processed transformation in %.1f seconds (%s)" %
+                   ( time.time() - transContext['StartTime'],
+                     ', '.join( '%s: %.1f' % ( stageName, transContext['StageTimes'][stageName] )
+                                for stageName, _method in STAGES if stageName in transContext['StageTimes'] ) ),
+                   transID = transID )
+    if transID in self.transInQueue:
+      self.transInQueue.remove( transID )
+    self.transInThread.pop( transID, None )
+    self._logVerbose( "%d transformations still in queue" % len( self.transInQueue ) )
+
   def processTransformation( self, transDict, clients ):
-    """ process a single transformation (in transDict)
+    """ process a single transformation (in transDict), going through all the stages in sequence
     """
-    method = 'processTransformation'
+    transContext = {'TransDict': transDict}
+    for _stageName, stageMethod in STAGES:
+      res = getattr( self, stageMethod )( transContext, clients )
+      if not res['OK'] or not res['Value']:
+        return res
+    return S_OK()
+
+  def _getFilesStage( self, transContext, clients ):
+    """ get the files to be processed
+
+    :return: S_OK( True ) if there are files to process
+    """
+    method = '_getFilesStage'
+    transDict = transContext['TransDict']
     transID = transDict['TransformationID']
     forJobs = transDict['Type'].lower() not in ( 'replication', 'removal' )
 
@@ -236,10 +290,8 @@ class TransformationAgent( AgentModule, TransformationAgentsUtilities ):
     if not transFiles['OK']:
       return transFiles
     if not transFiles['Value']:
-      return S_OK()
+      return S_OK( False )
 
-    if transID not in self.replicaCache:
-      self.__readCache( transID )
     transFiles = transFiles['Value']
     unusedLfns = [ f['LFN'] for f in transFiles ]
     unusedFiles = len( unusedLfns )
@@ -258,13 +310,30 @@ class TransformationAgent( AgentModule, TransformationAgentsUtilities ):
     else:
       lfnsToProcess = unusedLfns
 
-    # Check the data is available with replicas
-    res = self.__getDataReplicas( transDict, lfnsToProcess, clients, forJobs = forJobs )
+    transContext.update( {'ForJobs': forJobs, 'Plugin': plugin, 'TransFiles': transFiles,
+                          'UnusedFiles': unusedFiles, 'LfnsToProcess': lfnsToProcess} )
+    return S_OK( True )
+
+  def _getReplicasStage( self, transContext, clients ):
+    """ check the data is available with replicas
+    """
+    transDict = transContext['TransDict']
+    res = self.__getDataReplicas( transDict, transContext['LfnsToProcess'], clients,
+                                  forJobs = transContext['ForJobs'] )
     if not res['OK']:
       self._logError( "Failed to get data replicas:", res['Message'],
-                      method = method, transID = transID )
+                      method = '_getReplicasStage', transID = transDict['TransformationID'] )
       return res
-    dataReplicas = res['Value']
+    transContext['DataReplicas'] = res['Value']
+    return S_OK( True )
+
+  def _runPluginStage( self, transContext, clients ):
+    """ run the plugin, that groups the files into tasks
+    """
+    method = '_runPluginStage'
+    transDict = transContext['TransDict']
+    transID = transDict['TransformationID']
+    plugin = transContext['Plugin']
 
     # Get the plug-in type and create the plug-in object
     self._logInfo( "Processing transformation with '%s' plug-in." % plugin,
@@ -276,35 +345,50 @@ class TransformationAgent( AgentModule, TransformationAgentsUtilities ):
 
     # Get the plug-in and set the required params
     oPlugin.setParameters( transDict )
-    oPlugin.setInputData( dataReplicas )
-    oPlugin.setTransformationFiles( transFiles )
+    oPlugin.setInputData( transContext['DataReplicas'] )
+    oPlugin.setTransformationFiles( transContext['TransFiles'] )
     res = oPlugin.run()
     if not res['OK']:
       self._logError( "Failed to generate tasks for transformation:", res['Message'],
                       method = method, transID = transID )
       return res
-    tasks = res['Value']
+    transContext['Tasks'] = res['Value']
     self.pluginTimeout[transID] = res.get( 'Timeout', False )
-    # Create the tasks
+    return S_OK( True )
+
+  def _createTasksStage( self, transContext, clients ):
+    """ create the tasks generated by the plugin
+    """
+    method = '_createTasksStage'
+    transDict = transContext['TransDict']
+    transID = transDict['TransformationID']
+    lfnsToProcess = set( transContext['LfnsToProcess'] )
+    # Create the tasks, all together
+    tasks = transContext['Tasks']
     allCreated = True
     created = 0
     lfnsInTasks = []
-    for se, lfns in tasks:
-      res = clients['TransformationClient'].addTaskForTransformation( transID, lfns, se )
+    if tasks:
+      res = clients['TransformationClient'].addTasksForTransformation( transID, tasks )
       if not res['OK']:
-        self._logError( "Failed to add task generated by plug-in:", res['Message'],
+        self._logError( "Failed to add %d tasks generated by plug-in:" % len( tasks ), res['Message'],
                         method = method, transID = transID )
         allCreated = False
       else:
-        created += 1
-        lfnsInTasks += [lfn for lfn in lfns if lfn in lfnsToProcess]
+        for error in res['Value']['Failed'].itervalues():
+          self._logError( "Failed to add task generated by plug-in:", error,
+                          method = method, transID = transID )
+          allCreated = False
+        for taskIndex in res['Value']['Successful']:
+          created += 1
+          lfnsInTasks += [lfn for lfn in tasks[taskIndex][1] if lfn in lfnsToProcess]
     if created:
       self._logInfo( "Successfully created %d tasks for transformation." % created,
                      method = method, transID = transID )
     else:
       self._logInfo( "No new tasks created for transformation.",
                      method = method, transID = transID )
-    self.unusedFiles[transID] = unusedFiles - len( lfnsInTasks )
+    self.unusedFiles[transID] = transContext['UnusedFiles'] - len( lfnsInTasks )
     # If not all files were obtained, move the offset
     lastOffset = self.lastFileOffset.get( transID )
     if lastOffset:
@@ -320,7 +404,7 @@ class TransformationAgent( AgentModule, TransformationAgentsUtilities ):
       else:
         self._logInfo( "Updated transformation status to 'Active'.",
                        method = method, transID = transID )
-    return S_OK()
+    return S_OK( True )
 
   ######################################################################
   #
@@ -446,17 +530,12 @@ class TransformationAgent( AgentModule, TransformationAgentsUtilities ):
     dataReplicas = {}
     nLfns = len( lfns )
     self._logVerbose( "Getting replicas for %d files" % nLfns, method = method, transID = transID )
-    cachedReplicaSets = self.replicaCache.get( transID, {} )
-    cachedReplicas = {}
-    # Merge all sets of replicas
-    for replicas in cachedReplicaSets.itervalues():
-      cachedReplicas.update( replicas )
-    self._logInfo( "Number of cached replicas: %d" % len( cachedReplicas ), method = method, transID = transID )
-    setCached = set( cachedReplicas )
     setLfns = set( lfns )
-    for lfn in setLfns & setCached:
-      dataReplicas[lfn] = cachedReplicas[lfn]
-    newLFNs = setLfns - setCached
+    try:
+      dataReplicas = self.__getCache( transID ).getReplicas( setLfns )
+    except Exception as x:
+      self._logException( "Failed to read the replica cache", lException = x, method = method, transID = transID )
+    newLFNs = setLfns - set( dataReplicas )
     self._logInfo( "ReplicaCache hit for %d out of %d LFNs" % ( len( dataReplicas ), nLfns ),
                    method = method, transID = transID )
     if newLFNs:
@@ -479,7 +558,6 @@ class TransformationAgent( AgentModule, TransformationAgentsUtilities ):
                      method = method, transID = transID )
       dataReplicas.update( newReplicas )
       noReplicas = newLFNs - set( dataReplicas )
-      self.__writeCache( transID )
       if noReplicas:
         self._logWarn( "Found %d files without replicas (or only in Failover)" % len( noReplicas ),
                        method = method, transID = transID )
@@ -544,45 +622,65 @@ class TransformationAgent( AgentModule, TransformationAgentsUtilities ):
                           method = method, transID = transID )
     return S_OK( dataReplicas )
 
+  @gSynchro
+  def __getCache( self, transID ):
+    """ Get the replica cache of a transformation, importing the former pickle file if any
+    """
+    if transID not in self.replicaCache:
+      cache = ReplicaCache( self.__cacheFile( transID ) )
+      self.__importPickleCache( transID, cache )
+      self.replicaCache[transID] = cache
+    return self.replicaCache[transID]
+
+  def __importPickleCache( self, transID, cache ):
+    """ Move the replicas of a cache file written by a previous version of the agent into the new cache
+    """
+    method = '__importPickleCache'
+    fileName = os.path.join( self.workDirectory, 'ReplicaCache_%s.pkl' % str( transID ) )
+    if not os.path.exists( fileName ):
+      return
+    try:
+      with open( fileName, 'r' ) as cacheFile:
+        replicaSets = pickle.load( cacheFile )
+      for updateTime, replicas in replicaSets.iteritems():
+        cache.addReplicas( replicas, updateTime = calendar.timegm( updateTime.utctimetuple() ) )
+      self._logInfo( "Successfully imported replica cache from file %s (%d files)" % ( fileName, cache.count() ),
+                     method = method, transID = transID )
+    except Exception as x:
+      self._logException( "Failed to import replica cache from file %s" % fileName, lException = x,
+                          method = method, transID = transID )
+    try:
+      os.remove( fileName )
+    except OSError:
+      pass
+
   def __updateCache( self, transID, newReplicas ):
     """ Add replicas to the cache
     """
-    self.replicaCache.setdefault( transID, {} )[datetime.datetime.utcnow()] = newReplicas
-#    if len( newReplicas ) > 5000:
-#      self.__writeCache( transID )
+    try:
+      self.__getCache( transID ).addReplicas( newReplicas )
+    except Exception as x:
+      self._logException( "Failed to add replicas to the cache", lException = x,
+                          method = '__updateCache', transID = transID )
 
   def __clearCacheForTrans( self, transID ):
     """ Remove all replicas for a transformation
     """
-    self.replicaCache.pop( transID , None )
-
-  def __cleanReplicas( self, transID, lfns ):
-    """ Remove cached replicas that are not in a list
-    """
-    cachedReplicas = set()
-    for replicas in self.replicaCache.get( transID, {} ).itervalues():
-      cachedReplicas.update( replicas )
-    toRemove = cachedReplicas - set( lfns )
-    if toRemove:
-      self._logInfo( "Remove %d files from cache" % len( toRemove ), method = '__cleanReplicas', transID = transID )
-      self.__removeFromCache( transID, toRemove )
+    try:
+      self.__getCache( transID ).clear()
+    except Exception as x:
+      self._logException( "Failed to clear the replica cache", lException = x,
+                          method = '__clearCacheForTrans', transID = transID )
 
   def __cleanCache( self, transID ):
     """ Cleans the cache
     """
     try:
-      if transID in self.replicaCache:
-        timeLimit = datetime.datetime.utcnow() - datetime.timedelta( days = self.replicaCacheValidity )
-        for updateTime in set( self.replicaCache[transID] ):
-          nCache = len( self.replicaCache[transID][updateTime] )
-          if updateTime < timeLimit or not nCache:
-            self._logInfo( "Clear %s replicas for transformation %s, time %s" %
-                           ( '%d cached' % nCache if nCache else 'empty cache' , str( transID ), str( updateTime ) ),
-                           transID = transID, method = '__cleanCache' )
-            del self.replicaCache[transID][updateTime]
-        # Remove empty transformations
-        if not self.replicaCache[transID]:
-          del self.replicaCache[transID]
+      timeLimit = time.time() - self.replicaCacheValidity * 86400
+      removed = self.__getCache( transID ).removeOlderThan( timeLimit )
+      if removed:
+        self._logInfo( "Cleared %d cached replicas older than %s days" % ( removed, self.replicaCacheValidity ),
+                       transID = transID, method = '__cleanCache' )
     except Exception as x:
       self._logException( "Exception when cleaning replica cache:", lException = x )
 
@@ -590,76 +688,19 @@ class TransformationAgent( AgentModule, TransformationAgentsUtilities ):
     removed = self.__removeFromCache( transID, lfns )
     if removed:
       self._logInfo( "Removed %d replicas from cache" % removed, method = '__removeFilesFromCache', transID = transID )
-      self.__writeCache( transID )
 
   def __removeFromCache( self, transID, lfns ):
-    if transID not in self.replicaCache:
-      return
-    removed = 0
-    if self.replicaCache[transID] and lfns:
-      for lfn in lfns:
-        for timeKey in self.replicaCache[transID]:
-          if self.replicaCache[transID][timeKey].pop( lfn, None ):
-            removed += 1
-    return removed
-
-  def __cacheFile( self, transID ):
-    return self.cacheFile.replace( '.pkl', '_%s.pkl' % str( transID ) )
-
-  @gSynchro
-  def __readCache( self, transID ):
-    """ Reads from the cache
-    """
-    if transID in self.replicaCache:
-      return
+    if not lfns:
+      return 0
     try:
-      method = '__readCache'
-      fileName = self.__cacheFile( transID )
-      if not os.path.exists( fileName ):
-        self.replicaCache[transID] = {}
-      else:
-        with open( fileName, 'r' ) as cacheFile:
-          self.replicaCache[transID] = pickle.load( cacheFile )
-        self._logInfo( "Successfully loaded replica cache from file %s (%d files)" %
-                       ( fileName, self.__filesInCache( transID ) ),
-                       method = method, transID = transID )
+      return self.__getCache( transID ).removeLFNs( lfns )
     except Exception as x:
-      self._logException( "Failed to load replica cache from file %s" % fileName, lException = x,
-                          method = method, transID = transID )
-      self.replicaCache[transID] = {}
-
-  def __filesInCache( self, transID ):
-    cache = self.replicaCache.get( transID, {} )
-    return sum( len( lfns ) for lfns in cache.itervalues() )
+      self._logException( "Failed to remove files from the replica cache", lException = x,
+                          method = '__removeFromCache', transID = transID )
+      return 0
 
-  @gSynchro
-  def __writeCache( self, transID = None ):
-    """ Writes the cache
-    """
-    method = '__writeCache'
-    try:
-      startTime = time.time()
-      transList = [transID] if transID else set( self.replicaCache )
-      filesInCache = 0
-      nCache = 0
-      for t_id in transList:
-        # Protect the copy of the cache
-        filesInCache += self.__filesInCache( t_id )
-        # write to a temporary file in order to avoid corrupted files
-        cacheFile = self.__cacheFile( t_id )
-        tmpFile = cacheFile + '.tmp'
-        f = open( tmpFile, 'w' )
-        pickle.dump( self.replicaCache.get( t_id, {} ), f )
-        f.close()
-        # Now rename the file as it shold
-        os.rename( tmpFile, cacheFile )
-        nCache += 1
-      self._logInfo( "Successfully wrote %d replica cache file(s) (%d files) in %.1f seconds" \
-                     % ( nCache, filesInCache, time.time() - startTime ),
-                     method = method, transID = transID if transID else None )
-    except Exception as x:
-      self._logException( "Could not write replica cache file %s" % cacheFile, lException = x,
-                          method = method, transID = t_id )
+  def __cacheFile( self, transID ):
+    return self.cacheFile.replace( '.db', '_%s.db' % str( transID ) )
 
   def __generatePluginObject( self, plugin, clients ):
     """ This simply instantiates the TransformationPlugin class with the relevant plugin name
@@ -686,9 +727,7 @@ class TransformationAgent( AgentModule, TransformationAgentsUtilities ):
     """
     if invalidateCache:
       try:
-        if transID in self.replicaCache:
+        if self.__getCache( transID ).clear():
           self._logInfo( "Removed cached replicas for transformation" , method = 'pluginCallBack', transID = transID )
-          self.replicaCache.pop( transID )
-          self.__writeCache( transID )
       except:
         pass
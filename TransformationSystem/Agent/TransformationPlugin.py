@@ -113,10 +113,10 @@ class TransformationPlugin( PluginBase ):
     groupSize = self.params['GroupSize']  # Number of files per tasks
 
     fileGroups = getFileGroups( self.data )  # groups by SE
+    targetSites = dict( ( targetSE, self._getSiteForSE( targetSE )['Value'] ) for targetSE in targetSEs )
     targetSELfns = {}
     for replicaSE, lfns in fileGroups.items():
       ses = replicaSE.split( ',' )
-      # sourceSites = self._getSitesForSEs(ses)
       atSource = False
       for se in ses:
         if se in sourceSEs:
@@ -124,12 +124,13 @@ class TransformationPlugin( PluginBase ):
       if not atSource:
         continue
 
+      sourceSites = self._getSitesForSEs( ses )
       for lfn in lfns:
         targets = []
-        sources = self._getSitesForSEs( ses )
+        sources = list( sourceSites )
         random.shuffle( targetSEs )
         for targetSE in targetSEs:
-          site = self._getSiteForSE( targetSE )['Value']
+          site = targetSites[targetSE]
           if not site in sources:
             if ( destinations ) and ( len( targets ) >= destinations ):
               continue
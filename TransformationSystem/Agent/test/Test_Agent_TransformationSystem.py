@@ -6,13 +6,17 @@
 # imports
 import unittest
 import importlib
+import threading
+import Queue
+import time
 import datetime
-from mock import MagicMock
+from mock import MagicMock, patch, call
 
 from DIRAC import gLogger
 # sut
 from DIRAC.TransformationSystem.Agent.TaskManagerAgentBase import TaskManagerAgentBase
 from DIRAC.TransformationSystem.Agent.TransformationAgent import TransformationAgent
+from DIRAC.TransformationSystem.Agent.InputDataAgent import InputDataAgent
 
 gLogger.setLevel( 'DEBUG' )
 
@@ -149,6 +153,29 @@ class TaskManagerAgentBaseSuccess( AgentsTestCase ):
     self.assert_( res['OK'] )
 
 
+  def test_updateTaskStatusChanges( self ):
+    clients = {'TransformationClient':self.tc_mock, 'TaskManager':self.tm_mock}
+    transIDOPBody = {1:{'Operations':['op1', 'op2'], 'Body':'veryBigBody'}}
+    self.tmab.useStatusChanges = True
+    self.tc_mock.getTransformationTasks.return_value = {'OK': True,
+                                                        'Value': [{'ExternalID': '1', 'ExternalStatus': 'Waiting',
+                                                                   'TaskID': 1L, 'TransformationID': 1L}]}
+    self.tm_mock.getSubmittedTaskStatus.return_value = {'OK': True, 'Value': {}}
+
+    # First a full update, then only the changes
+    res = self.tmab.updateTaskStatus( transIDOPBody, clients )
+    self.assert_( res['OK'] )
+    self.assertEqual( self.tm_mock.getSubmittedTaskStatus.call_args[1], {} )
+    res = self.tmab.updateTaskStatus( transIDOPBody, clients )
+    self.assert_( res['OK'] )
+    self.assertTrue( 'since' in self.tm_mock.getSubmittedTaskStatus.call_args[1] )
+
+    # After fullUpdatePeriod, a full update again
+    self.tmab.statusUpdateTimes[( 'updateTaskStatus', 1 )]['Full'] -= datetime.timedelta( seconds = self.tmab.fullUpdatePeriod + 1 )
+    res = self.tmab.updateTaskStatus( transIDOPBody, clients )
+    self.assert_( res['OK'] )
+    self.assertEqual( self.tm_mock.getSubmittedTaskStatus.call_args[1], {} )
+
   def test_updateFileStatusSuccess( self ):
     clients = {'TransformationClient':self.tc_mock, 'TaskManager':self.tm_mock}
 
@@ -321,6 +348,135 @@ class TransformationAgentSuccess( AgentsTestCase ):
       res = self.ta._getTransformationFiles( transDict, {'TransformationClient': self.tc_mock} )
       self.assertTrue( res['OK'] )
 
+  def test_processTransformation( self ):
+    for stageName, stageMethod in self.ta_m.STAGES:
+      setattr( self.ta, stageMethod, MagicMock( return_value = {'OK': True, 'Value': stageName != 'Replicas'} ) )
+    res = self.ta.processTransformation( {'TransformationID': 123}, {} )
+    self.assertTrue( res['OK'] )
+    # Stops after the stage that returns False
+    self.assertEqual( self.ta._getReplicasStage.call_count, 1 )
+    self.assertEqual( self.ta._runPluginStage.call_count, 0 )
+
+  def test__createTasksStage( self ):
+    self.tc_mock.addTasksForTransformation.return_value = {'OK': True,
+                                                            'Value': {'Successful': {0: 11, 2: 12},
+                                                                      'Failed': {1: 'Not all supplied files available'}}}
+    transContext = {'TransDict': {'TransformationID': 123, 'Status': 'Flush'},
+                    'LfnsToProcess': ['/a/1', '/a/2', '/a/3', '/a/4'], 'UnusedFiles': 4,
+                    'Tasks': [( 'SE1', ['/a/1'] ), ( 'SE1', ['/a/2'] ), ( 'SE2', ['/a/3', '/a/4'] )]}
+    self.ta._TransformationAgent__removeFilesFromCache = MagicMock()
+    res = self.ta._createTasksStage( transContext, {'TransformationClient': self.tc_mock} )
+    self.assertTrue( res['OK'] )
+    self.tc_mock.addTasksForTransformation.assert_called_once_with( 123, transContext['Tasks'] )
+    self.assertEqual( self.ta.unusedFiles[123], 1 )
+    # Not all tasks were created: no reset of the Flush status
+    self.assertFalse( self.tc_mock.setTransformationParameter.called )
+
+  def test__executeStage( self ):
+    self.ta._getClients = MagicMock( return_value = {} )
+    self.ta.stageQueues = [self.ta.transQueue] + [Queue.Queue( 1 ) for _stage in self.ta_m.STAGES[1:]]
+    processed = []
+    def stage( transContext, _clients ):
+      processed.append( transContext['TransDict']['TransformationID'] )
+      return {'OK': True, 'Value': True}
+    for stageIndex, ( _stageName, stageMethod ) in enumerate( self.ta_m.STAGES ):
+      setattr( self.ta, stageMethod, stage )
+      thread = threading.Thread( target = self.ta._executeStage, args = ( stageIndex, 0 ) )
+      thread.daemon = True
+      thread.start()
+    for transID in ( 1, 2, 3 ):
+      self.ta.transInQueue.append( transID )
+      self.ta.transQueue.put( {'TransformationID': transID} )
+    for _i in xrange( 100 ):
+      if not self.ta.transInQueue:
+        break
+      time.sleep( 0.05 )
+    self.assertFalse( self.ta.transInQueue )
+    self.assertFalse( self.ta.transInThread )
+    self.assertEqual( sorted( processed ), [1] * 4 + [2] * 4 + [3] * 4 )
+
+class InputDataAgentSuccess( AgentsTestCase ):
+
+  def setUp( self ):
+    super( InputDataAgentSuccess, self ).setUp()
+    self.ida_m = importlib.import_module( 'DIRAC.TransformationSystem.Agent.InputDataAgent' )
+    self.ida_m.AgentModule = self.mockAM
+    self.ida_m.gMonitor = MagicMock()
+    with patch.object( InputDataAgent, 'am_getOption', side_effect = lambda _name, default: default ):
+      self.ida = InputDataAgent()
+    self.ida.useChangeFeed = True
+    self.ida.transClient = self.tc_mock
+    self.ida.metadataClient = MagicMock()
+    self.tc_mock.getTransformations.return_value = {'OK': True, 'Value': [{'TransformationID': 1}]}
+    self.tc_mock.getTransformationInputDataQuery.return_value = {'OK': True, 'Value': {'Type': 'RAW'}}
+    self.tc_mock.addFilesToTransformation.return_value = {'OK': True, 'Value': {'Successful': {}, 'Failed': {}}}
+
+  def test_executeWithChangeFeed( self ):
+    fc = self.ida.metadataClient
+    # First cycle: full query
+    fc.getFileChanges.return_value = {'OK': True, 'Value': {'LastLogID': 5, 'Files': {}, 'Directories': {}}}
+    fc.findFilesByMetadata.return_value = {'OK': True, 'Value': ['/a/1']}
+    res = self.ida.execute()
+    self.assertTrue( res['OK'] )
+    fc.getFileChanges.assert_called_once_with( 0, 0 )
+    self.assertEqual( fc.findFilesByMetadata.call_count, 1 )
+    self.tc_mock.addFilesToTransformation.assert_called_with( 1, ['/a/1'] )
+
+    # Then only the changes are matched
+    fc.getFileChanges.reset_mock()
+    fc.getFileChanges.side_effect = [{'OK': True, 'Value': {'LastLogID': 7,
+                                                            'Files': {'/a/2': {'Type': 'RAW'}, '/a/3': {'Type': 'DST'}},
+                                                            'Directories': {'/b': {'Type': 'DST'}, '/c': {}}}},
+                                     {'OK': True, 'Value': {'LastLogID': 7, 'Files': {}, 'Directories': {}}}]
+    fc.getMetadataFields.return_value = {'OK': True, 'Value': {'FileMetaFields': {},
+                                                               'DirectoryMetaFields': {'Type': 'VARCHAR(128)'}}}
+    fc.findFilesByMetadata.return_value = {'OK': True, 'Value': ['/c/4']}
+    res = self.ida.execute()
+    self.assertTrue( res['OK'] )
+    self.assertEqual( fc.getFileChanges.call_count, 2 )
+    self.assertEqual( self.ida.lastLogID, 7 )
+    # Only the directory that may hold matching files is queried
+    fc.findFilesByMetadata.assert_called_with( {'Type': 'RAW'}, '/c' )
+    self.assertEqual( fc.findFilesByMetadata.call_count, 2 )
+    self.tc_mock.addFilesToTransformation.assert_called_with( 1, ['/a/2', '/c/4'] )
+
+    # Failing to add the files triggers a full query
+    fc.getFileChanges.side_effect = None
+    fc.getFileChanges.return_value = {'OK': True, 'Value': {'LastLogID': 7, 'Files': {}, 'Directories': {}}}
+    self.tc_mock.addFilesToTransformation.return_value = {'OK': False, 'Message': 'Some error'}
+    self.ida.fullTimeLog.pop( 1 )
+    fc.findFilesByMetadata.return_value = {'OK': True, 'Value': ['/a/1', '/a/2', '/c/4']}
+    res = self.ida.execute()
+    self.assertTrue( res['OK'] )
+    fc.findFilesByMetadata.assert_called_with( {'Type': 'RAW'} )
+    self.assertFalse( 1 in self.ida.fullTimeLog )
+
+  def test_executeSkippedTransformations( self ):
+    fc = self.ida.metadataClient
+    fc.getFileChanges.return_value = {'OK': True, 'Value': {'LastLogID': 5, 'Files': {}, 'Directories': {}}}
+    fc.getMetadataFields.return_value = {'OK': True, 'Value': {'FileMetaFields': {'Type': 'VARCHAR(128)'},
+                                                               'DirectoryMetaFields': {}}}
+    fc.findFilesByMetadata.return_value = {'OK': True, 'Value': ['/a/1']}
+    self.tc_mock.getTransformations.return_value = {'OK': True, 'Value': [{'TransformationID': 1},
+                                                                          {'TransformationID': 2}]}
+    self.ida.execute()
+    self.assertEqual( sorted( self.ida.fullTimeLog ), [1, 2] )
+
+    # Transformation 2 is not active any more, the query of transformation 1 cannot be read
+    self.tc_mock.getTransformations.return_value = {'OK': True, 'Value': [{'TransformationID': 1}]}
+    self.tc_mock.getTransformationInputDataQuery.return_value = {'OK': False, 'Message': 'Some error'}
+    self.ida.execute()
+    # Both miss the changes of this cycle: they get a full query next time
+    self.assertEqual( self.ida.fullTimeLog, {} )
+
+    self.tc_mock.getTransformations.return_value = {'OK': True, 'Value': [{'TransformationID': 1},
+                                                                          {'TransformationID': 2}]}
+    self.tc_mock.getTransformationInputDataQuery.return_value = {'OK': True, 'Value': {'Type': 'RAW'}}
+    fc.findFilesByMetadata.reset_mock()
+    self.ida.execute()
+    self.assertEqual( fc.findFilesByMetadata.call_args_list, [call( {'Type': 'RAW'} )] * 2 )
+    self.assertEqual( sorted( self.ida.fullTimeLog ), [1, 2] )
+
 
 
 #############################################################################
@@ -331,6 +487,7 @@ if __name__ == '__main__':
   suite = unittest.defaultTestLoader.loadTestsFromTestCase( AgentsTestCase )
   suite.addTest( unittest.defaultTestLoader.loadTestsFromTestCase( TaskManagerAgentBaseSuccess ) )
   suite.addTest( unittest.defaultTestLoader.loadTestsFromTestCase( TransformationAgentSuccess ) )
+  suite.addTest( unittest.defaultTestLoader.loadTestsFromTestCase( InputDataAgentSuccess ) )
   testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
 
 # EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#
@@ -0,0 +1,55 @@
+""" Test for the on-disk replica cache of the TransformationAgent
+"""
+
+__RCSID__ = "$Id$"
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from DIRAC.TransformationSystem.Agent.ReplicaCache import ReplicaCache
+
+class ReplicaCacheSuccess( unittest.TestCase ):
+
+  def setUp( self ):
+    self.tmpDir = tempfile.mkdtemp()
+    self.cache = ReplicaCache( os.path.join( self.tmpDir, 'ReplicaCache_1.db' ) )
+
+  def tearDown( self ):
+    shutil.rmtree( self.tmpDir )
+
+  def test_addAndGet( self ):
+    self.cache.addReplicas( { '/a/1' : ['SE1', 'SE2'], '/a/2' : ['SE2'] } )
+    self.assertEqual( self.cache.getReplicas( ['/a/1', '/a/2', '/a/3'] ),
+                      { '/a/1' : ['SE1', 'SE2'], '/a/2' : ['SE2'] } )
+    # Replaced, not duplicated
+    self.cache.addReplicas( { '/a/1' : ['SE3'] } )
+    self.assertEqual( self.cache.getReplicas( ['/a/1'] ), { '/a/1' : ['SE3'] } )
+    self.assertEqual( self.cache.count(), 2 )
+    # More LFNs than variables allowed in a query
+    lfns = ['/b/%d' % i for i in xrange( 1234 )]
+    self.cache.addReplicas( dict.fromkeys( lfns, ['SE1'] ) )
+    self.assertEqual( len( self.cache.getReplicas( lfns ) ), 1234 )
+
+  def test_persistence( self ):
+    self.cache.addReplicas( { '/a/1' : ['SE1'] } )
+    other = ReplicaCache( self.cache.fileName )
+    self.assertEqual( other.getReplicas( ['/a/1'] ), { '/a/1' : ['SE1'] } )
+
+  def test_remove( self ):
+    now = time.time()
+    self.cache.addReplicas( { '/a/1' : ['SE1'], '/a/2' : ['SE1'] }, updateTime = now - 3 * 86400 )
+    self.cache.addReplicas( { '/a/3' : ['SE1'], '/a/4' : ['SE1'] }, updateTime = now )
+    self.assertEqual( self.cache.removeOlderThan( now - 86400 ), 2 )
+    self.assertEqual( self.cache.removeLFNs( ['/a/3', '/a/5'] ), 1 )
+    self.assertEqual( self.cache.getReplicas( ['/a/1', '/a/3', '/a/4'] ), { '/a/4' : ['SE1'] } )
+    self.assertEqual( self.cache.clear(), 1 )
+    self.assertEqual( self.cache.count(), 0 )
+    self.cache.remove()
+    self.assertFalse( os.path.exists( self.cache.fileName ) )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( ReplicaCacheSuccess )
+  testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
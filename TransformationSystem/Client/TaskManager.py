@@ -83,10 +83,16 @@ class TaskBase( TransformationAgentsUtilities ):
   def updateTransformationReservedTasks( self, taskDicts ):
     return S_ERROR( "Not implemented" )
 
-  def getSubmittedTaskStatus( self, taskDicts ):
+  def getSubmittedTaskStatus( self, taskDicts, since = None ):
+    """ Check if tasks changed status (only those updated in the external system since a given UTC time
+        if since is not None), and return a list of tasks per new status
+    """
     return S_ERROR( "Not implemented" )
 
-  def getSubmittedFileStatus( self, fileDicts ):
+  def getSubmittedFileStatus( self, fileDicts, since = None ):
+    """ Check if transformation files changed status (only those whose task was updated in the external system
+        since a given UTC time if since is not None), and return the new status of each LFN
+    """
     return S_ERROR( "Not implemented" )
 
 class RequestTasks( TaskBase ):
@@ -328,35 +334,52 @@ class RequestTasks( TaskBase ):
     return S_OK( {'NoTasks':noTasks, 'TaskNameIDs':requestNameIDs} )
 
 
-  def getSubmittedTaskStatus( self, taskDicts ):
+  def getSubmittedTaskStatus( self, taskDicts, since = None ):
     """
     Check if tasks changed status, and return a list of tasks per new status
+
+    If since is given, the status of the requests updated since then is obtained in one call
     """
     updateDict = {}
     badRequestID = 0
+    requestTasks = {}
     for taskDict in taskDicts:
-      oldStatus = taskDict['ExternalStatus']
       # ExternalID is normally a string
       if taskDict['ExternalID'] and int( taskDict['ExternalID'] ):
-        newStatus = self.requestClient.getRequestStatus( taskDict['ExternalID'] )
+        requestTasks[int( taskDict['ExternalID'] )] = taskDict
+      else:
+        badRequestID += 1
+    if badRequestID:
+      self._logWarn( "%d requests have identifier 0" % badRequestID )
+
+    if since is not None:
+      res = self.requestClient.getRequestsStatusChanges( requestTasks.keys(), since )
+      if not res['OK']:
+        return res
+      statusDict = res['Value']
+    else:
+      statusDict = {}
+      for requestID, taskDict in requestTasks.iteritems():
+        newStatus = self.requestClient.getRequestStatus( requestID )
         if not newStatus['OK']:
           log = self._logVerbose if 'not exist' in newStatus['Message'] else self._logWarn
           log( "getSubmittedTaskStatus: Failed to get requestID for request", newStatus['Message'],
                transID = taskDict['TransformationID'] )
         else:
-          newStatus = newStatus['Value']
-          # We don't care updating the tasks to Assigned while the request is being processed
-          if newStatus != oldStatus and newStatus != 'Assigned':
-            updateDict.setdefault( newStatus, [] ).append( taskDict['TaskID'] )
-      else:
-        badRequestID += 1
-    if badRequestID:
-      self._logWarn( "%d requests have identifier 0" % badRequestID )
+          statusDict[requestID] = newStatus['Value']
+
+    for requestID, newStatus in statusDict.iteritems():
+      taskDict = requestTasks[int( requestID )]
+      # We don't care updating the tasks to Assigned while the request is being processed
+      if newStatus != taskDict['ExternalStatus'] and newStatus != 'Assigned':
+        updateDict.setdefault( newStatus, [] ).append( taskDict['TaskID'] )
     return S_OK( updateDict )
 
-  def getSubmittedFileStatus( self, fileDicts ):
+  def getSubmittedFileStatus( self, fileDicts, since = None ):
     """
     Check if transformation files changed status, and return a list of taskIDs per new status
+
+    If since is given, only the files of the requests updated since then are checked
     """
     # Don't try and get status of not submitted tasks!
     transID = None
@@ -381,6 +404,14 @@ class RequestTasks( TaskBase ):
       if taskDict['ExternalStatus'] != 'Created' and externalID and int( externalID ):
         requestFiles[externalID] = taskFiles[taskID]
 
+    if since is not None and requestFiles:
+      res = self.requestClient.getRequestsStatusChanges( requestFiles.keys(), since )
+      if not res['OK']:
+        return res
+      changedRequests = set( int( requestID ) for requestID in res['Value'] )
+      requestFiles = dict( ( requestID, lfnList ) for requestID, lfnList in requestFiles.iteritems()
+                           if int( requestID ) in changedRequests )
+
     updateDict = {}
     for requestID, lfnList in requestFiles.iteritems():
       statusDict = self.requestClient.getRequestFileStatus( requestID, lfnList )
@@ -866,16 +897,21 @@ class WorkflowTasks( TaskBase ):
     noTask = list( set( jobNames ) - set( jobNameIDs ) )
     return S_OK( {'NoTasks':noTask, 'TaskNameIDs':jobNameIDs} )
 
-  def getSubmittedTaskStatus( self, taskDicts ):
+  def getSubmittedTaskStatus( self, taskDicts, since = None ):
     """
     Check the status of a list of tasks and return lists of taskIDs for each new status
+
+    If since is given, only the jobs updated since then are considered
     """
     if taskDicts:
       wmsIDs = [int( taskDict['ExternalID'] ) for taskDict in taskDicts if int( taskDict['ExternalID'] )]
       transID = taskDicts[0]['TransformationID']
     else:
       return S_OK( {} )
-    res = self.jobMonitoringClient.getJobsStatus( wmsIDs )
+    if since is not None:
+      res = self.jobMonitoringClient.getJobsStatusChanges( wmsIDs, since )
+    else:
+      res = self.jobMonitoringClient.getJobsStatus( wmsIDs )
     if not res['OK']:
       self._logWarn( "Failed to get job status from the WMS system",
                      transID = transID )
@@ -887,6 +923,9 @@ class WorkflowTasks( TaskBase ):
       wmsID = int( taskDict['ExternalID'] )
       if not wmsID:
         continue
+      if since is not None and wmsID not in statusDict:
+        # Not updated since: the jobs removed from the WMS are only found by a full check
+        continue
       oldStatus = taskDict['ExternalStatus']
       newStatus = statusDict.get( wmsID, {} ).get( 'Status', 'Removed' )
       if oldStatus != newStatus:
@@ -899,9 +938,11 @@ class WorkflowTasks( TaskBase ):
         updateDict.setdefault( newStatus, [] ).append( taskID )
     return S_OK( updateDict )
 
-  def getSubmittedFileStatus( self, fileDicts ):
+  def getSubmittedFileStatus( self, fileDicts, since = None ):
     """
     Check the status of a list of files and return the new status of each LFN
+
+    If since is given, only the files of the jobs updated since then are considered
     """
     if not fileDicts:
       return S_OK( {} )
@@ -912,26 +953,43 @@ class WorkflowTasks( TaskBase ):
       jobName = self._transTaskName( transID, fileDict['TaskID'] )
       taskFiles.setdefault( jobName, {} )[fileDict['LFN']] = fileDict['Status']
 
-    res = self.updateTransformationReservedTasks( fileDicts )
-    if not res['OK']:
-      self._logWarn( "Failed to obtain taskIDs for files",
-                     transID = transID )
-      return res
-    noTasks = res['Value']['NoTasks']
-    taskNameIDs = res['Value']['TaskNameIDs']
-
     updateDict = {}
-    for jobName in noTasks:
-      for lfn, oldStatus in taskFiles[jobName].iteritems():
-        if oldStatus != 'Unused':
-          updateDict[lfn] = 'Unused'
+    if since is not None:
+      # The jobs updated since then, with their name and status. The jobs removed from the WMS are only found
+      # by a full check
+      res = self.jobMonitoringClient.getJobs( {'JobName':taskFiles.keys()}, since )
+      if not res['OK']:
+        self._logWarn( "Failed to get tasks from the WMS system",
+                       transID = transID )
+        return res
+      res = self.jobMonitoringClient.getJobsParameters( [int( wmsID ) for wmsID in res['Value']], ['JobName', 'Status'] )
+      if not res['OK']:
+        self._logWarn( "Failed to get job status from the WMS system",
+                       transID = transID )
+        return res
+      statusDict = res['Value']
+      taskNameIDs = dict( ( jobDict['JobName'], wmsID ) for wmsID, jobDict in statusDict.iteritems()
+                          if jobDict['JobName'] in taskFiles )
+    else:
+      res = self.updateTransformationReservedTasks( fileDicts )
+      if not res['OK']:
+        self._logWarn( "Failed to obtain taskIDs for files",
+                       transID = transID )
+        return res
+      noTasks = res['Value']['NoTasks']
+      taskNameIDs = res['Value']['TaskNameIDs']
 
-    res = self.jobMonitoringClient.getJobsStatus( taskNameIDs.values() )
-    if not res['OK']:
-      self._logWarn( "Failed to get job status from the WMS system",
-                     transID = transID )
-      return res
-    statusDict = res['Value']
+      for jobName in noTasks:
+        for lfn, oldStatus in taskFiles[jobName].iteritems():
+          if oldStatus != 'Unused':
+            updateDict[lfn] = 'Unused'
+
+      res = self.jobMonitoringClient.getJobsStatus( taskNameIDs.values() )
+      if not res['OK']:
+        self._logWarn( "Failed to get job status from the WMS system",
+                       transID = transID )
+        return res
+      statusDict = res['Value']
     for jobName, wmsID in taskNameIDs.iteritems():
       jobStatus = statusDict.get( wmsID, {} ).get( 'Status' )
       newFileStatus = {'Done': 'Processed',
@@ -26,6 +26,7 @@ class TransformationClient( Client ):
 
           addFilesToTransformation(transName,lfns)
           addTaskForTransformation(transName,lfns=[],se='Unknown')
+          addTasksForTransformation(transName,tasks)
           getTransformationStats(transName)
 
       TransformationTasks table manipulation
@@ -13,6 +13,7 @@ import random
 from DIRAC import S_OK, S_ERROR, gLogger
 
 from DIRAC.Core.Utilities.List import breakListIntoChunks
+from DIRAC.Core.Utilities.DictCache import DictCache
 from DIRAC.Core.Utilities.SiteSEMapping import getSitesForSE
 # from DIRAC.Core.Utilities.Time import timeThis
 from DIRAC.ConfigurationSystem.Client.Helpers.Operations import Operations
@@ -24,6 +25,14 @@ from DIRAC.TransformationSystem.Client.TransformationClient import Transformatio
 
 __RCSID__ = "$Id$"
 
+# Sizes of the files of each transformation, kept from one plugin execution to the next as they don't change,
+# and forgotten once the transformation is no longer processed for FILE_SIZE_CACHE_LIFETIME seconds
+gFileSizeCache = DictCache()
+FILE_SIZE_CACHE_LIFETIME = 24 * 3600
+# Sorted SEs and key of each list of replicas met so far, such that the key strings are created only once
+gSEGroups = {}
+MAX_SE_GROUPS = 10000
+
 
 class PluginUtilities( object ):
   """
@@ -93,6 +102,12 @@ class PluginUtilities( object ):
   def setParameters( self, params ):
     self.params = params
     self.transID = params['TransformationID']
+    gFileSizeCache.purgeExpired()
+    self.cachedLFNSize = gFileSizeCache.get( self.transID )
+    if self.cachedLFNSize is None:
+      self.cachedLFNSize = {}
+    # the lifetime is extended at each execution
+    gFileSizeCache.add( self.transID, FILE_SIZE_CACHE_LIFETIME, self.cachedLFNSize )
     self.transString = self.transInThread.get( self.transID, ' [NoThread] [%d] ' % self.transID ) + '%s: ' % self.plugin
 
 
@@ -136,21 +151,17 @@ class PluginUtilities( object ):
 
       for replicaSE in sortSEs( seFiles ):
         lfns = seFiles[replicaSE]
+        if not groupSE:
+          # In case the file was at more than one site, it may already be in a task for another site
+          lfns = [lfn for lfn in lfns if lfn in files]
         if lfns:
           tasksLfns = breakListIntoChunks( lfns, self.groupSize )
-          lfnsInTasks = []
           for taskLfns in tasksLfns:
             if ( flush and not groupSE ) or ( len( taskLfns ) >= self.groupSize ):
               tasks.append( ( replicaSE, taskLfns ) )
-              lfnsInTasks += taskLfns
-          # In case the file was at more than one site, remove it from the other sites' list
-          # Remove files from global list
-          for lfn in lfnsInTasks:
-            files.pop( lfn )
-          if not groupSE:
-            # Remove files from other SEs
-            for se in [se for se in seFiles if se != replicaSE]:
-              seFiles[se] = [lfn for lfn in seFiles[se] if lfn not in lfnsInTasks]
+              # Remove files from global list
+              for lfn in taskLfns:
+                files.pop( lfn )
       self.logVerbose( "groupByReplicas: %d tasks created (groupSE %s), %d files not included in tasks" % ( len( tasks ) - nTasks,
                                                                                                             str( groupSE ),
                                                                                                             len( files ) ) )
@@ -158,9 +169,11 @@ class PluginUtilities( object ):
 
     return S_OK( tasks )
 
-  def createTasksBySize( self, lfns, replicaSE, fileSizes = None, flush = False ):
+  def createTasksBySize( self, lfns, replicaSE, fileSizes = None, flush = False, sortedBySize = False ):
     """
     Split files in groups according to the size and create tasks for a given SE
+
+    :param bool sortedBySize: the lfns are already sorted by increasing size
     """
     tasks = []
     if fileSizes is None:
@@ -175,7 +188,8 @@ class PluginUtilities( object ):
     if not self.maxFiles:
       # FIXME: prepare for chaging the name of the ambiguoug  CS option
       self.maxFiles = self.getPluginParam( 'MaxFilesPerTask', self.getPluginParam( 'MaxFiles', 100 ) )
-    lfns = sorted( lfns, key = fileSizes.get )
+    if not sortedBySize:
+      lfns = sorted( lfns, key = fileSizes.get )
     for lfn in lfns:
       size = fileSizes.get( lfn, 0 )
       if size:
@@ -218,15 +232,21 @@ class PluginUtilities( object ):
     if not res['OK']:
       return res
     fileSizes = res['Value']
+    # Sort the files only once: the groups are made in that order, hence are sorted by size as well
+    sortedLfns = sorted( files, key = fileSizes.get )
 
     for groupSE in ( True, False ):
       if not files:
         break
-      seFiles = getFileGroups( files, groupSE = groupSE )
+      seFiles = getFileGroups( [( lfn, files[lfn] ) for lfn in sortedLfns if lfn in files], groupSE = groupSE )
 
       for replicaSE in sorted( seFiles ) if groupSE else sortSEs( seFiles ):
         lfns = seFiles[replicaSE]
-        newTasks = self.createTasksBySize( lfns, replicaSE, fileSizes = fileSizes, flush = flush )
+        if not groupSE:
+          # The file may already be in a task for another SE
+          lfns = [lfn for lfn in lfns if lfn in files]
+        newTasks = self.createTasksBySize( lfns, replicaSE, fileSizes = fileSizes, flush = flush,
+                                           sortedBySize = True )
         lfnsInTasks = []
         for task  in newTasks:
           lfnsInTasks += task[1]
@@ -234,10 +254,6 @@ class PluginUtilities( object ):
 
         # Remove the selected files from the size cache
         self.clearCachedFileSize( lfnsInTasks )
-        if not groupSE:
-          # Remove files from other SEs
-          for se in [se for se in seFiles if se != replicaSE]:
-            seFiles[se] = [lfn for lfn in seFiles[se] if lfn not in lfnsInTasks]
         # Remove files from global list
         for lfn in lfnsInTasks:
           files.pop( lfn )
@@ -277,16 +293,17 @@ class PluginUtilities( object ):
   # @timeThis
   def _getFileSize( self, lfns ):
     """ Get file size from a cache, if not from the catalog
-    #FIXME: have to fill the cachedLFNSize!
     """
     lfns = list( lfns )
-    cachedLFNSize = dict( self.cachedLFNSize )
+    cachedLFNSize = self.cachedLFNSize
 
     fileSizes = {}
-    for lfn in [lfn for lfn in lfns if lfn in cachedLFNSize]:
-      fileSizes[lfn] = cachedLFNSize[lfn]
+    for lfn in lfns:
+      size = cachedLFNSize.get( lfn )
+      if size is not None:
+        fileSizes[lfn] = size
     self.logDebug( "Found cache hit for File size for %d files out of %d" % ( len( fileSizes ), len( lfns ) ) )
-    lfns = [lfn for lfn in lfns if lfn not in cachedLFNSize]
+    lfns = [lfn for lfn in lfns if lfn not in fileSizes]
     if lfns:
       fileSizes = self._getFileSizeFromCatalog( lfns, fileSizes )
       if not fileSizes['OK']:
@@ -317,8 +334,8 @@ class PluginUtilities( object ):
   def clearCachedFileSize( self, lfns ):
     """ Utility function
     """
-    for lfn in [lfn for lfn in lfns if lfn in self.cachedLFNSize]:
-      self.cachedLFNSize.pop( lfn )
+    for lfn in lfns:
+      self.cachedLFNSize.pop( lfn, None )
 
 
   def getPluginParam( self, name, default = None ):
@@ -423,11 +440,27 @@ class PluginUtilities( object ):
     return ( targetSEs + list( sameSEs ) ) if not local else targetSEs
 
 
+def getSEGroup( replicas ):
+  """
+  Sorted unique SEs of a list of replicas, and the corresponding comma-separated key.
+  They are cached, as there are few different sets of SEs for many files
+
+  :return: tuple ( tuple of SEs, key )
+  """
+  replicas = tuple( replicas )
+  seGroup = gSEGroups.get( replicas )
+  if seGroup is None:
+    if len( gSEGroups ) >= MAX_SE_GROUPS:
+      gSEGroups.clear()
+    ses = tuple( sorted( set( replicas ) ) )
+    seGroup = gSEGroups[replicas] = ( ses, ','.join( ses ) )
+  return seGroup
+
 def getFileGroups( fileReplicas, groupSE = True ):
   """
   Group files by set of SEs
 
-  :param dict fileReplicas:
+  :param fileReplicas: dictionary, or list of ( lfn, replicas ) tuples whose order is kept in the groups
               {'/this/is/at.1': ['SE1'],
                '/this/is/at.12': ['SE1', 'SE2'],
                '/this/is/at.2': ['SE2'],
@@ -438,15 +471,16 @@ def getFileGroups( fileReplicas, groupSE = True ):
   If groupSE == False, group by SE, in which case a file can be in more than one element
   """
   fileGroups = {}
-  for lfn, replicas in fileReplicas.items():
+  if isinstance( fileReplicas, dict ):
+    fileReplicas = fileReplicas.iteritems()
+  for lfn, replicas in fileReplicas:
     if not replicas:
       continue
-    replicas = sorted( list( set( replicas ) ) )
+    replicas, replicaSEs = getSEGroup( replicas )
     if not groupSE or len( replicas ) == 1:
       for rep in replicas:
         fileGroups.setdefault( rep, [] ).append( lfn )
     else:
-      replicaSEs = ','.join( replicas )
       fileGroups.setdefault( replicaSEs, [] ).append( lfn )
   return fileGroups
 
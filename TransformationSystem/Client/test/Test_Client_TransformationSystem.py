@@ -5,6 +5,7 @@
 
 import unittest
 import json
+import time
 import mock
 
 from DIRAC import gLogger, S_OK
@@ -12,7 +13,7 @@ from DIRAC.RequestManagementSystem.Client.Request             import Request
 from DIRAC.TransformationSystem.Client.TaskManager            import TaskBase, WorkflowTasks, RequestTasks
 from DIRAC.TransformationSystem.Client.TransformationClient   import TransformationClient
 from DIRAC.TransformationSystem.Client.Transformation         import Transformation
-from DIRAC.TransformationSystem.Client.Utilities import PluginUtilities
+from DIRAC.TransformationSystem.Client.Utilities import PluginUtilities, getFileGroups
 
 #############################################################################
 
@@ -122,6 +123,39 @@ class PluginUtilitiesSuccess( ClientsTestCase ):
     print res['Value']
     self.assertEqual( res['Value'], [( 'SE1', ['/this/is/at.123', '/this/is/at.134', '/this/is/at.12'] ) ] )
 
+  def test_groupBySize( self ):
+    self.pu.groupSize = 10
+    self.pu.maxFiles = 100
+    self.pu.cachedLFNSize.update( {'/a':4, '/b':3, '/c':5, '/d':20} )
+    res = self.pu.groupBySize( {'/a':['SE1'], '/b':['SE1'], '/c':['SE2', 'SE1'], '/d':['SE2']}, 'Active' )
+    self.assert_( res['OK'] )
+    # Files sorted by size, /c can only go to one of its SEs
+    self.assertEqual( res['Value'], [( 'SE2', ['/d'] ), ( 'SE1', ['/b', '/a', '/c'] )] )
+
+  @mock.patch( 'DIRAC.TransformationSystem.Client.Utilities.FILE_SIZE_CACHE_LIFETIME', 1 )
+  def test_fileSizeCache( self ):
+    self.pu.setParameters( {'TransformationID': 1} )
+    self.pu.cachedLFNSize.update( {'/a':4} )
+    # The sizes are kept for the next execution of the transformation
+    pu = PluginUtilities( transClient = self.mockTransClient )
+    pu.setParameters( {'TransformationID': 1} )
+    self.assertEqual( pu.cachedLFNSize, {'/a':4} )
+    pu.setParameters( {'TransformationID': 2} )
+    self.assertEqual( pu.cachedLFNSize, {} )
+    # and forgotten when the transformation is no longer processed
+    time.sleep( 1.1 )
+    pu = PluginUtilities( transClient = self.mockTransClient )
+    pu.setParameters( {'TransformationID': 1} )
+    self.assertEqual( pu.cachedLFNSize, {} )
+
+  def test_getFileGroups( self ):
+    fileGroups = getFileGroups( [( '/b', ['SE2', 'SE1'] ), ( '/a', ['SE1', 'SE2', 'SE1'] ), ( '/c', ['SE1'] )] )
+    self.assertEqual( fileGroups, {'SE1,SE2': ['/b', '/a'], 'SE1': ['/c']} )
+    fileGroups = getFileGroups( {'/b': ['SE2', 'SE1'], '/c': ['SE1']}, groupSE = False )
+    self.assertEqual( sorted( fileGroups ), ['SE1', 'SE2'] )
+    self.assertEqual( sorted( fileGroups['SE1'] ), ['/b', '/c'] )
+    self.assertEqual( fileGroups['SE2'], ['/b'] )
+
 #############################################################################
 
 class WorkflowTasksSuccess( ClientsTestCase ):
@@ -183,6 +217,21 @@ class WorkflowTasksSuccess( ClientsTestCase ):
     res = self.wfTasks._handleDestination( {'Site':'Site1', 'TargetSE':'pluto'} )
     self.assertEqual( res, [] )
 
+  def test_getSubmittedTaskStatus( self ):
+    taskDicts = [{'TransformationID': 1, 'TaskID': 1, 'ExternalID': '11', 'ExternalStatus': 'Waiting'},
+                 {'TransformationID': 1, 'TaskID': 2, 'ExternalID': '12', 'ExternalStatus': 'Running'}]
+    # Full check: a job not found is removed
+    self.jobMonitoringClient.getJobsStatus.return_value = {'OK': True, 'Value': {11: {'Status': 'Running'}}}
+    res = self.wfTasks.getSubmittedTaskStatus( taskDicts )
+    self.assertTrue( res['OK'] )
+    self.assertEqual( res['Value'], {'Running': [1], 'Failed': [2]} )
+    # Only the jobs updated since
+    self.jobMonitoringClient.getJobsStatusChanges.return_value = {'OK': True, 'Value': {11: {'Status': 'Running'}}}
+    res = self.wfTasks.getSubmittedTaskStatus( taskDicts, since = '2017-01-01 00:00:00' )
+    self.assertTrue( res['OK'] )
+    self.assertEqual( res['Value'], {'Running': [1]} )
+    self.jobMonitoringClient.getJobsStatusChanges.assert_called_once_with( [11, 12], '2017-01-01 00:00:00' )
+
 #############################################################################
 
 class RequestTasksSuccess( ClientsTestCase ):
@@ -268,6 +317,21 @@ class RequestTasksSuccess( ClientsTestCase ):
       self.assertEqual( task['TaskObject'][0].TargetSE, 'BAR-SRM' )
       self.assertEqual( task['TaskObject'][1].TargetSE, 'FOO-SRM' )
 
+  def test_getSubmittedTaskStatus( self ):
+    taskDicts = [{'TransformationID': 1, 'TaskID': 1, 'ExternalID': '11', 'ExternalStatus': 'Waiting'},
+                 {'TransformationID': 1, 'TaskID': 2, 'ExternalID': '12', 'ExternalStatus': 'Waiting'},
+                 {'TransformationID': 1, 'TaskID': 3, 'ExternalID': '0', 'ExternalStatus': 'Waiting'}]
+    self.mockReqClient.getRequestStatus.side_effect = lambda reqID: {'OK': True, 'Value': {11: 'Done', 12: 'Waiting'}[reqID]}
+    res = self.requestTasks.getSubmittedTaskStatus( taskDicts )
+    self.assertTrue( res['OK'] )
+    self.assertEqual( res['Value'], {'Done': [1]} )
+    # One call for the requests updated since
+    self.mockReqClient.getRequestsStatusChanges.return_value = {'OK': True, 'Value': {12: 'Failed'}}
+    res = self.requestTasks.getSubmittedTaskStatus( taskDicts, since = '2017-01-01 00:00:00' )
+    self.assertTrue( res['OK'] )
+    self.assertEqual( res['Value'], {'Failed': [2]} )
+    self.assertEqual( self.mockReqClient.getRequestStatus.call_count, 2 )
+
 #############################################################################
 
 
@@ -1284,6 +1284,105 @@ class TransformationDB( DB ):
         return res
     return S_OK( taskID )
 
+  def addTasksForTransformation( self, transID, tasks, connection = False ):
+    """ Create in one transaction all the tasks generated by a plugin for a transformation:
+        the tasks, their input vectors and the assignment of their files are inserted with multi-row
+        statements, the files being updated with a join on a temporary table.
+
+    :param list tasks: list of ( se, lfns ) tuples
+    :return: S_OK( { 'Successful' : { taskIndex : taskID }, 'Failed' : { taskIndex : error } } )
+    """
+    res = self._getConnectionTransID( connection, transID )
+    if not res['OK']:
+      return res
+    connection = res['Value']['Connection']
+    transID = res['Value']['TransformationID']
+    failed = {}
+    # Be sure the all the supplied LFNs are known to the database for the supplied transformation
+    allLfns = set( lfn for _se, lfns in tasks for lfn in lfns )
+    fileIDs = {}
+    if allLfns:
+      res = self.getTransformationFiles( condDict = {'TransformationID':transID, 'LFN':list( allLfns )},
+                                         connection = connection )
+      if not res['OK']:
+        return res
+      for fileDict in res['Value']:
+        if fileDict['Status'] in self.allowedStatusForTasks:
+          fileIDs[fileDict['LFN']] = fileDict['FileID']
+        else:
+          gLogger.error( "Supplied file not in %s status but %s" % ( self.allowedStatusForTasks, fileDict['Status'] ),
+                         fileDict['LFN'] )
+    newTasks = []
+    lfnsInTasks = set()
+    for taskIndex, ( se, lfns ) in enumerate( tasks ):
+      # A file can only be in one task
+      unavailableLfns = [lfn for lfn in lfns if lfn not in fileIDs or lfn in lfnsInTasks]
+      if unavailableLfns:
+        gLogger.error( "Supplied files not found for transformation", sorted( unavailableLfns ) )
+        failed[taskIndex] = "Not all supplied files available in the transformation database"
+      else:
+        lfnsInTasks.update( lfns )
+        newTasks.append( ( taskIndex, se, lfns ) )
+    if not newTasks:
+      return S_OK( {'Successful':{}, 'Failed':failed} )
+
+    res = self._escapeValues( [se for _taskIndex, se, _lfns in newTasks] )
+    if not res['OK']:
+      return res
+    escapedSEs = res['Value']
+    # The TaskIDs are consecutive, they are computed from the first one: with InnoDB, TaskID is computed by
+    # a trigger which sets @last, i.e. the last TaskID inserted by the statement
+    req = "INSERT INTO TransformationTasks(TransformationID, ExternalStatus, ExternalID, TargetSE,"
+    req += " CreationTime, LastUpdateTime) VALUES "
+    req += ','.join( "(%d,'Created','0',%s,UTC_TIMESTAMP(),UTC_TIMESTAMP())" % ( transID, se ) for se in escapedSEs )
+    cmdList = ["START TRANSACTION", req]
+    if self.isTransformationTasksInnoDB:
+      cmdList.append( "SET @firstTask = @last - %d" % ( len( newTasks ) - 1 ) )
+    else:
+      cmdList.append( "SET @firstTask = LAST_INSERT_ID()" )
+
+    taskInputs = []
+    taskFiles = []
+    for taskNumber, ( _taskIndex, _se, lfns ) in enumerate( newTasks ):
+      if lfns:
+        res = self._escapeString( ';'.join( lfns ) )
+        if not res['OK']:
+          return res
+        taskInputs.append( "(%d,@firstTask+%d,%s)" % ( transID, taskNumber, res['Value'] ) )
+        taskFiles += ["(%d,@firstTask+%d,%s)" % ( fileIDs[lfn], taskNumber, escapedSEs[taskNumber] ) for lfn in lfns]
+    for chunk in breakListIntoChunks( taskInputs, 1000 ):
+      cmdList.append( "INSERT INTO TaskInputs (TransformationID,TaskID,InputVector) VALUES %s" % ','.join( chunk ) )
+    if taskFiles:
+      cmdList += ["DROP TEMPORARY TABLE IF EXISTS TmpTaskFiles",
+                  "CREATE TEMPORARY TABLE TmpTaskFiles (FileID INTEGER NOT NULL PRIMARY KEY, TaskID INTEGER NOT NULL,"
+                  " UsedSE VARCHAR(255)) ENGINE=MEMORY"]
+      for chunk in breakListIntoChunks( taskFiles, 10000 ):
+        cmdList.append( "INSERT INTO TmpTaskFiles (FileID,TaskID,UsedSE) VALUES %s" % ','.join( chunk ) )
+      cmdList += ["UPDATE TransformationFiles f JOIN TmpTaskFiles t ON f.FileID = t.FileID"
+                  " SET f.TaskID = t.TaskID, f.UsedSE = t.UsedSE, f.Status = 'Assigned', f.LastUpdate = UTC_TIMESTAMP()"
+                  " WHERE f.TransformationID = %d" % transID,
+                  "INSERT INTO TransformationFileTasks (TransformationID,FileID,TaskID)"
+                  " SELECT %d, FileID, TaskID FROM TmpTaskFiles" % transID,
+                  "DROP TEMPORARY TABLE TmpTaskFiles"]
+
+    # All the statements and the query of the first TaskID must go through the same connection
+    self.lock.acquire()
+    try:
+      res = self._transaction( cmdList, connection )
+      if res['OK']:
+        res = self._query( "SELECT @firstTask;", connection )
+    finally:
+      self.lock.release()
+    if not res['OK']:
+      gLogger.error( "Failed to publish tasks for transformation", res['Message'] )
+      return res
+    firstTaskID = int( res['Value'][0][0] )
+    successful = dict( ( taskIndex, firstTaskID + taskNumber )
+                       for taskNumber, ( taskIndex, _se, _lfns ) in enumerate( newTasks ) )
+    gLogger.verbose( "Published tasks %d to %d for transformation %d." % ( firstTaskID, firstTaskID + len( newTasks ) - 1,
+                                                                          transID ) )
+    return S_OK( {'Successful':successful, 'Failed':failed} )
+
   def extendTransformation( self, transName, nTasks, author = '', connection = False ):
     """ Extend SIMULATION type transformation by nTasks number of tasks
     """
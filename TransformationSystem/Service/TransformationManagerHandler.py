@@ -136,6 +136,13 @@ class TransformationManagerHandlerBase( RequestHandler ):
     res = database.addTaskForTransformation( transName, lfns = lfns, se = se )
     return self._parseRes( res )
 
+  types_addTasksForTransformation = [transTypes, [list, tuple]]
+  def export_addTasksForTransformation( self, transName, tasks ):
+    """ Create all the tasks generated by a plugin, given as a list of ( se, lfns ) tuples
+    """
+    res = database.addTasksForTransformation( transName, tasks )
+    return self._parseRes( res )
+
   types_setFileStatusForTransformation = [transTypes, [basestring, dict]]
   def export_setFileStatusForTransformation( self, transName, dictOfNewFilesStatus, lfns = [], force = False ):
     """ Sets the file status for the transformation.
@@ -12,6 +12,8 @@ import tempfile
 import random
 import socket
 import hashlib
+import threading
+import time
 from collections import defaultdict
 
 
@@ -34,6 +36,7 @@ from DIRAC.Core.Security                                   import CS
 from DIRAC.Core.Utilities.SiteCEMapping                    import getSiteForCE
 from DIRAC.Core.Utilities.Time                             import dateTime, second
 from DIRAC.Core.Utilities.List                             import fromChar
+from DIRAC.Core.Utilities.ThreadPool                       import ThreadPool
 
 __RCSID__ = "$Id$"
 
@@ -46,6 +49,8 @@ WAITING_PILOT_STATUS = ['Submitted', 'Waiting', 'Scheduled', 'Ready']
 FINAL_PILOT_STATUS = ['Aborted', 'Failed', 'Done']
 MAX_PILOTS_TO_SUBMIT = 100
 MAX_JOBS_IN_FILLMODE = 5
+MAX_CE_THREADS = 10
+CE_TIMEOUT = 600
 
 def getSubmitPools( group = None, vo = None ):
   if group:
@@ -77,6 +82,15 @@ class SiteDirector( AgentModule ):
     self.firstPass = True
     self.maxJobsInFillMode = MAX_JOBS_IN_FILLMODE
     self.maxPilotsToSubmit = MAX_PILOTS_TO_SUBMIT
+    self.maxPilotsToSubmitPerCE = 0
+    self.ceTimeout = CE_TIMEOUT
+    self.threadPool = None
+    # CEs with a submission or status update still running in the thread pool
+    self.busyCEs = set()
+    # Time spent per CE in the last cycle, per action
+    self.ceCycleTimes = {}
+    # Compressed and encoded pilot files, keyed by path, with the file modification time
+    self.encodedFilesCache = {}
 
     self.gridEnv = ''
     self.vo = ''
@@ -103,6 +117,8 @@ class SiteDirector( AgentModule ):
     """
     self.am_setOption( "PollingTime", 60.0 )
     self.am_setOption( "maxPilotWaitingHours", 6 )
+    maxCEThreads = self.am_getOption( 'MaxCEThreads', MAX_CE_THREADS )
+    self.threadPool = ThreadPool( 1, maxCEThreads )
     return S_OK()
 
   def beginExecution( self ):
@@ -148,6 +164,8 @@ class SiteDirector( AgentModule ):
     self.pilotLogLevel = self.am_getOption( 'PilotLogLevel', 'INFO' )
     self.maxJobsInFillMode = self.am_getOption( 'MaxJobsInFillMode', self.maxJobsInFillMode )
     self.maxPilotsToSubmit = self.am_getOption( 'MaxPilotsToSubmit', self.maxPilotsToSubmit )
+    self.maxPilotsToSubmitPerCE = self.am_getOption( 'MaxPilotsToSubmitPerCE', self.maxPilotsToSubmitPerCE )
+    self.ceTimeout = self.am_getOption( 'CETimeout', self.ceTimeout )
     self.pilotWaitingFlag = self.am_getOption( 'PilotWaitingFlag', True )
     self.pilotWaitingTime = self.am_getOption( 'MaxPilotWaitingTime', 3600 )
     self.failedQueueCycleFactor = self.am_getOption( 'FailedQueueCycleFactor', 10 )
@@ -207,6 +225,8 @@ class SiteDirector( AgentModule ):
     self.log.always( 'PilotGroup:', self.pilotGroup )
     self.log.always( 'MaxPilotsToSubmit:', self.maxPilotsToSubmit )
     self.log.always( 'MaxJobsInFillMode:', self.maxJobsInFillMode )
+    self.log.always( 'MaxPilotsToSubmitPerCE:', self.maxPilotsToSubmitPerCE )
+    self.log.always( 'CETimeout:', self.ceTimeout )
 
     self.localhost = socket.getfqdn()
     self.proxy = ''
@@ -441,236 +461,360 @@ class SiteDirector( AgentModule ):
         return S_ERROR( 'Can not get the site mask' )
       siteMaskList = result['Value']
 
+    # Queues of the same CE are served sequentially, different CEs in parallel
     queues = self.queueDict.keys()
     random.shuffle( queues )
-    totalSubmittedPilots = 0
-    matchedQueues = 0
+    ceQueues = defaultdict( list )
     for queue in queues:
+      ceQueues[self.queueDict[queue]['CEName']].append( queue )
 
-      # Check if the queue failed previously
-      failedCount = self.failedQueues[ queue ] % self.failedQueueCycleFactor
-      if failedCount != 0:
-        self.log.warn( "%s queue failed recently, skipping %d cycles" % ( queue, 10-failedCount ) )
-        self.failedQueues[queue] += 1
-        continue
+    submitContext = { 'SiteMask': siteMaskList,
+                      'AnySite': anySite,
+                      'JobSites': jobSites,
+                      'TestSites': testSites }
+    ceResults = self.__executePerCE( self._submitPilotsToCE, ceQueues, 'submission', submitContext )
 
-      ce = self.queueDict[queue]['CE']
-      ceName = self.queueDict[queue]['CEName']
-      ceType = self.queueDict[queue]['CEType']
-      queueName = self.queueDict[queue]['QueueName']
-      siteName = self.queueDict[queue]['Site']
-      platform = self.queueDict[queue]['Platform']
-      siteMask = siteName in siteMaskList
+    totalSubmittedPilots = 0
+    matchedQueues = 0
+    for ceName, result in ceResults.items():
+      if not result['OK']:
+        self.log.error( 'Failed pilot submission to CE', '%s: %s' % ( ceName, result['Message'] ) )
+        continue
+      ceMatchedQueues, ceSubmittedPilots = result['Value']
+      matchedQueues += ceMatchedQueues
+      totalSubmittedPilots += ceSubmittedPilots
 
-      if self.rssFlag:
-        # Check the status of the Site
-        result = self.siteClient.getSiteStatuses({siteName})
-        if not result['OK']:
-          self.log.error( "Can not get the status of site %s: %s" % (siteName, result['Message']) )
-          continue
-        if result['Value']:
-          result = result['Value'][siteName]   #get the value of the status
+    self.log.info( "%d pilots submitted in total in this cycle, %d matched queues" % ( totalSubmittedPilots, matchedQueues ) )
+    return S_OK()
 
-        if result not in ('Active', 'Degraded'):
-          self.log.verbose( "Skipping site %s: site not usable" % siteName )
-          continue
+  def __executePerCE( self, method, ceQueues, action, *args ):
+    """ Execute method( ceName, queueList, *args ) for each CE in ceQueues
+        in the thread pool, waiting at most self.ceTimeout seconds for each CE.
+        CEs still busy from a previous cycle are skipped.
 
-        # Check the status of the ComputingElement
-        result = self.rssClient.getElementStatus(ceName, "ComputingElement")
-        if not result['OK']:
-          self.log.error( "Can not get the status of computing element %s: %s" % (siteName, result['Message']) )
-          continue
-        if result['Value']:
-          result = result['Value'][ceName]['all']   #get the value of the status
+        :return: dictionary { ceName : result } for the CEs which completed in time
+    """
+    ceResults = {}
+    ceTimes = {}
+    resultsLock = threading.Lock()
+
+    def timedCall( ceName, queueList ):
+      startTime = time.time()
+      try:
+        return method( ceName, queueList, *args )
+      finally:
+        with resultsLock:
+          ceTimes[ceName] = time.time() - startTime
+        self.busyCEs.discard( ceName )
+
+    def callback( threadedJob, result ):
+      with resultsLock:
+        ceResults[threadedJob.jobId()] = result
+
+    def exceptionCallback( threadedJob, exceptionInfo ):
+      self.log.exception( 'Exception in CE %s' % action, threadedJob.jobId(), lExcInfo = exceptionInfo )
+      with resultsLock:
+        ceResults[threadedJob.jobId()] = S_ERROR( 'Exception during %s: %s' % ( action, exceptionInfo[1] ) )
+
+    startTimes = {}
+    for ceName, queueList in ceQueues.items():
+      if ceName in self.busyCEs:
+        self.log.warn( 'CE still busy from a previous cycle, skipping %s' % action, ceName )
+        continue
+      self.busyCEs.add( ceName )
+      startTimes[ceName] = time.time()
+      self.threadPool.generateJobAndQueueIt( timedCall,
+                                             args = ( ceName, queueList ),
+                                             sTJId = ceName,
+                                             oCallback = callback,
+                                             oExceptionCallback = exceptionCallback )
+
+    # Wait for all the CEs to finish, giving up on those exceeding the timeout
+    pendingCEs = set( startTimes )
+    while pendingCEs:
+      self.threadPool.processResults()
+      with resultsLock:
+        pendingCEs -= set( ceResults )
+      now = time.time()
+      for ceName in list( pendingCEs ):
+        if self.ceTimeout and now - startTimes[ceName] > self.ceTimeout:
+          self.log.warn( 'CE %s timed out' % action, '%s after %d seconds' % ( ceName, self.ceTimeout ) )
+          for queue in ceQueues[ceName]:
+            self.failedQueues[queue] += 1
+          pendingCEs.discard( ceName )
+      if pendingCEs:
+        time.sleep( 0.1 )
+
+    with resultsLock:
+      ceResults = dict( ceResults )
+      ceTimes = dict( ceTimes )
+    # Report the cycle timing broken down per CE, the slowest first
+    for ceName in sorted( ceTimes, key = ceTimes.get, reverse = True ):
+      self.log.info( 'CE %s time' % action, '%s: %.1f seconds' % ( ceName, ceTimes[ceName] ) )
+    self.ceCycleTimes[action] = ceTimes
+    return ceResults
+
+  def _submitPilotsToCE( self, ceName, queueList, submitContext ):
+    """ Submit pilots to all the queues of the given CE, one after the other,
+        within the MaxPilotsToSubmitPerCE limit
+
+        :return: S_OK( ( number of matched queues, number of submitted pilots ) )
+    """
+    # Each thread gets its own client
+    rpcMatcher = RPCClient( "WorkloadManagement/Matcher" )
+    matchedQueues = 0
+    submittedPilots = 0
+    for queue in queueList:
+      maxPilots = None
+      if self.maxPilotsToSubmitPerCE:
+        maxPilots = self.maxPilotsToSubmitPerCE - submittedPilots
+        if maxPilots <= 0:
+          self.log.verbose( 'Maximum number of pilots per cycle reached for CE %s' % ceName )
+          break
+      result = self._submitPilotsToQueue( queue, submitContext, rpcMatcher, maxPilots )
+      if not result['OK']:
+        return result
+      queueMatched, queueSubmittedPilots = result['Value']
+      if queueMatched:
+        matchedQueues += 1
+      submittedPilots += queueSubmittedPilots
+    return S_OK( ( matchedQueues, submittedPilots ) )
 
-        if result not in ('Active', 'Degraded'):
-          self.log.verbose( "Skipping computing element %s at %s: resource not usable" % (ceName, siteName) )
-          continue
+  def _submitPilotsToQueue( self, queue, submitContext, rpcMatcher, maxPilots = None ):
+    """ Submit pilots to the given queue if there are eligible jobs and free slots
 
-      if not anySite and siteName not in jobSites:
-        self.log.verbose( "Skipping queue %s at %s: no workload expected" % (queueName, siteName) )
-        continue
-      if not siteMask and siteName not in testSites:
-        self.log.verbose( "Skipping queue %s: site %s not in the mask" % (queueName, siteName) )
-        continue
+        :return: S_OK( ( matched flag, number of submitted pilots ) )
+    """
+    submittedPilots = 0
 
-      if 'CPUTime' in self.queueDict[queue]['ParametersDict'] :
-        queueCPUTime = int( self.queueDict[queue]['ParametersDict']['CPUTime'] )
-      else:
-        self.log.warn( 'CPU time limit is not specified for queue %s, skipping...' % queue )
-        continue
-      if queueCPUTime > self.maxQueueLength:
-        queueCPUTime = self.maxQueueLength
-
-      # Prepare the queue description to look for eligible jobs
-      ceDict = ce.getParameterDict()
-      ceDict[ 'GridCE' ] = ceName
-      #if not siteMask and 'Site' in ceDict:
-      #  self.log.info( 'Site not in the mask %s' % siteName )
-      #  self.log.info( 'Removing "Site" from matching Dict' )
-      #  del ceDict[ 'Site' ]
-      if not siteMask:
-        ceDict['JobType'] = "Test"
-      if self.vo:
-        ceDict['Community'] = self.vo
-      if self.voGroups:
-        ceDict['OwnerGroup'] = self.voGroups
+    # Check if the queue failed previously
+    failedCount = self.failedQueues[ queue ] % self.failedQueueCycleFactor
+    if failedCount != 0:
+      self.log.warn( "%s queue failed recently, skipping %d cycles" % ( queue, 10-failedCount ) )
+      self.failedQueues[queue] += 1
+      return S_OK( ( False, 0 ) )
 
-      # This is a hack to get rid of !
-      ceDict['SubmitPool'] = self.defaultSubmitPools
+    ce = self.queueDict[queue]['CE']
+    ceName = self.queueDict[queue]['CEName']
+    ceType = self.queueDict[queue]['CEType']
+    queueName = self.queueDict[queue]['QueueName']
+    siteName = self.queueDict[queue]['Site']
+    platform = self.queueDict[queue]['Platform']
+    siteMask = siteName in submitContext['SiteMask']
 
-      result = Resources.getCompatiblePlatforms( platform )
+    if self.rssFlag:
+      # Check the status of the Site
+      result = self.siteClient.getSiteStatuses({siteName})
       if not result['OK']:
-        continue
-      ceDict['Platform'] = result['Value']
+        self.log.error( "Can not get the status of site %s: %s" % (siteName, result['Message']) )
+        return S_OK( ( False, 0 ) )
+      if result['Value']:
+        result = result['Value'][siteName]   #get the value of the status
 
-      # Get the number of eligible jobs for the target site/queue
-      result = rpcMatcher.getMatchingTaskQueues( ceDict )
+      if result not in ('Active', 'Degraded'):
+        self.log.verbose( "Skipping site %s: site not usable" % siteName )
+        return S_OK( ( False, 0 ) )
+
+      # Check the status of the ComputingElement
+      result = self.rssClient.getElementStatus(ceName, "ComputingElement")
       if not result['OK']:
-        self.log.error( 'Could not retrieve TaskQueues from TaskQueueDB', result['Message'] )
-        return result
-      taskQueueDict = result['Value']
-      if not taskQueueDict:
-        self.log.verbose( 'No matching TQs found for %s' % queue )
-        continue
+        self.log.error( "Can not get the status of computing element %s: %s" % (siteName, result['Message']) )
+        return S_OK( ( False, 0 ) )
+      if result['Value']:
+        result = result['Value'][ceName]['all']   #get the value of the status
+
+      if result not in ('Active', 'Degraded'):
+        self.log.verbose( "Skipping computing element %s at %s: resource not usable" % (ceName, siteName) )
+        return S_OK( ( False, 0 ) )
+
+    if not submitContext['AnySite'] and siteName not in submitContext['JobSites']:
+      self.log.verbose( "Skipping queue %s at %s: no workload expected" % (queueName, siteName) )
+      return S_OK( ( False, 0 ) )
+    if not siteMask and siteName not in submitContext['TestSites']:
+      self.log.verbose( "Skipping queue %s: site %s not in the mask" % (queueName, siteName) )
+      return S_OK( ( False, 0 ) )
+
+    if 'CPUTime' in self.queueDict[queue]['ParametersDict'] :
+      queueCPUTime = int( self.queueDict[queue]['ParametersDict']['CPUTime'] )
+    else:
+      self.log.warn( 'CPU time limit is not specified for queue %s, skipping...' % queue )
+      return S_OK( ( False, 0 ) )
+    if queueCPUTime > self.maxQueueLength:
+      queueCPUTime = self.maxQueueLength
+
+    # Prepare the queue description to look for eligible jobs
+    ceDict = ce.getParameterDict()
+    ceDict[ 'GridCE' ] = ceName
+    #if not siteMask and 'Site' in ceDict:
+    #  self.log.info( 'Site not in the mask %s' % siteName )
+    #  self.log.info( 'Removing "Site" from matching Dict' )
+    #  del ceDict[ 'Site' ]
+    if not siteMask:
+      ceDict['JobType'] = "Test"
+    if self.vo:
+      ceDict['Community'] = self.vo
+    if self.voGroups:
+      ceDict['OwnerGroup'] = self.voGroups
 
-      matchedQueues += 1
-      totalTQJobs = 0
-      tqIDList = taskQueueDict.keys()
-      for tq in taskQueueDict:
-        totalTQJobs += taskQueueDict[tq]['Jobs']
-
-      self.log.verbose( '%d job(s) from %d task queue(s) are eligible for %s queue' % (totalTQJobs, len( tqIDList ), queue) )
-
-      # Get the number of already waiting pilots for these task queues
-      totalWaitingPilots = 0
-      manyWaitingPilotsFlag = False
-      if self.pilotWaitingFlag:
-        lastUpdateTime = dateTime() - self.pilotWaitingTime * second
-        result = pilotAgentsDB.countPilots( { 'TaskQueueID': tqIDList,
-                                              'Status': WAITING_PILOT_STATUS },
-                                            None, lastUpdateTime )
-        if not result['OK']:
-          self.log.error( 'Failed to get Number of Waiting pilots', result['Message'] )
-          totalWaitingPilots = 0
-        else:
-          totalWaitingPilots = result['Value']
-          self.log.verbose( 'Waiting Pilots for TaskQueue %s:' % tqIDList, totalWaitingPilots )
-      if totalWaitingPilots >= totalTQJobs:
-        self.log.verbose( "%d waiting pilots already for all the available jobs" % totalWaitingPilots )
-        manyWaitingPilotsFlag = True
-        if not self.addPilotsToEmptySites:
-          continue
+    # This is a hack to get rid of !
+    ceDict['SubmitPool'] = self.defaultSubmitPools
 
-      self.log.verbose( "%d waiting pilots for the total of %d eligible jobs for %s" % (totalWaitingPilots, totalTQJobs, queue) )
+    result = Resources.getCompatiblePlatforms( platform )
+    if not result['OK']:
+      return S_OK( ( False, 0 ) )
+    ceDict['Platform'] = result['Value']
 
-      # Get the working proxy
-      cpuTime = queueCPUTime + 86400
-      self.log.verbose( "Getting pilot proxy for %s/%s %d long" % ( self.pilotDN, self.pilotGroup, cpuTime ) )
-      result = gProxyManager.getPilotProxyFromDIRACGroup( self.pilotDN, self.pilotGroup, cpuTime )
-      if not result['OK']:
-        return result
-      self.proxy = result['Value']
-      # Check returned proxy lifetime
-      result = self.proxy.getRemainingSecs() #pylint: disable=no-member
-      if not result['OK']:
-        return result
-      lifetime_secs = result['Value']
-      ce.setProxy( self.proxy, lifetime_secs )
+    # Get the number of eligible jobs for the target site/queue
+    result = rpcMatcher.getMatchingTaskQueues( ceDict )
+    if not result['OK']:
+      self.log.error( 'Could not retrieve TaskQueues from TaskQueueDB', result['Message'] )
+      return result
+    taskQueueDict = result['Value']
+    if not taskQueueDict:
+      self.log.verbose( 'No matching TQs found for %s' % queue )
+      return S_OK( ( False, 0 ) )
 
-      # Get the number of available slots on the target site/queue
-      totalSlots = self.getQueueSlots( queue, manyWaitingPilotsFlag )
-      if totalSlots == 0:
-        self.log.debug( '%s: No slots available' % queue )
-        continue
+    totalTQJobs = 0
+    tqIDList = taskQueueDict.keys()
+    for tq in taskQueueDict:
+      totalTQJobs += taskQueueDict[tq]['Jobs']
 
-      if manyWaitingPilotsFlag:
-        # Throttle submission of extra pilots to empty sites
-        pilotsToSubmit = self.maxPilotsToSubmit/10 + 1
-      else:
-        pilotsToSubmit = max( 0, min( totalSlots, totalTQJobs - totalWaitingPilots ) )
-        self.log.info( '%s: Slots=%d, TQ jobs=%d, Pilots: waiting %d, to submit=%d' % \
-                                ( queue, totalSlots, totalTQJobs, totalWaitingPilots, pilotsToSubmit ) )
+    self.log.verbose( '%d job(s) from %d task queue(s) are eligible for %s queue' % (totalTQJobs, len( tqIDList ), queue) )
 
-      # Limit the number of pilots to submit to MAX_PILOTS_TO_SUBMIT
-      pilotsToSubmit = min( self.maxPilotsToSubmit, pilotsToSubmit )
+    # Get the number of already waiting pilots for these task queues
+    totalWaitingPilots = 0
+    manyWaitingPilotsFlag = False
+    if self.pilotWaitingFlag:
+      lastUpdateTime = dateTime() - self.pilotWaitingTime * second
+      result = pilotAgentsDB.countPilots( { 'TaskQueueID': tqIDList,
+                                            'Status': WAITING_PILOT_STATUS },
+                                          None, lastUpdateTime )
+      if not result['OK']:
+        self.log.error( 'Failed to get Number of Waiting pilots', result['Message'] )
+        totalWaitingPilots = 0
+      else:
+        totalWaitingPilots = result['Value']
+        self.log.verbose( 'Waiting Pilots for TaskQueue %s:' % tqIDList, totalWaitingPilots )
+    if totalWaitingPilots >= totalTQJobs:
+      self.log.verbose( "%d waiting pilots already for all the available jobs" % totalWaitingPilots )
+      manyWaitingPilotsFlag = True
+      if not self.addPilotsToEmptySites:
+        return S_OK( ( True, 0 ) )
+
+    self.log.verbose( "%d waiting pilots for the total of %d eligible jobs for %s" % (totalWaitingPilots, totalTQJobs, queue) )
+
+    # Get the working proxy
+    cpuTime = queueCPUTime + 86400
+    self.log.verbose( "Getting pilot proxy for %s/%s %d long" % ( self.pilotDN, self.pilotGroup, cpuTime ) )
+    result = gProxyManager.getPilotProxyFromDIRACGroup( self.pilotDN, self.pilotGroup, cpuTime )
+    if not result['OK']:
+      return result
+    # The proxy is kept local: the CEs are served by concurrent threads
+    proxy = result['Value']
+    # Check returned proxy lifetime
+    result = proxy.getRemainingSecs() #pylint: disable=no-member
+    if not result['OK']:
+      return result
+    lifetime_secs = result['Value']
+    ce.setProxy( proxy, lifetime_secs )
 
-      while pilotsToSubmit > 0:
-        self.log.info( 'Going to submit %d pilots to %s queue' % ( pilotsToSubmit, queue ) )
+    # Get the number of available slots on the target site/queue
+    totalSlots = self.getQueueSlots( queue, manyWaitingPilotsFlag )
+    if totalSlots == 0:
+      self.log.debug( '%s: No slots available' % queue )
+      return S_OK( ( True, 0 ) )
 
-        bundleProxy = self.queueDict[queue].get( 'BundleProxy', False )
-        jobExecDir = ''
-        jobExecDir = self.queueDict[queue]['ParametersDict'].get( 'JobExecDir', jobExecDir )
-        httpProxy = self.queueDict[queue]['ParametersDict'].get( 'HttpProxy', '' )
+    if manyWaitingPilotsFlag:
+      # Throttle submission of extra pilots to empty sites
+      pilotsToSubmit = self.maxPilotsToSubmit/10 + 1
+    else:
+      pilotsToSubmit = max( 0, min( totalSlots, totalTQJobs - totalWaitingPilots ) )
+      self.log.info( '%s: Slots=%d, TQ jobs=%d, Pilots: waiting %d, to submit=%d' % \
+                              ( queue, totalSlots, totalTQJobs, totalWaitingPilots, pilotsToSubmit ) )
+
+    # Limit the number of pilots to submit to MAX_PILOTS_TO_SUBMIT
+    pilotsToSubmit = min( self.maxPilotsToSubmit, pilotsToSubmit )
+    # Limit the number of pilots to what is left of the budget of the CE in this cycle
+    if maxPilots is not None:
+      pilotsToSubmit = min( maxPilots, pilotsToSubmit )
+
+    while pilotsToSubmit > 0:
+      self.log.info( 'Going to submit %d pilots to %s queue' % ( pilotsToSubmit, queue ) )
+
+      bundleProxy = self.queueDict[queue].get( 'BundleProxy', False )
+      jobExecDir = ''
+      jobExecDir = self.queueDict[queue]['ParametersDict'].get( 'JobExecDir', jobExecDir )
+      httpProxy = self.queueDict[queue]['ParametersDict'].get( 'HttpProxy', '' )
+
+      result = self.getExecutable( queue, pilotsToSubmit,
+                                   bundleProxy = bundleProxy,
+                                   httpProxy = httpProxy,
+                                   jobExecDir = jobExecDir,
+                                   proxy = proxy )
+      if not result['OK']:
+        return result
 
-        result = self.getExecutable( queue, pilotsToSubmit,
-                                     bundleProxy = bundleProxy,
-                                     httpProxy = httpProxy,
-                                     jobExecDir = jobExecDir )
-        if not result['OK']:
-          return result
+      executable, pilotSubmissionChunk = result['Value']
+      result = ce.submitJob( executable, '', pilotSubmissionChunk )
+      ### FIXME: The condor thing only transfers the file with some
+      ### delay, so when we unlink here the script is gone
+      ### FIXME 2: but at some time we need to clean up the pilot wrapper scripts...
+      if ceType != 'HTCondorCE':
+        os.unlink( executable )
+      if not result['OK']:
+        self.log.error( 'Failed submission to queue %s:\n' % queue, result['Message'] )
+        pilotsToSubmit = 0
+        self.failedQueues[queue] += 1
+        continue
 
-        executable, pilotSubmissionChunk = result['Value']
-        result = ce.submitJob( executable, '', pilotSubmissionChunk )
-        ### FIXME: The condor thing only transfers the file with some
-        ### delay, so when we unlink here the script is gone
-        ### FIXME 2: but at some time we need to clean up the pilot wrapper scripts...
-        if ceType != 'HTCondorCE':
-          os.unlink( executable )
+      pilotsToSubmit = pilotsToSubmit - pilotSubmissionChunk
+      # Add pilots to the PilotAgentsDB assign pilots to TaskQueue proportionally to the
+      # task queue priorities
+      pilotList = result['Value']
+      self.queueSlots[queue]['AvailableSlots'] -= len( pilotList )
+      submittedPilots += len( pilotList )
+      self.log.info( 'Submitted %d pilots to %s@%s' % ( len( pilotList ), queueName, ceName ) )
+      stampDict = {}
+      if result.has_key( 'PilotStampDict' ):
+        stampDict = result['PilotStampDict']
+      tqPriorityList = []
+      sumPriority = 0.
+      for tq in taskQueueDict:
+        sumPriority += taskQueueDict[tq]['Priority']
+        tqPriorityList.append( ( tq, sumPriority ) )
+      tqDict = {}
+      for pilotID in pilotList:
+        rndm = random.random() * sumPriority
+        for tq, prio in tqPriorityList:
+          if rndm < prio:
+            tqID = tq
+            break
+        if not tqDict.has_key( tqID ):
+          tqDict[tqID] = []
+        tqDict[tqID].append( pilotID )
+
+      for tqID, pilotList in tqDict.items():
+        result = pilotAgentsDB.addPilotTQReference( pilotList,
+                                                    tqID,
+                                                    self.pilotDN,
+                                                    self.pilotGroup,
+                                                    self.localhost,
+                                                    ceType,
+                                                    '',
+                                                    stampDict )
         if not result['OK']:
-          self.log.error( 'Failed submission to queue %s:\n' % queue, result['Message'] )
-          pilotsToSubmit = 0
-          self.failedQueues[queue] += 1
+          self.log.error( 'Failed add pilots to the PilotAgentsDB: ', result['Message'] )
           continue
-
-        pilotsToSubmit = pilotsToSubmit - pilotSubmissionChunk
-        # Add pilots to the PilotAgentsDB assign pilots to TaskQueue proportionally to the
-        # task queue priorities
-        pilotList = result['Value']
-        self.queueSlots[queue]['AvailableSlots'] -= len( pilotList )
-        totalSubmittedPilots += len( pilotList )
-        self.log.info( 'Submitted %d pilots to %s@%s' % ( len( pilotList ), queueName, ceName ) )
-        stampDict = {}
-        if result.has_key( 'PilotStampDict' ):
-          stampDict = result['PilotStampDict']
-        tqPriorityList = []
-        sumPriority = 0.
-        for tq in taskQueueDict:
-          sumPriority += taskQueueDict[tq]['Priority']
-          tqPriorityList.append( ( tq, sumPriority ) )
-        tqDict = {}
-        for pilotID in pilotList:
-          rndm = random.random() * sumPriority
-          for tq, prio in tqPriorityList:
-            if rndm < prio:
-              tqID = tq
-              break
-          if not tqDict.has_key( tqID ):
-            tqDict[tqID] = []
-          tqDict[tqID].append( pilotID )
-
-        for tqID, pilotList in tqDict.items():
-          result = pilotAgentsDB.addPilotTQReference( pilotList,
-                                                      tqID,
-                                                      self.pilotDN,
-                                                      self.pilotGroup,
-                                                      self.localhost,
-                                                      ceType,
-                                                      '',
-                                                      stampDict )
+        for pilot in pilotList:
+          result = pilotAgentsDB.setPilotStatus(pilot, 'Submitted', ceName,
+                                                'Successfully submitted by the SiteDirector',
+                                                siteName, queueName )
           if not result['OK']:
-            self.log.error( 'Failed add pilots to the PilotAgentsDB: ', result['Message'] )
+            self.log.error( 'Failed to set pilot status: ', result['Message'] )
             continue
-          for pilot in pilotList:
-            result = pilotAgentsDB.setPilotStatus(pilot, 'Submitted', ceName,
-                                                  'Successfully submitted by the SiteDirector',
-                                                  siteName, queueName )
-            if not result['OK']:
-              self.log.error( 'Failed to set pilot status: ', result['Message'] )
-              continue
 
-    self.log.info( "%d pilots submitted in total in this cycle, %d matched queues" % ( totalSubmittedPilots, matchedQueues ) )
-    return S_OK()
+
+    return S_OK( ( True, submittedPilots ) )
 
   def getQueueSlots( self, queue, manyWaitingPilotsFlag ):
     """ Get the number of available slots in the queue
@@ -750,12 +894,13 @@ class SiteDirector( AgentModule ):
       return totalSlots
 
 #####################################################################################
-  def getExecutable( self, queue, pilotsToSubmit, bundleProxy = True, httpProxy = '', jobExecDir = '' ):
+  def getExecutable( self, queue, pilotsToSubmit, bundleProxy = True, httpProxy = '', jobExecDir = '', proxy = None ):
     """ Prepare the full executable for queue
     """
 
-    proxy = None
-    if bundleProxy:
+    if not bundleProxy:
+      proxy = None
+    elif proxy is None:
       proxy = self.proxy
     pilotOptions, pilotsToSubmit = self._getPilotOptions( queue, pilotsToSubmit )
     if pilotOptions is None:
@@ -886,12 +1031,12 @@ class SiteDirector( AgentModule ):
       if proxy is not None:
         compressedAndEncodedProxy = base64.encodestring( bz2.compress( proxy.dumpAllToString()['Value'] ) )
         proxyFlag = 'True'
-      compressedAndEncodedPilot = base64.encodestring( bz2.compress( open( self.pilot, "rb" ).read(), 9 ) )
-      compressedAndEncodedInstall = base64.encodestring( bz2.compress( open( self.install, "rb" ).read(), 9 ) )
+      compressedAndEncodedPilot = self.__getCompressedAndEncodedFile( self.pilot )
+      compressedAndEncodedInstall = self.__getCompressedAndEncodedFile( self.install )
       compressedAndEncodedExtra = {}
       for module in self.extraModules:
         moduleName = os.path.basename( module )
-        compressedAndEncodedExtra[moduleName] = base64.encodestring( bz2.compress( open( module, "rb" ).read(), 9 ) )
+        compressedAndEncodedExtra[moduleName] = self.__getCompressedAndEncodedFile( module )
     except:
       self.log.exception( 'Exception during file compression of proxy, dirac-pilot or dirac-install' )
       return S_ERROR( 'Exception during file compression of proxy, dirac-pilot or dirac-install' )
@@ -964,11 +1109,109 @@ EOF
     pilotWrapper.close()
     return name
 
+  def __getCompressedAndEncodedFile( self, filePath ):
+    """ Get the bz2 compressed and base64 encoded content of a file bundled in the
+        pilot wrapper. The result is reused for all the submissions until the file changes
+    """
+    mtime = os.stat( filePath ).st_mtime
+    cached = self.encodedFilesCache.get( filePath )
+    if cached and cached[0] == mtime:
+      return cached[1]
+    with open( filePath, "rb" ) as fd:
+      encoded = base64.encodestring( bz2.compress( fd.read(), 9 ) )
+    self.encodedFilesCache[filePath] = ( mtime, encoded )
+    return encoded
+
   def updatePilotStatus( self ):
     """ Update status of pilots in transient states
     """
+    ceQueues = defaultdict( list )
+    for queue in self.queueDict:
+      ceQueues[self.queueDict[queue]['CEName']].append( queue )
+    ceResults = self.__executePerCE( self._updatePilotStatusForCE, ceQueues, 'status update' )
+    for ceName, result in ceResults.items():
+      if not result['OK']:
+        self.log.error( 'Failed to update pilot status', '%s: %s' % ( ceName, result['Message'] ) )
+
+    # The pilot can be in Done state set by the job agent check if the output is retrieved
     for queue in self.queueDict:
       ce = self.queueDict[queue]['CE']
+
+      if not ce.isProxyValid( 120 ):
+        result = gProxyManager.getPilotProxyFromDIRACGroup( self.pilotDN, self.pilotGroup, 1000 )
+        if not result['OK']:
+          return result
+        ce.setProxy( result['Value'], 940 )
+
+      ceName = self.queueDict[queue]['CEName']
+      queueName = self.queueDict[queue]['QueueName']
+      ceType = self.queueDict[queue]['CEType']
+      siteName = self.queueDict[queue]['Site']
+      result = pilotAgentsDB.selectPilots( {'DestinationSite':ceName,
+                                            'Queue':queueName,
+                                            'GridType':ceType,
+                                            'GridSite':siteName,
+                                            'OutputReady':'False',
+                                            'Status':FINAL_PILOT_STATUS} )
+
+      if not result['OK']:
+        self.log.error( 'Failed to select pilots', result['Message'] )
+        continue
+      pilotRefs = result['Value']
+      if not pilotRefs:
+        continue
+      result = pilotAgentsDB.getPilotInfo( pilotRefs )
+      if not result['OK']:
+        self.log.error( 'Failed to get pilots info from DB', result['Message'] )
+        continue
+      pilotDict = result['Value']
+      if self.getOutput:
+        for pRef in pilotRefs:
+          self.log.info( 'Retrieving output for pilot %s' % pRef )
+          pilotStamp = pilotDict[pRef]['PilotStamp']
+          pRefStamp = pRef
+          if pilotStamp:
+            pRefStamp = pRef + ':::' + pilotStamp
+          result = ce.getJobOutput( pRefStamp )
+          if not result['OK']:
+            self.log.error( 'Failed to get pilot output', '%s: %s' % ( ceName, result['Message'] ) )
+          else:
+            output, error = result['Value']
+            result = pilotAgentsDB.storePilotOutput( pRef, output, error )
+            if not result['OK']:
+              self.log.error( 'Failed to store pilot output', result['Message'] )
+
+      # Check if the accounting is to be sent
+      if self.sendAccounting:
+        result = pilotAgentsDB.selectPilots( {'DestinationSite':ceName,
+                                              'Queue':queueName,
+                                              'GridType':ceType,
+                                              'GridSite':siteName,
+                                              'AccountingSent':'False',
+                                              'Status':FINAL_PILOT_STATUS} )
+
+        if not result['OK']:
+          self.log.error( 'Failed to select pilots', result['Message'] )
+          continue
+        pilotRefs = result['Value']
+        if not pilotRefs:
+          continue
+        result = pilotAgentsDB.getPilotInfo( pilotRefs )
+        if not result['OK']:
+          self.log.error( 'Failed to get pilots info from DB', result['Message'] )
+          continue
+        pilotDict = result['Value']
+        result = self.sendPilotAccounting( pilotDict )
+        if not result['OK']:
+          self.log.error( 'Failed to send pilot agent accounting' )
+
+    return S_OK()
+
+  def _updatePilotStatusForCE( self, ceName, queueList ):
+    """ Update status of pilots in transient states for the queues of the given CE
+    """
+    for queue in queueList:
+      ce = self.queueDict[queue]['CE']
       ceName = self.queueDict[queue]['CEName']
       queueName = self.queueDict[queue]['QueueName']
       ceType = self.queueDict[queue]['CEType']
@@ -1011,8 +1254,8 @@ EOF
         result = gProxyManager.getPilotProxyFromDIRACGroup( self.pilotDN, self.pilotGroup, 23400 )
         if not result['OK']:
           return result
-        self.proxy = result['Value']
-        ce.setProxy( self.proxy, 23300 )
+        proxy = result['Value']
+        ce.setProxy( proxy, 23300 )
 
       result = ce.getJobStatus( stampedPilotRefs )
       if not result['OK']:
@@ -1075,78 +1318,6 @@ EOF
       if abortedPilots:
         self.failedQueues[queue] += 1
 
-    # The pilot can be in Done state set by the job agent check if the output is retrieved
-    for queue in self.queueDict:
-      ce = self.queueDict[queue]['CE']
-
-      if not ce.isProxyValid( 120 ):
-        result = gProxyManager.getPilotProxyFromDIRACGroup( self.pilotDN, self.pilotGroup, 1000 )
-        if not result['OK']:
-          return result
-        ce.setProxy( self.proxy, 940 )
-
-      ceName = self.queueDict[queue]['CEName']
-      queueName = self.queueDict[queue]['QueueName']
-      ceType = self.queueDict[queue]['CEType']
-      siteName = self.queueDict[queue]['Site']
-      result = pilotAgentsDB.selectPilots( {'DestinationSite':ceName,
-                                            'Queue':queueName,
-                                            'GridType':ceType,
-                                            'GridSite':siteName,
-                                            'OutputReady':'False',
-                                            'Status':FINAL_PILOT_STATUS} )
-
-      if not result['OK']:
-        self.log.error( 'Failed to select pilots', result['Message'] )
-        continue
-      pilotRefs = result['Value']
-      if not pilotRefs:
-        continue
-      result = pilotAgentsDB.getPilotInfo( pilotRefs )
-      if not result['OK']:
-        self.log.error( 'Failed to get pilots info from DB', result['Message'] )
-        continue
-      pilotDict = result['Value']
-      if self.getOutput:
-        for pRef in pilotRefs:
-          self.log.info( 'Retrieving output for pilot %s' % pRef )
-          pilotStamp = pilotDict[pRef]['PilotStamp']
-          pRefStamp = pRef
-          if pilotStamp:
-            pRefStamp = pRef + ':::' + pilotStamp
-          result = ce.getJobOutput( pRefStamp )
-          if not result['OK']:
-            self.log.error( 'Failed to get pilot output', '%s: %s' % ( ceName, result['Message'] ) )
-          else:
-            output, error = result['Value']
-            result = pilotAgentsDB.storePilotOutput( pRef, output, error )
-            if not result['OK']:
-              self.log.error( 'Failed to store pilot output', result['Message'] )
-
-      # Check if the accounting is to be sent
-      if self.sendAccounting:
-        result = pilotAgentsDB.selectPilots( {'DestinationSite':ceName,
-                                              'Queue':queueName,
-                                              'GridType':ceType,
-                                              'GridSite':siteName,
-                                              'AccountingSent':'False',
-                                              'Status':FINAL_PILOT_STATUS} )
-
-        if not result['OK']:
-          self.log.error( 'Failed to select pilots', result['Message'] )
-          continue
-        pilotRefs = result['Value']
-        if not pilotRefs:
-          continue
-        result = pilotAgentsDB.getPilotInfo( pilotRefs )
-        if not result['OK']:
-          self.log.error( 'Failed to get pilots info from DB', result['Message'] )
-          continue
-        pilotDict = result['Value']
-        result = self.sendPilotAccounting( pilotDict )
-        if not result['OK']:
-          self.log.error( 'Failed to send pilot agent accounting' )
-
     return S_OK()
 
   def sendPilotAccounting( self, pilotDict ):
@@ -6,7 +6,7 @@ import unittest
 import importlib
 from mock import MagicMock
 
-from DIRAC import gLogger
+from DIRAC import gLogger, S_OK
 
 # sut
 from DIRAC.WorkloadManagementSystem.Agent.SiteDirector import SiteDirector
@@ -37,6 +37,35 @@ class SiteDirectorBaseSuccess( AgentsTestCase ):
     self.sd.queueDict['aQueue']['ParametersDict'] = {}
     _res = self.sd._getPilotOptions( 'aQueue', 10 )
 
+  def test__submitPilotsToCE( self ):
+    self.sd_m.RPCClient = MagicMock()
+    self.sd._submitPilotsToQueue = MagicMock( return_value = S_OK( ( True, 10 ) ) )
+    self.sd.maxPilotsToSubmitPerCE = 15
+    res = self.sd._submitPilotsToCE( 'aCE', ['aQueue', 'bQueue', 'cQueue'], {} )
+    self.assertTrue( res['OK'] )
+    self.assertEqual( res['Value'], ( 2, 20 ) )
+    self.assertEqual( self.sd._submitPilotsToQueue.call_args[0][3], 5 )
+
+    self.sd._submitPilotsToQueue.reset_mock()
+    self.sd.maxPilotsToSubmitPerCE = 0
+    res = self.sd._submitPilotsToCE( 'aCE', ['aQueue', 'bQueue', 'cQueue'], {} )
+    self.assertTrue( res['OK'] )
+    self.assertEqual( res['Value'], ( 3, 30 ) )
+    self.assertEqual( self.sd._submitPilotsToQueue.call_args[0][3], None )
+
+  def test_getExecutable( self ):
+    self.sd.workingDirectory = '/tmp'
+    self.sd.proxy = 'sharedProxy'
+    self.sd._getPilotOptions = MagicMock( return_value = ( ['-o', 'opt'], 5 ) )
+    self.sd._writePilotScript = MagicMock( return_value = 'pilotScript' )
+    # The proxy of the CE thread is bundled, not the one of the agent
+    res = self.sd.getExecutable( 'aQueue', 5, bundleProxy = True, proxy = 'ceProxy' )
+    self.assertTrue( res['OK'] )
+    self.assertEqual( res['Value'], ['pilotScript', 5] )
+    self.assertEqual( self.sd._writePilotScript.call_args[0][2], 'ceProxy' )
+    res = self.sd.getExecutable( 'aQueue', 5, bundleProxy = False, proxy = 'ceProxy' )
+    self.assertEqual( self.sd._writePilotScript.call_args[0][2], None )
+
 
 #############################################################################
 # Test Suite run
@@ -142,6 +142,20 @@ class SandboxStoreClient( object ):
         oMD5.update( bData )
         bData = fd.read( 10240 )
 
+    # Ask the service first whether this very same sandbox is already there
+    result = self.__getRPCClient().getSandboxForHash( oMD5.hexdigest(), "tar.bz2", assignTo )
+    if result[ 'OK' ] and result[ 'Value' ]:
+      gLogger.verbose( "Sandbox already in the store, skipping upload", result[ 'Value' ] )
+      result[ 'SandboxFileName' ] = tmpFilePath
+      try:
+        os.unlink( tmpFilePath )
+      except OSError:
+        pass
+      return result
+    if not result[ 'OK' ]:
+      # Older services do not implement the check, just upload
+      gLogger.debug( "Could not check if the sandbox already exists", result[ 'Message' ] )
+
     transferClient = self.__getTransferClient()
     result = transferClient.sendFile( tmpFilePath, ( "%s.tar.bz2" % oMD5.hexdigest(), assignTo ) )
     result[ 'SandboxFileName' ] = tmpFilePath
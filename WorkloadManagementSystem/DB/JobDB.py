@@ -146,6 +146,30 @@ class JobDB( DB ):
       return S_ERROR( 'JobDB.getAttributesForJobList: Failed\n%s' % str( x ) )
 
 
+#############################################################################
+  def getJobsStatusChanges( self, jobIDList, since ):
+    """ Get the status of the jobs in the jobIDList updated since a given time.
+        Returns an S_OK structure with a dictionary of dictionaries as its Value:
+        ValueDict[jobID] = { 'Status' : status, 'LastUpdateTime' : time stamp }
+    """
+    if not jobIDList:
+      return S_OK( {} )
+    ret = self._escapeString( str( since ) )
+    if not ret['OK']:
+      return ret
+    since = ret['Value']
+    jobList = ','.join( [str( int( x ) ) for x in jobIDList] )
+
+    cmd = 'SELECT JobID,Status,LastUpdateTime FROM Jobs WHERE JobID in ( %s ) AND LastUpdateTime >= %s' % ( jobList,
+                                                                                                           since )
+    res = self._query( cmd )
+    if not res['OK']:
+      return res
+    retDict = {}
+    for jobID, status, lastUpdateTime in res['Value']:
+      retDict[int( jobID )] = { 'Status' : status, 'LastUpdateTime' : lastUpdateTime }
+    return S_OK( retDict )
+
 #############################################################################
   def getDistinctJobAttributes( self, attribute, condDict = None, older = None,
                                 newer = None, timeStamp = 'LastUpdateTime' ):
@@ -97,6 +97,15 @@ class OptimizerExecutor( ExecutorModule ):
   def optimizeJob( self, jid, jobState ):
     raise Exception( "You need to overwrite this method to optimize the job!" )
 
+  def preProcessTasks( self, jobStates ):
+    return self.preOptimizeJobs( jobStates )
+
+  def preOptimizeJobs( self, jobStates ):
+    """ Receives all the jobs ( jid -> jobState ) that are going to be optimized together.
+        Overwrite it to do bulk queries whose results are then used by optimizeJob
+    """
+    return S_OK()
+
   def setNextOptimizer( self, jobState = None ):
     if not jobState:
       jobState = self.__jobData.jobState
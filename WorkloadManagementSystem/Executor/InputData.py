@@ -50,6 +50,14 @@ class InputData( OptimizerExecutor ):
 
     return S_OK()
 
+  def __init__( self ):
+    super( InputData, self ).__init__()
+    # Replicas and metadata resolved in bulk for the jobs being optimized together, per VO
+    self.__bulkReplicas = {}
+    self.__bulkMetadata = {}
+    # Sites and status of the SEs seen by the jobs being optimized together
+    self.__seData = {}
+
   def __getDataManager( self, vo ):
     if vo in self.__dataManDict:
       return self.__dataManDict[vo]
@@ -74,6 +82,93 @@ class InputData( OptimizerExecutor ):
         return None
       return self.__fcDict[vo]
 
+  @staticmethod
+  def __stripLFNPrefix( inputData ):
+    lfns = []
+    for lfn in inputData:
+      if lfn[:4].lower() == "lfn:":
+        lfns.append( lfn[4:] )
+      else:
+        lfns.append( lfn )
+    return lfns
+
+  def preOptimizeJobs( self, jobStates ):
+    """ Resolve with one catalog query per VO the replicas (and metadata) of the input data
+        of all the jobs that are going to be optimized together
+    """
+    self.__bulkReplicas = {}
+    self.__bulkMetadata = {}
+    self.__seData = {}
+    if self.checkWithUserProxy:
+      # Each job has to be resolved with the proxy of its owner
+      return S_OK()
+    productionTypes = Operations().getValue( 'Transformations/DataProcessing', [] )
+    voLFNs = {}
+    voJobs = {}
+    for jobState in jobStates.values():
+      result = jobState.getAttribute( "JobType" )
+      if not result['OK'] or result['Value'] in productionTypes:
+        continue
+      result = jobState.getInputData()
+      if not result['OK'] or not result['Value']:
+        continue
+      inputData = result['Value']
+      result = jobState.getManifest()
+      if not result['OK']:
+        continue
+      vo = result['Value'].getOption( 'VirtualOrganization' )
+      voLFNs.setdefault( vo, set() ).update( self.__stripLFNPrefix( inputData ) )
+      voJobs[vo] = voJobs.get( vo, 0 ) + 1
+
+    for vo, lfns in voLFNs.items():
+      lfns = list( lfns )
+      dm = self.__getDataManager( vo )
+      if dm is None:
+        continue
+      startTime = time.time()
+      result = dm.getReplicasForJobs( lfns )
+      self.log.info( 'Bulk catalog replicas lookup for %d files of %d jobs: %.2f seconds' % ( len( lfns ),
+                                                                                             voJobs[vo],
+                                                                                             time.time() - startTime ) )
+      if not result['OK']:
+        self.log.warn( "Bulk replicas lookup failed", result['Message'] )
+        continue
+      self.__bulkReplicas[vo] = result['Value']
+      if not self.ex_getOption( 'CheckFileMetadata', True ):
+        continue
+      fc = self.__getFileCatalog( vo )
+      if fc is None:
+        continue
+      startTime = time.time()
+      result = fc.getFileMetadata( lfns )
+      self.log.info( 'Bulk catalog metadata lookup for %d files: %.2f seconds' % ( len( lfns ),
+                                                                                   time.time() - startTime ) )
+      if not result['OK']:
+        self.log.warn( "Bulk metadata lookup failed", result['Message'] )
+        continue
+      self.__bulkMetadata[vo] = result['Value']
+    return S_OK()
+
+  @staticmethod
+  def __fromBulk( bulkDict, vo, lfns ):
+    """ Extract the result for the given lfns from a bulk query done in preOptimizeJobs.
+        Returns None if not all the lfns were resolved in bulk
+    """
+    if vo not in bulkDict:
+      return None
+    successful = bulkDict[vo]['Successful']
+    failed = bulkDict[vo]['Failed']
+    resDict = { 'Successful' : {}, 'Failed' : {} }
+    for lfn in lfns:
+      if lfn in successful:
+        # Copied, as the caller may modify it
+        resDict['Successful'][lfn] = dict( successful[lfn] )
+      elif lfn in failed:
+        resDict['Failed'][lfn] = failed[lfn]
+      else:
+        return None
+    return S_OK( resDict )
+
   def optimizeJob( self, jid, jobState ):
     """ This is the method that needs to be implemented by each and every Executor
 
@@ -133,12 +228,7 @@ class InputData( OptimizerExecutor ):
   def _resolveInputData( self, jobState, inputData ):
     """ This method checks the file catalog for replica information.
     """
-    lfns = []
-    for lfn in inputData:
-      if lfn[:4].lower() == "lfn:":
-        lfns.append( lfn[4:] )
-      else:
-        lfns.append( lfn )
+    lfns = self.__stripLFNPrefix( inputData )
 
     result = jobState.getManifest()
     if not result['OK']:
@@ -146,13 +236,16 @@ class InputData( OptimizerExecutor ):
     manifest = result['Value']
     vo = manifest.getOption( 'VirtualOrganization' )
     startTime = time.time()
-    dm = self.__getDataManager( vo )
-    if dm is None:
-      return S_ERROR( 'Failed to instantiate DataManager for vo %s' % vo )
+    result = self.__fromBulk( self.__bulkReplicas, vo, lfns )
+    if result:
+      self.jobLog.verbose( 'Using replicas resolved in bulk' )
     else:
+      dm = self.__getDataManager( vo )
+      if dm is None:
+        return S_ERROR( 'Failed to instantiate DataManager for vo %s' % vo )
       # This will return already active replicas, excluding banned SEs, and removing tape replicas if there are disk replicas
       result = dm.getReplicasForJobs( lfns )
-    self.jobLog.info( 'Catalog replicas lookup time: %.2f seconds ' % ( time.time() - startTime ) )
+      self.jobLog.info( 'Catalog replicas lookup time: %.2f seconds ' % ( time.time() - startTime ) )
     if not result['OK']:
       self.log.warn( result['Message'] )
       return result
@@ -174,12 +267,13 @@ class InputData( OptimizerExecutor ):
         return result
       manifest = result['Value']
       vo = manifest.getOption( 'VirtualOrganization' )
-      fc = self.__getFileCatalog( vo )
-      if fc is None:
-        return S_ERROR( 'Failed to instantiate FileCatalog for vo %s' % vo )
-      else:
+      guidDict = self.__fromBulk( self.__bulkMetadata, vo, lfns )
+      if not guidDict:
+        fc = self.__getFileCatalog( vo )
+        if fc is None:
+          return S_ERROR( 'Failed to instantiate FileCatalog for vo %s' % vo )
         guidDict = fc.getFileMetadata( lfns )
-      self.jobLog.info( 'Catalog Metadata Lookup Time: %.2f seconds ' % ( time.time() - startTime ) )
+        self.jobLog.info( 'Catalog Metadata Lookup Time: %.2f seconds ' % ( time.time() - startTime ) )
 
       if not guidDict['OK']:
         self.log.warn( guidDict['Message'] )
@@ -335,13 +429,14 @@ class InputData( OptimizerExecutor ):
       sitesData[ siteName ] = { 'disk': set(), 'tape': set() }
 
     # Loop time!
-    seDict = {}
+    seDict = self.__seData
     for lfn in okReplicas:
       replicas = okReplicas[ lfn ]
       # Check each SE in the replicas
       for seName in replicas:
         # If not already "loaded" the add it to the dict
-        if seName not in seDict:
+        seKey = ( seName, vo )
+        if seKey not in seDict:
           result = self.__getSitesForSE( seName )
           if not result['OK']:
             self.jobLog.warn( "Could not get sites for SE %s: %s" % ( seName, result[ 'Message' ] ) )
@@ -353,9 +448,9 @@ class InputData( OptimizerExecutor ):
             self.jobLog.error( "Could not retrieve status for SE %s: %s" % ( seName, result[ 'Message' ] ) )
             continue
           seStatus = result[ 'Value' ]
-          seDict[ seName ] = { 'Sites': siteList, 'Status': seStatus }
+          seDict[ seKey ] = { 'Sites': siteList, 'Status': seStatus }
         # Get SE info from the dict
-        seData = seDict[ seName ]
+        seData = seDict[ seKey ]
         siteList = seData[ 'Sites' ]
         seStatus = seData[ 'Status' ]
         for siteName in siteList:
@@ -12,6 +12,7 @@
 
 import random
 import errno
+import time
 
 from DIRAC import S_OK, S_ERROR, gConfig
 
@@ -23,7 +24,8 @@ from DIRAC.ConfigurationSystem.Client.Helpers.Resources             import getSi
 from DIRAC.ConfigurationSystem.Client.Helpers                       import Registry
 from DIRAC.ConfigurationSystem.Client.Helpers.Path                  import cfgPath
 from DIRAC.ConfigurationSystem.Client.Helpers.Operations            import Operations
-from DIRAC.StorageManagementSystem.Client.StorageManagerClient      import StorageManagerClient, getFilesToStage
+from DIRAC.StorageManagementSystem.Client.StorageManagerClient      import StorageManagerClient, getFilesToStage, \
+                                                                           getFilesToStageForJobs
 from DIRAC.Resources.Storage.StorageElement                         import StorageElement
 from DIRAC.WorkloadManagementSystem.Executor.Base.OptimizerExecutor import OptimizerExecutor
 from DIRAC.ResourceStatusSystem.Client.SiteStatus                   import SiteStatus
@@ -48,6 +50,67 @@ class JobScheduling( OptimizerExecutor ):
     cls.__jobDB = JobDB()
     return S_OK()
 
+  def __init__( self ):
+    super( JobScheduling, self ).__init__()
+    # Site, SE and status lookups done for the jobs being optimized together
+    self.__cycleCache = {}
+    # getFilesToStage results for production jobs, checked in bulk
+    self.__filesToStage = {}
+
+  def __cycleCached( self, key, func, *args, **kwargs ):
+    """ Successful results of func are reused for all the jobs being optimized together
+    """
+    if key not in self.__cycleCache:
+      result = func( *args, **kwargs )
+      if not result[ 'OK' ]:
+        return result
+      self.__cycleCache[ key ] = result
+    return self.__cycleCache[ key ]
+
+  def __getProductionTypes( self ):
+    if 'productionTypes' not in self.__cycleCache:
+      self.__cycleCache[ 'productionTypes' ] = Operations().getValue( 'Transformations/DataProcessing', [] )
+    return self.__cycleCache[ 'productionTypes' ]
+
+  def __getSEStatus( self, seName, vo ):
+    return self.__cycleCached( ( 'seStatus', seName, vo ),
+                               lambda: StorageElement( seName, vo = vo ).getStatus() )
+
+  def preOptimizeJobs( self, jobStates ):
+    """ Start a new resolution cycle and check with one bulk query per owner
+        the input data of the production jobs that are going to be optimized together
+    """
+    self.__cycleCache = {}
+    self.__filesToStage = {}
+    productionTypes = self.__getProductionTypes()
+    ownerJobs = {}
+    for jid, jobState in jobStates.items():
+      result = jobState.getAttributes( [ 'JobType', 'Owner', 'OwnerGroup' ] )
+      if not result[ 'OK' ] or result[ 'Value' ].get( 'JobType' ) not in productionTypes:
+        continue
+      owner = ( result[ 'Value' ].get( 'Owner' ), result[ 'Value' ].get( 'OwnerGroup' ) )
+      result = jobState.getInputData()
+      if not result[ 'OK' ] or not result[ 'Value' ]:
+        continue
+      ownerJobs.setdefault( owner, {} )[ jid ] = ( jobState, result[ 'Value' ] )
+
+    for jobs in ownerJobs.values():
+      # Nothing to share with a single job
+      if len( jobs ) < 2:
+        continue
+      jobLFNs = dict( ( jid, inputData ) for jid, ( _jobState, inputData ) in jobs.items() )
+      startTime = time.time()
+      result = getFilesToStageForJobs( jobLFNs, jobState = jobs.values()[0][0],
+                                       checkOnlyTapeSEs = self.ex_getOption( 'CheckOnlyTapeSEs', True ),
+                                       jobLog = self.log )
+      if not result[ 'OK' ]:
+        self.log.warn( "Could not check input data in bulk", result[ 'Message' ] )
+        continue
+      self.log.info( "Checked input data of %d production jobs in %.2f seconds" % ( len( jobs ),
+                                                                                   time.time() - startTime ) )
+      self.__filesToStage.update( result[ 'Value' ] )
+    return S_OK()
+
   def optimizeJob( self, jid, jobState ):
     """ 1. Banned sites are removed from the destination list.
         2. Get input files
@@ -89,7 +152,7 @@ class JobScheduling( OptimizerExecutor ):
     jobType = result[ 'Value' ]
 
     # Get banned sites from DIRAC
-    result = self.siteClient.getSites( 'Banned' )
+    result = self.__cycleCached( 'bannedSites', self.siteClient.getSites, 'Banned' )
     if not result[ 'OK' ]:
       return S_ERROR( "Cannot retrieve banned sites from JobDB" )
     wmsBannedSites = result[ 'Value' ]
@@ -98,7 +161,8 @@ class JobScheduling( OptimizerExecutor ):
     if userSites:
       if jobType not in self.ex_getOption( 'ExcludedOnHoldJobTypes', [] ):
 
-        result = self.siteClient.getUsableSites( userSites )
+        result = self.__cycleCached( ( 'usableSites', tuple( sorted( userSites ) ) ),
+                                     self.siteClient.getUsableSites, userSites )
         if not result[ 'OK' ]:
           return S_ERROR( "Problem checking userSites for tuple of active/banned/invalid sites" )
         usableSites = set( result['Value'] )
@@ -128,7 +192,7 @@ class JobScheduling( OptimizerExecutor ):
     jobPlatform = jobManifest.getOption( "Platform", None )
     # First check that the platform is valid (in OSCompatibility list)
     if checkPlatform and jobPlatform:
-      result = gConfig.getOptionsDict( '/Resources/Computing/OSCompatibility' )
+      result = self.__cycleCached( 'OSCompatibility', gConfig.getOptionsDict, '/Resources/Computing/OSCompatibility' )
       if not result[ 'OK' ]:
         return S_ERROR( "Unable to get OSCompatibility list" )
       allPlatforms = result[ 'Value' ]
@@ -139,7 +203,8 @@ class JobScheduling( OptimizerExecutor ):
     # Filter the userSites by the platform selection (if there is one)
     if checkPlatform and userSites:
       if jobPlatform:
-        result = self.__filterByPlatform( jobPlatform, userSites )
+        result = self.__cycleCached( ( 'platformSites', jobPlatform, tuple( sorted( userSites ) ) ),
+                                     self.__filterByPlatform, jobPlatform, userSites )
         if not result['OK']:
           self.jobLog.error( "Failed to filter job sites by platform: %s" % result[ 'Message' ] )
           return S_ERROR( "Failed to filter job sites by platform" )
@@ -165,10 +230,12 @@ class JobScheduling( OptimizerExecutor ):
     # ===================================================================================
     # Production jobs are sent to TQ, but first we have to verify if staging is necessary
     # ===================================================================================
-    if jobType in Operations().getValue( 'Transformations/DataProcessing', [] ):
+    if jobType in self.__getProductionTypes():
       self.jobLog.info( "Production job: sending to TQ, but first checking if staging is requested" )
 
-      res = getFilesToStage( inputData, jobState = jobState, checkOnlyTapeSEs = self.ex_getOption( 'CheckOnlyTapeSEs', True ), jobLog = self.jobLog )
+      res = self.__filesToStage.pop( jid, None )
+      if res is None:
+        res = getFilesToStage( inputData, jobState = jobState, checkOnlyTapeSEs = self.ex_getOption( 'CheckOnlyTapeSEs', True ), jobLog = self.jobLog )
 
       if not res['OK']:
         return self.__holdJob( jobState, res['Message'] )
@@ -471,14 +538,14 @@ class JobScheduling( OptimizerExecutor ):
     inputDataPolicy = jobManifest.getOption( 'InputDataPolicy', 'Protocol' )
     connectionLevel = 'DOWNLOAD' if 'download' in inputDataPolicy.lower() else 'PROTOCOL'
     # Allow staging from SEs accessible by protocol
-    result = DMSHelpers( vo = vo ).getSEsForSite( stageSite, connectionLevel = connectionLevel )
+    result = self.__cycleCached( ( 'sesForSite', vo, stageSite, connectionLevel ),
+                                 DMSHelpers( vo = vo ).getSEsForSite, stageSite, connectionLevel = connectionLevel )
     if not result['OK']:
       return S_ERROR( 'Could not determine SEs for site %s' % stageSite )
     siteSEs = result['Value']
 
     for seName in siteSEs:
-      se = StorageElement( seName, vo = vo )
-      result = se.getStatus()
+      result = self.__getSEStatus( seName, vo )
       if not result[ 'OK' ]:
         self.jobLog.error( "Cannot retrieve SE %s status: %s" % ( seName, result[ 'Message' ] ) )
         return S_ERROR( "Cannot retrieve SE status" )
@@ -586,7 +653,7 @@ class JobScheduling( OptimizerExecutor ):
         continue
       self.jobLog.verbose( "Checking %s for shared SEs" % siteName )
       siteData = siteCandidates[ siteName ]
-      result = getSEsForSite( siteName )
+      result = self.__cycleCached( ( 'closeSEs', siteName ), getSEsForSite, siteName )
       if not result[ 'OK' ]:
         continue
       closeSEs = result[ 'Value' ]
@@ -594,8 +661,7 @@ class JobScheduling( OptimizerExecutor ):
       for seName in closeSEs:
         # If we don't have the SE status get it and store it
         if seName not in seStatus:
-          seObj = StorageElement( seName, vo = vo )
-          result = seObj.getStatus()
+          result = self.__getSEStatus( seName, vo )
           if not result['OK' ]:
             self.jobLog.error( "Cannot retrieve SE %s status: %s" % ( seName, result[ 'Message' ] ) )
             continue
@@ -646,7 +712,7 @@ class JobScheduling( OptimizerExecutor ):
     tierSite = []
     tierLevel = -1
     for siteName in siteList:
-      result = getSiteTier( siteName )
+      result = self.__cycleCached( ( 'siteTier', siteName ), getSiteTier, siteName )
       if not result[ 'OK' ]:
         self.jobLog.error( "Cannot get tier for site %s" % ( siteName ) )
         continue
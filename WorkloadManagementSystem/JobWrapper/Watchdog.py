@@ -50,6 +50,9 @@ class Watchdog( object ):
     self.peekFailCount = 0
     self.peekRetry = 5
     self.processMonitor = ProcessMonitor()
+    # ( time, resources ) samples of the job resource consumption since the last heartbeat
+    self.resourceSamples = []
+    self.lastSampleTime = 0
     self.checkError = ''
     self.currentStats = {}
     self.initialized = False
@@ -65,6 +68,7 @@ class Watchdog( object ):
     self.testMemoryLimit = 0
     self.testTimeLeft = 1
     self.pollingTime = 10  # 10 seconds
+    self.sampleTime = 0  # sample resources only at checking time
     self.checkingTime = 30 * 60  # 30 minute period
     self.minCheckingTime = 20 * 60  # 20 mins
     self.maxWallClockTime = 3 * 24 * 60 * 60  # e.g. 4 days
@@ -117,6 +121,7 @@ class Watchdog( object ):
     self.testTimeLeft = gConfig.getValue( self.section + '/CheckTimeLeftFlag', 1 )
     # Other parameters
     self.pollingTime = gConfig.getValue( self.section + '/PollingTime', 10 )  # 10 seconds
+    self.sampleTime = gConfig.getValue( self.section + '/ResourceSampleTime', 0 )  # 0 means at each check
     self.checkingTime = gConfig.getValue( self.section + '/CheckingTime', 30 * 60 )  # 30 minute period
     self.minCheckingTime = gConfig.getValue( self.section + '/MinCheckingTime', 20 * 60 )  # 20 mins
     self.maxWallClockTime = gConfig.getValue( self.section + '/MaxWallClockTime', 3 * 24 * 60 * 60 )  # e.g. 4 days
@@ -188,6 +193,10 @@ class Watchdog( object ):
         self.littleTimeLeftCount -= 1
 
 
+    # Sample the job resources at a finer resolution than the checks if requested
+    if self.sampleTime and time.time() - self.lastSampleTime >= self.sampleTime:
+      self.__sampleResources()
+
     # Note: need to poll regularly to see if the thread is alive
     #      but only perform checks with a certain frequency
     if ( time.time() - self.initialValues['StartTime'] ) > self.checkingTime * self.checkCount:
@@ -235,10 +244,11 @@ class Watchdog( object ):
         self.parameters['MemoryUsed'] = []
       self.parameters['MemoryUsed'].append( memoryUsed )
 
-    result = self.processMonitor.getMemoryConsumed( self.wrapperPID )
-    if result['OK']:
-      vsize = result['Value']['Vsize']/1024.
-      rss = result['Value']['RSS']/1024.
+    result = self.__sampleResources()
+    resources = result['Value'] if result['OK'] else None
+    if resources:
+      vsize = resources['Vsize']/1024.
+      rss = resources['RSS']/1024.
       heartBeatDict['Vsize'] = vsize
       heartBeatDict['RSS'] = rss
       self.parameters.setdefault( 'Vsize', [] )
@@ -247,6 +257,7 @@ class Watchdog( object ):
       self.parameters['RSS'].append( rss )
       msg += "Job Vsize: %.1f kb " % vsize
       msg += "Job RSS: %.1f kb " % rss
+      heartBeatDict.update( self.__getSamplesSummary() )
     result = self.getDiskSpace()
     if not result['OK']:
       self.log.warn( "Could not establish DiskSpace", result['Message'] )
@@ -258,7 +269,7 @@ class Watchdog( object ):
       self.parameters['DiskSpace'].append( result['Value'] )
       heartBeatDict['AvailableDiskSpace'] = result['Value']
 
-    cpu = self.__getCPU()
+    cpu = self.__getCPU( resources )
     if not cpu['OK']:
       msg += 'CPU: ERROR '
       hmsCPU = 0
@@ -336,15 +347,19 @@ class Watchdog( object ):
     return S_OK( 'Watchdog checking cycle complete' )
 
   #############################################################################
-  def __getCPU( self ):
+  def __getCPU( self, resources = None ):
     """Uses os.times() to get CPU time and returns HH:MM:SS after conversion.
+       If given, the CPU time is taken from an already available resources sample.
     """
     try:
-      cpuTime = self.processMonitor.getCPUConsumed( self.wrapperPID )
-      if not cpuTime['OK']:
-        self.log.warn( 'Problem while checking consumed CPU' )
-        return cpuTime
-      cpuTime = cpuTime['Value']
+      if resources:
+        cpuTime = resources['CPU']
+      else:
+        cpuTime = self.processMonitor.getCPUConsumed( self.wrapperPID )
+        if not cpuTime['OK']:
+          self.log.warn( 'Problem while checking consumed CPU' )
+          return cpuTime
+        cpuTime = cpuTime['Value']
       if cpuTime:
         self.log.verbose( "Raw CPU time consumed (s) = %s" % ( cpuTime ) )
         return self.__getCPUHMS( cpuTime )
@@ -359,6 +374,48 @@ class Watchdog( object ):
 
 
 
+  #############################################################################
+  def __sampleResources( self ):
+    """ Take one sample of the resources consumed by the job process tree, and of
+        its cgroup if available, and keep it until the next heartbeat
+    """
+    self.lastSampleTime = time.time()
+    result = self.processMonitor.getResourceConsumed( self.wrapperPID )
+    if not result['OK']:
+      self.log.warn( 'Could not sample job resources', result['Message'] )
+      return result
+    resources = result['Value']
+    cgroupResult = self.processMonitor.getCGroupResourceConsumed()
+    if cgroupResult['OK']:
+      for key, value in cgroupResult['Value'].items():
+        resources['CGroup%s' % key] = value
+    self.resourceSamples.append( ( self.lastSampleTime, resources ) )
+    return S_OK( resources )
+
+  #############################################################################
+  def __getSamplesSummary( self ):
+    """ Summarize the resource samples taken since the last heartbeat: peak memory
+        and IO rates over the period. The samples are then discarded, but the last one.
+    """
+    summary = {}
+    if not self.resourceSamples:
+      return summary
+    firstTime, firstSample = self.resourceSamples[0]
+    lastTime, lastSample = self.resourceSamples[-1]
+    summary['MaxVsize'] = max( [ sample['Vsize'] for _t, sample in self.resourceSamples ] ) / 1024.
+    summary['MaxRSS'] = max( [ sample['RSS'] for _t, sample in self.resourceSamples ] ) / 1024.
+    summary['ReadBytes'] = lastSample['ReadBytes']
+    summary['WriteBytes'] = lastSample['WriteBytes']
+    if lastTime > firstTime:
+      # IO rates in kB/s
+      summary['ReadRate'] = max( 0, lastSample['ReadBytes'] - firstSample['ReadBytes'] ) / 1024. / ( lastTime - firstTime )
+      summary['WriteRate'] = max( 0, lastSample['WriteBytes'] - firstSample['WriteBytes'] ) / 1024. / ( lastTime - firstTime )
+    for key in ( 'CGroupCPU', 'CGroupMemory' ):
+      if key in lastSample:
+        summary[key] = lastSample[key]
+    self.resourceSamples = self.resourceSamples[-1:]
+    return summary
+
   #############################################################################
   def __getCPUHMS( self, cpuTime ):
     mins, secs = divmod( cpuTime, 60 )
@@ -647,7 +704,10 @@ class Watchdog( object ):
     self.__getWallClockTime()
     self.parameters['WallClockTime'] = []
 
-    cpuConsumed = self.__getCPU()
+    result = self.__sampleResources()
+    resources = result['Value'] if result['OK'] else None
+
+    cpuConsumed = self.__getCPU( resources )
     if not cpuConsumed['OK']:
       self.log.warn( "Could not establish CPU consumed, setting to 0.0" )
       cpuConsumed = 0.0
@@ -677,13 +737,12 @@ class Watchdog( object ):
     self.initialValues['MemoryUsed'] = memUsed
     self.parameters['MemoryUsed'] = []
 
-    result = self.processMonitor.getMemoryConsumed( self.wrapperPID )
-    self.log.verbose( 'Job Memory: %s' % ( result['Value'] ) )
-    if not result['OK']:
+    if not resources:
       self.log.warn( 'Could not get job memory usage' )
-
-    self.initialValues['Vsize'] = result['Value']['Vsize']/1024.
-    self.initialValues['RSS'] = result['Value']['RSS']/1024.
+    else:
+      self.log.verbose( 'Job Memory: Vsize %s, RSS %s' % ( resources['Vsize'], resources['RSS'] ) )
+      self.initialValues['Vsize'] = resources['Vsize']/1024.
+      self.initialValues['RSS'] = resources['RSS']/1024.
     self.parameters['Vsize'] = []
     self.parameters['RSS'] = []
 
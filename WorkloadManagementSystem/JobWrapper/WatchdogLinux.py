@@ -62,24 +62,27 @@ class WatchdogLinux( Watchdog ):
   def getLoadAverage(self):
     """Obtains the load average.
     """
-    comm = '/bin/cat /proc/loadavg'
-    loadAvgDict = shellCall( 5, comm )
-    if loadAvgDict['OK']:
-      return S_OK( float( loadAvgDict['Value'][1].split( )[0] ) )
-    else:
+    try:
+      with open( '/proc/loadavg', 'r' ) as loadAvg:
+        return S_OK( float( loadAvg.readline().split()[0] ) )
+    except ( IOError, ValueError, IndexError ):
       self.log.warn( 'Could not obtain load average' )
       return S_ERROR( 'Could not obtain load average' )
 
   #############################################################################
   def getMemoryUsed(self):
-    """Obtains the memory used.
+    """Obtains the memory used (kB), as reported by free: total memory minus the
+       free memory, the buffers and the page cache
     """
-    comm = '/usr/bin/free'
-    memDict = shellCall( 5, comm )
-    if memDict['OK']:
-      mem = memDict['Value'][1].split()[8]
-      return S_OK( float( mem ) )
-    else:
+    try:
+      memInfo = {}
+      with open( '/proc/meminfo', 'r' ) as memFile:
+        for line in memFile:
+          items = line.split()
+          memInfo[items[0].rstrip( ':' )] = float( items[1] )
+      mem = memInfo['MemTotal'] - memInfo['MemFree'] - memInfo.get( 'Buffers', 0 ) - memInfo.get( 'Cached', 0 )
+      return S_OK( mem )
+    except ( IOError, ValueError, IndexError, KeyError ):
       self.log.warn( 'Could not obtain memory used' )
       return S_ERROR( 'Could not obtain memory used' )
 
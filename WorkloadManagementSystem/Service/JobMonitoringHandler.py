@@ -257,6 +257,16 @@ class JobMonitoringHandler( RequestHandler ):
       return S_OK( {} )
     return gJobDB.getAttributesForJobList( jobIDs, ['Status'] )
 
+##############################################################################
+  types_getJobsStatusChanges = [ ListType, StringTypes ]
+  @staticmethod
+  def export_getJobsStatusChanges ( jobIDs, since ):
+    """ Status of the jobs whose attributes were updated since a given UTC time
+    """
+    if not jobIDs:
+      return S_OK( {} )
+    return gJobDB.getJobsStatusChanges( jobIDs, since )
+
 ##############################################################################
   types_getJobsMinorStatus = [ ListType ]
   @staticmethod
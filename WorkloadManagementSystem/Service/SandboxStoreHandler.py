@@ -97,22 +97,13 @@ class SandboxStoreHandler( RequestHandler ):
 
     credDict = self.getRemoteCredentials()
     sbPath = self.__getSandboxPath( "%s.%s" % ( aHash, extension ) )
-    # Generate the location
-    result = self.__generateLocation( sbPath )
+    result = self.__getExistingSandbox( sbPath, assignTo )
     if not result[ 'OK' ]:
       return result
-    seName, sePFN = result[ 'Value' ]
-
-    result = sandboxDB.getSandboxId( seName, sePFN, credDict[ 'username' ], credDict[ 'group' ] )
-    if result[ 'OK' ]:
+    if result[ 'Value' ]:
       gLogger.info( "Sandbox already exists. Skipping upload" )
       fileHelper.markAsTransferred()
-      sbURL = "SB:%s|%s" % ( seName, sePFN )
-      assignTo = dict( [ ( key, [ ( sbURL, assignTo[ key ] ) ] ) for key in assignTo ] )
-      result = self.export_assignSandboxesToEntities( assignTo )
-      if not result[ 'OK' ]:
-        return result
-      return S_OK( sbURL )
+      return result
 
     if self.__useLocalStorage:
       hdPath = self.__sbToHDPath( sbPath )
@@ -153,6 +144,44 @@ class SandboxStoreHandler( RequestHandler ):
       return result
     return S_OK( sbURL )
 
+  def __getExistingSandbox( self, sbPath, assignTo ):
+    """ Look for an already registered sandbox with the given path for the
+        remote user and assign it to the requested entities
+
+        :return: S_OK( sbURL ) if it exists, S_OK( False ) otherwise
+    """
+    credDict = self.getRemoteCredentials()
+    # Generate the location
+    result = self.__generateLocation( sbPath )
+    if not result[ 'OK' ]:
+      return result
+    seName, sePFN = result[ 'Value' ]
+
+    result = sandboxDB.getSandboxId( seName, sePFN, credDict[ 'username' ], credDict[ 'group' ] )
+    if not result[ 'OK' ]:
+      return S_OK( False )
+    sbURL = "SB:%s|%s" % ( seName, sePFN )
+    assignTo = dict( [ ( key, [ ( sbURL, assignTo[ key ] ) ] ) for key in assignTo ] )
+    result = self.export_assignSandboxesToEntities( assignTo )
+    if not result[ 'OK' ]:
+      return result
+    return S_OK( sbURL )
+
+  types_getSandboxForHash = [ basestring, basestring ]
+  def export_getSandboxForHash( self, aHash, extension, assignTo = None ):
+    """ Pre-upload check: if a sandbox with the given md5 hash and extension has
+        already been uploaded by the remote user, assign it to the entities in
+        assignTo ( { 'Job:<jobid>' : '<sbType>', ... } ) and return its URL so the
+        client can skip the transfer. Returns S_OK( False ) if it has to be uploaded.
+    """
+    if assignTo is None:
+      assignTo = {}
+    if not isinstance( assignTo, dict ):
+      return S_ERROR( "assignTo has to be a dictionary" )
+    gLogger.info( "Existence check requested for %s [%s]" % ( aHash, extension ) )
+    sbPath = self.__getSandboxPath( "%s.%s" % ( aHash, extension ) )
+    return self.__getExistingSandbox( sbPath, assignTo )
+
   def transfer_bulkFromClient( self, fileId, token, fileSize, fileHelper ):
     """ Receive files packed into a tar archive by the fileHelper logic.
         token is used for access rights confirmation.
@@ -71,7 +71,8 @@ DATABASE_CONFIG = { 'UserGroupManager'  : 'UserAndGroupManagerDB',  # UserAndGro
                     'ValidFileStatus'     : ['AprioriGood', 'Trash', 'Removing', 'Probing'],
                     'ValidReplicaStatus'  : ['AprioriGood', 'Trash', 'Removing', 'Probing'],
                     'VisibleFileStatus'   : ['AprioriGood'],
-                    'VisibleReplicaStatus': ['AprioriGood'] }
+                    'VisibleReplicaStatus': ['AprioriGood'],
+                    'FileLog'             : True }
 
 ALL_MANAGERS = { "UserGroupManager"  : ["UserAndGroupManagerDB", "UserAndGroupManagerCS"],
                  "SEManager" : ["SEManagerDB", "SEManagerCS"],
@@ -1015,6 +1016,41 @@ class DirectoryUsageCase ( FileCatalogDBTestCase ):
     self.assertEqual( d1s2 , ( 0, 0 ), "Unexpected size %s, expected %s" % ( d1s2, ( 0, 0 ) ) )
 
 
+class FileLogCase( FileCatalogDBTestCase ):
+
+  def test_fileChanges( self ):
+    """Testing the change log of the new files"""
+
+    logFile = '/fileLogTest/d1/f1'
+
+    ret = self.db.getFileChanges( 0, 0, credDict )
+    self.assert_( ret['OK'], "getFileChanges failed: %s" % ret )
+    lastLogID = ret['Value']['LastLogID']
+
+    ret = self.db.addFile( { logFile: { 'PFN': 'f1se1',
+                                         'SE': 'se1' ,
+                                         'Size': 123,
+                                         'GUID': '1003',
+                                         'Checksum': '1' }}, credDict )
+    self.assert_( ret['OK'] )
+    if logFile not in ret['Value']['Successful']:
+      # Not allowed to add the file
+      return
+
+    ret = self.db.getFileChanges( lastLogID, 100, credDict )
+    self.assert_( ret['OK'], "getFileChanges failed: %s" % ret )
+    self.assert_( ret['Value']['LastLogID'] > lastLogID )
+    self.assert_( logFile in ret['Value']['Files'], "%s should be in the changes %s" % ( logFile, ret ) )
+
+    # Nothing new since
+    ret = self.db.getFileChanges( ret['Value']['LastLogID'], 100, credDict )
+    self.assert_( ret['OK'] )
+    self.assertEqual( ret['Value']['Files'], {} )
+
+    ret = self.db.removeFile( [logFile], credDict )
+    self.assert_( ret['OK'] )
+
+
 if __name__ == '__main__':
 
   managerTypes = MANAGER_TO_TEST.keys()
@@ -1037,6 +1073,7 @@ if __name__ == '__main__':
     suite.addTest( unittest.defaultTestLoader.loadTestsFromTestCase( ReplicaCase ) )
     suite.addTest( unittest.defaultTestLoader.loadTestsFromTestCase( DirectoryCase ) )
     suite.addTest( unittest.defaultTestLoader.loadTestsFromTestCase( DirectoryUsageCase ) )
+    suite.addTest( unittest.defaultTestLoader.loadTestsFromTestCase( FileLogCase ) )
 
     # Then run without admin privilege:
     isAdmin = False
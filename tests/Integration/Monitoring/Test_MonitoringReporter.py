@@ -54,6 +54,7 @@ from datetime import datetime
 from DIRAC import gLogger
 
 from DIRAC.MonitoringSystem.Client.MonitoringReporter import MonitoringReporter
+from DIRAC.MonitoringSystem.Client.ServerUtils import monitoringDB
 from DIRAC.MonitoringSystem.DB.MonitoringDB import MonitoringDB
 
 #pylint: disable=line-too-long
@@ -119,6 +120,9 @@ class MonitoringReporterAdd( MonitoringTestCase ):
     result = self.monitoringReporter.commit()
     self.assert_( result['OK'] )
     self.assertEqual( result['Value'], len( self.data ) )
+    # the records are inserted in the background
+    result = monitoringDB.flush()
+    self.assert_( result['OK'] )
 
 
 class MonitoringDeleteChain( MonitoringTestCase ):
@@ -235,6 +235,72 @@ class ReqClientMix( ReqClientTestCase ):
       self.assertEqual( delete["OK"], True, delete['Message'] if 'Message' in delete else 'OK' )
 
 
+  def test04BulkJSON( self ):
+    """ bulk requests serialized directly from the DB rows """
+    db = RequestDB()
+
+    request = Request( { "RequestName": "bulkJSON" } )
+    op = Operation( { "Type": "RemoveReplica", "TargetSE": "CERN-USER" } )
+    for i in xrange( 10 ):
+      op += File( { "LFN": "/lhcb/user/c/cibak/foo%s" % i } )
+    request += op
+    put = db.putRequest( request )
+    self.assertEqual( put["OK"], True, put['Message'] if 'Message' in put else 'OK' )
+    reqID = put['Value']
+
+    peek = db.getBulkRequestsJSON( 10, False )
+    self.assertEqual( peek["OK"], True, peek['Message'] if 'Message' in peek else 'OK' )
+    self.assertTrue( reqID in peek["Value"] )
+
+    get = db.getBulkRequestsJSON( 10, True )
+    self.assertEqual( get["OK"], True, get['Message'] if 'Message' in get else 'OK' )
+    self.assertTrue( reqID in get["Value"] )
+    fromJSON = Request( get["Value"][reqID] )
+    self.assertEqual( fromJSON.RequestName, "bulkJSON" )
+    self.assertEqual( [ f.LFN for f in fromJSON[0] ], [ "/lhcb/user/c/cibak/foo%s" % i for i in xrange( 10 ) ] )
+
+    # Already assigned: not returned again
+    get = db.getBulkRequestsJSON( 10, True )
+    self.assertEqual( get["OK"], True, get['Message'] if 'Message' in get else 'OK' )
+    self.assertFalse( reqID in get["Value"] )
+
+    delete = db.deleteRequest( reqID )
+    self.assertEqual( delete["OK"], True, delete['Message'] if 'Message' in delete else 'OK' )
+
+  def test04UpdateDelta( self ):
+    """ only the changed attributes are written back """
+    db = RequestDB()
+
+    request = Request( { "RequestName": "updateDelta" } )
+    op = Operation( { "Type": "RemoveReplica", "TargetSE": "CERN-USER" } )
+    for i in xrange( 10 ):
+      op += File( { "LFN": "/lhcb/user/c/cibak/bar%s" % i } )
+    request += op
+    put = db.putRequest( request )
+    self.assertEqual( put["OK"], True, put['Message'] if 'Message' in put else 'OK' )
+    reqID = put['Value']
+
+    get = db.getRequest( reqID, False )
+    self.assertEqual( get["OK"], True, get['Message'] if 'Message' in get else 'OK' )
+    # # as received by a client
+    fromDB = Request( get["Value"].toJSON()["Value"] )
+    for opFile in fromDB[0][:5]:
+      opFile.Status = "Done"
+    delta = fromDB.getDelta()
+    self.assertEqual( delta["OK"], True, delta['Message'] if 'Message' in delta else 'OK' )
+    delta = delta["Value"]
+    self.assertEqual( len( delta["Files"] ), 5 )
+
+    update = db.updateRequest( reqID, delta["Request"], delta["Operations"], delta["Files"] )
+    self.assertEqual( update["OK"], True, update['Message'] if 'Message' in update else 'OK' )
+
+    get = db.getRequest( reqID, False )
+    self.assertEqual( get["OK"], True, get['Message'] if 'Message' in get else 'OK' )
+    self.assertEqual( [ opFile.Status for opFile in get["Value"][0] ], ["Done"] * 5 + ["Waiting"] * 5 )
+
+    delete = db.deleteRequest( reqID )
+    self.assertEqual( delete["OK"], True, delete['Message'] if 'Message' in delete else 'OK' )
+
   def test05Scheduled( self ):
     """ scheduled request r/w """
 
@@ -158,6 +158,37 @@ class TransformationClientChain( TestClientTransformationTestCase ):
     self.transClient.deleteTransformation( transID )
     self.transClient.deleteTransformation( transIDNew )
 
+  def test_addTasksInBulk( self ):
+    res = self.transClient.addTransformation( 'transName', 'description', 'longDescription', 'MCSimulation', 'Standard',
+                                              'Manual', '' )
+    transID = res['Value']
+    lfns = ['/aa/lfn.%d.txt' % i for i in xrange( 1, 6 )]
+    res = self.transClient.addFilesToTransformation( transID, lfns )
+    self.assert_( res['OK'] )
+    res = self.transClient.addTaskForTransformation( transID, lfns[:1] )
+    self.assert_( res['OK'] )
+
+    # the second task has a file already in a task, the third one a file not in the transformation
+    tasks = [( 'SE1', lfns[1:3] ), ( 'SE2', lfns[:1] ), ( 'SE2', ['/aa/lfn.0.txt'] ), ( 'SE2', lfns[3:] )]
+    res = self.transClient.addTasksForTransformation( transID, tasks )
+    self.assert_( res['OK'] )
+    self.assertEqual( res['Value']['Successful'], {0: 2, 3: 3} )
+    self.assertEqual( sorted( res['Value']['Failed'] ), [1, 2] )
+
+    res = self.transClient.getTransformationFiles( {'TransformationID': transID} )
+    self.assert_( res['OK'] )
+    taskForLfn = dict( ( f['LFN'], ( f['TaskID'], f['UsedSE'], f['Status'] ) ) for f in res['Value'] )
+    self.assertEqual( taskForLfn['/aa/lfn.2.txt'], ( 2, 'SE1', 'Assigned' ) )
+    self.assertEqual( taskForLfn['/aa/lfn.5.txt'], ( 3, 'SE2', 'Assigned' ) )
+    res = self.transClient.getTransformationTasks( {'TransformationID': transID, 'TaskID': [2, 3]}, inputVector = True )
+    self.assert_( res['OK'] )
+    self.assertEqual( dict( ( task['TaskID'], ( task['TargetSE'], task['InputVector'] ) ) for task in res['Value'] ),
+                      {2: ( 'SE1', ';'.join( lfns[1:3] ) ), 3: ( 'SE2', ';'.join( lfns[3:] ) )} )
+
+    # delete it in the end
+    self.transClient.cleanTransformation( transID )
+    self.transClient.deleteTransformation( transID )
+
   def test_mix( self ):
     res = self.transClient.addTransformation( 'transName', 'description', 'longDescription', 'MCSimulation', 'Standard',
                                               'Manual', '' )
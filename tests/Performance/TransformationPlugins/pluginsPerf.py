@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+""" This script times the main transformation plugins (Standard, BySize, Broadcast, ByShare)
+    on a large set of input files with random replicas, to check how the grouping scales.
+
+    The catalog, the storage elements and the CS are mocked, such that only the grouping is measured.
+    For each number of files, the time of a first plugin execution (file sizes obtained from the
+    "catalog") and of a second one (sizes and SE groups already cached) are printed.
+
+    Tunable parameters:
+      * nFilesList: numbers of input files
+      * nSEs: number of SEs, each file has from 1 to maxReplicas of them
+"""
+
+import random
+import time
+
+from mock import MagicMock
+
+from DIRAC import S_OK, gLogger
+
+import DIRAC.TransformationSystem.Client.Utilities as pluginUtilities
+import DIRAC.TransformationSystem.Agent.TransformationPlugin as transformationPlugin
+from DIRAC.TransformationSystem.Agent.TransformationPlugin import TransformationPlugin
+
+nFilesList = [1000, 10000, 100000]
+nSEs = 10
+maxReplicas = 3
+plugins = ['Standard', 'BySize', 'Broadcast', 'ByShare']
+
+gLogger.setLevel( 'ERROR' )
+
+ses = ['SE%d' % i for i in xrange( nSEs )]
+sites = dict( ( se, 'Site%d' % ( i % ( nSEs / 2 ) ) ) for i, se in enumerate( ses ) )
+
+# Mocks of the catalog, SEs and CS
+seMock = MagicMock()
+seMock.return_value.getStatus.return_value = S_OK( {'DiskSE': True} )
+pluginUtilities.StorageElement = seMock
+transformationPlugin.getSitesForSE = lambda se: S_OK( [sites[se]] )
+transformationPlugin.getSEsForSite = lambda site: S_OK( [se for se in ses if sites[se] == site] )
+transformationPlugin.gConfig = MagicMock()
+transformationPlugin.gConfig.getOptionsDict.return_value = S_OK( dict.fromkeys( set( sites.values() ), '1' ) )
+transClient = MagicMock()
+transClient.getCounters.return_value = S_OK( [] )
+
+def getParams( plugin ):
+  params = {'TransformationID': 1, 'Status': 'Active', 'Type': 'Replication',
+            'GroupSize': 10 if plugin != 'BySize' else 1,
+            'SourceSE': str( ses[:nSEs / 2] ), 'TargetSE': str( ses[nSEs / 2:] )}
+  return params
+
+def timePlugin( plugin, data, fc ):
+  oPlugin = TransformationPlugin( plugin, transClient = transClient, dataManager = MagicMock(), fc = fc )
+  oPlugin.setParameters( getParams( plugin ) )
+  oPlugin.setInputData( data )
+  startTime = time.time()
+  res = oPlugin.run()
+  elapsed = time.time() - startTime
+  if not res['OK']:
+    print "%s failed: %s" % ( plugin, res['Message'] )
+  return elapsed, len( res.get( 'Value', [] ) )
+
+print "%10s %10s %10s %10s %10s" % ( 'Plugin', 'Files', 'Tasks', 'First (s)', 'Next (s)' )
+for nFiles in nFilesList:
+  data = dict( ( '/vo/data/%08d' % i, random.sample( ses, random.randint( 1, maxReplicas ) ) )
+               for i in xrange( nFiles ) )
+  fc = MagicMock()
+  fc.getFileSize.side_effect = lambda lfns: S_OK( {'Successful': dict( ( lfn, random.randint( 1, 5 * 10 ** 8 ) )
+                                                                        for lfn in lfns ),
+                                                   'Failed': {}} )
+  for plugin in plugins:
+    pluginUtilities.gFileSizeCache.purgeAll()
+    pluginUtilities.gSEGroups.clear()
+    first, nTasks = timePlugin( plugin, data, fc )
+    following, _nTasks = timePlugin( plugin, data, fc )
+    print "%10s %10d %10d %10.2f %10.2f" % ( plugin, nFiles, nTasks, first, following )